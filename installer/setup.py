@@ -8,7 +8,7 @@ import sys
 sys.path.append(sys.argv[0] == '' and os.path.curdir or os.path.dirname(sys.argv[0]))
 from whimbrel.install.cfg import read_config
 from whimbrel.install.util import out
-from whimbrel.install import install_db
+from whimbrel.install import install_db, report_capacity, report_migrations, archive_workflows
 from whimbrel.install.lambdas import install_lambdas, bundle_modules, test_nodejs
 
 config_file = len(sys.argv) > 1 and sys.argv[1] or "setup.config"
@@ -32,3 +32,9 @@ for target in targets:
         bundle_modules(config, True)
     elif target == 'nodejs-test':
         test_nodejs(config)
+    elif target == 'capacity-report':
+        report_capacity(config)
+    elif target == 'migration-plan':
+        report_migrations(config)
+    elif target == 'archive':
+        archive_workflows(config)
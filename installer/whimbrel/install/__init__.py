@@ -1,6 +1,6 @@
 
 from . import cfg, db, lambdas, util
 
-from .db import install_db
+from .db import install_db, report_capacity, report_migrations, archive_workflows
 from .lambdas import install_lambdas
 
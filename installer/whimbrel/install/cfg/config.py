@@ -60,6 +60,19 @@ DEFAULTS = {
     },
     'dynamodb': {
         'wait seconds': 5,
+        'max wait seconds': 30,
+        'wait timeout seconds': 1800,
+        'concurrent install': False,
+        'version check': True,
+        'concurrent limit': 10,
+        'discovery workers': 8,
+        'snapshot file': None,
+        # Tables whose key schema, attributes or local indexes change must
+        # be copied into a new table; this must be turned on to allow it.
+        'allow rebuild': False,
+        # Capacity units per second the rebuild copy may use, or None.
+        'migration capacity': 100,
+        'migration scan segments': 4,
         'endpoint': None,
         'use ssl': None
     },
@@ -72,6 +85,44 @@ DEFAULTS = {
             "on_db_workflow_request": None
         }
     },
+    'capacity': {
+        # Set to the expected number of workflows started per hour to turn on
+        # the capacity planner.
+        'workflows per hour': None,
+        'activities per workflow': 5,
+        'dependencies per activity': 1,
+        'activity duration seconds': 300,
+        'heartbeat interval seconds': 30,
+        'monitor interval seconds': 60,
+        'peak factor': 2.0,
+        'headroom': 1.2,
+        # table name -> average item size in bytes
+        'item sizes': {},
+        # table name -> [reads per workflow, strongly consistent]
+        'reads': {},
+        # 'auto', 'provisioned' or 'on demand'
+        'billing': 'auto',
+        'prices': {}
+    },
+    'archive': {
+        # Workflows in one of these states, that started more than
+        # 'older than days' ago, are archived with their activities.
+        'states': ['COMPLETED', 'FAILED', 'CANCELLED'],
+        'older than days': 30,
+        'directory': 'archive',
+        'max file megabytes': 64,
+        # 'delete' removes the archived items; 'ttl' sets the 'ttl attribute'
+        # so that DynamoDB expires them 'ttl delay seconds' later.
+        'mode': 'delete',
+        'ttl attribute': 'expires_epoch',
+        'ttl delay seconds': 24 * 60 * 60,
+        # Capacity units per second the archiver may use.
+        'read capacity': 100,
+        'write capacity': 50,
+        # Threads for the workflow scan (without the state index) and for
+        # the queries of the archived workflows' children.
+        'scan segments': 4
+    },
     'setup': {
         'db prefix': 'whimbrel_',
     },
@@ -117,6 +168,14 @@ class Config(object):
     def _dynamodb(self):
         return self.get_category('dynamodb')
 
+    @property
+    def _capacity(self):
+        return self.get_category('capacity')
+
+    @property
+    def _archive(self):
+        return self.get_category('archive')
+
     @property
     def _setup(self):
         return self.get_category('setup')
@@ -161,6 +220,58 @@ class Config(object):
         assert isinstance(val, float) or isinstance(val, int)
         self._dynamodb['wait seconds'] = val
 
+    @property
+    def db_max_wait_seconds(self):
+        return max(self._dynamodb['max wait seconds'], self.db_wait_seconds)
+
+    @property
+    def db_wait_timeout_seconds(self):
+        return self._dynamodb['wait timeout seconds']
+
+    @property
+    def db_version_check(self):
+        return self._dynamodb['version check']
+
+    @property
+    def db_concurrent_install(self):
+        return self._dynamodb['concurrent install']
+
+    def set_db_concurrent_install(self, val):
+        assert isinstance(val, bool)
+        self._dynamodb['concurrent install'] = val
+
+    @property
+    def db_concurrent_limit(self):
+        return self._dynamodb['concurrent limit']
+
+    @property
+    def db_discovery_workers(self):
+        return self._dynamodb['discovery workers']
+
+    @property
+    def db_snapshot_file(self):
+        return self._dynamodb['snapshot file']
+
+    @property
+    def db_allow_rebuild(self):
+        return self._dynamodb['allow rebuild']
+
+    @property
+    def db_migration_capacity(self):
+        return self._dynamodb['migration capacity']
+
+    @property
+    def db_migration_segments(self):
+        return self._dynamodb['migration scan segments']
+
+    @property
+    def capacity_settings(self):
+        return dict(self._capacity)
+
+    @property
+    def archive_settings(self):
+        return dict(self._archive)
+
     @property
     def lambda_use_ssl(self):
         return self._lambda('use ssl') is not None and self._lambda['use ssl'] or self._aws['use ssl']
@@ -213,7 +324,7 @@ class Config(object):
     def load_modules(self):
         if self.__loaded_modules is None:
             self.__loaded_modules = {}
-            for module_name, module_path in self.module_paths:
+            for module_name, module_path in self.module_paths.items():
                 module_install_dir = os.path.join(module_path, 'installer')
                 if module_install_dir not in sys.path:
                     sys.path.append(module_install_dir)
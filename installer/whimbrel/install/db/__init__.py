@@ -1,3 +1,5 @@
 
-from .install import install_db
-from .tabledef import DbTableDef
\ No newline at end of file
+from .install import install_db, report_capacity, report_migrations
+from .archive import archive_workflows
+from .tabledef import DbTableDef
+from .status import InstallStatusBatch
\ No newline at end of file
@@ -0,0 +1,433 @@
+"""
+Archives the terminal workflows.
+
+Workflows in a terminal state (COMPLETED, FAILED or CANCELLED by default)
+that started before the cutoff are written, along with their activities,
+activity dependencies and activity events, to compressed, append-only
+archive files.  Once the archive file is safely on disk, the items are
+removed from the tables with batched deletes, or marked with a TTL
+attribute so that DynamoDB expires them itself.  The children are found
+with a Query per archived workflow (or activity) on the tables' global
+indexes, so the cost follows the archived workflows rather than the size
+of the tables.  The reads and the deletes draw from a capacity budget, so
+an archive run can share the tables with the running workflows.
+
+The children are removed before the workflows, so an interrupted run
+leaves the workflow in place for the next run to pick up.  That run
+writes the remaining items to its own archive file; the archive can
+contain an item more than once, but never loses one.
+"""
+
+import base64
+import datetime
+import gzip
+import json
+import os
+import threading
+import time
+
+from ..util import out
+from .bulk import CapacityBudget, batch_get, batch_write, segmented_scan, item_key, key_names, consumed_units
+from .connect import connect
+from .errors import error_code, is_not_found
+from .status import table_names
+
+# Global index on the workflow_exec table, keyed on state and start time.
+WORKFLOW_STATE_INDEX = 'state_start_time'
+
+# Global indexes that find the children of the archived items.
+WORKFLOW_ACTIVITY_INDEX = 'workflow_activity'
+WORKFLOW_DEPENDENCY_INDEX = 'workflow_dependency'
+ACTIVITY_EVENT_INDEX = 'activity_events'
+
+ARCHIVED_TABLES = ('workflow_exec', 'activity_exec', 'activity_exec_dependency', 'activity_event')
+
+ARCHIVE_DELETE = 'delete'
+ARCHIVE_TTL = 'ttl'
+
+ARCHIVE_FORMAT_VERSION = 1
+
+
+class ArchiveWriter(object):
+    """
+    Writes items to gzip compressed JSON lines files.  Each line is one item,
+    in the DynamoDB attribute value form, along with the table it came from.
+    A file is written under a temporary name, and only renamed to its final
+    name once it is complete and synced to disk, so readers never see a
+    partial file.  Files are never opened for writing again.  It is safe to
+    share between threads.
+
+    :param directory: directory to put the archive files in.
+    :param prefix: archive file name prefix.
+    :param max_bytes: start a new file once this many uncompressed bytes have
+        been written to the current one.
+    """
+    def __init__(self, directory, prefix='whimbrel-archive', max_bytes=64 * 1024 * 1024, clock=time.time):
+        object.__init__(self)
+        self.__directory = directory
+        self.__prefix = prefix
+        self.__max_bytes = max_bytes
+        self.__clock = clock
+        self.__lock = threading.Lock()
+        self.__file = None
+        self.__file_name = None
+        self.__file_bytes = 0
+        self.__sequence = 0
+        self.files = []
+        self.item_count = 0
+        self.table_counts = {}
+
+    def write(self, table_name, item):
+        line = json.dumps({'table': table_name, 'item': item}, sort_keys=True, default=_json_default)
+        data = (line + '\n').encode('utf-8')
+        with self.__lock:
+            if self.__file is not None and self.__file_bytes + len(data) > self.__max_bytes:
+                self._close_file()
+            if self.__file is None:
+                self._open_file()
+            self.__file.write(data)
+            self.__file_bytes += len(data)
+            self.item_count += 1
+            self.table_counts[table_name] = self.table_counts.get(table_name, 0) + 1
+
+    def close(self):
+        """
+        Finish the current file.
+
+        :return: the list of archive files written.
+        """
+        with self.__lock:
+            if self.__file is not None:
+                self._close_file()
+        return list(self.files)
+
+    def _open_file(self):
+        if not os.path.isdir(self.__directory):
+            os.makedirs(self.__directory)
+        stamp = datetime.datetime.utcfromtimestamp(self.__clock()).strftime('%Y%m%dT%H%M%SZ')
+        while True:
+            self.__sequence += 1
+            name = os.path.join(self.__directory, '{0}-{1}-{2:04d}.jsonl.gz'.format(
+                self.__prefix, stamp, self.__sequence))
+            if not os.path.exists(name):
+                break
+        self.__file_name = name
+        self.__file = gzip.GzipFile(name + '.tmp', 'wb')
+        self.__file_bytes = 0
+        header = json.dumps({'archive_version': ARCHIVE_FORMAT_VERSION}, sort_keys=True)
+        self.__file.write((header + '\n').encode('utf-8'))
+
+    def _close_file(self):
+        self.__file.close()
+        temp_name = self.__file_name + '.tmp'
+        with open(temp_name, 'rb') as f:
+            os.fsync(f.fileno())
+        os.rename(temp_name, self.__file_name)
+        self.files.append(self.__file_name)
+        self.__file = None
+        self.__file_name = None
+
+
+def read_archive(filename):
+    """
+    Generator for the (table name, item) pairs in an archive file.
+    """
+    with gzip.GzipFile(filename, 'rb') as f:
+        header = json.loads(f.readline().decode('utf-8'))
+        if header.get('archive_version') != ARCHIVE_FORMAT_VERSION:
+            raise ValueError("Unsupported archive file version in " + filename)
+        for line in f:
+            record = json.loads(line.decode('utf-8'))
+            yield record['table'], record['item']
+
+
+def archive_workflows(config, client=None, clock=time.time):
+    """
+    Archive the terminal workflows older than the configured cutoff, then
+    remove them from the tables (or set their TTL).
+
+    :param config: Config
+    :param client: dynamodb client; created from the configuration if None.
+    :return: dictionary of table name (without prefix) -> number of items archived.
+    """
+    settings = config.archive_settings
+    mode = settings['mode']
+    if mode not in (ARCHIVE_DELETE, ARCHIVE_TTL):
+        raise ValueError("archive mode must be '{0}' or '{1}', found {2!r}".format(
+            ARCHIVE_DELETE, ARCHIVE_TTL, mode))
+    if client is None:
+        client = connect(config)
+    # Tables an upgrade rebuilt are read from, and removed from, the table
+    # that install_status says holds them now.
+    tables = table_names(client, config.db_prefix, ARCHIVED_TABLES)
+    # In 'ttl' mode, the items archived by an earlier run are still in
+    # place until they expire; they are left out rather than archived
+    # again (and their expiry pushed back).
+    ttl_attribute = mode == ARCHIVE_TTL and settings['ttl attribute'] or None
+    now = clock()
+    cutoff = int(now - settings['older than days'] * 24 * 60 * 60)
+    read_budget = CapacityBudget(settings['read capacity'])
+    write_budget = CapacityBudget(settings['write capacity'])
+    segments = settings['scan segments']
+
+    # Find the workflows to archive.
+    workflow_table = tables['workflow_exec']
+    workflow_desc = client.describe_table(TableName=workflow_table)['Table']
+    workflow_keys = key_names(workflow_desc)
+    out.action("Archive", "Finding workflows that started before {0}".format(
+        datetime.datetime.utcfromtimestamp(cutoff).strftime('%Y-%m-%d %H:%M')))
+    keys = _find_workflow_keys(client, workflow_desc, settings['states'], cutoff, read_budget, segments,
+                               ttl_attribute)
+    out.status("{0} found".format(len(keys)))
+    if len(keys) <= 0:
+        return {}
+
+    writer = ArchiveWriter(settings['directory'], max_bytes=int(settings['max file megabytes'] * 1024 * 1024),
+                           clock=clock)
+    workflow_ids = set()
+    archived = {}
+    try:
+        out.action("Archive", "Archiving workflow_exec")
+        archived['workflow_exec'] = []
+        for item in batch_get(client, workflow_table, keys, budget=read_budget):
+            # The state index doesn't project the TTL attribute, so the
+            # workflows it found are checked here.
+            if ttl_attribute is not None and ttl_attribute in item:
+                continue
+            writer.write('workflow_exec', item)
+            workflow_ids.add(item['workflow_exec_id']['S'])
+            archived['workflow_exec'].append(item_key(item, workflow_keys))
+        out.status("{0} items".format(len(workflow_ids)))
+
+        activity_ids = set()
+        for table_name, index_name, parent_attribute, parent_ids, on_item in (
+                ('activity_exec', WORKFLOW_ACTIVITY_INDEX, 'workflow_exec_id', workflow_ids,
+                    lambda item: activity_ids.add(item['activity_exec_id']['S'])),
+                ('activity_exec_dependency', WORKFLOW_DEPENDENCY_INDEX, 'workflow_exec_id', workflow_ids, None),
+                # Filled in while archiving the activities.
+                ('activity_event', ACTIVITY_EVENT_INDEX, 'activity_exec_id', activity_ids, None)):
+            found = _archive_children(client, writer, tables[table_name], table_name, index_name,
+                                      parent_attribute, sorted(parent_ids), on_item, read_budget, segments,
+                                      ttl_attribute)
+            if found is not None:
+                archived[table_name] = found
+    finally:
+        files = writer.close()
+    for name in files:
+        out.action("Archive", "Wrote " + os.path.basename(name))
+        out.status("OK")
+
+    # Only now that the archive files are complete, remove the items.
+    # Children first, so an interrupted run can pick up the workflow again.
+    for table_name in ('activity_event', 'activity_exec_dependency', 'activity_exec', 'workflow_exec'):
+        if table_name not in archived or len(archived[table_name]) <= 0:
+            continue
+        if mode == ARCHIVE_DELETE:
+            out.action("Archive", "Deleting {0} items from {1}".format(len(archived[table_name]), table_name))
+            requests = [{'DeleteRequest': {'Key': key}} for key in archived[table_name]]
+            consumed = batch_write(client, tables[table_name], requests, budget=write_budget)
+        else:
+            out.action("Archive", "Expiring {0} items in {1}".format(len(archived[table_name]), table_name))
+            consumed = _set_ttl(client, tables[table_name], archived[table_name], ttl_attribute,
+                                int(now + settings['ttl delay seconds']), write_budget)
+        out.status("{0:.0f} WCU".format(consumed))
+
+    out.action("Archive", "Read {0:.0f} RCU, waited {1:.1f}s for capacity".format(
+        read_budget.consumed, read_budget.waited_seconds + write_budget.waited_seconds))
+    out.status("OK")
+    return dict((name, len(found)) for name, found in archived.items())
+
+
+def _find_workflow_keys(client, workflow_desc, states, cutoff, budget, segments, ttl_attribute=None):
+    """
+    Keys of the workflows in one of the states, that started before the
+    cutoff.  Uses the state global index when the table has it, otherwise
+    falls back to a filtered scan.
+
+    :param ttl_attribute: if given, the scan leaves out the workflows that
+        have it.  The index doesn't project it, so the workflows found with
+        the index still include them.
+    """
+    table_name = workflow_desc['TableName']
+    names = key_names(workflow_desc)
+    ret = []
+    index_names = [i['IndexName'] for i in workflow_desc.get('GlobalSecondaryIndexes', [])]
+    if WORKFLOW_STATE_INDEX in index_names:
+        for state in states:
+            args = {
+                'TableName': table_name,
+                'IndexName': WORKFLOW_STATE_INDEX,
+                'KeyConditionExpression': '#state = :state AND start_time_epoch < :cutoff',
+                'ExpressionAttributeNames': {'#state': 'state'},
+                'ExpressionAttributeValues': {':state': {'S': state}, ':cutoff': {'N': str(cutoff)}},
+                'ReturnConsumedCapacity': 'TOTAL'
+            }
+            while True:
+                budget.acquire()
+                response = client.query(**args)
+                budget.spend(consumed_units(response))
+                for item in response.get('Items', []):
+                    ret.append(item_key(item, names))
+                if 'LastEvaluatedKey' not in response:
+                    break
+                args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        return ret
+
+    state_values = {}
+    for i, state in enumerate(states):
+        state_values[':state{0}'.format(i)] = {'S': state}
+    values = dict(state_values)
+    values[':cutoff'] = {'N': str(cutoff)}
+    filter_expression = '#state IN ({0}) AND start_time_epoch < :cutoff'.format(
+        ', '.join(sorted(state_values.keys())))
+    attribute_names = {'#state': 'state'}
+    if ttl_attribute is not None:
+        filter_expression += ' AND attribute_not_exists(#ttl)'
+        attribute_names['#ttl'] = ttl_attribute
+    segmented_scan(
+        client, table_name, lambda items: ret.extend(item_key(item, names) for item in items),
+        segments=segments, budget=budget,
+        FilterExpression=filter_expression,
+        ExpressionAttributeNames=attribute_names,
+        ExpressionAttributeValues=values)
+    return ret
+
+
+def _archive_children(client, writer, full_name, table_name, index_name, parent_attribute, parent_ids, on_item,
+                      budget, workers, ttl_attribute=None):
+    """
+    Find the items belonging to the archived parents with a Query per
+    parent on the table's global index, and write them to the archive.
+
+    :param full_name: full name of the table.
+    :param table_name: table name, without the prefix, as written to the archive.
+    :param index_name: global index with the parent attribute as its hash key.
+    :param parent_attribute: attribute holding the parent ID.
+    :param parent_ids: list of the archived parent IDs.
+    :param on_item: function called with each archived item, or None.
+    :param workers: number of threads running the queries.
+    :param ttl_attribute: if given, the items that have it are left out.
+    :return: list of the archived item keys, or None if the table does not
+        exist (its module is not installed).
+    """
+    try:
+        desc = client.describe_table(TableName=full_name)['Table']
+    except Exception as e:
+        if is_not_found(e):
+            return None
+        raise
+    if index_name not in [i['IndexName'] for i in desc.get('GlobalSecondaryIndexes', [])]:
+        raise ValueError("{0} has no {1} index; run the installer to add it".format(full_name, index_name))
+    names = key_names(desc)
+
+    out.action("Archive", "Archiving " + table_name)
+    keys = _query_keys(client, full_name, index_name, parent_attribute, parent_ids, names, budget, workers)
+    found = []
+    # The index only projects the keys, so the TTL attribute is checked on
+    # the full items.
+    for item in batch_get(client, full_name, keys, budget=budget):
+        if ttl_attribute is not None and ttl_attribute in item:
+            continue
+        writer.write(table_name, item)
+        found.append(item_key(item, names))
+        if on_item is not None:
+            on_item(item)
+    out.status("{0} items".format(len(found)))
+    return found
+
+
+def _query_keys(client, table_name, index_name, parent_attribute, parent_ids, names, budget, workers):
+    """
+    Keys of the table items for each of the parent IDs, queried from the
+    index on one thread per worker.
+    """
+    assert workers > 0
+    errors = []
+    ret = []
+    lock = threading.Lock()
+
+    def worker(ids):
+        try:
+            for parent_id in ids:
+                args = {
+                    'TableName': table_name,
+                    'IndexName': index_name,
+                    'KeyConditionExpression': '#parent = :parent',
+                    'ExpressionAttributeNames': {'#parent': parent_attribute},
+                    'ExpressionAttributeValues': {':parent': {'S': parent_id}},
+                    'ReturnConsumedCapacity': 'TOTAL'
+                }
+                while len(errors) <= 0:
+                    budget.acquire()
+                    response = client.query(**args)
+                    budget.spend(consumed_units(response))
+                    with lock:
+                        ret.extend(item_key(item, names) for item in response.get('Items', []))
+                    if 'LastEvaluatedKey' not in response:
+                        break
+                    args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+                if len(errors) > 0:
+                    return
+        except Exception as e:
+            errors.append(e)
+
+    workers = max(1, min(workers, len(parent_ids)))
+    if workers == 1:
+        worker(parent_ids)
+    else:
+        threads = []
+        for i in range(workers):
+            t = threading.Thread(target=worker, args=(parent_ids[i::workers],),
+                                 name="query-{0}-{1}".format(table_name, i))
+            t.daemon = True
+            t.start()
+            threads.append(t)
+        for t in threads:
+            t.join()
+    if len(errors) > 0:
+        raise errors[0]
+    return ret
+
+
+def _set_ttl(client, table_name, keys, ttl_attribute, expires, budget):
+    """
+    Set the TTL attribute on each of the items, turning on TTL for the
+    table if it isn't already.  Items removed since they were archived are
+    left alone.
+    """
+    status = client.describe_time_to_live(TableName=table_name).get('TimeToLiveDescription', {})
+    if status.get('TimeToLiveStatus') not in ('ENABLED', 'ENABLING'):
+        client.update_time_to_live(
+            TableName=table_name,
+            TimeToLiveSpecification={'Enabled': True, 'AttributeName': ttl_attribute})
+    elif status.get('AttributeName') != ttl_attribute:
+        raise ValueError("{0} already expires items with the {1} attribute".format(
+            table_name, status.get('AttributeName')))
+
+    consumed = 0.0
+    for key in keys:
+        budget.acquire()
+        try:
+            response = client.update_item(
+                TableName=table_name,
+                Key=key,
+                UpdateExpression='SET #ttl = :expires',
+                ConditionExpression='attribute_exists(#key)',
+                ExpressionAttributeNames={'#ttl': ttl_attribute, '#key': sorted(key.keys())[0]},
+                ExpressionAttributeValues={':expires': {'N': str(expires)}},
+                ReturnConsumedCapacity='TOTAL')
+        except Exception as e:
+            if error_code(e) == 'ConditionalCheckFailedException':
+                continue
+            raise
+        units = consumed_units(response)
+        budget.spend(units)
+        consumed += units
+    return consumed
+
+
+def _json_default(value):
+    # Binary attribute values come back from the client as bytes.
+    if isinstance(value, (bytes, bytearray)):
+        return base64.b64encode(value).decode('ascii')
+    raise TypeError("Cannot archive {0!r}".format(value))
@@ -0,0 +1,262 @@
+"""
+Bulk item operations: segmented parallel scans, batched reads and writes,
+and a capacity budget to keep them from starving the workflow traffic.
+
+The budget is measured with the consumed capacity DynamoDB reports for
+each request, so it holds no matter the item sizes.
+"""
+
+import random
+import threading
+import time
+
+# BatchWriteItem limit on the number of items per request.
+MAX_BATCH_WRITE_ITEMS = 25
+
+# BatchGetItem limit on the number of keys per request.
+MAX_BATCH_GET_ITEMS = 100
+
+
+class UnprocessedItemsError(Exception):
+    """
+    Items were still unprocessed after the retries ran out.
+    """
+    def __init__(self, table_name, unprocessed_count, attempts):
+        Exception.__init__(self, "{0} items for {1} were still unprocessed after {2} attempts".format(
+            unprocessed_count, table_name, attempts))
+        self.table_name = table_name
+        self.unprocessed_count = unprocessed_count
+        self.attempts = attempts
+
+
+class BatchStats(object):
+    """
+    Counts the batch requests, and the retries of unprocessed items.
+    """
+    def __init__(self):
+        object.__init__(self)
+        self.requests = 0
+        self.retries = 0
+
+
+class CapacityBudget(object):
+    """
+    A token bucket of capacity units, refilled at a fixed rate per second.
+    Callers `acquire` before sending a request, then `spend` what the
+    response says was consumed.  The balance can go negative; the next
+    acquire then waits for it to be paid back.  It is safe to share between
+    threads.
+
+    :param units_per_second: capacity units to allow per second; None for no limit.
+    :param burst: most units the bucket holds; defaults to one second's worth.
+    """
+    def __init__(self, units_per_second, burst=None, sleep=time.sleep, clock=time.time):
+        object.__init__(self)
+        assert units_per_second is None or units_per_second > 0
+        self.__rate = units_per_second
+        self.__burst = burst or units_per_second
+        self.__sleep = sleep
+        self.__clock = clock
+        self.__lock = threading.Lock()
+        self.__balance = self.__burst or 0
+        self.__updated = clock()
+        self.consumed = 0.0
+        self.waited_seconds = 0.0
+
+    @property
+    def units_per_second(self):
+        return self.__rate
+
+    def acquire(self):
+        """
+        Wait until the budget is no longer overdrawn.
+        """
+        if self.__rate is None:
+            return
+        while True:
+            with self.__lock:
+                self._refill()
+                if self.__balance > 0:
+                    return
+                delay = (1.0 - self.__balance) / self.__rate
+                self.waited_seconds += delay
+            self.__sleep(delay)
+
+    def spend(self, units):
+        with self.__lock:
+            self.consumed += units
+            if self.__rate is not None:
+                self._refill()
+                self.__balance -= units
+
+    def _refill(self):
+        now = self.__clock()
+        self.__balance = min(self.__burst, self.__balance + (now - self.__updated) * self.__rate)
+        self.__updated = now
+
+
+def consumed_units(response):
+    """
+    Total the consumed capacity reported in a response.
+    """
+    capacity = response.get('ConsumedCapacity')
+    if capacity is None:
+        return 0.0
+    if isinstance(capacity, dict):
+        capacity = [capacity]
+    ret = 0.0
+    for c in capacity:
+        ret += c.get('CapacityUnits', 0.0)
+    return ret
+
+
+def batch_write(client, table_name, requests, budget=None, max_attempts=8, initial_delay=0.05, max_delay=5,
+                sleep=time.sleep, rand=random.random, stats=None):
+    """
+    Send the write requests (PutRequest or DeleteRequest dictionaries) in
+    batches of 25, retrying the unprocessed items with a capped, jittered
+    exponential backoff.
+
+    :param client: dynamodb client
+    :param table_name: full table name
+    :param requests: list of write requests
+    :param budget: CapacityBudget to draw the write capacity from, or None.
+    :param stats: BatchStats to count the requests in, or None.
+    :return: the write capacity consumed.
+    """
+    consumed = 0.0
+    for i in range(0, len(requests), MAX_BATCH_WRITE_ITEMS):
+        pending = requests[i:i + MAX_BATCH_WRITE_ITEMS]
+        attempt = 0
+        while len(pending) > 0:
+            if attempt >= max_attempts:
+                raise UnprocessedItemsError(table_name, len(pending), attempt)
+            if attempt > 0:
+                if stats is not None:
+                    stats.retries += 1
+                delay = min(max_delay, initial_delay * (2 ** (attempt - 1)))
+                sleep(delay / 2.0 + delay * rand() / 2.0)
+            attempt += 1
+            if budget is not None:
+                budget.acquire()
+            if stats is not None:
+                stats.requests += 1
+            response = client.batch_write_item(
+                RequestItems={table_name: pending},
+                ReturnConsumedCapacity='TOTAL')
+            units = consumed_units(response)
+            if budget is not None:
+                budget.spend(units)
+            consumed += units
+            pending = (response.get('UnprocessedItems') or {}).get(table_name, [])
+    return consumed
+
+
+def batch_get(client, table_name, keys, budget=None, max_attempts=8, initial_delay=0.05, max_delay=5,
+              sleep=time.sleep, rand=random.random):
+    """
+    Generator for the items with the given keys, read 100 keys at a time.
+    Keys that are not found are skipped.
+
+    :param client: dynamodb client
+    :param table_name: full table name
+    :param keys: list of key dictionaries
+    :param budget: CapacityBudget to draw the read capacity from, or None.
+    """
+    for i in range(0, len(keys), MAX_BATCH_GET_ITEMS):
+        pending = keys[i:i + MAX_BATCH_GET_ITEMS]
+        attempt = 0
+        while len(pending) > 0:
+            if attempt >= max_attempts:
+                raise UnprocessedItemsError(table_name, len(pending), attempt)
+            if attempt > 0:
+                delay = min(max_delay, initial_delay * (2 ** (attempt - 1)))
+                sleep(delay / 2.0 + delay * rand() / 2.0)
+            attempt += 1
+            if budget is not None:
+                budget.acquire()
+            response = client.batch_get_item(
+                RequestItems={table_name: {'Keys': pending}},
+                ReturnConsumedCapacity='TOTAL')
+            if budget is not None:
+                budget.spend(consumed_units(response))
+            for item in response.get('Responses', {}).get(table_name, []):
+                yield item
+            pending = (response.get('UnprocessedKeys') or {}).get(table_name, {}).get('Keys', [])
+
+
+def segmented_scan(client, table_name, handler, segments=4, budget=None, **scan_args):
+    """
+    Scan the whole table with a parallel scan, one thread per segment.
+    Each page of items is passed to the handler, from the segment's thread,
+    so the handler must be thread safe.
+
+    :param client: dynamodb client
+    :param table_name: full table name
+    :param handler: function called with the list of items in each page.
+    :param segments: number of scan segments (and threads).
+    :param budget: CapacityBudget to draw the read capacity from, or None.
+    :param scan_args: additional arguments for each scan call, such as
+        FilterExpression or ConsistentRead.
+    :return: number of items scanned.
+    """
+    assert segments > 0
+    errors = []
+    counts = [0] * segments
+
+    def worker(segment):
+        args = dict(scan_args)
+        args['TableName'] = table_name
+        args['ReturnConsumedCapacity'] = 'TOTAL'
+        if segments > 1:
+            args['Segment'] = segment
+            args['TotalSegments'] = segments
+        try:
+            while len(errors) <= 0:
+                if budget is not None:
+                    budget.acquire()
+                response = client.scan(**args)
+                if budget is not None:
+                    budget.spend(consumed_units(response))
+                counts[segment] += response.get('ScannedCount', 0)
+                handler(response.get('Items', []))
+                if 'LastEvaluatedKey' not in response:
+                    return
+                args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        except Exception as e:
+            errors.append(e)
+
+    if segments == 1:
+        worker(0)
+    else:
+        threads = []
+        for i in range(segments):
+            t = threading.Thread(target=worker, args=(i,), name="scan-{0}-{1}".format(table_name, i))
+            t.daemon = True
+            t.start()
+            threads.append(t)
+        for t in threads:
+            t.join()
+    if len(errors) > 0:
+        raise errors[0]
+    return sum(counts)
+
+
+def item_key(item, key_names):
+    """
+    Pull the primary key out of an item.
+
+    :param item: item, in the client's attribute value form.
+    :param key_names: the names of the key attributes.
+    """
+    ret = {}
+    for name in key_names:
+        ret[name] = item[name]
+    return ret
+
+
+def key_names(table_description):
+    """
+    The names of the key attributes from a describe_table 'Table' value.
+    """
+    return [ks['AttributeName'] for ks in table_description['KeySchema']]
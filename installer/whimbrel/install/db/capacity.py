@@ -0,0 +1,405 @@
+"""
+Capacity planning for the DynamoDB tables.
+
+Rather than giving every table the same throughput, the planner takes a
+workload profile (how many workflows run, how big they are, how often the
+activities send heartbeats) and works out the read and write capacity each
+table and index needs at peak, or recommends on-demand billing when that
+is cheaper for the workload.
+
+The model follows the contract (docs/contract.md):
+
+* Each workflow writes one `workflow_request` item, and its
+  `workflow_exec` item is written on creation, on `RUNNING` and when it
+  finishes.
+* Each activity is inserted into `activity_exec`, then written for each
+  transition (queued, running, finished), and once per heartbeat interval
+  while it runs.  Each of its dependencies is one `activity_exec_dependency`
+  item, and each transition is one `activity_event` item.
+* When an activity completes, the workflow and the activities depending on
+  it are read to decide what runs next.
+
+Every write to a table is also a write to each local secondary index that
+holds the item (all the indexes here project ALL attributes), so the write
+cost of a table grows with its index count.  Global secondary indexes have
+their own capacity: they take a write for each table write, and their reads
+come from whichever readers query them:
+
+* `state_heartbeat` - the monitors, which read the entry of each active
+  activity on every pass.
+* `state_start_time` - the web monitor, which reads the entry of each
+  active workflow on every pass, and the archiver, once per workflow.
+* `workflow_dependency` - the dependency tracker, which loads the graph of
+  each workflow once, and the archiver, once per workflow.
+* `workflow_activity` and `activity_events` - only the archiver, once per
+  workflow and once per activity.
+"""
+
+import math
+
+from .tabledef import PROVISIONED, PAY_PER_REQUEST
+
+HOURS_PER_MONTH = 730
+
+# Billing choices for the profile.
+BILLING_AUTO = 'auto'
+BILLING_PROVISIONED = 'provisioned'
+BILLING_ON_DEMAND = 'on demand'
+
+DEFAULT_ITEM_SIZES = {
+    'workflow_request': 300,
+    'workflow_exec': 400,
+    'activity_exec': 600,
+    'activity_exec_dependency': 200,
+    'activity_event': 300,
+    'workflow_lambda': 200,
+    'install_status': 100
+}
+DEFAULT_ITEM_SIZE = 500
+
+# Size of a global index entry that only projects the keys and a few attributes.
+SMALL_PROJECTION_SIZE = 100
+
+# US East prices, in dollars.  Override with the 'prices' capacity setting.
+DEFAULT_PRICES = {
+    'rcu hour': 0.00013,
+    'wcu hour': 0.00065,
+    'million read requests': 0.25,
+    'million write requests': 1.25
+}
+
+
+class WorkloadProfile(object):
+    """
+    Describes the expected load on the Whimbrel tables.
+
+    :param workflows_per_hour: average number of workflows started each hour.
+    :param activities_per_workflow: average number of activities in a workflow.
+    :param dependencies_per_activity: average number of upstream activities for each activity.
+    :param activity_duration_seconds: average time an activity spends RUNNING.
+    :param heartbeat_interval_seconds: time between heartbeats for a running
+        activity; None or 0 if heartbeats are not used.
+    :param peak_factor: ratio of the peak load to the average load.
+    :param headroom: extra capacity ratio on top of the peak, so that normal
+        variation does not throttle.
+    :param item_sizes: table name -> average item size in bytes, to override the defaults.
+    :param reads: table name -> (reads per workflow, strongly consistent) to
+        override the default read patterns.
+    :param billing: one of BILLING_AUTO, BILLING_PROVISIONED, BILLING_ON_DEMAND.
+    :param prices: price overrides; see DEFAULT_PRICES.
+    :param monitor_interval_seconds: time between the monitor passes that
+        query the global indexes.
+    """
+    def __init__(self, workflows_per_hour, activities_per_workflow=5, dependencies_per_activity=1,
+                 activity_duration_seconds=300, heartbeat_interval_seconds=30, peak_factor=2.0,
+                 headroom=1.2, item_sizes=None, reads=None, billing=BILLING_AUTO, prices=None,
+                 monitor_interval_seconds=60):
+        object.__init__(self)
+        assert workflows_per_hour >= 0
+        assert peak_factor >= 1
+        assert billing in (BILLING_AUTO, BILLING_PROVISIONED, BILLING_ON_DEMAND)
+        self.workflows_per_hour = workflows_per_hour
+        self.activities_per_workflow = activities_per_workflow
+        self.dependencies_per_activity = dependencies_per_activity
+        self.activity_duration_seconds = activity_duration_seconds
+        self.heartbeat_interval_seconds = heartbeat_interval_seconds
+        self.peak_factor = peak_factor
+        self.headroom = headroom
+        self.item_sizes = dict(DEFAULT_ITEM_SIZES)
+        self.item_sizes.update(item_sizes or {})
+        self.reads = reads or {}
+        self.billing = billing
+        self.prices = dict(DEFAULT_PRICES)
+        self.prices.update(prices or {})
+        self.monitor_interval_seconds = monitor_interval_seconds
+
+    @staticmethod
+    def from_config(config):
+        """
+        Create the profile from the 'capacity' configuration category.
+
+        :param config: Config
+        :return: the WorkloadProfile, or None if no workload is configured.
+        """
+        settings = config.capacity_settings
+        if settings.get('workflows per hour') is None:
+            return None
+        reads = {}
+        for (name, pattern) in (settings.get('reads') or {}).items():
+            reads[name] = tuple(pattern)
+        return WorkloadProfile(
+            workflows_per_hour=settings['workflows per hour'],
+            activities_per_workflow=settings['activities per workflow'],
+            dependencies_per_activity=settings['dependencies per activity'],
+            activity_duration_seconds=settings['activity duration seconds'],
+            heartbeat_interval_seconds=settings['heartbeat interval seconds'],
+            peak_factor=settings['peak factor'],
+            headroom=settings['headroom'],
+            item_sizes=settings.get('item sizes'),
+            reads=reads,
+            billing=settings['billing'],
+            prices=settings.get('prices'),
+            monitor_interval_seconds=settings.get('monitor interval seconds', 60))
+
+    @property
+    def workflows_per_second(self):
+        return self.workflows_per_hour / 3600.0
+
+    @property
+    def running_activities(self):
+        """
+        Average number of activities running at once (Little's law).
+        """
+        return self.workflows_per_second * self.activities_per_workflow * self.activity_duration_seconds
+
+    @property
+    def running_workflows(self):
+        """
+        Average number of workflows running at once.  Workflows with
+        dependencies are taken to run their activities one after another.
+        """
+        steps = self.dependencies_per_activity > 0 and self.activities_per_workflow or 1
+        return self.workflows_per_second * steps * self.activity_duration_seconds
+
+    @property
+    def heartbeats_per_second(self):
+        if not self.heartbeat_interval_seconds:
+            return 0.0
+        return self.running_activities / float(self.heartbeat_interval_seconds)
+
+    def item_size(self, table_name):
+        return self.item_sizes.get(table_name, DEFAULT_ITEM_SIZE)
+
+
+class TableCapacity(object):
+    """
+    The planned capacity for one table.
+    """
+    def __init__(self, table_name, billing_mode, read_capacity, write_capacity,
+                 reads_per_second, writes_per_second, index_capacity, global_index_capacity,
+                 provisioned_cost, on_demand_cost):
+        object.__init__(self)
+        self.table_name = table_name
+        self.billing_mode = billing_mode
+        self.read_capacity = read_capacity
+        self.write_capacity = write_capacity
+        # Average request unit rates, before the peak factor.
+        self.reads_per_second = reads_per_second
+        self.writes_per_second = writes_per_second
+        # local index name -> (read capacity, write capacity) the index accounts for.
+        self.index_capacity = index_capacity
+        # global index name -> (read capacity, write capacity) for the index itself.
+        self.global_index_capacity = global_index_capacity
+        # Monthly dollar costs for each billing mode.
+        self.provisioned_cost = provisioned_cost
+        self.on_demand_cost = on_demand_cost
+
+    @property
+    def monthly_cost(self):
+        if self.billing_mode == PAY_PER_REQUEST:
+            return self.on_demand_cost
+        return self.provisioned_cost
+
+    def apply(self, desc):
+        """
+        Create a copy of the DbTableDef with this capacity.
+        """
+        return desc.with_capacity(self.read_capacity, self.write_capacity, self.billing_mode,
+                                  self.global_index_capacity)
+
+
+def plan_capacity(profile, tables):
+    """
+    Compute the capacity for each table.
+
+    :param profile: WorkloadProfile
+    :param tables: table name (without prefix) -> DbTableDef
+    :return: table name -> TableCapacity
+    """
+    assert isinstance(profile, WorkloadProfile)
+    ret = {}
+    for (name, desc) in tables.items():
+        ret[name] = _plan_table(profile, name, desc)
+    return ret
+
+
+def apply_plan(plan, tables):
+    """
+    Create the table definitions with the planned capacity.
+
+    :param plan: result of plan_capacity
+    :param tables: table name -> DbTableDef
+    :return: new dictionary of table name -> DbTableDef
+    """
+    ret = {}
+    for (name, desc) in tables.items():
+        if name in plan:
+            ret[name] = plan[name].apply(desc)
+        else:
+            ret[name] = desc
+    return ret
+
+
+def format_report(profile, plan):
+    """
+    Create the text report for the capacity plan.
+
+    :return: list of lines
+    """
+    lines = [
+        "Workload: {0} workflows/hour, {1} activities/workflow, {2:.1f} running activities, "
+        "{3:.2f} heartbeats/second (peak x{4})".format(
+            profile.workflows_per_hour, profile.activities_per_workflow, profile.running_activities,
+            profile.heartbeats_per_second, profile.peak_factor),
+        "{0:<36} {1:>15} {2:>6} {3:>6} {4:>12} {5:>12}".format(
+            "table / index", "billing", "RCU", "WCU", "provisioned", "on demand")
+    ]
+    total = 0.0
+    for name in sorted(plan.keys()):
+        cap = plan[name]
+        lines.append("{0:<36} {1:>15} {2:>6} {3:>6} {4:>12} {5:>12}".format(
+            name, cap.billing_mode, cap.read_capacity, cap.write_capacity,
+            "${0:.2f}".format(cap.provisioned_cost), "${0:.2f}".format(cap.on_demand_cost)))
+        for index_name in sorted(cap.index_capacity.keys()):
+            index_read, index_write = cap.index_capacity[index_name]
+            lines.append("  {0:<34} {1:>15} {2:>6} {3:>6}".format(index_name, "local", index_read, index_write))
+        for index_name in sorted(cap.global_index_capacity.keys()):
+            index_read, index_write = cap.global_index_capacity[index_name]
+            lines.append("  {0:<34} {1:>15} {2:>6} {3:>6}".format(index_name, "global", index_read, index_write))
+        total += cap.monthly_cost
+    lines.append("Estimated monthly cost: ${0:.2f}".format(total))
+    return lines
+
+
+def _plan_table(profile, name, desc):
+    writes, reads, consistent = _table_rates(profile, name)
+    size = profile.item_size(name)
+    write_units = int(math.ceil(size / 1024.0))
+    read_units = int(math.ceil(size / 4096.0))
+    if not consistent:
+        read_units *= 0.5
+    local_index_names = [i['IndexName'] for i in desc.local_indexes]
+
+    # Each write lands in the table and in every local index.
+    table_write_rate = writes * write_units
+    write_rate = table_write_rate * (1 + len(local_index_names))
+    read_rate = reads * read_units
+
+    read_capacity = _capacity(read_rate, profile)
+    write_capacity = _capacity(write_rate, profile)
+    index_capacity = {}
+    for index_name in local_index_names:
+        # Local indexes share the table's capacity; this is the share of the
+        # table writes that each one is responsible for.
+        index_capacity[index_name] = (0, _capacity(table_write_rate, profile))
+
+    global_index_capacity = {}
+    for index in desc.global_indexes:
+        if index['Projection']['ProjectionType'] == 'ALL':
+            entry_size = size
+        else:
+            entry_size = SMALL_PROJECTION_SIZE
+        index_write_rate = writes * int(math.ceil(entry_size / 1024.0))
+        index_read_rate = _index_read_rate(profile, index['IndexName'], entry_size)
+        reads_key = name + '.' + index['IndexName']
+        if reads_key in profile.reads:
+            # Global indexes only support eventually consistent reads.
+            reads_per_workflow = profile.reads[reads_key][0]
+            index_read_rate = profile.workflows_per_second * reads_per_workflow * 0.5
+        global_index_capacity[index['IndexName']] = (
+            _capacity(index_read_rate, profile), _capacity(index_write_rate, profile))
+        read_rate += index_read_rate
+        write_rate += index_write_rate
+
+    all_read_capacity = read_capacity
+    all_write_capacity = write_capacity
+    for (index_read, index_write) in global_index_capacity.values():
+        all_read_capacity += index_read
+        all_write_capacity += index_write
+    provisioned_cost = HOURS_PER_MONTH * (
+        all_read_capacity * profile.prices['rcu hour'] + all_write_capacity * profile.prices['wcu hour'])
+    seconds_per_month = HOURS_PER_MONTH * 3600
+    on_demand_cost = seconds_per_month * (
+        read_rate * profile.prices['million read requests'] +
+        write_rate * profile.prices['million write requests']) / 1000000.0
+
+    if profile.billing == BILLING_ON_DEMAND:
+        billing_mode = PAY_PER_REQUEST
+    elif profile.billing == BILLING_PROVISIONED:
+        billing_mode = PROVISIONED
+    elif on_demand_cost < provisioned_cost:
+        billing_mode = PAY_PER_REQUEST
+    else:
+        billing_mode = PROVISIONED
+
+    return TableCapacity(
+        name, billing_mode, read_capacity, write_capacity, read_rate, write_rate,
+        index_capacity, global_index_capacity, provisioned_cost, on_demand_cost)
+
+
+def _capacity(rate, profile):
+    return max(1, int(math.ceil(rate * profile.peak_factor * profile.headroom)))
+
+
+def _index_read_rate(profile, index_name, entry_size):
+    """
+    Average read units per second for the global index, from the readers
+    that query it.  Global indexes only support eventually consistent reads.
+    """
+    wf = profile.workflows_per_second
+    activities = wf * profile.activities_per_workflow
+    passes = 1.0 / profile.monitor_interval_seconds
+    if index_name == 'state_heartbeat':
+        return _query_units(passes, profile.running_activities, entry_size)
+    if index_name == 'state_start_time':
+        return _query_units(passes, profile.running_workflows, entry_size) + _query_units(wf, 1, entry_size)
+    if index_name == 'workflow_dependency':
+        dependencies = profile.activities_per_workflow * profile.dependencies_per_activity
+        return 2 * _query_units(wf, dependencies, entry_size)
+    if index_name == 'workflow_activity':
+        return _query_units(wf, profile.activities_per_workflow, entry_size)
+    if index_name == 'activity_events':
+        # One event per transition; see _table_rates.
+        return _query_units(activities, 3, entry_size)
+    # Other indexes are taken to be read like the state indexes.
+    return _query_units(passes, profile.running_activities, entry_size)
+
+
+def _query_units(queries_per_second, entries_per_query, entry_size):
+    # A query reads at least one 4 KB unit, half a unit when eventually consistent.
+    return queries_per_second * max(1.0, entries_per_query * entry_size / 4096.0) * 0.5
+
+
+def _table_rates(profile, name):
+    """
+    Average item writes and reads per second for the table.
+
+    :return: (writes per second, reads per second, strongly consistent reads)
+    """
+    wf = profile.workflows_per_second
+    activities = wf * profile.activities_per_workflow
+    dependencies = activities * profile.dependencies_per_activity
+
+    if name == 'workflow_request':
+        writes, reads, consistent = wf, 0.0, False
+    elif name == 'workflow_exec':
+        # created, RUNNING, finished; the workflow is read on each activity completion.
+        writes, reads, consistent = wf * 3, activities, True
+    elif name == 'activity_exec':
+        # inserted, queued, running, finished, plus the heartbeats.  Each completion
+        # reads the activities depending on it, and their other upstream activities.
+        writes = activities * 4 + profile.heartbeats_per_second
+        reads, consistent = dependencies * (1 + profile.dependencies_per_activity), True
+    elif name == 'activity_exec_dependency':
+        writes, reads, consistent = dependencies, dependencies, False
+    elif name == 'activity_event':
+        writes, reads, consistent = activities * 3, 0.0, False
+    elif name == 'workflow_lambda':
+        writes, reads, consistent = 0.0, wf + activities, False
+    else:
+        writes, reads, consistent = 0.0, 0.0, False
+
+    if name in profile.reads:
+        reads_per_workflow, consistent = profile.reads[name]
+        reads = wf * reads_per_workflow
+    return writes, reads, consistent
@@ -0,0 +1,18 @@
+"""
+The DynamoDB connection for the installer commands.
+"""
+
+
+def connect(config):
+    """
+    Creates a dynamodb low-level API client
+    :param config:
+    :return:
+    """
+    opt_args = {}
+    if config.db_endpoint is not None:
+        opt_args['endpoint_url'] = config.db_endpoint
+    if config.db_use_ssl is not None:
+        opt_args['use_ssl'] = config.db_use_ssl
+    db = config.create_boto3_session().client('dynamodb', **opt_args)
+    return db
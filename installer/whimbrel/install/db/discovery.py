@@ -0,0 +1,163 @@
+"""
+Discovers the existing DynamoDB tables.
+
+Listing is done as a paginated stream of names, and the `describe_table`
+calls are spread over a bounded pool of worker threads.  The discovered
+descriptions can be written to a snapshot file, so that later planning
+steps can reuse them without asking DynamoDB again.
+"""
+
+import datetime
+import json
+import os
+import threading
+
+try:
+    # Python 3
+    import queue
+except ImportError:
+    # Python 2
+    import Queue as queue
+
+from .errors import is_not_found
+
+SNAPSHOT_VERSION = 1
+
+
+def list_table_names(client, db_prefix, page_size=None):
+    """
+    Generator for the names of all the tables that start with the prefix,
+    following the list_tables pagination.
+
+    :param client: dynamodb client
+    :param db_prefix: database table prefix (string)
+    :param page_size: maximum number of names per list_tables call, or None
+        for the service default.
+    :return: generator of full table names.
+    """
+    args = {}
+    if page_size is not None:
+        args['Limit'] = page_size
+    while True:
+        response = client.list_tables(**args)
+        for name in response['TableNames']:
+            if name.startswith(db_prefix):
+                yield name
+        if 'LastEvaluatedTableName' not in response:
+            return
+        args['ExclusiveStartTableName'] = response['LastEvaluatedTableName']
+
+
+def describe_tables(client, names, workers=8):
+    """
+    Describe each of the tables, using up to `workers` threads at once.
+    The low-level boto3 client is thread safe, so it is shared between the
+    workers.  Tables that do not exist (say, removed since they were listed)
+    are left out of the result.
+
+    :param client: dynamodb client
+    :param names: iterable of full table names; it is consumed as the
+        workers need more names, so it can be a list_table_names generator.
+    :param workers: maximum number of describe_table calls in flight.
+    :return: dictionary of full table name -> table description (the 'Table'
+        value of the describe_table response).
+    """
+    assert workers > 0
+    ret = {}
+    errors = []
+    names_lock = threading.Lock()
+    names_iter = iter(names)
+    results = queue.Queue()
+
+    def next_name():
+        with names_lock:
+            if len(errors) > 0:
+                return None
+            try:
+                return next(names_iter)
+            except StopIteration:
+                return None
+
+    def worker():
+        while True:
+            name = next_name()
+            if name is None:
+                return
+            try:
+                response = client.describe_table(TableName=name)
+                results.put((name, response['Table']))
+            except Exception as e:
+                if is_not_found(e):
+                    continue
+                with names_lock:
+                    errors.append(e)
+                return
+
+    threads = []
+    for i in range(workers):
+        t = threading.Thread(target=worker, name="describe-table-{0}".format(i))
+        t.daemon = True
+        t.start()
+        threads.append(t)
+    for t in threads:
+        t.join()
+
+    if len(errors) > 0:
+        raise errors[0]
+    while not results.empty():
+        name, table = results.get()
+        ret[name] = table
+    return ret
+
+
+def save_snapshot(filename, db_prefix, tables):
+    """
+    Write the discovered table descriptions to a JSON snapshot file.
+
+    :param filename: snapshot file name
+    :param db_prefix: database table prefix the descriptions were loaded with.
+    :param tables: dictionary of table name (without prefix) -> description
+    :return: None
+    """
+    parent = os.path.dirname(filename)
+    if len(parent) > 0 and not os.path.isdir(parent):
+        os.makedirs(parent)
+    snapshot = {
+        'version': SNAPSHOT_VERSION,
+        'db_prefix': db_prefix,
+        'tables': tables
+    }
+    temp_file = filename + '.tmp'
+    with open(temp_file, 'w') as f:
+        json.dump(snapshot, f, indent=2, sort_keys=True, default=_json_default)
+    if os.path.exists(filename):
+        os.remove(filename)
+    os.rename(temp_file, filename)
+
+
+def load_snapshot(filename, db_prefix=None):
+    """
+    Read a snapshot written by save_snapshot.
+
+    :param filename: snapshot file name
+    :param db_prefix: if given, the snapshot must have been taken with this prefix.
+    :return: dictionary of table name (without prefix) -> description, or
+        None if there is no usable snapshot.
+    """
+    if not os.path.isfile(filename):
+        return None
+    with open(filename, 'r') as f:
+        snapshot = json.load(f)
+    if snapshot.get('version') != SNAPSHOT_VERSION:
+        return None
+    if db_prefix is not None and snapshot.get('db_prefix') != db_prefix:
+        return None
+    return snapshot['tables']
+
+
+def _json_default(value):
+    # The table descriptions contain datetime values (CreationDateTime and
+    # friends), which json can't write on its own.
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    raise TypeError("Cannot write {0!r} to a snapshot".format(value))
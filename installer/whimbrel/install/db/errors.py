@@ -0,0 +1,21 @@
+"""
+Helpers for inspecting the errors raised by the boto3 clients.
+"""
+
+
+def error_code(e):
+    """
+    The AWS error code for a boto3 client exception, or None if it is not
+    an AWS error.
+
+    :param e: exception
+    :return: string error code, or None
+    """
+    response = getattr(e, 'response', None)
+    if isinstance(response, dict) and 'Error' in response:
+        return response['Error'].get('Code')
+    return None
+
+
+def is_not_found(e):
+    return error_code(e) == 'ResourceNotFoundException'
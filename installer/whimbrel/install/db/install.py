@@ -4,13 +4,20 @@ Handles the schema creation and upgrade.
 
 import time
 
+from .capacity import WorkloadProfile, plan_capacity, apply_plan, format_report
+from .connect import connect
+from .discovery import list_table_names, describe_tables, save_snapshot, load_snapshot
+from .errors import is_not_found
+from .migrate import MigrationRequired, SHADOW_SEPARATOR, plan_migration, apply_stream_steps, shadow_table_name
+from .migrate import MAX_CATCH_UP_PASSES, backfill_table, catch_up_table, strip_index_values
+from .bulk import CapacityBudget
 from .schema_metadata import METADATA_DB_TABLES
-from .tabledef import DbTableDef
+from .status import InstallStatusBatch, load_installed_status, physical_names
+from .tabledef import DbTableDef, PROVISIONED, PAY_PER_REQUEST
+from .waiter import TableWaiter, ALL_ACTIVE, ANY_ACTIVE, is_active
 from ..cfg.config import Config
 from ..util import out
 
-_TIMEOUT = [2]
-
 
 def install_db(config):
     """
@@ -20,29 +27,220 @@ def install_db(config):
     :return: None
     """
     assert isinstance(config, Config)
-    _TIMEOUT[0] = config.db_wait_seconds
-    client = _connect(config)
+    client = connect(config)
+    waiter = TableWaiter(
+        client,
+        initial_delay=config.db_wait_seconds,
+        max_delay=config.db_max_wait_seconds,
+        deadline=config.db_wait_timeout_seconds)
     db_prefix = config.db_prefix
-    existing_tables = _load_tables(client, db_prefix)
 
-    # These must be installed first; they should never be upgraded.
-    for name, desc in METADATA_DB_TABLES.items():
+    requested_tables = _load_requested_tables(config)
+    metadata_tables = dict(METADATA_DB_TABLES)
+
+    profile = WorkloadProfile.from_config(config)
+    if profile is not None:
+        all_tables = dict(metadata_tables)
+        all_tables.update(requested_tables)
+        plan = plan_capacity(profile, all_tables)
+        for line in format_report(profile, plan):
+            print(line)
+        metadata_tables = apply_plan(plan, metadata_tables)
+        requested_tables = apply_plan(plan, requested_tables)
+
+    all_tables = dict(metadata_tables)
+    all_tables.update(requested_tables)
+    installed = load_installed_status(client, db_prefix, all_tables.keys())
+    locations = physical_names(installed)
+
+    existing_tables = None
+    # With a capacity plan, every table must be inspected to check its
+    # throughput, so the version fast path can't skip any of them.
+    if config.db_version_check and profile is None:
+        current_tables, existing_tables = _load_changed_tables(
+            client, db_prefix, all_tables, installed, config.db_discovery_workers)
+        # Tables already installed at the requested version need no
+        # further inspection.
+        for name in current_tables:
+            metadata_tables.pop(name, None)
+            requested_tables.pop(name, None)
+    if existing_tables is None:
+        existing_tables = _load_tables(client, db_prefix, config.db_discovery_workers)
+    _use_physical_names(existing_tables, locations)
+    if config.db_snapshot_file is not None:
+        save_snapshot(config.db_snapshot_file, db_prefix, existing_tables)
+
+    migration = MigrationOptions(
+        config.db_allow_rebuild, config.db_migration_capacity, config.db_migration_segments)
+    status = InstallStatusBatch(client, db_prefix)
+    try:
+        if config.db_concurrent_install:
+            _install_db_concurrent(client, waiter, status, db_prefix, existing_tables, metadata_tables,
+                                   requested_tables, config.db_concurrent_limit, locations, migration)
+        else:
+            # These must be installed first; they should never be upgraded.
+            for name, desc in metadata_tables.items():
+                if name not in existing_tables:
+                    _create_table(client, waiter, status, db_prefix, name, desc)
+
+            remaining = _update_existing_tables(client, waiter, status, db_prefix, existing_tables,
+                                                requested_tables, locations, migration)
+
+            for (name, desc) in remaining.items():
+                _create_table(client, waiter, status, db_prefix, name, desc)
+    finally:
+        # Everything that was installed gets its status recorded, even if a
+        # later table failed.
+        if len(status) > 0:
+            status.flush()
+    status.report()
+    waiter.report()
+
+
+def report_capacity(config):
+    """
+    Print the capacity plan for the configured workload, without changing
+    anything.
+
+    :param config:
+    :return: table name -> TableCapacity, or None if there is no workload configured.
+    """
+    assert isinstance(config, Config)
+    profile = WorkloadProfile.from_config(config)
+    if profile is None:
+        out.action("Capacity", "No workload profile in the 'capacity' configuration")
+        out.status("SKIPPED")
+        return None
+    tables = _load_requested_tables(config)
+    tables.update(METADATA_DB_TABLES)
+    plan = plan_capacity(profile, tables)
+    for line in format_report(profile, plan):
+        print(line)
+    return plan
+
+
+def report_migrations(config):
+    """
+    Print the schema changes the install would make to the existing tables,
+    without changing anything.  With a 'snapshot file' configured, the table
+    descriptions the last install saved there are used, rather than
+    describing the tables again.
+
+    :param config:
+    :return: table name -> MigrationPlan for the existing tables.
+    """
+    assert isinstance(config, Config)
+    client = connect(config)
+    db_prefix = config.db_prefix
+    requested_tables = _load_requested_tables(config)
+    installed = load_installed_status(client, db_prefix, requested_tables.keys())
+    current = set()
+    existing_tables = None
+    if config.db_snapshot_file is not None:
+        existing_tables = _load_snapshot_tables(
+            client, db_prefix, config.db_snapshot_file, requested_tables, installed, config.db_discovery_workers)
+    if existing_tables is None:
+        existing_tables = _load_tables(client, db_prefix, config.db_discovery_workers)
+        _use_physical_names(existing_tables, physical_names(installed))
+    else:
+        for (name, desc) in requested_tables.items():
+            if name not in existing_tables and name in (installed or {}) and installed[name][0] == desc.version:
+                current.add(name)
+    ret = {}
+    for name in sorted(requested_tables.keys()):
+        if name in current:
+            out.action("Migrate", "{0}: installed at version {1}".format(name, installed[name][0]))
+            out.status("OK")
+            continue
         if name not in existing_tables:
-            _create_table(client, db_prefix, name, desc)
+            out.action("Migrate", "{0}: create".format(name))
+            out.status("NEW")
+            continue
+        plan = plan_migration(name, requested_tables[name], existing_tables[name])
+        ret[name] = plan
+        if plan.is_empty:
+            out.action("Migrate", "{0}: no schema changes".format(name))
+            out.status("OK")
+        for step in plan.describe():
+            out.action("Migrate", "{0}: {1}".format(name, step))
+            out.status(plan.needs_rebuild and "REBUILD" or "IN PLACE")
+    return ret
 
+
+class MigrationOptions(object):
+    """
+    How the install may migrate tables that need a rebuild.
+
+    :param allow_rebuild: if False, a table that needs a rebuild fails the install.
+    :param capacity: capacity units per second the rebuild copy may use; None for no limit.
+    :param segments: number of parallel scan segments for the copy.
+    """
+    def __init__(self, allow_rebuild=False, capacity=None, segments=4):
+        object.__init__(self)
+        self.allow_rebuild = allow_rebuild
+        self.capacity = capacity
+        self.segments = segments
+
+
+def _load_requested_tables(config):
     requested_tables = {}
     for module_name in config.modules:
         module = config.load_modules()[module_name]
         # Every module has the "get_schema()" function; it returns {} if it
         # has no schema to install.
         requested_tables.update(module.get_schema())
-    remaining = _update_existing_tables(client, db_prefix, existing_tables, requested_tables)
+    return requested_tables
+
+
+def _install_db_concurrent(client, waiter, status, db_prefix, existing_tables, metadata_tables, requested_tables, limit,
+                           locations=None, migration=None):
+    """
+    Concurrent version of the install.  All the missing tables (metadata
+    included) are requested up front, and a single poller waits on all of
+    them together, rather than waiting for each table before creating the
+    next.  Existing tables that are not yet active are also waited on
+    together before any upgrade happens.
+
+    :param client:
+    :param waiter: TableWaiter
+    :param status: InstallStatusBatch
+    :param db_prefix:
+    :param existing_tables: result of a _load_tables call
+    :param metadata_tables: table name -> DbTableDef for the metadata tables
+    :param requested_tables: table name -> DbTableDef for all the modules
+    :param limit: maximum number of tables to have in the CREATING state at once.
+    :param locations: table name -> physical table name, for the rebuilt tables.
+    :param migration: MigrationOptions
+    :return: None
+    """
+    start = time.time()
+
+    missing_tables = {}
+    for (name, desc) in metadata_tables.items():
+        if name not in existing_tables:
+            missing_tables[name] = desc
+    for (name, desc) in requested_tables.items():
+        if name not in existing_tables:
+            missing_tables[name] = desc
+    if len(missing_tables) > 0:
+        _create_tables(client, waiter, status, db_prefix, missing_tables, limit)
+
+    not_active = {}
+    for (name, desc) in existing_tables.items():
+        if not is_active(desc):
+            not_active[desc['TableName']] = name
+    if len(not_active) > 0:
+        for (name, desc) in waiter.wait_all(sorted(not_active.keys())).items():
+            existing_tables[not_active[name]] = desc['Table']
+
+    _update_existing_tables(client, waiter, status, db_prefix, existing_tables, requested_tables, locations,
+                            migration)
 
-    for (name, desc) in remaining.items():
-        _create_table(client, db_prefix, name, desc)
+    out.action("Install", "Total database install time")
+    out.status("{0:.1f}s".format(time.time() - start))
 
 
-def _load_tables(client, db_prefix):
+def _load_tables(client, db_prefix, workers=8):
     """
     Discovers the tables in the DynamoDB that start with the given
     prefix.  It returns the detailed table information in a dictionary.
@@ -50,10 +248,12 @@ def _load_tables(client, db_prefix):
     for details about the table description.
 
     We use the low-level API because it gives us more control over the
-    precise calls made, so we can reduce the data and call count.
+    precise calls made, so we can reduce the data and call count.  The
+    describe calls are made in parallel, as the listed names stream in.
 
     :param client: dynamodb client
     :param db_prefix: database table prefix (string)
+    :param workers: maximum number of parallel describe_table calls.
     :return: dictionary, mapping the table name (string) to the
         table description (dictionary).  Think of it as a union of all
         the describe_table calls for the matching tables.  However,
@@ -61,31 +261,96 @@ def _load_tables(client, db_prefix):
     """
     out.action("Load Tables", "Discovering existing tables")
 
-    args = {}
-    tables = []
-    has_more = True
-    while has_more:
-        response = client.list_tables(**args)
-        if 'LastEvaluatedTableName' in response:
-            args['ExclusiveStartTableName '] = response['LastEvaluatedTableName']
-        else:
-            has_more = False
-
-        for name in response['TableNames']:
-            if name.startswith(db_prefix):
-                tables.append(name)
-
+    described = describe_tables(client, list_table_names(client, db_prefix), workers)
     ret = {}
-    for name in tables:
-        response = client.describe_table(TableName=name)
-        table = response['Table']
+    for table in described.values():
         ret[table['TableName'][len(db_prefix):]] = table
 
     out.status("OK")
     return ret
 
 
-def _update_existing_tables(client, db_prefix, existing_tables, requested_tables):
+def _load_changed_tables(client, db_prefix, tables, installed, workers=8):
+    """
+    Fast path for re-running the installer.  The install_status versions for
+    all the tables are read in one batched read, and only the tables whose
+    recorded version is missing or differs from the definition are
+    described.  When everything is current, this is a single round trip.
+
+    :param client: dynamodb client
+    :param db_prefix: database table prefix (string)
+    :param tables: table name (without prefix) -> DbTableDef
+    :param installed: result of a load_installed_status call
+    :param workers: maximum number of parallel describe_table calls.
+    :return: (set of table names that are current, dictionary of the other
+        tables that exist, in the same form as _load_tables).  If there is no
+        install_status table, then the second value is None, which means the
+        full discovery must be done.
+    """
+    out.action("Versions", "Checking installed table versions")
+    if installed is None:
+        out.status("NO STATUS")
+        return set(), None
+
+    current = set()
+    for (name, desc) in tables.items():
+        if name in installed and installed[name][0] == desc.version:
+            current.add(name)
+    out.status("{0}/{1} OK".format(len(current), len(tables)))
+
+    changed = []
+    for name in sorted(tables.keys()):
+        if name not in current:
+            changed.append(db_prefix + (name in installed and installed[name][1] or name))
+    ret = {}
+    for (name, table) in describe_tables(client, changed, workers).items():
+        ret[name[len(db_prefix):]] = table
+    return current, ret
+
+
+def _load_snapshot_tables(client, db_prefix, filename, tables, installed, workers=8):
+    """
+    The existing tables, from the snapshot the last install saved.  An
+    install that took the version fast path only saved the tables it found
+    changed; the tables missing from the snapshot that are not installed at
+    their requested version are described now.
+
+    :param tables: table name (without prefix) -> DbTableDef
+    :param installed: result of a load_installed_status call
+    :return: dictionary in the same form as _load_tables, without the
+        current tables the snapshot left out; or None if there is no
+        usable snapshot.
+    """
+    out.action("Load Tables", "Reading the table snapshot {0}".format(filename))
+    ret = load_snapshot(filename, db_prefix)
+    if ret is None:
+        out.status("NONE")
+        return None
+    out.status("{0} tables".format(len(ret)))
+    installed = installed or {}
+    missing = {}
+    for (name, desc) in tables.items():
+        if name in ret or (name in installed and installed[name][0] == desc.version):
+            continue
+        missing[db_prefix + (name in installed and installed[name][1] or name)] = name
+    for (physical_name, table) in describe_tables(client, sorted(missing.keys()), workers).items():
+        ret[missing[physical_name]] = table
+    return ret
+
+
+def _use_physical_names(existing_tables, locations):
+    """
+    Key the descriptions of the rebuilt tables by their table name, rather
+    than the physical name.  The tables they replaced are dropped from the
+    dictionary.
+    """
+    for (name, physical_name) in locations.items():
+        if physical_name in existing_tables:
+            existing_tables[name] = existing_tables.pop(physical_name)
+
+
+def _update_existing_tables(client, waiter, status, db_prefix, existing_tables, requested_tables, locations=None,
+                            migration=None):
     """
     Updates the existing DynamoDB tables to have the expected schema.
     Returns the DB_TABLES table entries for the tables that do not
@@ -94,138 +359,310 @@ def _update_existing_tables(client, db_prefix, existing_tables, requested_tables
     :param client:
     :param db_prefix: prefix for the db tables.
     :param existing_tables: result of a _load_tables call
+    :param locations: table name -> physical table name, for the rebuilt tables.
+    :param migration: MigrationOptions
     :return:
     """
     tables_not_existing = dict(requested_tables)
+    locations = locations or {}
 
     for (name, desc) in existing_tables.items():
         if name in tables_not_existing:
             expected = tables_not_existing[name]
             del tables_not_existing[name]
-
-            # TODO reference the install_status table to see
-            # how to upgrade.
-
-            _update_table(client, db_prefix, name, expected, desc)
-        elif name not in METADATA_DB_TABLES:
+            _update_table(client, waiter, status, db_prefix, name, expected, desc, locations.get(name), migration)
+        elif name not in METADATA_DB_TABLES and SHADOW_SEPARATOR not in name:
             print("Unexpected existing table: {0}".format(name))
 
     return tables_not_existing
 
 
-def _update_table(client, db_prefix, table_name, expected_state, current_state):
+def _update_table(client, waiter, status, db_prefix, table_name, expected_state, current_state, physical_name=None,
+                  migration=None):
     """
-    Updates an existing table to have the correct schema.
+    Updates an existing table to have the correct schema.  Stream changes,
+    global indexes and throughput are changed in place; other changes
+    rebuild the table, if the migration options allow it.
 
     :param client:
+    :param waiter: TableWaiter
+    :param status: InstallStatusBatch
     :param table_name:
     :param expected_state:
     :param current_state:
+    :param physical_name: name (without prefix) of the table holding the data,
+        if the table was rebuilt; None if it is the table name.
+    :param migration: MigrationOptions
     :return:
     """
     assert isinstance(expected_state, DbTableDef)
-    name = db_prefix + table_name
+    name = db_prefix + (physical_name or table_name)
 
-    current_state = _wait_for_active(client, name, current_state)
+    current_state = waiter.wait(name, current_state)
     if 'Table' in current_state:
         current_state = current_state['Table']
     if 'TableDescription' in current_state:
         current_state = current_state['TableDescription']
 
-    # print("current state: " + repr(current_state))
+    plan = plan_migration(table_name, expected_state, current_state)
+    if plan.needs_rebuild:
+        _rebuild_table(client, waiter, status, db_prefix, table_name, expected_state, physical_name or table_name,
+                       plan, migration or MigrationOptions())
+        return
 
-    desired_primary_key = expected_state.key_schema
-    actual_primary_key = current_state['KeySchema']
-    if desired_primary_key != actual_primary_key:
-        # FIXME perform upgrade
-        out.action("Upgrade", "Updating primary key")
-        out.status("FAIL")
-        raise NotImplementedError()
+    apply_stream_steps(client, waiter, name, plan)
 
-    desired_attributes = expected_state.attributes
-    actual_attributes = current_state['AttributeDefinitions']
-    if desired_attributes != actual_attributes:
-        # FIXME perform upgrade
-        out.action("Upgrade", "Updating attributes")
-        out.status("FAIL")
-        raise NotImplementedError()
-
-    desired_index_desc = expected_state.local_indexes
-    if len(desired_index_desc) > 0:
-        if 'LocalSecondaryIndexes' in current_state and len(current_state['LocalSecondaryIndexes']) > 0:
-            actual_index_desc = _strip_index_values(current_state['LocalSecondaryIndexes'])
-
-            # indexes are a list, but order doesn't matter.  So, convert them into a
-            # dictionary.
-            ui_desired = {}
-            for i in desired_index_desc:
-                ui_desired[i['IndexName']] = i
-            ui_actual = {}
-            for i in actual_index_desc:
-                ui_actual[i['IndexName']] = i
-
-            if ui_desired != ui_actual:
-                # FIXME perform upgrade
-                out.action("Upgrade", "Updating secondary local indexes")
-                out.status("FAIL")
-                print("Expected indexes: " + repr(desired_index_desc))
-                print("Actual indexes: " + repr(actual_index_desc))
-                raise NotImplementedError()
-        else:
-            # FIXME perform upgrade
-            out.action("Upgrade", "Updating secondary local indexes (adding them in)")
-            out.status("FAIL")
-            raise NotImplementedError()
-    elif 'LocalSecondaryIndexes' in current_state and len(current_state['LocalSecondaryIndexes']) > 0:
-            # FIXME perform upgrade
-            out.action("Upgrade", "Updating secondary local indexes (removing them)")
-            out.status("FAIL")
-            raise NotImplementedError()
+    # Without a capacity plan, don't mess with the provisioned throughput -
+    # assume the user can adjust these as needed for the environment.
+    if expected_state.has_planned_capacity:
+        _update_capacity(client, waiter, name, expected_state, current_state)
 
-    # Don't do anything with GlobalSecondaryIndexes
+    _update_global_indexes(client, waiter, name, expected_state, current_state)
 
-    desired_stream_def = expected_state.stream_specification
-    if desired_stream_def['StreamEnabled']:
-        if 'StreamSpecification' not in current_state or not current_state['StreamSpecification']['StreamEnabled']:
-            # FIXME perform upgrade
-            out.action("Upgrade", "Updating stream (turn it on)")
-            out.status("FAIL")
-            raise NotImplementedError()
-        elif current_state['StreamSpecification'] != desired_stream_def:
-            # FIXME perform upgrade
-            out.action("Upgrade", "Updating stream (change it)")
-            out.status("FAIL")
-            raise NotImplementedError()
-    else:
-        if 'StreamSpecification' in current_state and current_state['StreamSpecification']['StreamEnabled']:
-            # FIXME perform upgrade
-            out.action("Upgrade", "Updating stream (turn it off)")
+    # Change the installer status of the object.
+    status.add_table(table_name, expected_state, physical_name)
+
+
+def _rebuild_table(client, waiter, status, db_prefix, table_name, expected_state, source_name, plan, migration):
+    """
+    Copy the table into a shadow table with the new schema, and cut over
+    to it by recording it in the install_status table.
+
+    :param source_name: name (without prefix) of the table holding the data now.
+    :param plan: MigrationPlan
+    :param migration: MigrationOptions
+    """
+    target_name = shadow_table_name(table_name, expected_state.version)
+    if not migration.allow_rebuild or target_name == source_name:
+        out.action("Upgrade", "Rebuilding table " + db_prefix + source_name)
+        out.status("FAIL")
+        raise MigrationRequired(plan)
+
+    # An interrupted rebuild may have already created the shadow table.
+    try:
+        shadow = client.describe_table(TableName=db_prefix + target_name)['Table']
+        if plan_migration(target_name, expected_state, shadow).needs_rebuild:
+            out.action("Upgrade", "Shadow table " + db_prefix + target_name + " has the wrong schema")
             out.status("FAIL")
-            raise NotImplementedError()
+            raise MigrationRequired(plan)
+    except Exception as e:
+        if not is_not_found(e):
+            raise
+        _start_create_table(client, db_prefix, target_name, expected_state)
+        waiter.mark_started(db_prefix + target_name)
+    waiter.wait(db_prefix + target_name)
+
+    budget = CapacityBudget(migration.capacity)
+    out.action("Migrate", "Copying {0} into {1}".format(source_name, target_name))
+    stats, copied = backfill_table(client, db_prefix + source_name, db_prefix + target_name, expected_state,
+                                   budget, migration.segments)
+    out.status("{0} items".format(stats.copied))
+
+    # Copy the writes made during the copy, until a pass finds none.
+    for n in range(MAX_CATCH_UP_PASSES):
+        out.action("Migrate", "Copying the items written during the copy")
+        catch_up = catch_up_table(client, db_prefix + source_name, db_prefix + target_name, expected_state, copied,
+                                  budget, migration.segments)
+        out.status("{0} items".format(catch_up.changed))
+        if catch_up.changed <= 0:
+            break
+    skipped = len([copy for copy in copied.values() if copy[1] is None])
+    if skipped > 0:
+        out.action("Migrate", "Items that do not fit the new schema were not copied")
+        out.status("{0} SKIPPED".format(skipped))
+
+    # The cutover; from here on, the shadow table is the table.
+    status.add_table(table_name, expected_state, target_name)
+    status.flush()
+
+    out.action("Migrate", "Copying the items written during the cutover")
+    catch_up = catch_up_table(client, db_prefix + source_name, db_prefix + target_name, expected_state, copied,
+                              budget, migration.segments, live=True)
+    out.status("{0} items".format(catch_up.changed))
+    if catch_up.conflicts > 0:
+        out.action("Migrate", "Items changed in both tables during the cutover kept the new table's version")
+        out.status("{0} CONFLICTS".format(catch_up.conflicts))
+
+    out.action("Migrate", "Table {0} is no longer used; remove it when ready".format(db_prefix + source_name))
+    out.status("KEPT")
+
+
+def _update_capacity(client, waiter, name, expected_state, current_state):
+    """
+    Change the billing mode or provisioned throughput of an existing table
+    to match the capacity plan.
 
-    # Don't mess with the provisioned throughput - assume the user can
-    # adjust these as needed for the environment.
+    :param client:
+    :param waiter: TableWaiter
+    :param name: full table name
+    :param expected_state: DbTableDef with the planned capacity
+    :param current_state: table description
+    """
+    current_billing = current_state.get('BillingModeSummary', {}).get('BillingMode', PROVISIONED)
+    args = {}
+    if expected_state.billing_mode == PAY_PER_REQUEST:
+        if current_billing != PAY_PER_REQUEST:
+            args['BillingMode'] = PAY_PER_REQUEST
+    else:
+        desired = expected_state.throughput
+        current = current_state.get('ProvisionedThroughput', {})
+        if current_billing != PROVISIONED:
+            args['BillingMode'] = PROVISIONED
+            args['ProvisionedThroughput'] = desired
+            # Switching to provisioned needs a throughput for every existing
+            # global index, too.
+            index_updates = []
+            for index in current_state.get('GlobalSecondaryIndexes', []):
+                if index['IndexName'] in expected_state.global_index_names:
+                    index_throughput = expected_state.global_index_throughput(index['IndexName'])
+                else:
+                    index_throughput = desired
+                index_updates.append({'Update': {
+                    'IndexName': index['IndexName'],
+                    'ProvisionedThroughput': index_throughput
+                }})
+            if len(index_updates) > 0:
+                args['GlobalSecondaryIndexUpdates'] = index_updates
+        elif (current.get('ReadCapacityUnits') != desired['ReadCapacityUnits'] or
+                current.get('WriteCapacityUnits') != desired['WriteCapacityUnits']):
+            args['ProvisionedThroughput'] = desired
+    if len(args) <= 0:
+        return
+
+    out.action("Upgrade", "Updating capacity for " + name)
+    client.update_table(TableName=name, **args)
+    out.status("OK")
+    waiter.mark_started(name)
+    waiter.wait(name)
 
-    # Change the installer status of the object.
-    client.put_item(
-        TableName=db_prefix + 'install_status',
-        Item={
-            "object_id": {'S': 'table.' + name},
-            "object_type": {'S': 'table'},
-            "version": {'N': str(expected_state.version)},
-            "description": {'S': "table"}
-        }
-    )
 
+def _update_global_indexes(client, waiter, name, expected_state, current_state):
+    """
+    Create, replace or remove the global secondary indexes so that they match
+    the definition, and bring their throughput in line with the capacity plan.
+    DynamoDB allows one index to be created or removed per update_table call,
+    so each change waits for the table and its indexes to become active
+    before the next one.
 
-def _create_table(client, db_prefix, table_name, desc):
+    :param client:
+    :param waiter: TableWaiter
+    :param name: full table name
+    :param expected_state: DbTableDef
+    :param current_state: table description
+    """
+    desired = {}
+    for index in expected_state.global_indexes:
+        desired[index['IndexName']] = index
+    actual = {}
+    for index in current_state.get('GlobalSecondaryIndexes', []):
+        actual[index['IndexName']] = index
+
+    for index_name in sorted(actual.keys()):
+        if (index_name not in desired or
+                strip_index_values([desired[index_name]]) != strip_index_values([actual[index_name]])):
+            out.action("Upgrade", "Removing global index " + index_name)
+            client.update_table(
+                TableName=name,
+                GlobalSecondaryIndexUpdates=[{'Delete': {'IndexName': index_name}}])
+            out.status("OK")
+            waiter.mark_started(name)
+            waiter.wait(name)
+            del actual[index_name]
+
+    for index_name in sorted(desired.keys()):
+        if index_name not in actual:
+            out.action("Upgrade", "Creating global index " + index_name)
+            client.update_table(
+                TableName=name,
+                AttributeDefinitions=expected_state.attributes,
+                GlobalSecondaryIndexUpdates=[{'Create': desired[index_name]}])
+            out.status("OK")
+            waiter.mark_started(name)
+            waiter.wait(name)
+        elif expected_state.has_planned_capacity and expected_state.billing_mode == PROVISIONED:
+            wanted = desired[index_name]['ProvisionedThroughput']
+            current = actual[index_name].get('ProvisionedThroughput', {})
+            if (current.get('ReadCapacityUnits') != wanted['ReadCapacityUnits'] or
+                    current.get('WriteCapacityUnits') != wanted['WriteCapacityUnits']):
+                out.action("Upgrade", "Updating capacity for global index " + index_name)
+                client.update_table(
+                    TableName=name,
+                    GlobalSecondaryIndexUpdates=[{'Update': {
+                        'IndexName': index_name,
+                        'ProvisionedThroughput': wanted
+                    }}])
+                out.status("OK")
+                waiter.mark_started(name)
+                waiter.wait(name)
+
+
+def _create_table(client, waiter, status, db_prefix, table_name, desc):
     """
     Create the table described.
 
     :param client:
+    :param waiter: TableWaiter
+    :param status: InstallStatusBatch
     :param table_name: full name of the table-
     :param desc: DB_TABLES description
     """
+    _start_create_table(client, db_prefix, table_name, desc)
+    waiter.mark_started(db_prefix + table_name)
+    waiter.wait(db_prefix + table_name)
+    status.add_table(table_name, desc)
+
+
+def _create_tables(client, waiter, status, db_prefix, tables, limit):
+    """
+    Create all the described tables together.  Every create request is sent
+    before any waiting happens (up to `limit` tables in the CREATING state at
+    once), then the waiter tracks all the pending tables together until each
+    is 'ACTIVE'.  The time for each table and the total time are reported.
+
+    :param client:
+    :param waiter: TableWaiter
+    :param status: InstallStatusBatch
+    :param db_prefix:
+    :param tables: table name (without prefix) -> DbTableDef
+    :param limit: maximum number of tables creating at the same time.
+    :return: None
+    """
+    assert limit > 0
+    start = time.time()
+    queued = sorted(tables.keys())
+    pending = []
+    while len(queued) > 0 or len(pending) > 0:
+        while len(queued) > 0 and len(pending) < limit:
+            table_name = queued.pop(0)
+            _start_create_table(client, db_prefix, table_name, tables[table_name])
+            waiter.mark_started(db_prefix + table_name)
+            pending.append(db_prefix + table_name)
+
+        # While tables are still queued, only wait until there is room to
+        # create more of them.
+        active = waiter.wait_all(pending, len(queued) > 0 and ANY_ACTIVE or ALL_ACTIVE)
+        for name in active.keys():
+            pending.remove(name)
+
+    for table_name in sorted(tables.keys()):
+        out.action("Active", "Table {0} active".format(db_prefix + table_name))
+        out.status("{0:.1f}s".format(waiter.stats.table_seconds[db_prefix + table_name]))
+        status.add_table(table_name, tables[table_name])
+
+    out.action("MkTable", "Created {0} tables".format(len(tables)))
+    out.status("{0:.1f}s".format(time.time() - start))
+
+
+def _start_create_table(client, db_prefix, table_name, desc):
+    """
+    Send the create request for the table described, without waiting for
+    it to become active.
+
+    :param client:
+    :param db_prefix:
+    :param table_name: name of the table, without the prefix.
+    :param desc: DB_TABLES description
+    """
     assert isinstance(db_prefix, str)
     assert isinstance(table_name, str)
     assert isinstance(desc, DbTableDef)
@@ -236,13 +673,18 @@ def _create_table(client, db_prefix, table_name, desc):
     attribs = {
         "TableName": name,
         "KeySchema": desc.key_schema,
-        "StreamSpecification": desc.stream_specification,
-        "ProvisionedThroughput": desc.throughput
+        "StreamSpecification": desc.stream_specification
     }
+    if desc.billing_mode == PAY_PER_REQUEST:
+        attribs["BillingMode"] = PAY_PER_REQUEST
+    else:
+        attribs["ProvisionedThroughput"] = desc.throughput
     if len(desc.attributes) > 0:
         attribs["AttributeDefinitions"] = desc.attributes
     if len(desc.local_indexes) > 0:
         attribs["LocalSecondaryIndexes"] = desc.local_indexes
+    if len(desc.global_indexes) > 0:
+        attribs["GlobalSecondaryIndexes"] = desc.global_indexes
 
     # print("create table attributes: " + repr(attribs))
     response = client.create_table(**attribs)
@@ -252,105 +694,3 @@ def _create_table(client, db_prefix, table_name, desc):
         raise Exception("invalid response")
 
     out.status("Created")
-
-    _wait_for_active(client, name)
-
-    client.put_item(
-        TableName=db_prefix + 'install_status',
-        Item={
-            "object_id": {'S': 'table.' + table_name},
-            "object_type": {'S': 'table'},
-            "version": {'N': str(desc.version)},
-            "description": {'S': "table"}
-        }
-    )
-
-
-def _wait_for_active(client, name, last_read_table_def=None):
-    """
-    Wait until the table with the given name is 'ACTIVE'.
-
-    :param client:
-    :param name:
-    :return:
-    """
-
-    waited = False
-    while True:
-        if last_read_table_def is None:
-            if not waited:
-                out.action("Waiting", "Waiting for table " + name + " to become active")
-                waited = True
-            out.waiting()
-            last_read_table_def = client.describe_table(TableName=name)
-
-        if _is_active(last_read_table_def):
-            if waited:
-                out.completed()
-            return last_read_table_def
-
-        if not waited:
-            out.action("Waiting", "Waiting for table " + name + " to become active")
-            waited = True
-
-        time.sleep(_TIMEOUT[0])
-
-        last_read_table_def = None
-
-
-def _is_active(table_def):
-    """
-    Is the table in an active state?
-
-    :param table_def:
-    :return:
-    """
-    assert table_def is not None
-    if isinstance(table_def, dict) and 'Table' in table_def:
-        table_def = table_def['Table']
-
-    assert isinstance(table_def, dict)
-    assert 'TableName' in table_def and 'TableStatus' in table_def
-
-    return table_def['TableStatus'] == 'ACTIVE'
-
-
-def _strip_index_values(values):
-    ret = []
-    for index_def in values:
-        stripped = {}
-        if 'Projection' in index_def:
-            stripped['Projection'] = {}
-            for key, val in index_def['Projection'].items():
-                # FIXME this can fail if complex projections are implemented
-                stripped['Projection'][key.encode("ascii")] = val.encode("ascii")
-        if 'KeySchema' in index_def:
-            key_schema = []
-            stripped['KeySchema'] = key_schema
-            for ks in index_def['KeySchema']:
-                ksh = {
-                    'KeyType': ks['KeyType'].encode("ascii"),
-                    'AttributeName': ks['AttributeName'].encode("ascii")
-                }
-                key_schema.append(ksh)
-        if 'IndexName' in index_def:
-            stripped['IndexName'] = index_def['IndexName'].encode("ascii")
-        # ignore all other types
-        ret.append(stripped)
-    return ret
-
-
-def _connect(config):
-    """
-    Creates a dynamodb low-level API client
-    :param config:
-    :return:
-    """
-    opt_args = {}
-    if config.db_endpoint is not None:
-        opt_args['endpoint_url'] = config.db_endpoint
-    if config.db_use_ssl is not None:
-        opt_args['use_ssl'] = config.db_use_ssl
-    db = config.create_boto3_session().client('dynamodb', **opt_args)
-    return db
-
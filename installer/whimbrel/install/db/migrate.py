@@ -0,0 +1,487 @@
+"""
+Plans and carries out the schema changes for existing tables.
+
+The migration plan compares a DbTableDef against the live table
+description.  Stream changes are made in place.  Changes DynamoDB cannot
+make to an existing table (the key schema, the attribute types, and the
+local indexes) need a rebuild: the table is copied into a shadow table
+with the new schema, and the install_status record for the table is
+pointed at the shadow table (its `physical_name`), which then becomes the
+live table.
+
+The copy is a parallel segmented scan of the old table, written with
+batched puts, and throttled to a capacity budget.  The copy remembers a
+digest of each item it copied.  Writes made to the old table while the copy
+runs are picked up by catch-up passes, which scan the old table again and
+copy the items that are new or changed since, and remove the ones that
+were deleted.  The passes repeat until one finds nothing to do, then the
+cutover is made, and a last pass picks up the writes made in between.  By
+then the new table is live, so the last pass only overwrites an item that
+the new table still holds as it was copied; an item changed in both tables
+keeps the new table's version, and is counted as a conflict.  For an exact
+copy, stop the writers for the cutover.  The old table is left in place
+for the operator to remove.
+"""
+
+import base64
+import hashlib
+import json
+import threading
+
+from ..util import out
+from .bulk import batch_write, segmented_scan, item_key, key_names, consumed_units
+from .errors import error_code
+
+# Separates the table name from the schema version in shadow table names.
+SHADOW_SEPARATOR = '__v'
+
+# Catch-up passes to make before the cutover, if the old table keeps
+# changing.
+MAX_CATCH_UP_PASSES = 3
+
+
+class MigrationRequired(Exception):
+    """
+    The table needs a rebuild, but rebuilds are not allowed.
+    """
+    def __init__(self, plan):
+        Exception.__init__(self, "Table {0} must be rebuilt ({1}); set the dynamodb 'allow rebuild' "
+                                 "option to migrate it".format(plan.table_name, "; ".join(plan.rebuild_reasons)))
+        self.plan = plan
+
+
+class MigrationPlan(object):
+    """
+    The changes needed to bring a table to its definition.
+
+    :param table_name: table name, without the prefix.
+    """
+    def __init__(self, table_name):
+        object.__init__(self)
+        self.table_name = table_name
+        self.rebuild_reasons = []
+        # StreamSpecification values to apply with update_table, in order.
+        self.stream_steps = []
+
+    @property
+    def needs_rebuild(self):
+        return len(self.rebuild_reasons) > 0
+
+    @property
+    def is_empty(self):
+        return not self.needs_rebuild and len(self.stream_steps) <= 0
+
+    def describe(self):
+        """
+        :return: list of strings describing each step.
+        """
+        ret = []
+        if self.needs_rebuild:
+            for reason in self.rebuild_reasons:
+                ret.append("rebuild: " + reason)
+        else:
+            for step in self.stream_steps:
+                if step['StreamEnabled']:
+                    ret.append("stream: enable " + step['StreamViewType'])
+                else:
+                    ret.append("stream: disable")
+        return ret
+
+
+class BackfillStats(object):
+    def __init__(self):
+        object.__init__(self)
+        self.scanned = 0
+        self.copied = 0
+        self.removed = 0
+        self.skipped = 0
+        self.conflicts = 0
+        self.consumed = 0.0
+
+    @property
+    def changed(self):
+        return self.copied + self.removed
+
+
+def plan_migration(table_name, expected_state, current_state):
+    """
+    Compare the table definition against the table description.  Global
+    indexes and throughput are not part of the plan; they are always
+    changed in place.
+
+    :param table_name: table name, without the prefix.
+    :param expected_state: DbTableDef
+    :param current_state: describe_table 'Table' value.
+    :return: MigrationPlan
+    """
+    plan = MigrationPlan(table_name)
+
+    if expected_state.key_schema != current_state['KeySchema']:
+        plan.rebuild_reasons.append("primary key changed")
+
+    # Attributes that are only keys for global indexes come and go with
+    # those indexes.  Order doesn't matter.
+    desired_attributes = strip_global_index_attributes(
+        expected_state.attributes, expected_state.key_schema, expected_state.local_indexes,
+        expected_state.global_indexes)
+    actual_attributes = strip_global_index_attributes(
+        current_state['AttributeDefinitions'], current_state['KeySchema'],
+        current_state.get('LocalSecondaryIndexes', []), current_state.get('GlobalSecondaryIndexes', []))
+    if desired_attributes != actual_attributes:
+        plan.rebuild_reasons.append("attributes changed")
+
+    # indexes are a list, but order doesn't matter.  So, convert them into a
+    # dictionary.
+    ui_desired = {}
+    for i in strip_index_values(expected_state.local_indexes):
+        ui_desired[i['IndexName']] = i
+    ui_actual = {}
+    for i in strip_index_values(current_state.get('LocalSecondaryIndexes', [])):
+        ui_actual[i['IndexName']] = i
+    if ui_desired != ui_actual:
+        plan.rebuild_reasons.append("local secondary indexes changed")
+
+    desired_stream = expected_state.stream_specification
+    actual_stream = current_state.get('StreamSpecification') or {'StreamEnabled': False}
+    if desired_stream['StreamEnabled']:
+        if not actual_stream['StreamEnabled']:
+            plan.stream_steps.append(desired_stream)
+        elif actual_stream.get('StreamViewType') != desired_stream['StreamViewType']:
+            # A stream's view type can't be changed; it must be turned off
+            # and back on again, which starts a new stream.
+            plan.stream_steps.append({'StreamEnabled': False})
+            plan.stream_steps.append(desired_stream)
+    elif actual_stream['StreamEnabled']:
+        plan.stream_steps.append({'StreamEnabled': False})
+
+    return plan
+
+
+def apply_stream_steps(client, waiter, name, plan):
+    """
+    Make the in-place stream changes of the plan.
+
+    :param client: dynamodb client
+    :param waiter: TableWaiter
+    :param name: full table name
+    :param plan: MigrationPlan
+    """
+    for step in plan.stream_steps:
+        if step['StreamEnabled']:
+            out.action("Upgrade", "Turning on the {0} stream for {1}".format(step['StreamViewType'], name))
+        else:
+            out.action("Upgrade", "Turning off the stream for " + name)
+        client.update_table(TableName=name, StreamSpecification=step)
+        out.status("OK")
+        waiter.mark_started(name)
+        waiter.wait(name)
+
+
+def shadow_table_name(table_name, version):
+    """
+    The name of the shadow table that a table is rebuilt into for a schema
+    version.
+
+    :param table_name: table name, without the prefix.
+    :param version: the schema version of the definition.
+    """
+    return '{0}{1}{2}'.format(table_name, SHADOW_SEPARATOR, version)
+
+
+def backfill_table(client, source_name, target_name, expected_state, budget=None, segments=4):
+    """
+    Copy the items from one table into another, with a segmented scan and
+    batched writes.  Items that can't be stored under the new schema (they
+    are missing a key attribute, or a key or index attribute has the wrong
+    type) are skipped.
+
+    :param client: dynamodb client
+    :param source_name: full name of the table to copy from.
+    :param target_name: full name of the table to copy to.
+    :param expected_state: DbTableDef of the target table.
+    :param budget: CapacityBudget shared by the reads and writes, or None.
+    :param segments: number of scan segments.
+    :return: (BackfillStats, dictionary of the source key tuple of each item
+        seen by the scan -> (item digest, key of its copy in the target
+        table, or None if it was skipped)), for catch_up_table.
+    """
+    source_keys = key_names(client.describe_table(TableName=source_name)['Table'])
+    target_keys = [ks['AttributeName'] for ks in expected_state.key_schema]
+    typed = _attribute_types(expected_state)
+    stats = BackfillStats()
+    copied = {}
+    lock = threading.Lock()
+
+    def handle_page(items):
+        requests = []
+        page_copies = {}
+        skipped = 0
+        for item in items:
+            if not _fits(item, target_keys, typed):
+                page_copies[_key_tuple(item, source_keys)] = (_digest(item), None)
+                skipped += 1
+                continue
+            page_copies[_key_tuple(item, source_keys)] = (_digest(item), item_key(item, target_keys))
+            requests.append({'PutRequest': {'Item': item}})
+        consumed = 0.0
+        if len(requests) > 0:
+            consumed = batch_write(client, target_name, requests, budget=budget)
+        with lock:
+            stats.scanned += len(items)
+            stats.copied += len(requests)
+            stats.skipped += skipped
+            stats.consumed += consumed
+            copied.update(page_copies)
+
+    segmented_scan(client, source_name, handle_page, segments=segments, budget=budget, ConsistentRead=True)
+    return stats, copied
+
+
+def catch_up_table(client, source_name, target_name, expected_state, copied, budget=None, segments=4, live=False):
+    """
+    Bring the target table up to date with the writes made to the source
+    table since it was copied.  The source table is scanned again; the items
+    that are new or changed since they were copied are copied again, and the
+    copies of the items deleted from it are deleted.  `copied` is updated
+    to match, so the pass can be repeated.
+
+    :param copied: the dictionary returned by backfill_table.
+    :param live: False before the cutover, when nothing else writes to the
+        target table, so its items are simply overwritten.  True after the
+        cutover: an item is only copied if the target table doesn't have it
+        yet, and only overwritten or deleted if the target table still holds
+        it as it was copied; otherwise the target table's version is kept,
+        and counted as a conflict.
+    :return: BackfillStats
+    """
+    source_keys = key_names(client.describe_table(TableName=source_name)['Table'])
+    target_keys = [ks['AttributeName'] for ks in expected_state.key_schema]
+    typed = _attribute_types(expected_state)
+    stats = BackfillStats()
+    seen = set()
+    lock = threading.Lock()
+
+    def handle_page(items):
+        page_stats = BackfillStats()
+        page_seen = []
+        for item in items:
+            source_key = _key_tuple(item, source_keys)
+            page_seen.append(source_key)
+            digest = _digest(item)
+            with lock:
+                previous = copied.get(source_key)
+            if previous is not None and previous[0] == digest:
+                continue
+            target_key = None
+            if _fits(item, target_keys, typed):
+                target_key = item_key(item, target_keys)
+            else:
+                page_stats.skipped += 1
+            # The old copy goes when the item moved to another key, or no
+            # longer fits the new schema.
+            if previous is not None and previous[1] is not None and previous[1] != target_key:
+                _remove_copy(client, target_name, previous, live, budget, page_stats)
+            if target_key is not None:
+                if previous is not None and previous[1] == target_key:
+                    _replace_copy(client, target_name, previous, item, live, budget, page_stats)
+                else:
+                    _add_copy(client, target_name, item, target_key, live, budget, page_stats)
+            with lock:
+                copied[source_key] = (digest, target_key)
+        with lock:
+            seen.update(page_seen)
+            stats.scanned += len(items)
+            _add_stats(stats, page_stats)
+
+    segmented_scan(client, source_name, handle_page, segments=segments, budget=budget, ConsistentRead=True)
+
+    # The items deleted from the source table since they were copied.
+    removed_stats = BackfillStats()
+    for source_key in [key for key in copied.keys() if key not in seen]:
+        previous = copied.pop(source_key)
+        if previous[1] is not None:
+            _remove_copy(client, target_name, previous, live, budget, removed_stats)
+    _add_stats(stats, removed_stats)
+    return stats
+
+
+def strip_index_values(values):
+    ret = []
+    for index_def in values:
+        stripped = {}
+        if 'Projection' in index_def:
+            stripped['Projection'] = {}
+            for key, val in index_def['Projection'].items():
+                if isinstance(val, list):
+                    # NonKeyAttributes order doesn't matter.
+                    val = sorted(val)
+                stripped['Projection'][key] = val
+        if 'KeySchema' in index_def:
+            key_schema = []
+            stripped['KeySchema'] = key_schema
+            for ks in index_def['KeySchema']:
+                ksh = {
+                    'KeyType': ks['KeyType'],
+                    'AttributeName': ks['AttributeName']
+                }
+                key_schema.append(ksh)
+        if 'IndexName' in index_def:
+            stripped['IndexName'] = index_def['IndexName']
+        # ignore all other types
+        ret.append(stripped)
+    return ret
+
+
+def strip_global_index_attributes(attributes, key_schema, local_indexes, global_indexes):
+    """
+    Turn the attribute definitions into a dictionary of name -> type,
+    leaving out those attributes that are only used as keys for the global
+    indexes.
+    """
+    used = set()
+    for ks in key_schema:
+        used.add(ks['AttributeName'])
+    for index in local_indexes:
+        for ks in index['KeySchema']:
+            used.add(ks['AttributeName'])
+    global_only = set()
+    for index in global_indexes:
+        for ks in index['KeySchema']:
+            if ks['AttributeName'] not in used:
+                global_only.add(ks['AttributeName'])
+    ret = {}
+    for attribute in attributes:
+        if attribute['AttributeName'] not in global_only:
+            ret[attribute['AttributeName']] = attribute['AttributeType']
+    return ret
+
+
+def _add_copy(client, target_name, item, target_key, live, budget, stats):
+    condition = {}
+    if live:
+        condition = {
+            'ConditionExpression': 'attribute_not_exists(#key)',
+            'ExpressionAttributeNames': {'#key': sorted(target_key.keys())[0]}
+        }
+    if _write(client, 'put_item', budget, stats, TableName=target_name, Item=item, **condition):
+        stats.copied += 1
+
+
+def _replace_copy(client, target_name, previous, item, live, budget, stats):
+    condition = {}
+    if live:
+        condition = _unchanged_condition(client, target_name, previous, stats)
+        if condition is None:
+            return
+    if _write(client, 'put_item', budget, stats, TableName=target_name, Item=item, **condition):
+        stats.copied += 1
+
+
+def _remove_copy(client, target_name, previous, live, budget, stats):
+    condition = {}
+    if live:
+        condition = _unchanged_condition(client, target_name, previous, stats)
+        if condition is None:
+            return
+    if _write(client, 'delete_item', budget, stats, TableName=target_name, Key=previous[1], **condition):
+        stats.removed += 1
+
+
+def _unchanged_condition(client, target_name, previous, stats):
+    """
+    The condition that the target table still holds the item as it was
+    copied, or None (counting a conflict) if it doesn't.
+    """
+    current = client.get_item(TableName=target_name, Key=previous[1], ConsistentRead=True).get('Item')
+    if current is None or _digest(current) != previous[0]:
+        stats.conflicts += 1
+        return None
+    names = {}
+    values = {}
+    terms = []
+    for i, name in enumerate(sorted(current.keys())):
+        names['#a{0}'.format(i)] = name
+        values[':a{0}'.format(i)] = current[name]
+        terms.append('#a{0} = :a{0}'.format(i))
+    return {
+        'ConditionExpression': ' AND '.join(terms),
+        'ExpressionAttributeNames': names,
+        'ExpressionAttributeValues': values
+    }
+
+
+def _write(client, operation, budget, stats, **args):
+    """
+    Make a single item write, drawing from the budget.
+
+    :return: True if it was made, False if its condition failed (counted as
+        a conflict).
+    """
+    if budget is not None:
+        budget.acquire()
+    try:
+        response = getattr(client, operation)(ReturnConsumedCapacity='TOTAL', **args)
+    except Exception as e:
+        if error_code(e) == 'ConditionalCheckFailedException':
+            stats.conflicts += 1
+            return False
+        raise
+    units = consumed_units(response)
+    if budget is not None:
+        budget.spend(units)
+    stats.consumed += units
+    return True
+
+
+def _add_stats(stats, other):
+    stats.copied += other.copied
+    stats.removed += other.removed
+    stats.skipped += other.skipped
+    stats.conflicts += other.conflicts
+    stats.consumed += other.consumed
+
+
+def _attribute_types(expected_state):
+    typed = {}
+    for attribute in expected_state.attributes:
+        typed[attribute['AttributeName']] = attribute['AttributeType']
+    return typed
+
+
+def _digest(item):
+    """
+    A digest of the item's attributes and values.  The members of a set
+    are unordered, so they are sorted first.
+    """
+    return hashlib.sha1(json.dumps(_canonical(item), sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _canonical(value):
+    if isinstance(value, dict):
+        ret = {}
+        for key, member in value.items():
+            if key in ('SS', 'NS', 'BS'):
+                ret[key] = sorted(_canonical(m) for m in member)
+            else:
+                ret[key] = _canonical(member)
+        return ret
+    if isinstance(value, list):
+        return [_canonical(member) for member in value]
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode('ascii')
+    return value
+
+
+def _key_tuple(item, names):
+    key = item_key(item, names)
+    return tuple(sorted((name, tuple(sorted(value.items()))) for name, value in key.items()))
+
+
+def _fits(item, key_attributes, typed):
+    for name in key_attributes:
+        if name not in item:
+            return False
+    for name, attribute_type in typed.items():
+        if name in item and attribute_type not in item[name]:
+            return False
+    return True
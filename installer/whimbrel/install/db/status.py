@@ -0,0 +1,195 @@
+"""
+Bookkeeping for the install_status table.
+
+Status records are collected while the schema work happens, and written
+together with BatchWriteItem (up to 25 items per request) rather than one
+put_item per object.  The same batch serves tables, lambdas, streams, or
+any other installed object.
+"""
+
+import random
+import time
+
+from ..util import out
+from .bulk import BatchStats, batch_write
+from .errors import is_not_found
+
+
+class InstallStatusBatch(object):
+    """
+    Collects install_status records, and writes them in batches.
+
+    :param client: dynamodb client
+    :param db_prefix: database table prefix (string)
+    :param max_attempts: number of times a request with unprocessed items is
+        sent before giving up with `bulk.UnprocessedItemsError`.
+    :param initial_delay: seconds to wait before the first unprocessed item retry.
+    :param max_delay: cap on the seconds between retries.
+    """
+    def __init__(self, client, db_prefix, max_attempts=8, initial_delay=0.05, max_delay=5,
+                 sleep=time.sleep, rand=random.random):
+        object.__init__(self)
+        self.__client = client
+        self.__table_name = db_prefix + 'install_status'
+        self.__max_attempts = max_attempts
+        self.__initial_delay = initial_delay
+        self.__max_delay = max_delay
+        self.__sleep = sleep
+        self.__rand = rand
+        # Keyed by (object_id, object_type), so that a later record for the same
+        # object replaces the earlier one; BatchWriteItem rejects duplicate keys.
+        self.__pending = {}
+        self.__order = []
+        self.__stats = BatchStats()
+        self.written_count = 0
+        self.consumed_capacity = 0.0
+
+    def __len__(self):
+        return len(self.__order)
+
+    @property
+    def request_count(self):
+        return self.__stats.requests
+
+    @property
+    def retry_count(self):
+        return self.__stats.retries
+
+    def add(self, object_id, object_type, version, description, attributes=None):
+        """
+        Record the install status for an object.  It is not written until
+        `flush` is called.
+
+        :param attributes: additional item attributes, in the attribute value form.
+        """
+        key = (object_id, object_type)
+        if key not in self.__pending:
+            self.__order.append(key)
+        item = {
+            "object_id": {'S': object_id},
+            "object_type": {'S': object_type},
+            "version": {'N': str(version)},
+            "description": {'S': description}
+        }
+        if attributes is not None:
+            item.update(attributes)
+        self.__pending[key] = item
+
+    def add_table(self, table_name, desc, physical_name=None):
+        """
+        Record the install status for a table.
+
+        :param table_name: table name, without the prefix.
+        :param desc: DbTableDef
+        :param physical_name: name (without the prefix) of the table that
+            holds the data, if the table was rebuilt into another table.
+        """
+        attributes = None
+        if physical_name is not None and physical_name != table_name:
+            attributes = {"physical_name": {'S': physical_name}}
+        self.add('table.' + table_name, 'table', desc.version, "table", attributes)
+
+    def add_lambda(self, lambda_name, version):
+        self.add('lambda.' + lambda_name, 'lambda', version, "lambda")
+
+    def add_stream(self, table_name, version):
+        self.add('stream.' + table_name, 'stream', version, "stream")
+
+    def flush(self):
+        """
+        Write all the collected records.  Unprocessed items are retried with
+        a capped, jittered exponential backoff.
+
+        :return: the write capacity consumed by this flush.
+        """
+        if len(self.__order) <= 0:
+            return 0.0
+        items = []
+        for key in self.__order:
+            items.append(self.__pending[key])
+        self.__pending = {}
+        self.__order = []
+
+        consumed = batch_write(
+            self.__client, self.__table_name, [{'PutRequest': {'Item': item}} for item in items],
+            max_attempts=self.__max_attempts, initial_delay=self.__initial_delay, max_delay=self.__max_delay,
+            sleep=self.__sleep, rand=self.__rand, stats=self.__stats)
+        self.written_count += len(items)
+        self.consumed_capacity += consumed
+        return consumed
+
+    def report(self):
+        out.action("Status", "Recorded {0} install status items in {1} requests".format(
+            self.written_count, self.request_count))
+        out.status("{0:.1f} WCU".format(self.consumed_capacity))
+
+
+def load_installed_status(client, db_prefix, table_names):
+    """
+    Read the installed version of each table, and the physical table that
+    holds it, from the install_status table with BatchGetItem.
+
+    :param client: dynamodb client
+    :param db_prefix: database table prefix (string)
+    :param table_names: table names, without the prefix.
+    :return: dictionary of table name -> (installed version (int), physical
+        table name without the prefix, or None if it is the table name) for
+        those tables with a status, or None if the install_status table does
+        not exist.
+    """
+    status_table = db_prefix + 'install_status'
+    keys = []
+    for name in sorted(table_names):
+        keys.append({
+            "object_id": {'S': 'table.' + name},
+            "object_type": {'S': 'table'}
+        })
+
+    ret = {}
+    # BatchGetItem allows at most 100 keys per request.
+    for i in range(0, len(keys), 100):
+        request = {
+            status_table: {
+                'Keys': keys[i:i + 100],
+                'ProjectionExpression': 'object_id, version, physical_name'
+            }
+        }
+        while len(request) > 0:
+            try:
+                response = client.batch_get_item(RequestItems=request)
+            except Exception as e:
+                if is_not_found(e):
+                    return None
+                raise
+            for item in response.get('Responses', {}).get(status_table, []):
+                physical_name = 'physical_name' in item and item['physical_name']['S'] or None
+                ret[item['object_id']['S'][len('table.'):]] = (int(item['version']['N']), physical_name)
+            request = response.get('UnprocessedKeys') or {}
+    return ret
+
+
+def physical_names(installed):
+    """
+    :param installed: result of a load_installed_status call
+    :return: table name -> physical table name, for the rebuilt tables.
+    """
+    ret = {}
+    for (name, (version, physical_name)) in (installed or {}).items():
+        if physical_name is not None and physical_name != name:
+            ret[name] = physical_name
+    return ret
+
+
+def table_names(client, db_prefix, names):
+    """
+    The full name of each table, following install_status to the table an
+    upgrade rebuilt it into.
+
+    :param names: table names, without the prefix.
+    :return: dictionary of table name -> full name of the table to use.
+    """
+    locations = physical_names(load_installed_status(client, db_prefix, names))
+    ret = {}
+    for name in names:
+        ret[name] = db_prefix + locations.get(name, name)
+    return ret
@@ -2,20 +2,60 @@
 Definition type for the DynamoDB tables.
 """
 
+# Table billing modes
+PROVISIONED = 'PROVISIONED'
+PAY_PER_REQUEST = 'PAY_PER_REQUEST'
+
 
 class DbTableDef(object):
     # Note that the definition does not know about the name.
     # This is to reduce cut-n-paste errors.
-    def __init__(self, pk, indexes, attributes, stream, version):
+    #
+    # `indexes` are the local secondary indexes, as attribute name -> type; they
+    # share the table's hash key.  `global_indexes` are the global secondary
+    # indexes, as index name -> {
+    #     "pk": [hash name, hash type] or [hash name, hash type, range name, range type],
+    #     "projection": "ALL", "KEYS_ONLY", or a list of the non-key attributes to include,
+    #     "throughput": [read capacity, write capacity] (optional)
+    # }
+    def __init__(self, pk, indexes, attributes, stream, version, throughput=None, billing_mode=PROVISIONED,
+                 global_indexes=None):
         object.__init__(self)
         assert len(pk) == 2 or len(pk) == 4
+        assert billing_mode in (PROVISIONED, PAY_PER_REQUEST)
         self.__s_pk = pk
         self.__s_indexes = indexes
+        self.__s_global_indexes = global_indexes or {}
         self.__s_attributes = attributes
         self.__s_stream = stream
+        self.__s_throughput = throughput
+        self.__billing_mode = billing_mode
         self.__attributes = None
         self.__indexes = None
         self.__version = version
+        for gsi in self.__s_global_indexes.values():
+            assert len(gsi['pk']) == 2 or len(gsi['pk']) == 4
+
+    def with_capacity(self, read_capacity, write_capacity, billing_mode=PROVISIONED, index_capacity=None):
+        """
+        Create a copy of this definition with planned capacity, rather than
+        the default throughput.
+
+        :param index_capacity: global index name -> (read capacity, write capacity)
+        """
+        throughput = None
+        global_indexes = {}
+        for (name, gsi) in self.__s_global_indexes.items():
+            gsi = dict(gsi)
+            if index_capacity is not None and name in index_capacity:
+                gsi['throughput'] = list(index_capacity[name])
+            global_indexes[name] = gsi
+        if billing_mode == PROVISIONED:
+            throughput = {'ReadCapacityUnits': read_capacity, 'WriteCapacityUnits': write_capacity}
+        return DbTableDef(
+            pk=self.__s_pk, indexes=self.__s_indexes, attributes=self.__s_attributes,
+            stream=self.__s_stream, version=self.__version,
+            throughput=throughput, billing_mode=billing_mode, global_indexes=global_indexes)
 
     @property
     def version(self):
@@ -46,12 +86,63 @@ class DbTableDef(object):
             self.__attributes, self.__indexes = self._create_attributes_and_local_indexes()
         return self.__indexes
 
+    @property
+    def global_indexes(self):
+        """
+        The global secondary index descriptions, in the form used by
+        create_table.
+        """
+        ret = []
+        for name in sorted(self.__s_global_indexes.keys()):
+            gsi = self.__s_global_indexes[name]
+            key_schema = [{'AttributeName': gsi['pk'][0], 'KeyType': 'HASH'}]
+            if len(gsi['pk']) == 4:
+                key_schema.append({'AttributeName': gsi['pk'][2], 'KeyType': 'RANGE'})
+            projection = gsi.get('projection', 'ALL')
+            if isinstance(projection, str):
+                projection = {'ProjectionType': projection}
+            else:
+                projection = {'ProjectionType': 'INCLUDE', 'NonKeyAttributes': list(projection)}
+            index = {
+                'IndexName': name,
+                'KeySchema': key_schema,
+                'Projection': projection
+            }
+            if self.__billing_mode == PROVISIONED:
+                index['ProvisionedThroughput'] = self.global_index_throughput(name)
+            ret.append(index)
+        return ret
+
+    def global_index_throughput(self, name):
+        gsi = self.__s_global_indexes[name]
+        if 'throughput' in gsi:
+            return {'ReadCapacityUnits': gsi['throughput'][0], 'WriteCapacityUnits': gsi['throughput'][1]}
+        return self.throughput
+
+    @property
+    def global_index_names(self):
+        return sorted(self.__s_global_indexes.keys())
+
     @property
     def throughput(self):
-        # TODO figure out how to tweak the throughput parameters.
+        # The capacity planner (capacity.py) can set these from a workload profile.
         # http://docs.aws.amazon.com/amazondynamodb/latest/developerguide/WorkingWithTables.html#ProvisionedThroughput
+        if self.__s_throughput is not None:
+            return dict(self.__s_throughput)
         return {'ReadCapacityUnits': 5, 'WriteCapacityUnits': 6}
 
+    @property
+    def billing_mode(self):
+        return self.__billing_mode
+
+    @property
+    def has_planned_capacity(self):
+        """
+        True if the capacity came from the planner, and so should be applied
+        to existing tables as well as new ones.
+        """
+        return self.__s_throughput is not None or self.__billing_mode != PROVISIONED
+
     def _create_attributes_and_local_indexes(self):
         indexes = []
         attributes = [
@@ -82,6 +173,12 @@ class DbTableDef(object):
                 "AttributeType": itype
             })
 
+        for name in sorted(self.__s_global_indexes.keys()):
+            gsi_pk = self.__s_global_indexes[name]['pk']
+            for i in range(0, len(gsi_pk), 2):
+                if gsi_pk[i] not in [a['AttributeName'] for a in attributes]:
+                    attributes.append({"AttributeName": gsi_pk[i], "AttributeType": gsi_pk[i + 1]})
+
         # Attributes are only for the key schema
         # for (aname, atype) in self.__s_attributes.items():
         #     attributes.append({
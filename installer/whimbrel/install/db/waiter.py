@@ -0,0 +1,204 @@
+"""
+Waits for DynamoDB tables to become active.
+
+The waiter polls `describe_table` with a capped exponential backoff plus
+jitter, gives up after a deadline, and can wait on several tables at once.
+It keeps a count of the describe calls made, and how long each table took
+to become active, so the callers can report on it.
+"""
+
+import random
+import time
+
+from ..util import out
+
+# Values for the `return_when` argument of TableWaiter.wait_all
+ALL_ACTIVE = 'ALL_ACTIVE'
+ANY_ACTIVE = 'ANY_ACTIVE'
+
+
+class TableWaitTimeout(Exception):
+    """
+    The tables did not become active before the deadline.
+    """
+    def __init__(self, pending, waited):
+        Exception.__init__(self, "Tables did not become active after {0:.1f} seconds: {1}".format(
+            waited, ", ".join(sorted(pending))))
+        self.pending = list(pending)
+        self.waited = waited
+
+
+class WaitStats(object):
+    """
+    Instrumentation for the waiter.
+    """
+    def __init__(self):
+        object.__init__(self)
+        self.describe_calls = 0
+        self.sleep_count = 0
+        self.sleep_seconds = 0.0
+        self.table_seconds = {}
+        self.table_describe_calls = {}
+
+    def record_describe(self, name):
+        self.describe_calls += 1
+        self.table_describe_calls[name] = self.table_describe_calls.get(name, 0) + 1
+
+    def record_sleep(self, seconds):
+        self.sleep_count += 1
+        self.sleep_seconds += seconds
+
+    def record_active(self, name, seconds):
+        self.table_seconds[name] = seconds
+
+
+class TableWaiter(object):
+    """
+    Polls tables until they become active.
+
+    :param client: dynamodb low-level client (or anything with a compatible
+        `describe_table` call, such as a local DynamoDB stand-in).
+    :param initial_delay: seconds to sleep after the first poll.
+    :param max_delay: cap on the seconds between polls.
+    :param deadline: maximum seconds any single wait call may take; None for no limit.
+    :param multiplier: backoff growth factor between polls.
+    :param jitter: fraction (0 to 1) of each delay that is randomized, to keep
+        many waiters from polling in lock step.
+    :param progress: if True, report the waiting progress on the output.
+    """
+    def __init__(self, client, initial_delay=1, max_delay=20, deadline=900, multiplier=2.0, jitter=0.5,
+                 progress=True, sleep=time.sleep, clock=time.time, rand=random.random):
+        object.__init__(self)
+        assert initial_delay >= 0
+        assert max_delay >= initial_delay
+        assert 0 <= jitter <= 1
+        self.__client = client
+        self.__initial_delay = initial_delay
+        self.__max_delay = max_delay
+        self.__deadline = deadline
+        self.__multiplier = multiplier
+        self.__jitter = jitter
+        self.__progress = progress
+        self.__sleep = sleep
+        self.__clock = clock
+        self.__rand = rand
+        self.__started = {}
+        self.stats = WaitStats()
+
+    def mark_started(self, name):
+        """
+        Record the time at which the table started its transition (say, when
+        the create request was sent), so the time to become active is measured
+        from that point rather than from when the wait began.
+        """
+        self.__started[name] = self.__clock()
+
+    def wait(self, name, last_read_table_def=None):
+        """
+        Wait until the table with the given name is 'ACTIVE'.
+
+        :param name: full table name
+        :param last_read_table_def: a recent describe_table response (or its
+            'Table' value); if it is already active, no call is made.
+        :return: the describe_table response for the active table.
+        """
+        if last_read_table_def is not None and is_active(last_read_table_def):
+            return last_read_table_def
+        return self.wait_all([name])[name]
+
+    def wait_all(self, names, return_when=ALL_ACTIVE):
+        """
+        Wait for several tables together, polling each of the still pending
+        tables once per round.
+
+        :param names: full table names
+        :param return_when: ALL_ACTIVE to wait for every table, or ANY_ACTIVE to
+            return as soon as at least one of them is active.
+        :return: dictionary of table name -> describe_table response, for the
+            tables found active.
+        """
+        assert return_when in (ALL_ACTIVE, ANY_ACTIVE)
+        start = self.__clock()
+        pending = []
+        for name in names:
+            if name not in pending:
+                pending.append(name)
+            if name not in self.__started:
+                self.__started[name] = start
+        ret = {}
+        attempt = 0
+        announced = False
+        while True:
+            for name in list(pending):
+                response = self.__client.describe_table(TableName=name)
+                self.stats.record_describe(name)
+                if is_active(response):
+                    pending.remove(name)
+                    ret[name] = response
+                    self.stats.record_active(name, self.__clock() - self.__started.pop(name))
+            if len(pending) <= 0 or (return_when == ANY_ACTIVE and len(ret) > 0):
+                if announced:
+                    out.completed()
+                return ret
+
+            if self.__progress:
+                if not announced:
+                    if len(pending) == 1:
+                        out.action("Waiting", "Waiting for table " + pending[0] + " to become active")
+                    else:
+                        out.action("Waiting", "Waiting for {0} tables to become active".format(len(pending)))
+                    announced = True
+                out.waiting()
+
+            delay = self.next_delay(attempt)
+            attempt += 1
+            if self.__deadline is not None:
+                remaining = self.__deadline - (self.__clock() - start)
+                if remaining <= 0:
+                    if announced:
+                        out.status("TIMEOUT")
+                    raise TableWaitTimeout(pending, self.__clock() - start)
+                delay = min(delay, remaining)
+            self.stats.record_sleep(delay)
+            self.__sleep(delay)
+
+    def next_delay(self, attempt):
+        """
+        The sleep time after the given (zero-based) poll attempt: exponential
+        growth capped at the max delay, with the jitter fraction randomized.
+        """
+        delay = min(self.__max_delay, self.__initial_delay * (self.__multiplier ** attempt))
+        return delay * (1.0 - self.__jitter) + delay * self.__jitter * self.__rand()
+
+    def report(self):
+        """
+        Write a summary of the waiting to the output.
+        """
+        out.action("Waiter", "{0} describe calls, {1:.1f}s asleep".format(
+            self.stats.describe_calls, self.stats.sleep_seconds))
+        out.status("OK")
+
+
+def is_active(table_def):
+    """
+    Is the table, and each of its global indexes, in an active state?
+
+    :param table_def: describe_table response, or its 'Table' / 'TableDescription' value.
+    :return:
+    """
+    assert table_def is not None
+    if isinstance(table_def, dict) and 'Table' in table_def:
+        table_def = table_def['Table']
+    if isinstance(table_def, dict) and 'TableDescription' in table_def:
+        table_def = table_def['TableDescription']
+
+    assert isinstance(table_def, dict)
+    assert 'TableName' in table_def and 'TableStatus' in table_def
+
+    if table_def['TableStatus'] != 'ACTIVE':
+        return False
+    # Global indexes are created and removed while the table itself is active.
+    for index in table_def.get('GlobalSecondaryIndexes', []):
+        if index.get('IndexStatus', 'ACTIVE') != 'ACTIVE':
+            return False
+    return True
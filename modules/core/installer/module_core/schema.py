@@ -6,7 +6,7 @@ from whimbrel.install.db import DbTableDef
 
 CORE_DB_TABLES = {
     "workflow_exec": DbTableDef(
-        version=1,
+        version=2,
         pk=["workflow_exec_id", "S", "workflow_name", "S"],
         indexes={
             "state": "S",
@@ -14,13 +14,23 @@ CORE_DB_TABLES = {
         },
         attributes={
             "workflow_request_id": "S",
+            # Not in items with an item_format of 2 (compact); see
+            # whimbrel_client.times.
             "start_time": "L[N,N,N,N,N,N]",
-            "workflow_version": "N"
+            "workflow_version": "N",
+            "item_format": "N"
+        },
+        global_indexes={
+            # Query the workflows in a state, across all workflow execs.
+            "state_start_time": {
+                "pk": ["state", "S", "start_time_epoch", "N"],
+                "projection": ["workflow_request_id", "workflow_version"]
+            }
         },
         stream=False
     ),
     "activity_exec": DbTableDef(
-        version=1,
+        version=4,
         pk=["activity_exec_id", "S", "workflow_exec_id", "S"],
         indexes={
             "state": "S",
@@ -34,20 +44,43 @@ CORE_DB_TABLES = {
             "end_time_epoch": "N",
             "heartbeat_enabled": "BOOL",
             "activity_version": "N",
+            # Not in items with an item_format of 2 (compact).
             "queue_time": "L[N,N,N,N,N,N]",
             "start_time": "L[N,N,N,N,N,N]",
-            "end_time": "L[N,N,N,N,N,N]"
+            "end_time": "L[N,N,N,N,N,N]",
+            "item_format": "N"
         },
-        stream=False
+        global_indexes={
+            # Query the activities in a state (say, all RUNNING activities),
+            # ordered by their last heartbeat, across all workflow execs.
+            "state_heartbeat": {
+                "pk": ["state", "S", "heartbeat_time_epoch", "N"],
+                "projection": ["activity_name", "workflow_name", "heartbeat_enabled", "start_time_epoch"]
+            },
+            # Query the activities of a workflow exec, for the archiver.
+            "workflow_activity": {
+                "pk": ["workflow_exec_id", "S", "activity_exec_id", "S"],
+                "projection": "KEYS_ONLY"
+            }
+        },
+        # The heartbeat timeout detector follows the heartbeats on the stream.
+        stream=True
     ),
     "activity_exec_dependency": DbTableDef(
-        version=1,
+        version=2,
         pk=["activity_exec_dependency_id", "S", "activity_exec_id", "S"],
         indexes={
             "workflow_exec_id": "S",
             "dependent_activity_exec_id": "S"
         },
         attributes={},
+        global_indexes={
+            # Query all the dependencies of a workflow exec at once.
+            "workflow_dependency": {
+                "pk": ["workflow_exec_id", "S", "dependent_activity_exec_id", "S"],
+                "projection": "KEYS_ONLY"
+            }
+        },
         stream=False
     )
 }
@@ -0,0 +1,33 @@
+#!/bin/sh
+
+# Send one command to the Whimbrel client sidecar (whimbrel-sidecar.py),
+# and print its reply.
+# ENV requirements:
+#   WHIMBREL_SIDECAR_SOCKET=sidecar socket file; defaults to
+#       /var/run/whimbrel/sidecar.sock
+# Arguments:
+#   The command and its arguments, such as
+#       transition (activity exec ID) (transition) [source]
+#       heartbeat (activity exec ID) (workflow exec ID)
+#       request (workflow name) [workflow version]
+# Exit code:
+#   0 if the reply is "OK ...", 2 if it is "REFUSED", and 1 otherwise.
+
+socket_file="${WHIMBREL_SIDECAR_SOCKET:-/var/run/whimbrel/sidecar.sock}"
+
+if command -v socat >/dev/null 2>&1; then
+    reply=`echo "$*" | socat -t 30 - "UNIX-CONNECT:${socket_file}"`
+elif command -v nc >/dev/null 2>&1; then
+    # OpenBSD netcat; "-N" closes our side after the command is sent.
+    reply=`echo "$*" | nc -N -U "${socket_file}"`
+else
+    echo "$0 requires socat or nc"
+    exit 1
+fi
+
+echo "${reply}"
+case "${reply}" in
+    OK*) exit 0;;
+    REFUSED*) exit 2;;
+    *) exit 1;;
+esac
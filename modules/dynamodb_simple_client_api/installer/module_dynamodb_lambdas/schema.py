@@ -13,20 +13,33 @@ DYNAMODB_LAMBDAS_DB_TABLES = {
             "source": "S",
             "manual": "B",
             "when_epoch": "N",
+            # Not in items with an item_format of 2 (compact); see
+            # whimbrel_client.times.
             "when": "L[N,N,N,N,N,N]",
-            "workflow_version": "N"
+            "workflow_version": "N",
+            "item_format": "N"
         },
         stream=True
     ),
     "activity_event": DbTableDef(
-        version=1,
+        version=2,
         pk=["activity_event_id", "S", "activity_exec_id", "S"],
         indexes={},
         attributes={
             "source": "S",
             "manual": "B",
             "transition": "S",
-            "when": "L[N,N,N,N,N,N]"
+            "when_epoch": "N",
+            # Not in items with an item_format of 2 (compact).
+            "when": "L[N,N,N,N,N,N]",
+            "item_format": "N"
+        },
+        global_indexes={
+            # Query the events of an activity exec, for the archiver.
+            "activity_events": {
+                "pk": ["activity_exec_id", "S", "activity_event_id", "S"],
+                "projection": "KEYS_ONLY"
+            }
         },
         stream=True
     )
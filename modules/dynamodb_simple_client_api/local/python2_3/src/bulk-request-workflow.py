@@ -0,0 +1,30 @@
+#!/usr/bin/python
+
+import sys
+from whimbrel_client.cli import CommandLine
+from whimbrel_client.bulk_import import WorkflowImport
+
+args = CommandLine(sys.argv, {
+    '--input': 'input',
+    '--checkpoint': 'checkpoint',
+    '--workers': 'workers',
+    '--source': 'source'
+}, defaults={'workers': '8'})
+workers = int(args.get('workers'))
+checkpoint = args.get('checkpoint')
+if checkpoint is None:
+    sys.stderr.write("--checkpoint (file) is required\n")
+    sys.exit(2)
+
+
+def progress(stats):
+    sys.stderr.write(stats.summary() + "\n")
+
+
+importer = WorkflowImport(args.client(max_pool_connections=workers + 2), checkpoint, workers, progress=progress)
+if args.get('input') in (None, '-'):
+    stats = importer.run(sys.stdin, args.get('source'))
+else:
+    with open(args.get('input'), 'r') as f:
+        stats = importer.run(f, args.get('source'))
+print(stats.summary())
@@ -0,0 +1,27 @@
+#!/usr/bin/python
+
+import signal
+import sys
+from whimbrel_client.cli import CommandLine
+from whimbrel_client.events import EventWriter
+from whimbrel_client.sidecar import Sidecar
+
+args = CommandLine(sys.argv, {
+    '--socket': 'socket',
+    '--max-age': 'max_age',
+    '--source': 'source'
+}, defaults={'socket': '/var/run/whimbrel/sidecar.sock', 'max_age': '0.2'})
+client = args.client(lite=True)
+sidecar = Sidecar(client, EventWriter(client, max_age=float(args.get('max_age'))))
+
+
+def stop(signum, frame):
+    # Unwinds serve_forever, which flushes the queued events.
+    raise KeyboardInterrupt()
+
+
+signal.signal(signal.SIGTERM, stop)
+try:
+    sidecar.serve(args.get('socket'))
+except KeyboardInterrupt:
+    pass
@@ -0,0 +1,11 @@
+"""
+Python client for the Whimbrel simple DynamoDB API.
+"""
+
+from .client import WhimbrelClient, idempotent_id, error_code, is_conditional_check_failure
+from .times import FULL_FORMAT, COMPACT_FORMAT, when_list, item_epoch, item_time_list, epochs_to_lists, \
+    lists_to_epochs
+from .connection import create_db_client, create_streams_client, shared_db_client
+from .heartbeat import HeartbeatAgent
+from .events import EventWriter
+from .bulk_import import WorkflowImport
@@ -0,0 +1,331 @@
+"""
+asyncio support.  This module needs Python 3.5 or better; the rest of the
+package also works with Python 2.
+
+`AsyncWhimbrelClient` is the asyncio form of `WhimbrelClient`.  Its
+`AsyncDbClient` makes the requests on the event loop itself, signed the
+same way as the standard library `lite` client, so thousands of
+concurrent activities don't each need a thread waiting on a blocking call.
+All the requests share a pool of kept-alive connections.  At most
+`max_connections` requests are sent at once; the rest wait their turn,
+which slows down the callers when DynamoDB can't keep up.
+"""
+
+import asyncio
+import random
+import ssl
+import time
+from urllib.parse import urlparse
+
+from .client import WhimbrelClient, DEFAULT_DB_PREFIX, DEFAULT_SOURCE, is_conditional_check_failure, error_code
+from .times import FULL_FORMAT
+from .lite import SigV4Signer, OPERATIONS, RETRY_ERRORS, TARGET_PREFIX, USER_AGENT, parse_error, \
+    encode_request, decode_response, find_credentials, find_region
+
+
+class AsyncDbClient(object):
+    """
+    asyncio DynamoDB client with the boto3 low-level client methods that
+    Whimbrel uses, as coroutines.  Create it, and use it, in one event loop.
+
+    :param credentials: CredentialSource; see `whimbrel_client.lite.find_credentials`.
+    :param region: AWS region name.
+    :param endpoint_url: endpoint, such as `http://localhost:8000` for a
+        local DynamoDB; defaults to the regional HTTPS endpoint.
+    :param max_connections: most requests sent at once, and most
+        connections kept open.
+    :param timeout: seconds to wait for each response.
+    :param max_attempts: total attempts for throttled or failed requests.
+    """
+    def __init__(self, credentials, region, endpoint_url=None, max_connections=100, timeout=30, max_attempts=3,
+                 clock=time.time):
+        object.__init__(self)
+        assert max_connections > 0
+        url = urlparse(endpoint_url or 'https://dynamodb.{0}.amazonaws.com'.format(region))
+        self.__ssl = url.scheme == 'https' and ssl.create_default_context() or None
+        self.__host = url.netloc
+        self.__hostname = url.hostname
+        self.__port = url.port or (self.__ssl is not None and 443 or 80)
+        self.__credentials = credentials
+        self.__signer = SigV4Signer(region)
+        self.__max_connections = max_connections
+        self.__timeout = timeout
+        self.__max_attempts = max_attempts
+        self.__clock = clock
+        # Created on first use, in the running loop.
+        self.__slots = None
+        self.__idle = []
+        self.in_flight = 0
+        self.waiting = 0
+        self.requests = 0
+        self.retries = 0
+
+    def __getattr__(self, name):
+        if name not in OPERATIONS:
+            raise AttributeError(name)
+        operation = OPERATIONS[name]
+
+        async def call(**kwargs):
+            return await self.call(operation, kwargs)
+        return call
+
+    async def call(self, operation, params):
+        """
+        Send one DynamoDB request, waiting for a free connection first.
+
+        :return: the decoded JSON response.
+        """
+        body = encode_request(params)
+        if self.__slots is None:
+            self.__slots = asyncio.Semaphore(self.__max_connections)
+        self.waiting += 1
+        try:
+            await self.__slots.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        try:
+            attempt = 0
+            while True:
+                attempt += 1
+                self.requests += 1
+                status, data = await self._post(operation, body)
+                if status == 200:
+                    return decode_response(data)
+                error = parse_error(operation, status, data)
+                if attempt >= self.__max_attempts or (status < 500 and error_code(error) not in RETRY_ERRORS):
+                    raise error
+                self.retries += 1
+                delay = min(2.0, 0.05 * (2 ** attempt))
+                await asyncio.sleep(delay / 2.0 + delay * random.random() / 2.0)
+        finally:
+            self.in_flight -= 1
+            self.__slots.release()
+
+    def close(self):
+        """
+        Close the idle connections.
+        """
+        while len(self.__idle) > 0:
+            self.__idle.pop()[1].close()
+
+    async def _post(self, operation, body):
+        headers = self.__signer.headers(
+            self.__credentials.current(), self.__host, TARGET_PREFIX + operation, body, self.__clock())
+        headers['user-agent'] = USER_AGENT
+        headers['content-length'] = str(len(body))
+        request = ''.join(['POST / HTTP/1.1\r\n'] + [
+            '{0}: {1}\r\n'.format(name, value) for name, value in headers.items()
+        ] + ['\r\n']).encode('latin-1') + body
+        while len(self.__idle) > 0:
+            connection = self.__idle.pop()
+            try:
+                return await self._exchange(connection, request)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                # The server closed the kept-alive connection; try the next.
+                pass
+        connection = await asyncio.wait_for(
+            asyncio.open_connection(self.__hostname, self.__port, ssl=self.__ssl), self.__timeout)
+        return await self._exchange(connection, request)
+
+    async def _exchange(self, connection, request):
+        reader, writer = connection
+        try:
+            writer.write(request)
+            await writer.drain()
+            status, data, keep_alive = await asyncio.wait_for(_read_response(reader), self.__timeout)
+        except BaseException:
+            writer.close()
+            raise
+        if keep_alive:
+            self.__idle.append(connection)
+        else:
+            writer.close()
+        return status, data
+
+
+class AsyncWhimbrelClient(object):
+    """
+    The asyncio form of `WhimbrelClient`.
+
+    :param db: AsyncDbClient; see `create_async_client`.
+    :param db_prefix: table name prefix.
+    :param source: default description of where the requests come from.
+    :param item_format: see `WhimbrelClient`.
+    """
+    def __init__(self, db, db_prefix=DEFAULT_DB_PREFIX, source=DEFAULT_SOURCE, clock=time.time,
+                 item_format=FULL_FORMAT):
+        object.__init__(self)
+        self.__db = db
+        # Builds the requests; it never calls its own db.
+        self.__requests = WhimbrelClient(
+            db=db, db_prefix=db_prefix, source=source, clock=clock, item_format=item_format)
+
+    @property
+    def db(self):
+        return self.__db
+
+    @property
+    def item_format(self):
+        return self.__requests.item_format
+
+    def table_name(self, name):
+        return self.__requests.table_name(name)
+
+    async def load_table_names(self, names=('workflow_request', 'activity_event', 'activity_exec', 'workflow_exec',
+                                            'activity_exec_dependency')):
+        """
+        See `WhimbrelClient.load_table_names`.
+        """
+        request = self.__requests.table_names_request(names)
+        while len(request) > 0:
+            request = self.__requests.use_table_names(await self.__db.batch_get_item(RequestItems=request))
+
+    async def request_workflow(self, workflow, source=None, workflow_version=None, idempotency_key=None):
+        """
+        Request a new execution of the workflow.
+
+        :param idempotency_key: see `WhimbrelClient.request_workflow`.
+        :return: the workflow request ID.
+        """
+        item = self.__requests.workflow_request_item(
+            workflow, source, workflow_version, idempotency_key=idempotency_key)
+        await self._put(self.table_name('workflow_request'), item, 'workflow_request_id', idempotency_key is not None)
+        return item['workflow_request_id']['S']
+
+    async def update_activity(self, activity_exec_id, transition, source=None, idempotency_key=None):
+        """
+        Request a transition of the activity's state.
+
+        :param idempotency_key: see `WhimbrelClient.update_activity`.
+        :return: the activity event ID.
+        """
+        item = self.__requests.activity_event_item(activity_exec_id, transition, source, idempotency_key)
+        await self._put(self.table_name('activity_event'), item, 'activity_event_id', idempotency_key is not None)
+        return item['activity_event_id']['S']
+
+    async def heartbeat(self, activity_exec_id, workflow_exec_id):
+        """
+        Record a heartbeat for the running activity.
+
+        :return: True if the heartbeat was recorded, False if the activity
+            does not have heartbeats enabled (or no longer exists).
+        """
+        try:
+            await self.__db.update_item(**self.__requests.heartbeat_request(activity_exec_id, workflow_exec_id))
+        except Exception as e:
+            if is_conditional_check_failure(e):
+                return False
+            raise
+        return True
+
+    async def get_workflow_exec(self, workflow_exec_id, workflow_name):
+        """
+        :return: the workflow_exec item, or None if it does not exist.
+        """
+        response = await self.__db.get_item(
+            **self.__requests.get_workflow_exec_request(workflow_exec_id, workflow_name))
+        return response.get('Item')
+
+    async def get_activity_exec(self, activity_exec_id, workflow_exec_id):
+        """
+        :return: the activity_exec item, or None if it does not exist.
+        """
+        response = await self.__db.get_item(
+            **self.__requests.get_activity_exec_request(activity_exec_id, workflow_exec_id))
+        return response.get('Item')
+
+    async def _put(self, table_name, item, id_attribute, once):
+        if not once:
+            await self.__db.put_item(TableName=table_name, Item=item)
+            return
+        try:
+            await self.__db.put_item(
+                TableName=table_name, Item=item,
+                ConditionExpression='attribute_not_exists({0})'.format(id_attribute))
+        except Exception as e:
+            if not is_conditional_check_failure(e):
+                raise
+
+
+def create_async_client(aws_args=None, dynamodb_args=None, db_prefix=DEFAULT_DB_PREFIX, source=DEFAULT_SOURCE,
+                        max_connections=100, item_format=FULL_FORMAT):
+    """
+    An AsyncWhimbrelClient for the boto3-style session and client arguments.
+    """
+    credentials = find_credentials(aws_args)
+    region = find_region(aws_args)
+    if credentials is None or region is None:
+        raise ValueError("no AWS credentials or region found")
+    dynamodb_args = dynamodb_args or {}
+    db = AsyncDbClient(credentials, region, dynamodb_args.get('endpoint_url'), max_connections)
+    return AsyncWhimbrelClient(db, db_prefix, source, item_format=item_format)
+
+
+async def _read_response(reader):
+    """
+    Read one HTTP/1.1 response.
+
+    :return: (status, body, whether the connection can be reused)
+    """
+    status_line = await reader.readline()
+    if len(status_line) <= 0:
+        raise ConnectionError("connection closed")
+    parts = status_line.decode('latin-1').split(None, 2)
+    status = int(parts[1])
+    keep_alive = parts[0] == 'HTTP/1.1'
+    length = None
+    chunked = False
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        name = name.strip().lower()
+        value = value.strip().lower()
+        if name == 'content-length':
+            length = int(value)
+        elif name == 'transfer-encoding':
+            chunked = 'chunked' in value
+        elif name == 'connection':
+            keep_alive = value == 'keep-alive' or (keep_alive and value != 'close')
+    if chunked:
+        chunks = []
+        while True:
+            size = int((await reader.readline()).split(b';')[0].strip(), 16)
+            if size == 0:
+                # The (empty) trailers.
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                break
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+        return status, b''.join(chunks), keep_alive
+    if length is not None:
+        return status, await reader.readexactly(length), keep_alive
+    return status, await reader.read(), False
+
+
+async def run_heartbeat_agent(agent, max_sleep=5.0, executor=None):
+    """
+    Run the heartbeat agent as an asyncio task, in place of its thread.
+    The blocking DynamoDB calls run in the loop's executor.  Cancel the task
+    to stop it.
+
+    :param agent: HeartbeatAgent
+    :param max_sleep: most seconds to sleep between checks, so that newly
+        registered activities are picked up.
+    :param executor: concurrent.futures executor for the DynamoDB calls, or
+        None for the loop's default.
+    """
+    loop = asyncio.get_event_loop()
+    while True:
+        keys = agent.take_due()
+        if len(keys) > 0:
+            agent.stats.wakeups += 1
+            await loop.run_in_executor(executor, agent.send, keys)
+            continue
+        delay = agent.seconds_until_due()
+        if delay is None or delay > max_sleep:
+            delay = max_sleep
+        await asyncio.sleep(delay)
@@ -0,0 +1,185 @@
+"""
+Batched puts and gets with retries.
+"""
+
+import random
+import threading
+import time
+
+from .client import error_code
+
+# BatchWriteItem limit on the number of items per request.
+MAX_BATCH_ITEMS = 25
+
+# BatchGetItem limit on the number of keys per request.
+MAX_BATCH_KEYS = 100
+
+THROTTLE_ERRORS = ('ProvisionedThroughputExceededException', 'ThrottlingException', 'RequestLimitExceeded')
+
+
+class UnprocessedItemsError(Exception):
+    """
+    Items could not be written after all the retries.
+    """
+    def __init__(self, table_name, unprocessed_count, attempts):
+        Exception.__init__(self, "{0} items for {1} were still unprocessed after {2} attempts".format(
+            unprocessed_count, table_name, attempts))
+        self.table_name = table_name
+        self.unprocessed_count = unprocessed_count
+        self.attempts = attempts
+
+
+class BatchPutter(object):
+    """
+    Puts items with BatchWriteItem.  Items DynamoDB leaves unprocessed, and
+    requests that are throttled outright, are retried with a capped,
+    jittered exponential backoff.  The counters are safe to share between
+    threads.
+
+    :param db: DynamoDB low-level client
+    :param max_attempts: number of times a request with unprocessed items is
+        sent before giving up.
+    """
+    def __init__(self, db, max_attempts=8, initial_delay=0.05, max_delay=5, sleep=time.sleep, rand=random.random):
+        object.__init__(self)
+        self.__db = db
+        self.__max_attempts = max_attempts
+        self.__initial_delay = initial_delay
+        self.__max_delay = max_delay
+        self.__sleep = sleep
+        self.__rand = rand
+        self.__lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.throttles = 0
+        self.written = 0
+
+    def put(self, table_name, items, id_attribute, on_written=None):
+        """
+        Put the items, up to 25 per request.
+
+        :param table_name: full table name.
+        :param items: the items to put.
+        :param id_attribute: name of the string attribute that is the item's
+            key, used to tell which items were processed.  Of the items with
+            the same key, only the last is put.
+        :param on_written: function called with each item once it is written.
+        """
+        # A request can't hold the same key twice; the last item wins.
+        last = {}
+        for i, item in enumerate(items):
+            last[item[id_attribute]['S']] = i
+        if len(last) < len(items):
+            items = [item for i, item in enumerate(items) if last[item[id_attribute]['S']] == i]
+        for i in range(0, len(items), MAX_BATCH_ITEMS):
+            requests = [{'PutRequest': {'Item': item}} for item in items[i:i + MAX_BATCH_ITEMS]]
+            attempt = 0
+            while len(requests) > 0:
+                if attempt >= self.__max_attempts:
+                    raise UnprocessedItemsError(table_name, len(requests), attempt)
+                if attempt > 0:
+                    self._count(retries=1)
+                    delay = min(self.__max_delay, self.__initial_delay * (2 ** (attempt - 1)))
+                    self.__sleep(delay / 2.0 + delay * self.__rand() / 2.0)
+                attempt += 1
+                self._count(requests=1)
+                try:
+                    response = self.__db.batch_write_item(RequestItems={table_name: requests})
+                except Exception as e:
+                    if error_code(e) in THROTTLE_ERRORS:
+                        self._count(throttles=1)
+                        continue
+                    raise
+                unprocessed = (response.get('UnprocessedItems') or {}).get(table_name, [])
+                if len(unprocessed) > 0:
+                    self._count(throttles=1)
+                unprocessed_ids = set(r['PutRequest']['Item'][id_attribute]['S'] for r in unprocessed)
+                written = 0
+                for r in requests:
+                    item = r['PutRequest']['Item']
+                    if item[id_attribute]['S'] not in unprocessed_ids:
+                        written += 1
+                        if on_written is not None:
+                            on_written(item)
+                self._count(written=written)
+                requests = unprocessed
+
+    def _count(self, requests=0, retries=0, throttles=0, written=0):
+        with self.__lock:
+            self.requests += requests
+            self.retries += retries
+            self.throttles += throttles
+            self.written += written
+
+
+class BatchGetter(object):
+    """
+    Gets items with BatchGetItem, retrying the keys DynamoDB leaves
+    unprocessed, and throttled requests, with the same backoff as
+    BatchPutter.
+
+    :param db: DynamoDB low-level client
+    :param max_attempts: number of times a request with unprocessed keys is
+        sent before giving up.
+    """
+    def __init__(self, db, max_attempts=8, initial_delay=0.05, max_delay=5, sleep=time.sleep, rand=random.random):
+        object.__init__(self)
+        self.__db = db
+        self.__max_attempts = max_attempts
+        self.__initial_delay = initial_delay
+        self.__max_delay = max_delay
+        self.__sleep = sleep
+        self.__rand = rand
+        self.__lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.throttles = 0
+        self.read = 0
+
+    def get(self, table_name, keys, **get_args):
+        """
+        Get the items, up to 100 keys per request.  Keys with no item are
+        left out.
+
+        :param table_name: full table name.
+        :param keys: the item keys.
+        :param get_args: additional arguments for the table's request, such
+            as ProjectionExpression or ConsistentRead.
+        :return: list of the items, in no particular order.
+        """
+        ret = []
+        for i in range(0, len(keys), MAX_BATCH_KEYS):
+            pending = keys[i:i + MAX_BATCH_KEYS]
+            attempt = 0
+            while len(pending) > 0:
+                if attempt >= self.__max_attempts:
+                    raise UnprocessedItemsError(table_name, len(pending), attempt)
+                if attempt > 0:
+                    self._count(retries=1)
+                    delay = min(self.__max_delay, self.__initial_delay * (2 ** (attempt - 1)))
+                    self.__sleep(delay / 2.0 + delay * self.__rand() / 2.0)
+                attempt += 1
+                self._count(requests=1)
+                request = dict(get_args)
+                request['Keys'] = pending
+                try:
+                    response = self.__db.batch_get_item(RequestItems={table_name: request})
+                except Exception as e:
+                    if error_code(e) in THROTTLE_ERRORS:
+                        self._count(throttles=1)
+                        continue
+                    raise
+                items = response.get('Responses', {}).get(table_name, [])
+                ret.extend(items)
+                self._count(read=len(items))
+                pending = (response.get('UnprocessedKeys') or {}).get(table_name, {}).get('Keys', [])
+                if len(pending) > 0:
+                    self._count(throttles=1)
+        return ret
+
+    def _count(self, requests=0, retries=0, throttles=0, read=0):
+        with self.__lock:
+            self.requests += requests
+            self.retries += retries
+            self.throttles += throttles
+            self.read += read
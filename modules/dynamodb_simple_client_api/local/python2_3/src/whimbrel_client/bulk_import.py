@@ -0,0 +1,286 @@
+"""
+Bulk workflow request import.
+
+Reads one workflow request per input line, and writes the
+workflow_request items with batched puts from several worker threads.
+Each line is either a workflow name (optionally followed by the workflow
+version), or a JSON object with `workflow`, and optionally
+`workflow_version` and `source`.  Blank lines and lines starting with `#`
+are skipped.
+
+Progress is saved to a checkpoint file: the number of input lines whose
+requests are all written.  A crashed import, run again with the same
+checkpoint file and input, skips those lines.  The request IDs and
+request times come from the import ID and the line number, so the lines
+written after the last checkpoint are put again as the very same items;
+DynamoDB stores them once, and the stream sees no new insert, so no
+workflow starts twice.
+"""
+
+import json
+import os
+import threading
+import time
+import uuid
+
+try:
+    # Python 3
+    import queue
+except ImportError:
+    # Python 2
+    import Queue as queue
+
+from .batch import BatchPutter, MAX_BATCH_ITEMS
+
+# Namespace for the request IDs made from the import ID and line number.
+IMPORT_NAMESPACE = uuid.UUID('0c6f3ad4-5f7e-4d54-9c8e-6a4b3e1d2f10')
+
+
+class ImportCheckpoint(object):
+    """
+    The saved progress of an import.
+
+    :param filename: checkpoint file name.
+    """
+    def __init__(self, filename, import_id=None, started=None, lines_done=0, complete=False):
+        object.__init__(self)
+        self.filename = filename
+        self.import_id = import_id or str(uuid.uuid4())
+        self.started = started
+        if started is None:
+            self.started = int(time.time())
+        self.lines_done = lines_done
+        self.complete = complete
+
+    @staticmethod
+    def load(filename):
+        """
+        :return: the saved checkpoint, or None if there is none.
+        """
+        if not os.path.isfile(filename):
+            return None
+        with open(filename, 'r') as f:
+            data = json.load(f)
+        return ImportCheckpoint(filename, data['import_id'], data['started'], data['lines_done'],
+                                data.get('complete', False))
+
+    def save(self):
+        temp_file = self.filename + '.tmp'
+        with open(temp_file, 'w') as f:
+            json.dump({
+                'import_id': self.import_id,
+                'started': self.started,
+                'lines_done': self.lines_done,
+                'complete': self.complete
+            }, f, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+        os.rename(temp_file, self.filename)
+
+
+class ImportStats(object):
+    def __init__(self, putter, clock):
+        object.__init__(self)
+        self.__putter = putter
+        self.__clock = clock
+        self.start_time = clock()
+        self.end_time = None
+        self.lines_skipped = 0
+        self.lines_invalid = 0
+
+    @property
+    def written(self):
+        return self.__putter.written
+
+    @property
+    def requests(self):
+        return self.__putter.requests
+
+    @property
+    def throttles(self):
+        return self.__putter.throttles
+
+    @property
+    def retries(self):
+        return self.__putter.retries
+
+    @property
+    def elapsed(self):
+        return (self.end_time or self.__clock()) - self.start_time
+
+    @property
+    def per_second(self):
+        elapsed = self.elapsed
+        return elapsed > 0 and self.written / elapsed or 0.0
+
+    def summary(self):
+        return "{0} requests written in {1:.1f}s ({2:.1f}/s), {3} batch calls, {4} throttled, {5} retries".format(
+            self.written, self.elapsed, self.per_second, self.requests, self.throttles, self.retries)
+
+
+class WorkflowImport(object):
+    """
+    Imports workflow requests in bulk.
+
+    :param client: WhimbrelClient
+    :param checkpoint_file: file to save the progress to.
+    :param workers: number of threads writing batches at once.
+    :param checkpoint_seconds: most seconds between checkpoint saves.
+    :param progress: function called with the ImportStats after each
+        checkpoint save, or None.
+    """
+    def __init__(self, client, checkpoint_file, workers=8, checkpoint_seconds=5.0, progress=None,
+                 clock=time.time):
+        object.__init__(self)
+        assert workers > 0
+        self.__client = client
+        self.__checkpoint_file = checkpoint_file
+        self.__workers = workers
+        self.__checkpoint_seconds = checkpoint_seconds
+        self.__progress = progress
+        self.__clock = clock
+        self.__putter = BatchPutter(client.db)
+        self.stats = ImportStats(self.__putter, clock)
+
+    def run(self, lines, source=None):
+        """
+        Import the requests, resuming from the checkpoint if there is one.
+
+        :param lines: iterable of input lines (such as an open file).
+        :param source: default source for the requests.
+        :return: ImportStats
+        """
+        checkpoint = ImportCheckpoint.load(self.__checkpoint_file)
+        if checkpoint is None:
+            checkpoint = ImportCheckpoint(self.__checkpoint_file, started=int(self.__clock()))
+            checkpoint.save()
+        if checkpoint.complete:
+            self.stats.end_time = self.__clock()
+            return self.stats
+
+        table_name = self.__client.table_name('workflow_request')
+        work = queue.Queue(self.__workers * 2)
+        errors = []
+        tracker = _Watermark(checkpoint, self.__checkpoint_seconds, self.__clock, self._on_checkpoint)
+
+        def worker():
+            while True:
+                batch = work.get()
+                if batch is None:
+                    return
+                sequence, end_line, items = batch
+                if len(errors) <= 0:
+                    try:
+                        self.__putter.put(table_name, items, 'workflow_request_id')
+                        tracker.done(sequence, end_line)
+                    except Exception as e:
+                        errors.append(e)
+
+        threads = []
+        for i in range(self.__workers):
+            t = threading.Thread(target=worker, name="workflow-import-{0}".format(i))
+            t.daemon = True
+            t.start()
+            threads.append(t)
+
+        try:
+            sequence = 0
+            items = []
+            line_number = 0
+            for line in lines:
+                line_number += 1
+                if line_number <= checkpoint.lines_done:
+                    self.stats.lines_skipped += 1
+                    continue
+                if len(errors) > 0:
+                    break
+                item = self._parse(line, line_number, checkpoint, source)
+                if item is not None:
+                    items.append(item)
+                if len(items) >= MAX_BATCH_ITEMS:
+                    work.put((sequence, line_number, items))
+                    sequence += 1
+                    items = []
+            if len(errors) <= 0:
+                # The final batch also covers any trailing blank lines.
+                work.put((sequence, line_number, items))
+        finally:
+            for t in threads:
+                work.put(None)
+            for t in threads:
+                t.join()
+            self.stats.end_time = self.__clock()
+            tracker.save()
+
+        if len(errors) > 0:
+            raise errors[0]
+        checkpoint.complete = True
+        checkpoint.save()
+        return self.stats
+
+    def _parse(self, line, line_number, checkpoint, source):
+        line = line.strip()
+        if len(line) <= 0 or line.startswith('#'):
+            return None
+        workflow_version = None
+        if line.startswith('{'):
+            try:
+                data = json.loads(line)
+                workflow = data['workflow']
+            except (ValueError, KeyError):
+                self.stats.lines_invalid += 1
+                return None
+            workflow_version = data.get('workflow_version')
+            source = data.get('source', source)
+        else:
+            parts = line.split()
+            workflow = parts[0]
+            if len(parts) > 1:
+                workflow_version = parts[1]
+        request_id = workflow + '::' + str(uuid.uuid5(
+            IMPORT_NAMESPACE, '{0}:{1}'.format(checkpoint.import_id, line_number)))
+        return self.__client.workflow_request_item(
+            workflow, source, workflow_version, workflow_request_id=request_id, when_epoch=checkpoint.started)
+
+    def _on_checkpoint(self):
+        if self.__progress is not None:
+            self.__progress(self.stats)
+
+
+class _Watermark(object):
+    """
+    Tracks the batches that finished (in any order), and saves the line
+    number up to which every batch has finished.
+    """
+    def __init__(self, checkpoint, save_seconds, clock, on_save):
+        object.__init__(self)
+        self.__checkpoint = checkpoint
+        self.__save_seconds = save_seconds
+        self.__clock = clock
+        self.__on_save = on_save
+        self.__lock = threading.Lock()
+        self.__finished = {}
+        self.__next_sequence = 0
+        self.__last_save = clock()
+
+    def done(self, sequence, end_line):
+        with self.__lock:
+            self.__finished[sequence] = end_line
+            while self.__next_sequence in self.__finished:
+                self.__checkpoint.lines_done = self.__finished.pop(self.__next_sequence)
+                self.__next_sequence += 1
+            if self.__clock() - self.__last_save < self.__save_seconds:
+                return
+            self._save()
+        self.__on_save()
+
+    def save(self):
+        with self.__lock:
+            self._save()
+        self.__on_save()
+
+    def _save(self):
+        self.__checkpoint.save()
+        self.__last_save = self.__clock()
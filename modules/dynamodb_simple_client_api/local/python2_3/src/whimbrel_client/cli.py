@@ -0,0 +1,93 @@
+"""
+Command line argument handling shared by the scripts.
+"""
+
+from .client import WhimbrelClient, DEFAULT_DB_PREFIX, DEFAULT_SOURCE
+from .connection import aws_args_from_env, shared_db_client
+from .lite import create_lite_client
+from .times import FULL_FORMAT, COMPACT_FORMAT
+
+AWS_ARG_MAP = {
+    '--ak': 'aws_access_key_id',
+    '--as': 'aws_secret_access_key',
+    '--ar': 'region_name',
+    '--at': 'aws_session_token',
+    '--ap': 'profile_name'
+}
+
+
+class CommandLine(object):
+    """
+    The parsed command line.
+
+    :param argv: the full argument list, including the script name.
+    :param options: dictionary of the script's own `--option` -> name of the
+        value in `values`.
+    :param flags: dictionary of the script's `--flag` (no value) -> name of
+        the value set to True in `values`.
+    :param defaults: initial `values`.
+    """
+    def __init__(self, argv, options=None, flags=None, defaults=None):
+        object.__init__(self)
+        options = options or {}
+        flags = flags or {}
+        self.aws_args = aws_args_from_env()
+        self.dynamodb_args = {}
+        self.db_prefix = DEFAULT_DB_PREFIX
+        self.use_boto3 = False
+        self.item_format = FULL_FORMAT
+        self.values = {'source': DEFAULT_SOURCE}
+        self.values.update(defaults or {})
+
+        i = 1
+        while i < len(argv):
+            # AWS specific setup
+            if argv[i] in AWS_ARG_MAP:
+                arg = argv[i]
+                i += 1
+                self.aws_args[AWS_ARG_MAP[arg]] = argv[i]
+
+            # DynamoDB specific setup
+            elif argv[i] == '--endpoint':
+                i += 1
+                self.dynamodb_args['endpoint_url'] = argv[i]
+            elif argv[i] == '--ssl':
+                self.dynamodb_args['use_ssl'] = True
+            elif argv[i] == '--boto3':
+                self.use_boto3 = True
+
+            # Whimbrel specific setup
+            elif argv[i] == '--prefix':
+                i += 1
+                self.db_prefix = argv[i]
+            elif argv[i] == '--compact-times':
+                self.item_format = COMPACT_FORMAT
+            elif argv[i] in options:
+                arg = argv[i]
+                i += 1
+                self.values[options[arg]] = argv[i]
+            elif argv[i] in flags:
+                self.values[flags[argv[i]]] = True
+            i += 1
+
+    def get(self, name, default=None):
+        return self.values.get(name, default)
+
+    def client(self, max_pool_connections=None, lite=False):
+        """
+        The WhimbrelClient for these arguments, using the tables an upgrade
+        rebuilt (see `WhimbrelClient.load_table_names`).
+
+        :param lite: use the standard library `LiteDbClient` rather than
+            boto3, unless `--boto3` was given or the credentials need boto3.
+        """
+        db = None
+        if lite and not self.use_boto3:
+            db = create_lite_client(self.aws_args, self.dynamodb_args)
+        if db is None and max_pool_connections is not None:
+            db = shared_db_client(self.aws_args, self.dynamodb_args, max_pool_connections)
+        client = WhimbrelClient(
+            db=db, db_prefix=self.db_prefix, source=self.values['source'],
+            aws_args=self.aws_args, dynamodb_args=self.dynamodb_args, item_format=self.item_format)
+        client.load_table_names()
+        return client
@@ -0,0 +1,278 @@
+"""
+The Whimbrel simple DynamoDB client API.
+"""
+
+import time
+import uuid
+
+from .connection import shared_db_client
+from .times import FULL_FORMAT, ITEM_FORMATS, time_attributes, format_attributes
+
+DEFAULT_DB_PREFIX = 'whimbrel_'
+DEFAULT_SOURCE = 'Python CLI'
+
+# Namespace for the request and event IDs made from an idempotency key.
+IDEMPOTENCY_NAMESPACE = uuid.UUID('8d2f61c4-3b9e-4a57-b1d0-6e5c7f2a9b34')
+
+
+class WhimbrelClient(object):
+    """
+    Requests workflows, reports activity transitions and sends heartbeats,
+    all over one long-lived DynamoDB client.  It is safe to share between
+    threads.
+
+    :param db: DynamoDB low-level client; if None, the process-wide shared
+        client for the aws_args and dynamodb_args is used.
+    :param db_prefix: table name prefix.
+    :param source: default description of where the requests come from.
+    :param aws_args: boto3 Session arguments, if db is None.
+    :param dynamodb_args: client arguments (such as endpoint_url), if db is None.
+    :param item_format: format of the items written; `times.COMPACT_FORMAT`
+        leaves out the list form of the times.  Use it once every reader
+        of the tables accepts both formats.
+    """
+    def __init__(self, db=None, db_prefix=DEFAULT_DB_PREFIX, source=DEFAULT_SOURCE, aws_args=None,
+                 dynamodb_args=None, clock=time.time, item_format=FULL_FORMAT):
+        object.__init__(self)
+        assert item_format in ITEM_FORMATS
+        self.__db = db or shared_db_client(aws_args, dynamodb_args)
+        self.__db_prefix = db_prefix
+        self.__source = source
+        self.__clock = clock
+        self.__item_format = item_format
+        self.__tables = {}
+
+    @property
+    def db(self):
+        return self.__db
+
+    @property
+    def db_prefix(self):
+        return self.__db_prefix
+
+    @property
+    def source(self):
+        return self.__source
+
+    @property
+    def item_format(self):
+        return self.__item_format
+
+    def table_name(self, name):
+        """
+        The full name of the table, taking into account tables that an
+        upgrade moved to a new physical table.
+
+        :param name: table name, without the prefix.
+        """
+        return self.__tables.get(name) or self.__db_prefix + name
+
+    def load_table_names(self, names=('workflow_request', 'activity_event', 'activity_exec', 'workflow_exec',
+                                      'activity_exec_dependency')):
+        """
+        Look up the physical table for each of the tables in the
+        install_status table, for the tables that an upgrade rebuilt.
+        `CommandLine.client` calls it for the scripts and the services; call
+        it once when creating a client otherwise.
+        """
+        request = self.table_names_request(names)
+        while len(request) > 0:
+            request = self.use_table_names(self.__db.batch_get_item(RequestItems=request))
+
+    def table_names_request(self, names):
+        """
+        The batch_get_item RequestItems for `load_table_names`.
+        """
+        keys = [{'object_id': {'S': 'table.' + name}, 'object_type': {'S': 'table'}} for name in names]
+        return {
+            self.__db_prefix + 'install_status': {'Keys': keys, 'ProjectionExpression': 'object_id, physical_name'}
+        }
+
+    def use_table_names(self, response):
+        """
+        Use the physical tables in a `table_names_request` response.
+
+        :return: the RequestItems still to fetch.
+        """
+        for item in response.get('Responses', {}).get(self.__db_prefix + 'install_status', []):
+            if 'physical_name' in item:
+                name = item['object_id']['S'][len('table.'):]
+                self.__tables[name] = self.__db_prefix + item['physical_name']['S']
+        return response.get('UnprocessedKeys') or {}
+
+    def request_workflow(self, workflow, source=None, workflow_version=None, idempotency_key=None):
+        """
+        Request a new execution of the workflow.
+
+        :param idempotency_key: identifies this request among the caller's
+            requests for the workflow.  Retrying with the same key writes
+            nothing new, and returns the same ID; without it, each call
+            requests another execution.
+        :return: the workflow request ID.
+        """
+        item = self.workflow_request_item(workflow, source, workflow_version, idempotency_key=idempotency_key)
+        self._put(self.table_name('workflow_request'), item, 'workflow_request_id', idempotency_key is not None)
+        return item['workflow_request_id']['S']
+
+    def workflow_request_item(self, workflow, source=None, workflow_version=None, workflow_request_id=None,
+                              when_epoch=None, idempotency_key=None):
+        """
+        The workflow_request item for a new request.
+        """
+        if workflow_request_id is None and idempotency_key is not None:
+            workflow_request_id = idempotent_id(workflow, workflow, idempotency_key)
+        workflow_request_id = workflow_request_id or workflow + '::' + str(uuid.uuid1())
+        if when_epoch is None:
+            when_epoch = int(self.__clock())
+        item = {
+            "workflow_request_id": {"S": workflow_request_id},
+            "workflow_name": {"S": workflow},
+            "source": {"S": source or self.__source}
+        }
+        item.update(time_attributes('when', when_epoch, self.__item_format))
+        item.update(format_attributes(self.__item_format))
+        if workflow_version is not None:
+            item["workflow_version"] = {"N": str(workflow_version)}
+        return item
+
+    def update_activity(self, activity_exec_id, transition, source=None, idempotency_key=None):
+        """
+        Request a transition of the activity's state.
+
+        :param idempotency_key: identifies this event among the caller's
+            events for the activity; see `request_workflow`.
+        :return: the activity event ID.
+        """
+        item = self.activity_event_item(activity_exec_id, transition, source, idempotency_key)
+        self._put(self.table_name('activity_event'), item, 'activity_event_id', idempotency_key is not None)
+        return item['activity_event_id']['S']
+
+    def activity_event_item(self, activity_exec_id, transition, source=None, idempotency_key=None):
+        """
+        The activity_event item for a transition.
+        """
+        when_epoch = int(self.__clock())
+        if idempotency_key is not None:
+            activity_event_id = idempotent_id(activity_exec_id, activity_exec_id, transition, idempotency_key)
+        else:
+            activity_event_id = activity_exec_id + '::' + str(uuid.uuid1())
+        item = {
+            "activity_event_id": {"S": activity_event_id},
+            "activity_exec_id": {"S": activity_exec_id},
+            "transition": {"S": transition},
+            "source": {"S": source or self.__source}
+        }
+        item.update(time_attributes('when', when_epoch, self.__item_format))
+        item.update(format_attributes(self.__item_format))
+        return item
+
+    def heartbeat(self, activity_exec_id, workflow_exec_id):
+        """
+        Record a heartbeat for the running activity.
+
+        :return: True if the heartbeat was recorded, False if the activity
+            does not have heartbeats enabled (or no longer exists).
+        """
+        try:
+            self.__db.update_item(**self.heartbeat_request(activity_exec_id, workflow_exec_id))
+        except Exception as e:
+            if is_conditional_check_failure(e):
+                return False
+            raise
+        return True
+
+    def heartbeat_request(self, activity_exec_id, workflow_exec_id, when_epoch=None):
+        """
+        The update_item arguments for a heartbeat.
+        """
+        if when_epoch is None:
+            when_epoch = int(self.__clock())
+        return {
+            'TableName': self.table_name('activity_exec'),
+            'Key': {
+                "activity_exec_id": {"S": activity_exec_id},
+                "workflow_exec_id": {"S": workflow_exec_id}
+            },
+            'UpdateExpression': "SET heartbeat_time_epoch = :epoch",
+            'ConditionExpression': "attribute_exists(heartbeat_enabled) AND heartbeat_enabled=:true",
+            'ExpressionAttributeValues': {
+                ":epoch": {"N": str(when_epoch)},
+                ":true": {"BOOL": True}
+            }
+        }
+
+    def get_workflow_exec(self, workflow_exec_id, workflow_name):
+        """
+        :return: the workflow_exec item, or None if it does not exist.
+        """
+        return self.__db.get_item(**self.get_workflow_exec_request(workflow_exec_id, workflow_name)).get('Item')
+
+    def get_workflow_exec_request(self, workflow_exec_id, workflow_name):
+        """
+        The get_item arguments for reading a workflow exec.
+        """
+        return {
+            'TableName': self.table_name('workflow_exec'),
+            'Key': {
+                "workflow_exec_id": {"S": workflow_exec_id},
+                "workflow_name": {"S": workflow_name}
+            },
+            'ConsistentRead': True
+        }
+
+    def get_activity_exec(self, activity_exec_id, workflow_exec_id):
+        """
+        :return: the activity_exec item, or None if it does not exist.
+        """
+        return self.__db.get_item(**self.get_activity_exec_request(activity_exec_id, workflow_exec_id)).get('Item')
+
+    def get_activity_exec_request(self, activity_exec_id, workflow_exec_id):
+        """
+        The get_item arguments for reading an activity exec.
+        """
+        return {
+            'TableName': self.table_name('activity_exec'),
+            'Key': {
+                "activity_exec_id": {"S": activity_exec_id},
+                "workflow_exec_id": {"S": workflow_exec_id}
+            },
+            'ConsistentRead': True
+        }
+
+    def _put(self, table_name, item, id_attribute, once):
+        """
+        Write the item; with `once`, only if no item has its ID yet, so
+        that a retry leaves the first write (and its stream record) alone.
+        """
+        if not once:
+            self.__db.put_item(TableName=table_name, Item=item)
+            return
+        try:
+            self.__db.put_item(
+                TableName=table_name, Item=item,
+                ConditionExpression='attribute_not_exists({0})'.format(id_attribute))
+        except Exception as e:
+            if not is_conditional_check_failure(e):
+                raise
+
+
+def idempotent_id(prefix, *parts):
+    """
+    The `(prefix)::(uuid)` ID of a write identified by the parts; the same
+    parts always give the same ID.
+    """
+    return prefix + '::' + str(uuid.uuid5(IDEMPOTENCY_NAMESPACE, '\n'.join(parts)))
+
+
+def error_code(e):
+    """
+    The AWS error code for a client exception, or None.
+    """
+    response = getattr(e, 'response', None)
+    if isinstance(response, dict) and 'Error' in response:
+        return response['Error'].get('Code')
+    return None
+
+
+def is_conditional_check_failure(e):
+    return error_code(e) == 'ConditionalCheckFailedException'
@@ -0,0 +1,107 @@
+"""
+Long-lived DynamoDB connections.
+
+Creating a boto3 session and client is slow (it loads the service models
+and sets up the credential chain), and each new client opens its own
+HTTPS connections.  Long-running workers should create one client and
+reuse it.  The client keeps a pool of keep-alive connections, and is
+thread safe, so it can be shared by all the threads in the process.
+
+boto3 is only imported when the first client is created, so importing
+`whimbrel_client` stays cheap for scripts that use the `lite` client.
+"""
+
+import os
+import threading
+
+DEFAULT_MAX_POOL_CONNECTIONS = 10
+
+AWS_ENV_MAP = {
+    'AWS_ACCESS_KEY': 'aws_access_key_id',
+    'AWS_SECRET_KEY': 'aws_secret_access_key',
+    'AWS_REGION': 'region_name',
+    'AWS_SESSION_TOKEN': 'aws_session_token',
+    'AWS_PROFILE_NAME': 'profile_name'
+}
+
+_SHARED_CLIENTS = {}
+_SHARED_LOCK = threading.Lock()
+
+
+def aws_args_from_env(environ=None):
+    """
+    The boto3 session arguments from the environment variables used by the
+    command line scripts.
+    """
+    environ = environ is None and os.environ or environ
+    ret = {}
+    for env_name, arg_name in AWS_ENV_MAP.items():
+        ret[arg_name] = environ.get(env_name)
+    return ret
+
+
+def create_db_client(aws_args=None, dynamodb_args=None, max_pool_connections=DEFAULT_MAX_POOL_CONNECTIONS,
+                     max_attempts=None):
+    """
+    Create a new DynamoDB low-level client with a connection pool.
+
+    :param aws_args: boto3 Session arguments.
+    :param dynamodb_args: additional client arguments, such as endpoint_url.
+    :param max_pool_connections: maximum number of connections kept open;
+        this should be at least the number of threads sharing the client.
+    :param max_attempts: total attempts for throttled or failed requests,
+        or None for the botocore default.
+    """
+    from boto3.session import Session
+
+    session = Session(**(aws_args or {}))
+    args = dict(dynamodb_args or {})
+    args['config'] = _client_config(max_pool_connections, max_attempts)
+    return session.client('dynamodb', **args)
+
+
+def create_streams_client(aws_args=None, dynamodb_args=None, max_pool_connections=DEFAULT_MAX_POOL_CONNECTIONS):
+    """
+    Create a new DynamoDB Streams low-level client, for the stream
+    processors.  The arguments are the same as for `create_db_client`; an
+    `endpoint_url` (DynamoDB Local) serves the streams as well.
+    """
+    from boto3.session import Session
+
+    session = Session(**(aws_args or {}))
+    args = dict(dynamodb_args or {})
+    args['config'] = _client_config(max_pool_connections, None)
+    return session.client('dynamodbstreams', **args)
+
+
+def shared_db_client(aws_args=None, dynamodb_args=None, max_pool_connections=DEFAULT_MAX_POOL_CONNECTIONS):
+    """
+    A DynamoDB client shared by everything in the process that asks for the
+    same settings.  The first call creates it.
+    """
+    key = (_freeze(aws_args), _freeze(dynamodb_args), max_pool_connections)
+    with _SHARED_LOCK:
+        if key not in _SHARED_CLIENTS:
+            _SHARED_CLIENTS[key] = create_db_client(aws_args, dynamodb_args, max_pool_connections)
+        return _SHARED_CLIENTS[key]
+
+
+def _client_config(max_pool_connections, max_attempts):
+    from botocore.config import Config
+
+    args = {'max_pool_connections': max_pool_connections}
+    if max_attempts is not None:
+        args['retries'] = {'max_attempts': max_attempts}
+    try:
+        # TCP keep-alive on the pooled sockets, so idle connections
+        # survive between bursts.  Older botocore versions don't have it;
+        # they still reuse the connections with HTTP keep-alive.
+        return Config(tcp_keepalive=True, **args)
+    except TypeError:
+        return Config(**args)
+
+
+def _freeze(args):
+    if args is None:
+        return ()
+    return tuple(sorted((k, v) for k, v in args.items() if v is not None))
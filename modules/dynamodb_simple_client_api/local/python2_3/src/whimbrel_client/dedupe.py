@@ -0,0 +1,103 @@
+"""
+A bounded memory of the recently processed event IDs.
+
+The same event can reach a processor more than once: a stream batch is
+retried after a failure, a restarted processor reads again from its last
+checkpoint, or a client retries a write.  Each repeat costs a conditional
+update that then fails (and, without the idempotency key, may even apply a
+transition twice).  `DedupeCache` remembers the IDs of the events processed
+recently, so the repeats are dropped before any write.
+
+The cache holds at most `max_entries` IDs, dropping the least recently used
+first, and forgets an ID `ttl` seconds after it was added.  It only filters
+what reaches the conditional updates, which remain the guarantee, so an ID
+it forgot costs a failed update, never a wrong state.
+"""
+
+import collections
+import threading
+import time
+
+
+class DedupeStats(object):
+    def __init__(self):
+        object.__init__(self)
+        self.checked = 0
+        self.duplicates = 0
+        self.added = 0
+        self.evicted = 0
+        self.expired = 0
+
+
+class DedupeCache(object):
+    """
+    The IDs seen recently.  Safe to share between threads.
+
+    :param max_entries: most IDs kept.
+    :param ttl: seconds an ID is kept after it was added.
+    """
+    def __init__(self, max_entries=100000, ttl=3600, clock=time.time):
+        object.__init__(self)
+        assert max_entries > 0
+        self.__max_entries = max_entries
+        self.__ttl = ttl
+        self.__clock = clock
+        self.__lock = threading.Lock()
+        # ID -> expiry time, least recently used first
+        self.__entries = collections.OrderedDict()
+        self.stats = DedupeStats()
+
+    def __len__(self):
+        with self.__lock:
+            return len(self.__entries)
+
+    def seen(self, key):
+        """
+        :return: True if the ID was added, and has not expired; the caller
+            should drop the event.
+        """
+        now = self.__clock()
+        with self.__lock:
+            self.stats.checked += 1
+            expires = self.__entries.pop(key, None)
+            if expires is None:
+                return False
+            if expires <= now:
+                self.stats.expired += 1
+                return False
+            # Most recently used now.
+            self.__entries[key] = expires
+            self.stats.duplicates += 1
+            return True
+
+    def add(self, key):
+        """
+        Remember the ID; call once its event was processed.
+        """
+        now = self.__clock()
+        with self.__lock:
+            self.__entries.pop(key, None)
+            self.__entries[key] = now + self.__ttl
+            self.stats.added += 1
+            while len(self.__entries) > self.__max_entries:
+                oldest, expires = self.__entries.popitem(last=False)
+                if expires <= now:
+                    self.stats.expired += 1
+                else:
+                    self.stats.evicted += 1
+            # The least recently used entries are the likeliest to have
+            # expired; drop those, so idle IDs don't wait for an eviction.
+            while len(self.__entries) > 0:
+                oldest = next(iter(self.__entries))
+                if self.__entries[oldest] > now:
+                    break
+                del self.__entries[oldest]
+                self.stats.expired += 1
+
+    def discard(self, key):
+        with self.__lock:
+            self.__entries.pop(key, None)
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
@@ -0,0 +1,329 @@
+"""
+Activity dependency readiness.
+
+An activity becomes `READY` once every activity it depends on is
+`COMPLETED`.  Finding those activities from the tables alone, on each
+completion, means querying `activity_exec_dependency` for the activities
+that depend on the completed one, then reading the state of each of their
+other dependencies; the reads grow with the fan-in of every downstream
+activity.
+
+`DependencyTracker` instead keeps, per workflow execution, the dependency
+graph with the number of dependencies each activity still waits on.  The
+graph is loaded once, on the first completion the tracker sees for the
+workflow: one paged Query of the `workflow_dependency` index for the
+dependency items, and batched gets for the activity states.  After that a
+completion is only a counter update for each activity that depends on it.
+Graphs are dropped, least recently used first, past `max_workflows`, and
+are loaded again from the tables when needed; the tables stay the source
+of truth, so a restarted tracker picks up where the old one stopped.
+
+A graph only counts the completions its own tracker is told about.  When
+several processes each track the activities of the same workflows (such as
+the stream processor with several processes, each reading some of the
+shards), the tracker is created `shared`: after each completion, the
+dependencies that the activities waiting on it still count as unfinished
+are read again, in one batched get, and those another process completed
+are counted then.
+"""
+
+import collections
+import threading
+
+from .batch import BatchGetter
+
+# Global index on activity_exec_dependency, by workflow execution.
+WORKFLOW_DEPENDENCY_INDEX = 'workflow_dependency'
+
+
+class WorkflowGraph(object):
+    """
+    The dependencies between the activities of one workflow, and the
+    number of unfinished dependencies left for each activity.  The
+    activities can be any hashable values, such as activity exec IDs or
+    activity names.
+    """
+    def __init__(self):
+        object.__init__(self)
+        # activity -> activities that depend on it
+        self.__downstream = {}
+        # activity -> activities it depends on
+        self.__upstream = {}
+        # activity -> number of its dependencies not yet completed
+        self.__remaining = {}
+        # activity -> True if it has any dependency
+        self.__has_dependencies = {}
+        self.__completed = set()
+
+    def add(self, activity, depends_on=None):
+        """
+        Add the activity, and the dependencies it waits on.
+        """
+        self.__remaining.setdefault(activity, 0)
+        self.__has_dependencies.setdefault(activity, False)
+        for upstream in depends_on or []:
+            self.__remaining.setdefault(upstream, 0)
+            self.__has_dependencies.setdefault(upstream, False)
+            self.__downstream.setdefault(upstream, []).append(activity)
+            self.__upstream.setdefault(activity, []).append(upstream)
+            self.__has_dependencies[activity] = True
+            if upstream not in self.__completed:
+                self.__remaining[activity] += 1
+
+    def complete(self, activity):
+        """
+        Record the activity as completed.
+
+        :return: the activities that now have all their dependencies
+            completed.  Empty if the activity was already completed.
+        """
+        if activity in self.__completed:
+            return []
+        self.__completed.add(activity)
+        self.__remaining.setdefault(activity, 0)
+        self.__has_dependencies.setdefault(activity, False)
+        ready = []
+        for downstream in self.__downstream.get(activity, []):
+            self.__remaining[downstream] -= 1
+            if self.__remaining[downstream] == 0:
+                ready.append(downstream)
+        return ready
+
+    def is_completed(self, activity):
+        return activity in self.__completed
+
+    def remaining(self, activity):
+        """
+        :return: the number of the activity's dependencies not yet completed.
+        """
+        return self.__remaining.get(activity, 0)
+
+    def has_dependencies(self, activity):
+        return self.__has_dependencies.get(activity, False)
+
+    def roots(self):
+        """
+        :return: the activities that depend on nothing.
+        """
+        return [activity for activity, has in self.__has_dependencies.items() if not has]
+
+    def ready(self):
+        """
+        :return: the activities that are not completed and have all their
+            dependencies completed.
+        """
+        return [
+            activity for activity, remaining in self.__remaining.items()
+            if remaining == 0 and activity not in self.__completed
+        ]
+
+    def waiting_on(self, activity):
+        """
+        :return: the activity's dependencies that are not completed.
+        """
+        return [upstream for upstream in self.__upstream.get(activity, []) if upstream not in self.__completed]
+
+    def dependents(self, activity):
+        """
+        :return: the activities that depend directly on this one.
+        """
+        return list(self.__downstream.get(activity, []))
+
+    def downstream(self, activity):
+        """
+        :return: every activity that depends, directly or through other
+            activities, on this one, and is not completed.
+        """
+        ret = []
+        seen = set([activity])
+        pending = [activity]
+        while len(pending) > 0:
+            for downstream in self.__downstream.get(pending.pop(), []):
+                if downstream not in seen:
+                    seen.add(downstream)
+                    pending.append(downstream)
+                    if downstream not in self.__completed:
+                        ret.append(downstream)
+        return ret
+
+    def activities(self):
+        return list(self.__remaining.keys())
+
+    def __len__(self):
+        return len(self.__remaining)
+
+
+class DependencyStats(object):
+    def __init__(self):
+        object.__init__(self)
+        self.completions = 0
+        self.hits = 0
+        self.loads = 0
+        self.queries = 0
+        self.evictions = 0
+        self.rechecks = 0
+
+
+class DependencyTracker(object):
+    """
+    Tells which activities are ready when an activity completes.  Safe to
+    share between threads; each workflow's graph is loaded and updated
+    under its own lock.
+
+    :param client: WhimbrelClient
+    :param max_workflows: number of workflow graphs kept in memory.
+    :param getter: BatchGetter for the activity states.
+    :param shared: True if other processes complete activities of the same
+        workflows; see the module documentation.
+    """
+    def __init__(self, client, max_workflows=1000, getter=None, shared=False):
+        object.__init__(self)
+        assert max_workflows > 0
+        self.__client = client
+        self.__max_workflows = max_workflows
+        self.__shared = shared
+        self.__getter = getter or BatchGetter(client.db)
+        self.__lock = threading.Lock()
+        # workflow exec ID -> _Entry, least recently used first
+        self.__workflows = collections.OrderedDict()
+        self.stats = DependencyStats()
+
+    def completed(self, workflow_exec_id, activity_exec_id):
+        """
+        Record that the activity completed.  Call this after its
+        `COMPLETED` state is written.
+
+        :return: the activity exec IDs that now have all their dependencies
+            completed, and should transition to `READY`.  When the graph had
+            to be loaded, this also includes any other `REQUESTED` activity
+            whose dependencies were already completed, in case an earlier
+            completion was never tracked.
+        """
+        entry = self._entry(workflow_exec_id)
+        with entry.lock:
+            ready = []
+            loaded = entry.graph is None
+            if loaded:
+                entry.graph, ready = self._load(workflow_exec_id)
+            else:
+                self._count(hits=1)
+            self._count(completions=1)
+            for ready_id in entry.graph.complete(activity_exec_id):
+                if ready_id not in ready:
+                    ready.append(ready_id)
+            # A graph loaded just now already has the states of the table.
+            if self.__shared and not loaded:
+                for ready_id in self._recheck(workflow_exec_id, entry.graph, activity_exec_id):
+                    if ready_id not in ready:
+                        ready.append(ready_id)
+            return ready
+
+    def failed(self, workflow_exec_id, activity_exec_id):
+        """
+        :return: the activity exec IDs that can no longer run because the
+            activity failed; those that depend on it, directly or not.
+        """
+        entry = self._entry(workflow_exec_id)
+        with entry.lock:
+            if entry.graph is None:
+                entry.graph = self._load(workflow_exec_id)[0]
+            return entry.graph.downstream(activity_exec_id)
+
+    def forget(self, workflow_exec_id):
+        """
+        Drop the workflow's graph, once the workflow finished.
+        """
+        with self.__lock:
+            self.__workflows.pop(workflow_exec_id, None)
+
+    def _entry(self, workflow_exec_id):
+        with self.__lock:
+            entry = self.__workflows.pop(workflow_exec_id, None) or _Entry()
+            self.__workflows[workflow_exec_id] = entry
+            while len(self.__workflows) > self.__max_workflows:
+                self.__workflows.popitem(last=False)
+                self.stats.evictions += 1
+            return entry
+
+    def _recheck(self, workflow_exec_id, graph, activity_exec_id):
+        """
+        Read the states of the unfinished dependencies of the activities
+        still waiting on the completed one, and complete those another
+        process completed.
+
+        :return: the activity exec IDs that are ready because of them.
+        """
+        waiting_on = set()
+        for dependent in graph.dependents(activity_exec_id):
+            if not graph.is_completed(dependent):
+                waiting_on.update(graph.waiting_on(dependent))
+        if len(waiting_on) <= 0:
+            return []
+        self._count(rechecks=1)
+        keys = [
+            {'activity_exec_id': {'S': upstream}, 'workflow_exec_id': {'S': workflow_exec_id}}
+            for upstream in sorted(waiting_on)
+        ]
+        ready = []
+        for item in self.__getter.get(
+                self.__client.table_name('activity_exec'), keys,
+                ProjectionExpression='activity_exec_id, #state', ExpressionAttributeNames={'#state': 'state'},
+                ConsistentRead=True):
+            if item.get('state', {}).get('S') == 'COMPLETED':
+                ready.extend(graph.complete(item['activity_exec_id']['S']))
+        return ready
+
+    def _load(self, workflow_exec_id):
+        """
+        :return: (the WorkflowGraph, the REQUESTED activities that are ready)
+        """
+        self._count(loads=1)
+        graph = WorkflowGraph()
+        args = {
+            'TableName': self.__client.table_name('activity_exec_dependency'),
+            'IndexName': WORKFLOW_DEPENDENCY_INDEX,
+            'KeyConditionExpression': 'workflow_exec_id = :w',
+            'ExpressionAttributeValues': {':w': {'S': workflow_exec_id}}
+        }
+        while True:
+            self._count(queries=1)
+            response = self.__client.db.query(**args)
+            for item in response.get('Items', []):
+                graph.add(item['activity_exec_id']['S'], [item['dependent_activity_exec_id']['S']])
+            if 'LastEvaluatedKey' not in response:
+                break
+            args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+        keys = [
+            {'activity_exec_id': {'S': activity_exec_id}, 'workflow_exec_id': {'S': workflow_exec_id}}
+            for activity_exec_id in graph.activities()
+        ]
+        states = {}
+        for item in self.__getter.get(
+                self.__client.table_name('activity_exec'), keys,
+                ProjectionExpression='activity_exec_id, #state', ExpressionAttributeNames={'#state': 'state'},
+                ConsistentRead=True):
+            states[item['activity_exec_id']['S']] = item.get('state', {}).get('S')
+        for activity_exec_id, state in states.items():
+            if state == 'COMPLETED':
+                graph.complete(activity_exec_id)
+        ready = [
+            activity_exec_id for activity_exec_id in graph.ready()
+            if graph.has_dependencies(activity_exec_id) and states.get(activity_exec_id) == 'REQUESTED'
+        ]
+        return graph, ready
+
+    def _count(self, completions=0, hits=0, loads=0, queries=0, rechecks=0):
+        with self.__lock:
+            self.stats.completions += completions
+            self.stats.hits += hits
+            self.stats.loads += loads
+            self.stats.queries += queries
+            self.stats.rechecks += rechecks
+
+
+class _Entry(object):
+    def __init__(self):
+        object.__init__(self)
+        self.lock = threading.Lock()
+        self.graph = None
@@ -0,0 +1,270 @@
+"""
+A buffered activity event writer.
+
+Activity transitions are queued in memory and written together with
+BatchWriteItem (up to 25 items per request) when enough of them have
+collected, or the oldest has waited long enough.  Items DynamoDB leaves
+unprocessed, and requests that are throttled outright, are retried with a
+capped, jittered exponential backoff (see `BatchPutter`).  The time from
+`add` until the item is durably written is recorded for each event.
+
+An event added again while it is still queued (the same activity event ID,
+such as a retried transition with an idempotency key) replaces the queued
+one.  Events whose write DynamoDB refuses outright (a validation or access
+error) are dropped, and the error is kept in `last_error`; events that
+failed for throttling or a service or connection error are queued again
+for the next flush.
+"""
+
+import collections
+import logging
+import random
+import threading
+import time
+
+from .batch import BatchPutter, MAX_BATCH_ITEMS, THROTTLE_ERRORS, UnprocessedItemsError
+from .client import error_code
+
+_LOG = logging.getLogger(__name__)
+
+# Errors worth writing the events again for.
+SERVICE_ERRORS = ('InternalServerError', 'ServiceUnavailable')
+
+
+class LatencyStats(object):
+    """
+    Enqueue-to-durable latency, in seconds.  Keeps the totals for all
+    events, and the most recent `window` samples for the percentiles.
+    """
+    def __init__(self, window=1000):
+        object.__init__(self)
+        self.__window = window
+        self.__samples = []
+        self.__next = 0
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        if len(self.__samples) < self.__window:
+            self.__samples.append(seconds)
+        else:
+            self.__samples[self.__next] = seconds
+            self.__next = (self.__next + 1) % self.__window
+
+    @property
+    def mean(self):
+        return self.count > 0 and self.total / self.count or 0.0
+
+    def percentile(self, fraction):
+        if len(self.__samples) <= 0:
+            return 0.0
+        ordered = sorted(self.__samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class EventWriterStats(object):
+    def __init__(self, putter):
+        object.__init__(self)
+        self.__putter = putter
+        self.queued = 0
+        self.dropped = 0
+        self.latency = LatencyStats()
+
+    @property
+    def written(self):
+        return self.__putter.written
+
+    @property
+    def requests(self):
+        return self.__putter.requests
+
+    @property
+    def retries(self):
+        return self.__putter.retries
+
+    @property
+    def throttles(self):
+        return self.__putter.throttles
+
+
+class EventWriter(object):
+    """
+    Buffers activity events and writes them in batches.  It is safe to
+    share between threads.
+
+    :param client: WhimbrelClient
+    :param max_items: flush once this many events are waiting.
+    :param max_age: flush once the oldest waiting event is this many seconds old.
+    :param max_attempts: number of times a batch with unprocessed items is
+        sent before giving up.
+    :param background: if True, a daemon thread flushes on size and age;
+        otherwise the caller must call `flush` (adds still flush on size).
+    """
+    def __init__(self, client, max_items=MAX_BATCH_ITEMS, max_age=0.5, max_attempts=8, initial_delay=0.05,
+                 max_delay=5, background=True, clock=time.time, sleep=time.sleep, rand=random.random):
+        object.__init__(self)
+        assert max_items > 0
+        self.__client = client
+        self.__max_items = max_items
+        self.__max_age = max_age
+        self.__max_delay = max_delay
+        self.__background = background
+        self.__clock = clock
+        self.__sleep = sleep
+        self.__putter = BatchPutter(client.db, max_attempts, initial_delay, max_delay, sleep, rand)
+        self.__condition = threading.Condition()
+        # Serializes the writes, so a flush returns only after everything
+        # queued before it is written.
+        self.__write_lock = threading.Lock()
+        # activity event ID -> (enqueue time, item), in the order added
+        self.__pending = collections.OrderedDict()
+        self.__closed = False
+        self.__thread = None
+        self.last_error = None
+        self.stats = EventWriterStats(self.__putter)
+        if background:
+            self.__thread = threading.Thread(target=self._run, name="whimbrel-event-writer")
+            self.__thread.daemon = True
+            self.__thread.start()
+
+    def __len__(self):
+        with self.__condition:
+            return len(self.__pending)
+
+    def add(self, activity_exec_id, transition, source=None, idempotency_key=None):
+        """
+        Queue an activity transition.
+
+        :param idempotency_key: see `WhimbrelClient.update_activity`.  A
+            batched write can't be conditional, so a retry overwrites the
+            event; the stream shows the overwrite as a MODIFY record, which
+            the event processors skip.  If the event is still queued, this
+            one replaces it.
+        :return: the activity event ID.
+        """
+        item = self.__client.activity_event_item(activity_exec_id, transition, source, idempotency_key)
+        event_id = item['activity_event_id']['S']
+        with self.__condition:
+            if self.__closed:
+                raise ValueError("event writer is closed")
+            queued = self.__pending.get(event_id)
+            if queued is None:
+                self.__pending[event_id] = (self.__clock(), item)
+                self.stats.queued += 1
+            else:
+                self.__pending[event_id] = (queued[0], item)
+            full = len(self.__pending) >= self.__max_items
+            if full:
+                self.__condition.notify()
+        if full and not self.__background:
+            self.flush()
+        return event_id
+
+    def flush(self):
+        """
+        Write everything queued so far, and wait for it to be durable.  If
+        the write fails, the error is raised, and kept in `last_error`.
+        """
+        with self.__write_lock:
+            with self.__condition:
+                batch = list(self.__pending.values())
+                self.__pending = collections.OrderedDict()
+            try:
+                self._write(batch)
+            except Exception as e:
+                self.last_error = e
+                if not _is_retryable(e):
+                    # The batch starts with the refused request's events;
+                    # sending them again would be refused again.
+                    dropped = batch[:MAX_BATCH_ITEMS]
+                    del batch[:MAX_BATCH_ITEMS]
+                    self.stats.dropped += len(dropped)
+                    _LOG.error("dropped %d activity events: %s", len(dropped), e)
+                self._requeue(batch)
+                raise
+
+    def _requeue(self, batch):
+        """
+        Put back what wasn't written, ahead of the events added since; an
+        event added again since replaces its queued one.
+        """
+        with self.__condition:
+            pending = collections.OrderedDict()
+            for (when, item) in batch:
+                pending[item['activity_event_id']['S']] = (when, item)
+            for event_id, (when, item) in self.__pending.items():
+                if event_id in pending:
+                    when = pending[event_id][0]
+                pending[event_id] = (when, item)
+            self.__pending = pending
+
+    def close(self):
+        """
+        Flush the queued events and stop the background thread.
+        """
+        with self.__condition:
+            self.__closed = True
+            self.__condition.notify()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+        self.flush()
+
+    def _run(self):
+        while True:
+            with self.__condition:
+                while not self.__closed:
+                    if len(self.__pending) >= self.__max_items:
+                        break
+                    if len(self.__pending) > 0:
+                        age = self.__clock() - next(iter(self.__pending.values()))[0]
+                        if age >= self.__max_age:
+                            break
+                        self.__condition.wait(self.__max_age - age)
+                    else:
+                        self.__condition.wait()
+                if self.__closed:
+                    return
+            try:
+                self.flush()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = e
+                _LOG.warning("activity event write failed: %s", e)
+                self.__sleep(self.__max_delay)
+
+    def _write(self, batch):
+        """
+        Write the (enqueue time, item) pairs, removing them from the batch
+        list as each request completes.  If it fails, the batch keeps the
+        events of the failed request; writing those again is harmless, as
+        each put has the same event ID.
+        """
+        table_name = self.__client.table_name('activity_event')
+        while len(batch) > 0:
+            chunk = batch[:MAX_BATCH_ITEMS]
+            enqueued = {}
+            for (when, item) in chunk:
+                enqueued[item['activity_event_id']['S']] = when
+
+            def written(item):
+                self.stats.latency.record(self.__clock() - enqueued[item['activity_event_id']['S']])
+
+            self.__putter.put(table_name, [item for (when, item) in chunk], 'activity_event_id', written)
+            del batch[:len(chunk)]
+
+
+def _is_retryable(e):
+    """
+    Whether events that failed with the error may be written by trying
+    again: the request was throttled, or DynamoDB or the connection to it
+    failed, rather than DynamoDB refusing it.
+    """
+    if isinstance(e, UnprocessedItemsError):
+        return True
+    code = error_code(e)
+    return code is None or code in THROTTLE_ERRORS or code in SERVICE_ERRORS
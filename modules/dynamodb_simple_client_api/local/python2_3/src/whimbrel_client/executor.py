@@ -0,0 +1,402 @@
+"""
+An in-process workflow executor for the Full Logic API.
+
+The executor runs the whole contract for a workflow itself, rather than
+leaving it to the Lambda functions:
+
+1. It adds the `workflow_exec` item, in the `REQUESTED` state, and moves it
+   to `RUNNING`.
+2. It calls the workflow's decision function, which returns the
+   activities to run, and the activities each one depends on.
+3. It adds the `activity_exec` items (`REQUESTED`) and the
+   `activity_exec_dependency` items, with batched writes.
+4. It queues each activity once its dependencies completed, runs it, and
+   records it as `COMPLETED` or `FAILED`.  When an activity fails, the
+   workflow goes to `FAILED_WAITING`, the activities that haven't started
+   are cancelled, and the workflow ends `FAILED`; otherwise it ends
+   `COMPLETED`.  The workflow fails the same way when the executor itself
+   hits an error (a transition that keeps conflicting, or a DynamoDB
+   error) once it is `RUNNING`, and the error is raised again.
+
+Each workflow runs on one thread of the executor's pool, so independent
+workflows run side by side; the activities of one workflow run one at a
+time, in dependency order.  Every state change is a conditional update
+(see `whimbrel_client.transitions`), so other Full Logic clients see the
+same states the Lambda functions would produce.
+"""
+
+import logging
+import threading
+import time
+import uuid
+
+try:
+    # Python 3
+    import queue
+except ImportError:
+    # Python 2
+    import Queue as queue
+
+from .batch import BatchPutter
+from .client import idempotent_id, is_conditional_check_failure
+from .times import time_attributes, format_attributes
+from .dependencies import WorkflowGraph
+from .transitions import (
+    ACTIVITY_TRANSITIONS, ActivityTransitionEngine, WorkflowTransitionEngine, TransitionNotAllowed, ItemNotFound
+)
+
+_LOG = logging.getLogger(__name__)
+
+
+class Activity(object):
+    """
+    An activity that a decision function asks to run.
+
+    :param name: activity name; unique within the workflow.
+    :param run: function called with the ActivityExec to run it; raising an
+        exception fails the activity.
+    :param depends_on: names of the activities that must complete first.
+    :param heartbeat_enabled: if True, the executor's heartbeat agent sends
+        heartbeats while it runs.
+    """
+    def __init__(self, name, run, depends_on=None, heartbeat_enabled=False, version=None):
+        object.__init__(self)
+        self.name = name
+        self.run = run
+        self.depends_on = list(depends_on or [])
+        self.heartbeat_enabled = heartbeat_enabled
+        self.version = version
+
+
+class ActivityExec(object):
+    """
+    One execution of an activity, as passed to its `run` function.
+    """
+    def __init__(self, activity, activity_exec_id, workflow_exec):
+        object.__init__(self)
+        self.activity = activity
+        self.activity_exec_id = activity_exec_id
+        self.workflow_exec = workflow_exec
+        self.state = 'REQUESTED'
+        self.error = None
+
+    @property
+    def name(self):
+        return self.activity.name
+
+
+class WorkflowExec(object):
+    """
+    One execution of a workflow; `wait` for it to finish.
+    """
+    def __init__(self, workflow_name, workflow_exec_id, workflow_request_id=None, workflow_version=None):
+        object.__init__(self)
+        self.workflow_name = workflow_name
+        self.workflow_exec_id = workflow_exec_id
+        self.workflow_request_id = workflow_request_id
+        self.workflow_version = workflow_version
+        self.state = 'REQUESTED'
+        # activity name -> ActivityExec
+        self.activities = {}
+        self.error = None
+        # True if the execution already existed, so this one did nothing.
+        self.duplicate = False
+        self.__done = threading.Event()
+
+    def wait(self, timeout=None):
+        """
+        :return: True if the workflow finished.
+        """
+        return self.__done.wait(timeout)
+
+    def _finish(self):
+        self.__done.set()
+
+
+class ExecutorStats(object):
+    def __init__(self):
+        object.__init__(self)
+        self.workflows = 0
+        self.completed = 0
+        self.failed = 0
+        self.activities = 0
+        self.duplicates = 0
+
+
+class WorkflowExecutor(object):
+    """
+    Runs workflows on a pool of threads.
+
+    :param client: WhimbrelClient
+    :param decisions: workflow name -> decision function, called with the
+        WorkflowExec; it returns the list of Activity to run.
+    :param workers: number of workflows run at once.
+    :param heartbeats: HeartbeatAgent for the activities with heartbeats
+        enabled, or None.
+    """
+    def __init__(self, client, decisions, workers=8, heartbeats=None, clock=time.time):
+        object.__init__(self)
+        assert workers > 0
+        self.__client = client
+        self.__decisions = dict(decisions)
+        self.__heartbeats = heartbeats
+        self.__clock = clock
+        self.__putter = BatchPutter(client.db)
+        self.__activity_states = ActivityTransitionEngine(client, clock=clock)
+        self.__workflow_states = WorkflowTransitionEngine(client, clock=clock)
+        self.__work = queue.Queue()
+        self.__lock = threading.Lock()
+        self.stats = ExecutorStats()
+        self.__threads = []
+        for i in range(workers):
+            t = threading.Thread(target=self._run, name="whimbrel-executor-{0}".format(i))
+            t.daemon = True
+            t.start()
+            self.__threads.append(t)
+
+    def submit(self, workflow_name, workflow_request_id=None, workflow_version=None):
+        """
+        Start a new execution of the workflow.
+
+        :param workflow_request_id: the request being run, if any.  The
+            execution ID is made from it, so when the same request is
+            submitted again, the second run finds the execution already
+            created, and does nothing (its `duplicate` is True).
+        :return: the WorkflowExec, which finishes in the background.
+        """
+        if workflow_name not in self.__decisions:
+            raise ValueError("no decision function for workflow " + workflow_name)
+        if workflow_request_id is not None:
+            workflow_exec_id = idempotent_id(workflow_name, workflow_request_id)
+        else:
+            workflow_exec_id = workflow_name + '::' + str(uuid.uuid1())
+        workflow_exec = WorkflowExec(workflow_name, workflow_exec_id, workflow_request_id, workflow_version)
+        self.__work.put(workflow_exec)
+        return workflow_exec
+
+    def run(self, workflow_name, workflow_request_id=None, workflow_version=None):
+        """
+        Run a workflow and wait for it to finish.
+
+        :return: the finished WorkflowExec.
+        """
+        workflow_exec = self.submit(workflow_name, workflow_request_id, workflow_version)
+        workflow_exec.wait()
+        return workflow_exec
+
+    def shutdown(self):
+        """
+        Finish the submitted workflows, then stop the threads.
+        """
+        for t in self.__threads:
+            self.__work.put(None)
+        for t in self.__threads:
+            t.join()
+        self.__threads = []
+
+    def _run(self):
+        while True:
+            workflow_exec = self.__work.get()
+            if workflow_exec is None:
+                return
+            try:
+                self.execute(workflow_exec)
+            except Exception as e:
+                _LOG.exception("workflow %s failed to run", workflow_exec.workflow_exec_id)
+                workflow_exec.error = e
+            finally:
+                workflow_exec._finish()
+
+    def execute(self, workflow_exec):
+        """
+        Run the workflow on this thread.
+        """
+        try:
+            self._create_workflow(workflow_exec)
+        except Exception as e:
+            if not is_conditional_check_failure(e):
+                raise
+            _LOG.info("workflow %s was already started", workflow_exec.workflow_exec_id)
+            workflow_exec.duplicate = True
+            self._count(duplicates=1)
+            return
+        self._count(workflows=1)
+        self._workflow_transition(workflow_exec, 'RUNNING')
+        try:
+            activities = self.__decisions[workflow_exec.workflow_name](workflow_exec)
+            check_dependencies(activities)
+        except Exception:
+            self._workflow_transition(workflow_exec, 'FAILED')
+            self._count(failed=1)
+            raise
+        try:
+            failed = not self._run_activities(workflow_exec, activities)
+        except Exception:
+            self._fail_after_error(workflow_exec)
+            raise
+
+        if failed:
+            self._fail(workflow_exec)
+        else:
+            self._workflow_transition(workflow_exec, 'COMPLETED')
+            self._count(completed=1)
+
+    def _run_activities(self, workflow_exec, activities):
+        """
+        :return: True if every activity completed, False once one failed.
+        """
+        self._create_activities(workflow_exec, activities)
+        graph = WorkflowGraph()
+        for activity in activities:
+            graph.add(activity.name, activity.depends_on)
+        ready = sorted(graph.roots())
+        while len(ready) > 0:
+            name = ready.pop(0)
+            if not self._run_activity(workflow_exec.activities[name]):
+                return False
+            ready.extend(sorted(graph.complete(name)))
+        return True
+
+    def _fail(self, workflow_exec):
+        """
+        Move the workflow to `FAILED_WAITING`, cancel its activities that
+        can still be cancelled, and move it to `FAILED`.
+        """
+        self._workflow_transition(workflow_exec, 'FAILED_WAITING')
+        for name in sorted(workflow_exec.activities.keys()):
+            activity_exec = workflow_exec.activities[name]
+            if 'CANCEL' in ACTIVITY_TRANSITIONS.get(activity_exec.state, {}):
+                try:
+                    self._activity_transition(activity_exec, 'CANCEL')
+                except (TransitionNotAllowed, ItemNotFound) as e:
+                    _LOG.info("activity exec %s: %s", activity_exec.activity_exec_id, e)
+        self._workflow_transition(workflow_exec, 'FAILED')
+        self._count(failed=1)
+
+    def _fail_after_error(self, workflow_exec):
+        """
+        `_fail`, for an error the caller raises again; an error failing the
+        workflow is logged rather than raised in place of the first one.
+        """
+        try:
+            self._fail(workflow_exec)
+        except Exception:
+            _LOG.exception("workflow %s could not be moved to FAILED", workflow_exec.workflow_exec_id)
+
+    def _create_workflow(self, workflow_exec):
+        now = int(self.__clock())
+        item = {
+            "workflow_exec_id": {"S": workflow_exec.workflow_exec_id},
+            "workflow_name": {"S": workflow_exec.workflow_name},
+            "state": {"S": workflow_exec.state}
+        }
+        item.update(time_attributes('start_time', now, self.__client.item_format))
+        item.update(format_attributes(self.__client.item_format))
+        if workflow_exec.workflow_request_id is not None:
+            item["workflow_request_id"] = {"S": workflow_exec.workflow_request_id}
+        if workflow_exec.workflow_version is not None:
+            item["workflow_version"] = {"N": str(workflow_exec.workflow_version)}
+        self.__client.db.put_item(
+            TableName=self.__client.table_name('workflow_exec'), Item=item,
+            ConditionExpression="attribute_not_exists(workflow_exec_id)")
+
+    def _create_activities(self, workflow_exec, activities):
+        activity_items = []
+        dependency_items = []
+        for activity in activities:
+            activity_exec = ActivityExec(activity, activity.name + '::' + str(uuid.uuid1()), workflow_exec)
+            workflow_exec.activities[activity.name] = activity_exec
+            item = {
+                "activity_exec_id": {"S": activity_exec.activity_exec_id},
+                "workflow_exec_id": {"S": workflow_exec.workflow_exec_id},
+                "state": {"S": activity_exec.state},
+                "activity_name": {"S": activity.name},
+                "workflow_name": {"S": workflow_exec.workflow_name},
+                "heartbeat_enabled": {"BOOL": activity.heartbeat_enabled},
+                # Negative until the activity starts.
+                "start_time_epoch": {"N": "-1"},
+                "heartbeat_time_epoch": {"N": "-1"}
+            }
+            if activity.version is not None:
+                item["activity_version"] = {"N": str(activity.version)}
+            item.update(format_attributes(self.__client.item_format))
+            activity_items.append(item)
+        for activity in activities:
+            activity_exec_id = workflow_exec.activities[activity.name].activity_exec_id
+            for index, name in enumerate(activity.depends_on):
+                dependency_items.append({
+                    "activity_exec_dependency_id": {"S": '{0}:{1}'.format(activity_exec_id, index)},
+                    "activity_exec_id": {"S": activity_exec_id},
+                    "workflow_exec_id": {"S": workflow_exec.workflow_exec_id},
+                    "dependent_activity_exec_id": {"S": workflow_exec.activities[name].activity_exec_id}
+                })
+        self.__putter.put(self.__client.table_name('activity_exec'), activity_items, 'activity_exec_id')
+        if len(dependency_items) > 0:
+            self.__putter.put(
+                self.__client.table_name('activity_exec_dependency'), dependency_items,
+                'activity_exec_dependency_id')
+
+    def _run_activity(self, activity_exec):
+        """
+        :return: True if the activity completed.
+        """
+        activity = activity_exec.activity
+        if len(activity.depends_on) > 0:
+            self._activity_transition(activity_exec, 'READY')
+        self._activity_transition(activity_exec, 'QUEUED')
+        self._activity_transition(activity_exec, 'RUNNING')
+        self._count(activities=1)
+        heartbeats = activity.heartbeat_enabled and self.__heartbeats or None
+        if heartbeats is not None:
+            heartbeats.register(activity_exec.activity_exec_id, activity_exec.workflow_exec.workflow_exec_id)
+        try:
+            activity.run(activity_exec)
+        except Exception as e:
+            _LOG.warning("activity %s failed: %s", activity_exec.activity_exec_id, e)
+            activity_exec.error = e
+        finally:
+            if heartbeats is not None:
+                heartbeats.unregister(activity_exec.activity_exec_id, activity_exec.workflow_exec.workflow_exec_id)
+        self._activity_transition(activity_exec, activity_exec.error is None and 'COMPLETED' or 'FAILED')
+        return activity_exec.error is None
+
+    def _activity_transition(self, activity_exec, transition):
+        old_state, activity_exec.state = self.__activity_states.transition_activity(
+            activity_exec.activity_exec_id, activity_exec.workflow_exec.workflow_exec_id, transition,
+            activity_exec.state, activity_exec.activity.heartbeat_enabled)
+
+    def _workflow_transition(self, workflow_exec, transition):
+        old_state, workflow_exec.state = self.__workflow_states.transition_workflow(
+            workflow_exec.workflow_exec_id, workflow_exec.workflow_name, transition, workflow_exec.state)
+
+    def _count(self, workflows=0, completed=0, failed=0, activities=0, duplicates=0):
+        with self.__lock:
+            self.stats.workflows += workflows
+            self.stats.completed += completed
+            self.stats.failed += failed
+            self.stats.activities += activities
+            self.stats.duplicates += duplicates
+
+
+def check_dependencies(activities):
+    """
+    :raise ValueError: an activity name is repeated, or an activity
+        depends on an unknown activity, or the dependencies form a cycle.
+    """
+    remaining = {}
+    for activity in activities:
+        if activity.name in remaining:
+            raise ValueError("activity {0} is listed more than once".format(activity.name))
+        remaining[activity.name] = set(activity.depends_on)
+    for activity in activities:
+        for name in activity.depends_on:
+            if name not in remaining:
+                raise ValueError("activity {0} depends on unknown activity {1}".format(activity.name, name))
+    while len(remaining) > 0:
+        ready = [name for name, depends_on in remaining.items() if len(depends_on) <= 0]
+        if len(ready) <= 0:
+            raise ValueError("activities depend on each other: {0}".format(', '.join(sorted(remaining.keys()))))
+        for name in ready:
+            del remaining[name]
+        for depends_on in remaining.values():
+            depends_on.difference_update(ready)
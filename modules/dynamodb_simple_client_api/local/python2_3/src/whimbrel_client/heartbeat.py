@@ -0,0 +1,239 @@
+"""
+A heartbeat agent for all the running activities in the process.
+
+Activities register with the agent, and the agent sends their heartbeats
+from a single thread (or asyncio task, see `whimbrel_client.aio`) over the
+client's shared connection.  The pending heartbeats are kept in one heap
+ordered by due time.  Each activity's first heartbeat is placed at a
+random point in its interval, and each following one is pulled earlier
+by a random jitter, so that activities started together don't keep
+sending together.  Heartbeats that come due within the coalescing window
+are sent in the same pass, so the agent wakes once for a cluster of them
+rather than once each.
+
+An activity is dropped from the agent when DynamoDB reports that it no
+longer has heartbeats enabled (the conditional update fails).
+"""
+
+import heapq
+import logging
+import random
+import threading
+import time
+
+from .client import is_conditional_check_failure
+
+_LOG = logging.getLogger(__name__)
+
+
+class HeartbeatStats(object):
+    def __init__(self):
+        object.__init__(self)
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.wakeups = 0
+
+
+class HeartbeatAgent(object):
+    """
+    Sends the heartbeats for any number of activities.
+
+    :param client: WhimbrelClient
+    :param interval: default seconds between heartbeats.
+    :param jitter: fraction (0 to 1) of the interval that each heartbeat may
+        be sent early by.
+    :param coalesce: seconds; heartbeats due within this long of the first
+        due one are sent in the same pass.
+    :param on_drop: function called with (activity_exec_id, workflow_exec_id)
+        when an activity is dropped because its heartbeat was refused.
+    """
+    def __init__(self, client, interval=30, jitter=0.1, coalesce=1.0, on_drop=None,
+                 clock=time.time, rand=random.random):
+        object.__init__(self)
+        assert interval > 0
+        assert 0 <= jitter < 1
+        self.__client = client
+        self.__interval = interval
+        self.__jitter = jitter
+        self.__coalesce = coalesce
+        self.__on_drop = on_drop
+        self.__clock = clock
+        self.__rand = rand
+        self.__condition = threading.Condition()
+        # (due time, sequence, key); entries whose sequence no longer
+        # matches the registration are stale and skipped.
+        self.__heap = []
+        self.__registered = {}
+        self.__sequence = 0
+        self.__thread = None
+        self.__stopping = False
+        self.stats = HeartbeatStats()
+
+    def __len__(self):
+        with self.__condition:
+            return len(self.__registered)
+
+    def register(self, activity_exec_id, workflow_exec_id, interval=None):
+        """
+        Start sending heartbeats for the activity.  The first one is sent at
+        a random time within the interval.
+        """
+        interval = interval or self.__interval
+        key = (activity_exec_id, workflow_exec_id)
+        with self.__condition:
+            due = self.__clock() + interval * self.__rand()
+            self._schedule(key, interval, due)
+            self.__condition.notify()
+
+    def unregister(self, activity_exec_id, workflow_exec_id):
+        """
+        Stop sending heartbeats for the activity.
+
+        :return: True if the activity was registered.
+        """
+        with self.__condition:
+            return self.__registered.pop((activity_exec_id, workflow_exec_id), None) is not None
+
+    def is_registered(self, activity_exec_id, workflow_exec_id):
+        with self.__condition:
+            return (activity_exec_id, workflow_exec_id) in self.__registered
+
+    def next_due(self):
+        """
+        :return: the time the next heartbeat is due, or None if there are none.
+        """
+        with self.__condition:
+            self._discard_stale()
+            if len(self.__heap) <= 0:
+                return None
+            return self.__heap[0][0]
+
+    def seconds_until_due(self):
+        """
+        :return: seconds until the next heartbeat is due (zero if one is
+            overdue), or None if there are none.
+        """
+        due = self.next_due()
+        if due is None:
+            return None
+        return max(0.0, due - self.__clock())
+
+    def take_due(self, now=None):
+        """
+        Remove the heartbeats that are due (within the coalescing window) and
+        schedule their next ones.
+
+        :return: list of (activity_exec_id, workflow_exec_id) to send.
+        """
+        if now is None:
+            now = self.__clock()
+        ret = []
+        with self.__condition:
+            self._discard_stale()
+            if len(self.__heap) <= 0 or self.__heap[0][0] > now:
+                return ret
+            limit = now + self.__coalesce
+            while len(self.__heap) > 0 and self.__heap[0][0] <= limit:
+                due, sequence, key = heapq.heappop(self.__heap)
+                registration = self.__registered.get(key)
+                if registration is None or registration[1] != sequence:
+                    continue
+                ret.append(key)
+                # A late heartbeat is only sent once; the next one is
+                # counted from now, not from when this one was due.
+                interval = registration[0]
+                self._schedule(key, interval, max(due, now) + interval * (1.0 - self.__jitter * self.__rand()))
+        return ret
+
+    def send(self, keys):
+        """
+        Send the heartbeats, dropping the activities whose heartbeat is
+        refused.
+        """
+        when_epoch = int(self.__clock())
+        db = self.__client.db
+        for key in keys:
+            try:
+                db.update_item(**self.__client.heartbeat_request(key[0], key[1], when_epoch))
+                self.stats.sent += 1
+            except Exception as e:
+                if is_conditional_check_failure(e):
+                    self._drop(key)
+                else:
+                    # Try again at the next heartbeat.
+                    self.stats.failed += 1
+                    _LOG.warning("heartbeat for %s failed: %s", key[0], e)
+
+    def run_pending(self, now=None):
+        """
+        Send all the heartbeats that are due.
+
+        :return: number of heartbeats sent.
+        """
+        keys = self.take_due(now)
+        if len(keys) > 0:
+            self.stats.wakeups += 1
+            self.send(keys)
+        return len(keys)
+
+    def start(self):
+        """
+        Run the agent in a background daemon thread.
+        """
+        with self.__condition:
+            if self.__thread is not None:
+                return
+            self.__stopping = False
+            self.__thread = threading.Thread(target=self._run, name="whimbrel-heartbeat")
+            self.__thread.daemon = True
+            self.__thread.start()
+
+    def stop(self, timeout=None):
+        """
+        Stop the background thread.  The registrations are kept.
+        """
+        with self.__condition:
+            thread = self.__thread
+            self.__stopping = True
+            self.__condition.notify()
+        if thread is not None:
+            thread.join(timeout)
+        with self.__condition:
+            self.__thread = None
+
+    def _run(self):
+        while True:
+            with self.__condition:
+                if self.__stopping:
+                    return
+                due = self.next_due()
+                now = self.__clock()
+                if due is None:
+                    self.__condition.wait()
+                    continue
+                if due > now:
+                    self.__condition.wait(due - now)
+                    continue
+            self.run_pending()
+
+    def _schedule(self, key, interval, due):
+        self.__sequence += 1
+        self.__registered[key] = (interval, self.__sequence)
+        heapq.heappush(self.__heap, (due, self.__sequence, key))
+
+    def _discard_stale(self):
+        while len(self.__heap) > 0:
+            due, sequence, key = self.__heap[0]
+            registration = self.__registered.get(key)
+            if registration is not None and registration[1] == sequence:
+                return
+            heapq.heappop(self.__heap)
+
+    def _drop(self, key):
+        with self.__condition:
+            dropped = self.__registered.pop(key, None) is not None
+        if dropped:
+            self.stats.dropped += 1
+            if self.__on_drop is not None:
+                self.__on_drop(key[0], key[1])
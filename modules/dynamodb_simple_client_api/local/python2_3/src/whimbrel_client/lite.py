@@ -0,0 +1,427 @@
+"""
+A small DynamoDB client that needs only the Python standard library.
+
+Importing boto3 and loading its service models takes far longer than the
+single request each command line script makes.  `LiteDbClient` speaks the
+DynamoDB JSON protocol directly, signing each request with Signature
+Version 4, the same way `docker/src/core_aws_request.sh` does, but without
+running openssl.  It has the low-level client methods Whimbrel uses, with
+the same arguments and responses as boto3, so it can be passed to
+`WhimbrelClient` as the `db`.
+
+The derived signing key only changes with the date, so it is cached per
+day, and the HTTP connections are kept open between requests.  Binary
+(`B` and `BS`) attribute values are passed as bytes, and base64 encoded on
+the wire, as with boto3.
+
+Credentials come from the explicit arguments, then the standard AWS
+environment variables, then the container credentials endpoint (ECS task
+roles), then the shared credentials file.  `find_credentials` returns None
+when none of those has any, so the caller can fall back to boto3 (which
+also knows about instance profiles, SSO and the rest).
+"""
+
+import base64
+import calendar
+import hashlib
+import hmac
+import json
+import os
+import random
+import threading
+import time
+
+try:
+    # Python 3
+    import http.client as httplib
+    from urllib.parse import urlparse
+    from configparser import RawConfigParser
+except ImportError:
+    # Python 2
+    import httplib
+    from urlparse import urlparse
+    from ConfigParser import RawConfigParser
+
+from .client import error_code
+
+SERVICE = 'dynamodb'
+TARGET_PREFIX = 'DynamoDB_20120810.'
+CONTENT_TYPE = 'application/x-amz-json-1.0'
+USER_AGENT = 'whimbrel-lite/1.0'
+CONTAINER_CREDENTIALS_HOST = '169.254.170.2'
+
+RETRY_ERRORS = (
+    'ProvisionedThroughputExceededException', 'ThrottlingException', 'RequestLimitExceeded',
+    'InternalServerError', 'ServiceUnavailable'
+)
+
+# boto3 method name -> DynamoDB operation.
+OPERATIONS = {
+    'batch_get_item': 'BatchGetItem',
+    'batch_write_item': 'BatchWriteItem',
+    'delete_item': 'DeleteItem',
+    'describe_table': 'DescribeTable',
+    'get_item': 'GetItem',
+    'put_item': 'PutItem',
+    'query': 'Query',
+    'scan': 'Scan',
+    'update_item': 'UpdateItem'
+}
+
+
+class LiteClientError(Exception):
+    """
+    An error response from DynamoDB.  Like botocore's ClientError, the
+    `response` has the `Error` `Code` and `Message`, so
+    `whimbrel_client.error_code` works with either client.
+    """
+    def __init__(self, operation, status, code, message):
+        Exception.__init__(self, "An error occurred ({0}) when calling the {1} operation: {2}".format(
+            code, operation, message))
+        self.operation_name = operation
+        self.response = {
+            'Error': {'Code': code, 'Message': message},
+            'ResponseMetadata': {'HTTPStatusCode': status}
+        }
+
+
+class Credentials(object):
+    def __init__(self, access_key, secret_key, session_token=None, expiration=None):
+        object.__init__(self)
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.session_token = session_token
+        self.expiration = expiration
+
+
+class SigV4Signer(object):
+    """
+    Signs requests with AWS Signature Version 4.  The signing key is
+    derived once per day (and credentials).
+
+    :param region: AWS region name.
+    :param service: AWS service name.
+    """
+    def __init__(self, region, service=SERVICE):
+        object.__init__(self)
+        self.__region = region
+        self.__service = service
+        self.__lock = threading.Lock()
+        self.__key_id = None
+        self.__key = None
+
+    def signing_key(self, secret_key, date_scope):
+        key_id = (secret_key, date_scope)
+        with self.__lock:
+            if self.__key_id != key_id:
+                key = _hmac(('AWS4' + secret_key).encode('utf-8'), date_scope)
+                key = _hmac(key, self.__region)
+                key = _hmac(key, self.__service)
+                self.__key = _hmac(key, 'aws4_request')
+                self.__key_id = key_id
+            return self.__key
+
+    def headers(self, credentials, host, target, body, when_epoch):
+        """
+        The headers for a POST to `/` with the JSON body, including the
+        Authorization header.
+        """
+        amz_date = time.strftime('%Y%m%dT%H%M%SZ', time.gmtime(when_epoch))
+        date_scope = amz_date[:8]
+        scope = '{0}/{1}/{2}/aws4_request'.format(date_scope, self.__region, self.__service)
+        headers = {
+            'content-type': CONTENT_TYPE,
+            'host': host,
+            'x-amz-date': amz_date,
+            'x-amz-target': target
+        }
+        if credentials.session_token:
+            headers['x-amz-security-token'] = credentials.session_token
+        names = sorted(headers.keys())
+        signed_headers = ';'.join(names)
+        canonical_request = '\n'.join([
+            'POST',
+            '/',
+            '',
+            ''.join('{0}:{1}\n'.format(name, headers[name]) for name in names),
+            signed_headers,
+            hashlib.sha256(body).hexdigest()
+        ])
+        string_to_sign = '\n'.join([
+            'AWS4-HMAC-SHA256',
+            amz_date,
+            scope,
+            hashlib.sha256(canonical_request.encode('utf-8')).hexdigest()
+        ])
+        signature = hmac.new(
+            self.signing_key(credentials.secret_key, date_scope), string_to_sign.encode('utf-8'),
+            hashlib.sha256).hexdigest()
+        headers['authorization'] = 'AWS4-HMAC-SHA256 Credential={0}/{1}, SignedHeaders={2}, Signature={3}'.format(
+            credentials.access_key, scope, signed_headers, signature)
+        return headers
+
+
+class LiteDbClient(object):
+    """
+    DynamoDB client with the boto3 low-level client methods that Whimbrel
+    uses.  It is thread safe; the threads share a pool of kept-alive
+    connections.
+
+    :param credentials: CredentialSource; see `find_credentials`.
+    :param region: AWS region name.
+    :param endpoint_url: endpoint, such as `http://localhost:8000` for a
+        local DynamoDB; defaults to the regional HTTPS endpoint.
+    :param max_attempts: total attempts for throttled or failed requests.
+    :param max_idle: most idle connections kept open.
+    """
+    def __init__(self, credentials, region, endpoint_url=None, timeout=30, max_attempts=3, max_idle=10,
+                 clock=time.time, sleep=time.sleep):
+        object.__init__(self)
+        url = urlparse(endpoint_url or 'https://dynamodb.{0}.amazonaws.com'.format(region))
+        self.__secure = url.scheme == 'https'
+        self.__host = url.netloc
+        self.__credentials = credentials
+        self.__signer = SigV4Signer(region)
+        self.__timeout = timeout
+        self.__max_attempts = max_attempts
+        self.__clock = clock
+        self.__sleep = sleep
+        self.__max_idle = max_idle
+        self.__lock = threading.Lock()
+        self.__idle = []
+
+    def __getattr__(self, name):
+        if name not in OPERATIONS:
+            raise AttributeError(name)
+        operation = OPERATIONS[name]
+
+        def call(**kwargs):
+            return self.call(operation, kwargs)
+        return call
+
+    def call(self, operation, params):
+        """
+        Send one DynamoDB request.
+
+        :return: the decoded JSON response.
+        """
+        body = encode_request(params)
+        attempt = 0
+        while True:
+            attempt += 1
+            status, data = self._post(operation, body)
+            if status == 200:
+                return decode_response(data)
+            error = parse_error(operation, status, data)
+            if attempt >= self.__max_attempts or (status < 500 and error_code(error) not in RETRY_ERRORS):
+                raise error
+            delay = min(2.0, 0.05 * (2 ** attempt))
+            self.__sleep(delay / 2.0 + delay * random.random() / 2.0)
+
+    def close(self):
+        """
+        Close the idle connections.
+        """
+        with self.__lock:
+            idle = self.__idle
+            self.__idle = []
+        for connection in idle:
+            connection.close()
+
+    def _post(self, operation, body):
+        credentials = self.__credentials.current()
+        headers = self.__signer.headers(
+            credentials, self.__host, TARGET_PREFIX + operation, body, self.__clock())
+        headers['user-agent'] = USER_AGENT
+        headers['content-length'] = str(len(body))
+        while True:
+            with self.__lock:
+                connection = len(self.__idle) > 0 and self.__idle.pop() or None
+            if connection is None:
+                break
+            try:
+                return self._send(connection, body, headers)
+            except (httplib.HTTPException, IOError, OSError):
+                # The server closed the kept-alive connection; try the next.
+                connection.close()
+        if self.__secure:
+            connection = httplib.HTTPSConnection(self.__host, timeout=self.__timeout)
+        else:
+            connection = httplib.HTTPConnection(self.__host, timeout=self.__timeout)
+        try:
+            return self._send(connection, body, headers)
+        except Exception:
+            connection.close()
+            raise
+
+    def _send(self, connection, body, headers):
+        connection.request('POST', '/', body, headers)
+        response = connection.getresponse()
+        data = response.read()
+        if response.getheader('connection', '').lower() == 'close':
+            connection.close()
+        else:
+            with self.__lock:
+                if len(self.__idle) < self.__max_idle:
+                    self.__idle.append(connection)
+                    connection = None
+            if connection is not None:
+                connection.close()
+        return response.status, data
+
+
+class CredentialSource(object):
+    """
+    Credentials that may expire, and are loaded again before they do.
+    """
+    def __init__(self, loader, clock=time.time):
+        object.__init__(self)
+        self.__loader = loader
+        self.__clock = clock
+        self.__lock = threading.Lock()
+        self.__credentials = None
+
+    def current(self):
+        with self.__lock:
+            credentials = self.__credentials
+            if credentials is None or (
+                    credentials.expiration is not None and credentials.expiration - self.__clock() < 300):
+                credentials = self.__loader()
+                if credentials is None:
+                    raise LiteClientError('Credentials', 0, 'NoCredentials', 'no AWS credentials found')
+                self.__credentials = credentials
+            return credentials
+
+
+def find_credentials(aws_args=None, environ=None):
+    """
+    The credentials source for the boto3-style session arguments, or None
+    if no credentials can be found without boto3.
+    """
+    aws_args = aws_args or {}
+    environ = environ is None and os.environ or environ
+    if aws_args.get('aws_access_key_id') and aws_args.get('aws_secret_access_key'):
+        credentials = Credentials(
+            aws_args['aws_access_key_id'], aws_args['aws_secret_access_key'], aws_args.get('aws_session_token'))
+        return CredentialSource(lambda: credentials)
+    profile = aws_args.get('profile_name') or environ.get('AWS_PROFILE')
+    if not profile and environ.get('AWS_ACCESS_KEY_ID') and environ.get('AWS_SECRET_ACCESS_KEY'):
+        credentials = Credentials(
+            environ['AWS_ACCESS_KEY_ID'], environ['AWS_SECRET_ACCESS_KEY'], environ.get('AWS_SESSION_TOKEN'))
+        return CredentialSource(lambda: credentials)
+    if not profile and environ.get('AWS_CONTAINER_CREDENTIALS_RELATIVE_URI'):
+        uri = environ['AWS_CONTAINER_CREDENTIALS_RELATIVE_URI']
+        return CredentialSource(lambda: _container_credentials(uri))
+    credentials = _file_credentials(
+        environ.get('AWS_SHARED_CREDENTIALS_FILE') or os.path.expanduser(os.path.join('~', '.aws', 'credentials')),
+        profile or 'default')
+    if credentials is None:
+        return None
+    return CredentialSource(lambda: credentials)
+
+
+def find_region(aws_args=None, environ=None):
+    aws_args = aws_args or {}
+    environ = environ is None and os.environ or environ
+    return aws_args.get('region_name') or environ.get('AWS_REGION') or environ.get('AWS_DEFAULT_REGION')
+
+
+def create_lite_client(aws_args=None, dynamodb_args=None):
+    """
+    A LiteDbClient for the boto3-style session and client arguments, or
+    None if the credentials or region can't be found without boto3.
+    """
+    credentials = find_credentials(aws_args)
+    region = find_region(aws_args)
+    if credentials is None or region is None:
+        return None
+    dynamodb_args = dynamodb_args or {}
+    return LiteDbClient(credentials, region, endpoint_url=dynamodb_args.get('endpoint_url'))
+
+
+def encode_request(params):
+    """
+    The JSON request body for the boto3-style parameters, with the binary
+    attribute values base64 encoded.
+    """
+    if bytes is str:
+        # Python 2 has no separate bytes type, so the binary values are
+        # found by their type key instead.
+        params = _map_binary(params, (str, bytearray), bytearray)
+    return json.dumps(params, default=_json_default).encode('utf-8')
+
+
+def decode_response(data):
+    """
+    The boto3-style response for the JSON response body, with the binary
+    attribute values decoded to bytes.
+    """
+    return _map_binary(json.loads(data.decode('utf-8')), type(u''), base64.b64decode)
+
+
+def _map_binary(value, value_type, convert):
+    # Binary attribute values are the only single key dictionaries keyed on
+    # 'B' with a string, or on 'BS' with a list of strings.
+    if isinstance(value, dict):
+        if len(value) == 1:
+            if isinstance(value.get('B'), value_type):
+                return {'B': convert(value['B'])}
+            if isinstance(value.get('BS'), list) and all(isinstance(v, value_type) for v in value['BS']):
+                return {'BS': [convert(v) for v in value['BS']]}
+        return dict((k, _map_binary(v, value_type, convert)) for k, v in value.items())
+    if isinstance(value, list):
+        return [_map_binary(v, value_type, convert) for v in value]
+    return value
+
+
+def _json_default(value):
+    if isinstance(value, (bytes, bytearray)):
+        return base64.b64encode(bytes(value)).decode('ascii')
+    raise TypeError("{0!r} is not JSON serializable".format(value))
+
+
+def _hmac(key, msg):
+    return hmac.new(key, msg.encode('utf-8'), hashlib.sha256).digest()
+
+
+def parse_error(operation, status, data):
+    code = 'HTTP{0}'.format(status)
+    message = ''
+    try:
+        error = json.loads(data.decode('utf-8'))
+        # "com.amazonaws.dynamodb.v20120810#ConditionalCheckFailedException"
+        code = error.get('__type', code).split('#')[-1]
+        message = error.get('message') or error.get('Message') or ''
+    except ValueError:
+        message = data.decode('utf-8', 'replace')
+    return LiteClientError(operation, status, code, message)
+
+
+def _container_credentials(uri):
+    connection = httplib.HTTPConnection(CONTAINER_CREDENTIALS_HOST, timeout=5)
+    try:
+        connection.request('GET', uri)
+        response = connection.getresponse()
+        data = json.loads(response.read().decode('utf-8'))
+    finally:
+        connection.close()
+    # "2017-05-04T19:40:43Z"
+    expiration = calendar.timegm(time.strptime(data['Expiration'], '%Y-%m-%dT%H:%M:%SZ'))
+    return Credentials(data['AccessKeyId'], data['SecretAccessKey'], data.get('Token'), expiration)
+
+
+def _file_credentials(filename, profile):
+    if not os.path.isfile(filename):
+        return None
+    parser = RawConfigParser()
+    parser.read(filename)
+    if not parser.has_section(profile):
+        return None
+    if not parser.has_option(profile, 'aws_access_key_id') or not parser.has_option(
+            profile, 'aws_secret_access_key'):
+        return None
+    token = None
+    if parser.has_option(profile, 'aws_session_token'):
+        token = parser.get(profile, 'aws_session_token')
+    return Credentials(
+        parser.get(profile, 'aws_access_key_id'), parser.get(profile, 'aws_secret_access_key'), token)
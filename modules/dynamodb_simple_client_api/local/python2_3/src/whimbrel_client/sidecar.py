@@ -0,0 +1,130 @@
+"""
+A client sidecar daemon.
+
+Shell and container activities that report many events pay for a new
+process, and a new TLS connection, per event.  The sidecar instead runs
+once, next to them, and listens on a Unix socket.  Each caller writes one
+command per line, and reads one reply line per command:
+
+* `transition (activity exec ID) (transition) [source]` - queue an
+  activity transition; replies `OK (activity event ID)`.  The transitions
+  are written in batches (see `EventWriter`).
+* `heartbeat (activity exec ID) (workflow exec ID)` - replies `OK`, or
+  `REFUSED` if the activity does not have heartbeats enabled.
+* `request (workflow) [workflow version]` - request a workflow execution;
+  replies `OK (workflow request ID)`.
+* `flush` - replies `OK` once every queued transition is written.
+* `stats` - replies `OK` and the event writer counters.
+* `ping` - replies `OK`.
+
+Any failure replies `ERROR (message)`.  A caller may keep its connection
+open for many commands, or send a single command and close its side.
+"""
+
+import logging
+import os
+
+try:
+    # Python 3
+    import socketserver
+except ImportError:
+    # Python 2
+    import SocketServer as socketserver
+
+from .events import EventWriter
+
+_LOG = logging.getLogger(__name__)
+
+
+class Sidecar(object):
+    """
+    Runs the commands for the sidecar connections.
+
+    :param client: WhimbrelClient
+    :param events: EventWriter for the transitions; by default, one with
+        a background thread.
+    """
+    def __init__(self, client, events=None):
+        object.__init__(self)
+        self.__client = client
+        self.__events = events or EventWriter(client)
+        self.__server = None
+
+    def execute(self, line):
+        """
+        Run one command line.
+
+        :return: the reply line, without the newline.
+        """
+        words = line.split()
+        if len(words) <= 0:
+            return 'ERROR empty command'
+        command = words[0].lower()
+        args = words[1:]
+        try:
+            if command == 'transition' and len(args) >= 2:
+                source = len(args) > 2 and ' '.join(args[2:]) or None
+                return 'OK ' + self.__events.add(args[0], args[1], source)
+            if command == 'heartbeat' and len(args) == 2:
+                return self.__client.heartbeat(args[0], args[1]) and 'OK' or 'REFUSED'
+            if command == 'request' and 1 <= len(args) <= 2:
+                version = len(args) > 1 and args[1] or None
+                return 'OK ' + self.__client.request_workflow(args[0], workflow_version=version)
+            if command == 'flush' and len(args) == 0:
+                self.__events.flush()
+                return 'OK'
+            if command == 'stats' and len(args) == 0:
+                stats = self.__events.stats
+                return 'OK queued={0} written={1} requests={2} retries={3} throttles={4}'.format(
+                    stats.queued, stats.written, stats.requests, stats.retries, stats.throttles)
+            if command == 'ping' and len(args) == 0:
+                return 'OK'
+        except Exception as e:
+            _LOG.warning("sidecar command %s failed: %s", command, e)
+            return 'ERROR ' + ' '.join(str(e).split())
+        return 'ERROR bad command: ' + ' '.join(words)
+
+    def serve(self, socket_path, mode=0o660):
+        """
+        Listen on the Unix socket until `shutdown` is called (or the
+        process is interrupted), then write the queued transitions.
+
+        :param socket_path: socket file; a stale one is replaced.
+        :param mode: permissions of the socket file.
+        """
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        self.__server = _SidecarServer(socket_path, self)
+        try:
+            os.chmod(socket_path, mode)
+            self.__server.serve_forever()
+        finally:
+            self.__server.server_close()
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+            self.__events.close()
+
+    def shutdown(self):
+        """
+        Stop `serve`; call this from another thread.
+        """
+        if self.__server is not None:
+            self.__server.shutdown()
+
+
+class _SidecarServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, sidecar):
+        socketserver.UnixStreamServer.__init__(self, socket_path, _SidecarHandler)
+        self.sidecar = sidecar
+
+
+class _SidecarHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if len(line) <= 0:
+                return
+            reply = self.server.sidecar.execute(line.decode('utf-8', 'replace'))
+            self.wfile.write((reply + '\n').encode('utf-8'))
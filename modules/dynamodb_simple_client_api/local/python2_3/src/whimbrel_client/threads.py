@@ -0,0 +1,40 @@
+"""
+Spreading work over a few threads, for the services that update many items
+at once.
+"""
+
+import threading
+
+
+def split(items, parts):
+    """
+    Split the items into at most `parts` lists of about the same size.
+    """
+    return [chunk for chunk in [items[i::parts] for i in range(parts)] if len(chunk) > 0]
+
+
+def in_threads(target, chunks):
+    """
+    Call the target with each chunk, each on its own thread, and wait for
+    them all.  The first error raised is raised again.
+    """
+    if len(chunks) <= 0:
+        return
+    errors = []
+
+    def run(chunk):
+        try:
+            target(chunk)
+        except Exception as e:
+            errors.append(e)
+
+    if len(chunks) == 1:
+        run(chunks[0])
+    else:
+        threads = [threading.Thread(target=run, args=(chunk,)) for chunk in chunks]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    if len(errors) > 0:
+        raise errors[0]
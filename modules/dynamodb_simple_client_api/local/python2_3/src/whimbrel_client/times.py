@@ -0,0 +1,235 @@
+"""
+The time attributes of the items, and the compact item format.
+
+Each time (`when` on the requests and events, `start_time` on the
+workflows, `queue_time`, `start_time` and `end_time` on the activities)
+has always been written twice: `(name)_epoch`, the epoch seconds that the
+indexes and conditions use, and `(name)`, the same time as a
+`[ year, month, day, hour, minute, second ]` list in UTC.  The list adds
+about 25 bytes per time to every item, its stream records and its reads.
+
+Items in `COMPACT_FORMAT` carry only the `_epoch` attributes, and an
+`item_format` attribute of 2; items without `item_format` are in
+`FULL_FORMAT`.  The readers here accept both, attribute by attribute, so
+the writers can move to the compact format while older items (and items
+from older writers) are still in the tables:
+
+* `item_epoch` is the time in epoch seconds, from the `_epoch` attribute,
+  or else from the list.
+* `item_time_list` is the list form, from the list, or else derived from
+  the `_epoch` attribute.
+
+`epochs_to_lists` and `lists_to_epochs` convert many times at once, for
+exporters and monitors that handle pages of items; `expand_items` and
+`compact_items` convert whole items between the formats.
+"""
+
+import calendar
+import time
+
+FULL_FORMAT = 1
+COMPACT_FORMAT = 2
+ITEM_FORMATS = (FULL_FORMAT, COMPACT_FORMAT)
+
+ITEM_FORMAT_ATTRIBUTE = 'item_format'
+
+# table name, without the prefix -> names of its time attributes
+TIME_ATTRIBUTES = {
+    'workflow_request': ('when',),
+    'activity_event': ('when',),
+    'workflow_exec': ('start_time',),
+    'activity_exec': ('queue_time', 'start_time', 'end_time')
+}
+
+SECONDS_PER_DAY = 86400
+
+# The time of day parts, as DynamoDB number strings.
+_NUMBER_STRINGS = tuple(str(n) for n in range(60))
+
+
+def when_list(when_epoch):
+    """
+    The `[ year, month, day, hour, minute, second ]` list form of the epoch
+    time, in UTC.
+    """
+    when_gm = time.gmtime(when_epoch)
+    return [
+        {"N": str(when_gm.tm_year)},
+        {"N": str(when_gm.tm_mon)},
+        {"N": str(when_gm.tm_mday)},
+        {"N": str(when_gm.tm_hour)},
+        {"N": str(when_gm.tm_min)},
+        {"N": str(when_gm.tm_sec)}
+    ]
+
+
+def time_attributes(name, when_epoch, item_format=FULL_FORMAT):
+    """
+    The attributes that record a time in a new item.
+
+    :param name: time attribute name, without `_epoch`.
+    """
+    ret = {name + '_epoch': {"N": str(when_epoch)}}
+    if item_format == FULL_FORMAT:
+        ret[name] = {"L": when_list(when_epoch)}
+    return ret
+
+
+def format_attributes(item_format):
+    """
+    The attributes that mark a new item's format; none for the full format,
+    so its items stay as they always were.
+    """
+    if item_format == FULL_FORMAT:
+        return {}
+    return {ITEM_FORMAT_ATTRIBUTE: {"N": str(item_format)}}
+
+
+def item_format(item):
+    """
+    :return: the format the item was written in.
+    """
+    value = item.get(ITEM_FORMAT_ATTRIBUTE)
+    if value is None:
+        return FULL_FORMAT
+    return int(value['N'])
+
+
+def item_epoch(item, name):
+    """
+    The time from the item, in either format.
+
+    :param name: time attribute name, without `_epoch`.
+    :return: the epoch seconds, or None if the item doesn't have the time.
+        Times that aren't set yet are negative, as they are stored.
+    """
+    value = item.get(name + '_epoch')
+    if value is not None:
+        return int(value['N'])
+    value = item.get(name)
+    if value is not None:
+        return lists_to_epochs([value['L']])[0]
+    return None
+
+
+def item_time_list(item, name):
+    """
+    The `[ year, month, day, hour, minute, second ]` list of ints for the
+    time, from the item in either format.
+
+    :return: the list, or None if the item doesn't have the time (or it
+        isn't set yet).
+    """
+    value = item.get(name)
+    if value is not None:
+        return [int(part['N']) for part in value['L']]
+    value = item.get(name + '_epoch')
+    if value is None or int(value['N']) < 0:
+        return None
+    return epochs_to_lists([int(value['N'])])[0]
+
+
+def epochs_to_lists(epochs):
+    """
+    The `[ year, month, day, hour, minute, second ]` lists of ints for
+    the epoch times, in UTC.  The date is worked out once per day, so a
+    page of times from the same few days costs little more than the
+    arithmetic for their times of day.
+    """
+    dates = {}
+    ret = []
+    for epoch in epochs:
+        days, seconds = divmod(int(epoch), SECONDS_PER_DAY)
+        date = dates.get(days)
+        if date is None:
+            date = dates[days] = tuple(time.gmtime(days * SECONDS_PER_DAY)[0:3])
+        minutes, second = divmod(seconds, 60)
+        hour, minute = divmod(minutes, 60)
+        ret.append([date[0], date[1], date[2], hour, minute, second])
+    return ret
+
+
+def epochs_to_values(epochs):
+    """
+    The DynamoDB list values (as `when_list` makes them) for the epoch
+    times.
+    """
+    dates = {}
+    ret = []
+    for epoch in epochs:
+        days, seconds = divmod(int(epoch), SECONDS_PER_DAY)
+        date = dates.get(days)
+        if date is None:
+            date = dates[days] = tuple(str(part) for part in time.gmtime(days * SECONDS_PER_DAY)[0:3])
+        minutes, second = divmod(seconds, 60)
+        hour, minute = divmod(minutes, 60)
+        ret.append([
+            {"N": date[0]},
+            {"N": date[1]},
+            {"N": date[2]},
+            {"N": _NUMBER_STRINGS[hour]},
+            {"N": _NUMBER_STRINGS[minute]},
+            {"N": _NUMBER_STRINGS[second]}
+        ])
+    return ret
+
+
+def lists_to_epochs(lists):
+    """
+    The epoch times for the `[ year, month, day, hour, minute, second ]`
+    lists, in UTC.  Each list can hold ints, or DynamoDB number values.
+    """
+    days = {}
+    ret = []
+    for parts in lists:
+        if len(parts) > 0 and isinstance(parts[0], dict):
+            parts = [int(part['N']) for part in parts]
+        date = (parts[0], parts[1], parts[2])
+        day_start = days.get(date)
+        if day_start is None:
+            day_start = days[date] = calendar.timegm((parts[0], parts[1], parts[2], 0, 0, 0))
+        ret.append(day_start + parts[3] * 3600 + parts[4] * 60 + parts[5])
+    return ret
+
+
+def expand_items(items, names):
+    """
+    Add the list form of each time the items are missing it for, such as
+    for readers that still expect it.  Changes the items in place.
+
+    :param names: time attribute names, such as `TIME_ATTRIBUTES[table]`.
+    :return: the items.
+    """
+    for name in names:
+        missing = []
+        for item in items:
+            if name not in item and name + '_epoch' in item and int(item[name + '_epoch']['N']) >= 0:
+                missing.append(item)
+        values = epochs_to_values([int(item[name + '_epoch']['N']) for item in missing])
+        for item, value in zip(missing, values):
+            item[name] = {"L": value}
+    return items
+
+
+def compact_items(items, names):
+    """
+    Move the items to the compact format: each list is dropped, after
+    setting its `_epoch` attribute from it if that is missing.  Changes the
+    items in place.
+
+    :param names: time attribute names, such as `TIME_ATTRIBUTES[table]`.
+    :return: the items.
+    """
+    for name in names:
+        missing = []
+        for item in items:
+            if name in item and name + '_epoch' not in item:
+                missing.append(item)
+        epochs = lists_to_epochs([item[name]['L'] for item in missing])
+        for item, epoch in zip(missing, epochs):
+            item[name + '_epoch'] = {"N": str(epoch)}
+        for item in items:
+            item.pop(name, None)
+    for item in items:
+        item.update(format_attributes(COMPACT_FORMAT))
+    return items
@@ -0,0 +1,337 @@
+"""
+State transitions for the Full Logic API.
+
+The activity and workflow transition tables from `docs/contract.md` are
+kept as a lookup of (current state, transition) -> new state.  For each
+transition, the DynamoDB update (the `UpdateExpression`,
+`ConditionExpression` and the constant attribute values) is built once,
+when the table is loaded, rather than on every call.
+
+`TransitionEngine.transition` writes blind: it sends the conditional update
+for the states the item is most likely in, without reading it first.  Only
+when the condition fails does it read the item, to find the real state and
+send the update for that state (or report that the transition isn't
+allowed from there).
+"""
+
+import time
+
+from .client import is_conditional_check_failure
+from .times import FULL_FORMAT, COMPACT_FORMAT, ITEM_FORMAT_ATTRIBUTE, when_list
+
+# current state -> {transition: new state}
+ACTIVITY_TRANSITIONS = {
+    'REQUESTED': {'CANCEL': 'CANCELLED', 'READY': 'READY', 'QUEUED': 'QUEUED'},
+    'READY': {'CANCEL': 'CANCELLED', 'QUEUED': 'QUEUED', 'PREPARING': 'PREPARING', 'RUNNING': 'RUNNING'},
+    'QUEUED': {'CANCEL': 'CANCELLED', 'PREPARING': 'PREPARING', 'RUNNING': 'RUNNING', 'FAILED': 'FAILED'},
+    'PREPARING': {'CANCEL': 'CANCELLED', 'RUNNING': 'RUNNING', 'FAILED': 'FAILED'},
+    # TIMEOUT is only for the heartbeat monitor; see docs/architecture.md.
+    'RUNNING': {'CANCEL': 'CANCELLED_RUNNING', 'FAILED': 'FAILED', 'COMPLETED': 'COMPLETED',
+                'TIMEOUT': 'TIMED_OUT'},
+    'CANCELLED': {},
+    'CANCELLED_RUNNING': {},
+    'TIMED_OUT': {},
+    'FAILED': {},
+    'COMPLETED': {}
+}
+
+# Time attributes set on entering the state; the `_epoch` ones are the
+# epoch seconds, the others the `when_list` form, which the compact item
+# format leaves out.
+ACTIVITY_STATE_TIMES = {
+    'QUEUED': ['queue_time', 'queue_time_epoch'],
+    'RUNNING': ['start_time', 'start_time_epoch'],
+    'CANCELLED': ['end_time', 'end_time_epoch'],
+    'CANCELLED_RUNNING': ['end_time', 'end_time_epoch'],
+    'TIMED_OUT': ['end_time', 'end_time_epoch'],
+    'FAILED': ['end_time', 'end_time_epoch'],
+    'COMPLETED': ['end_time', 'end_time_epoch']
+}
+
+# The times for activities with heartbeats enabled: starting to run counts
+# as the first heartbeat.  The others keep a negative heartbeat time, as
+# the heartbeat monitor only looks at the non-negative ones.
+ACTIVITY_HEARTBEAT_STATE_TIMES = dict(ACTIVITY_STATE_TIMES)
+ACTIVITY_HEARTBEAT_STATE_TIMES['RUNNING'] = ACTIVITY_STATE_TIMES['RUNNING'] + ['heartbeat_time_epoch']
+
+WORKFLOW_TRANSITIONS = {
+    'REQUESTED': {'RUNNING': 'RUNNING', 'CANCEL': 'CANCEL_REQUESTED', 'FAILED': 'FAILED'},
+    'RUNNING': {'FAILED_WAITING': 'FAILED_WAITING', 'FAILED': 'FAILED', 'CANCEL': 'CANCEL_REQUESTED',
+                'COMPLETED': 'COMPLETED'},
+    'FAILED_WAITING': {'FAILED': 'FAILED', 'CANCEL': 'CANCEL_REQUESTED'},
+    'CANCEL_REQUESTED': {'CANCELLED': 'CANCELLED'},
+    'FAILED': {},
+    'CANCELLED': {},
+    'COMPLETED': {}
+}
+
+STATE_ATTRIBUTE = 'state'
+
+
+class TransitionNotAllowed(Exception):
+    """
+    The item's current state has no such transition.
+    """
+    def __init__(self, transition, current_state):
+        Exception.__init__(self, "transition {0} is not allowed from state {1}".format(transition, current_state))
+        self.transition = transition
+        self.current_state = current_state
+
+
+class TransitionConflict(Exception):
+    """
+    The item's state kept changing between the reads and the updates.
+    """
+    def __init__(self, transition, attempts):
+        Exception.__init__(self, "transition {0} still conflicted after {1} attempts".format(transition, attempts))
+        self.transition = transition
+        self.attempts = attempts
+
+
+class ItemNotFound(Exception):
+    def __init__(self, table_name, key):
+        Exception.__init__(self, "no item in {0} for {1}".format(table_name, key))
+        self.table_name = table_name
+        self.key = key
+
+
+class CompiledTransition(object):
+    """
+    The update for a transition from any of `from_states` to `to_state`.
+    """
+    def __init__(self, transition, from_states, to_state, time_attributes, item_format=FULL_FORMAT):
+        object.__init__(self)
+        self.transition = transition
+        self.from_states = tuple(from_states)
+        self.to_state = to_state
+        self.names = {'#state': STATE_ATTRIBUTE}
+        self.values = {':to': {'S': to_state}}
+        sets = ['#state = :to']
+        if item_format != FULL_FORMAT:
+            time_attributes = [name for name in time_attributes if name.endswith('_epoch')]
+        for name in time_attributes:
+            sets.append('{0} = {1}'.format(name, name.endswith('_epoch') and ':now' or ':now_list'))
+        self.has_time = len(time_attributes) > 0
+        self.has_list = any(not name.endswith('_epoch') for name in time_attributes)
+        if self.has_time and item_format != FULL_FORMAT:
+            # The item's lists may now be incomplete.
+            sets.append('{0} = :format'.format(ITEM_FORMAT_ATTRIBUTE))
+            self.values[':format'] = {'N': str(item_format)}
+        self.update_expression = 'SET ' + ', '.join(sets)
+        if len(self.from_states) == 1:
+            self.condition_expression = '#state = :from0'
+        else:
+            self.condition_expression = '#state IN ({0})'.format(
+                ', '.join(':from{0}'.format(i) for i in range(len(self.from_states))))
+        for i in range(len(self.from_states)):
+            self.values[':from{0}'.format(i)] = {'S': self.from_states[i]}
+
+    def request(self, table_name, key, when_epoch):
+        """
+        The update_item arguments.
+        """
+        values = self.values
+        if self.has_time:
+            values = dict(values)
+            values[':now'] = {'N': str(when_epoch)}
+            if self.has_list:
+                values[':now_list'] = {'L': when_list(when_epoch)}
+        return {
+            'TableName': table_name,
+            'Key': key,
+            'UpdateExpression': self.update_expression,
+            'ConditionExpression': self.condition_expression,
+            'ExpressionAttributeNames': self.names,
+            'ExpressionAttributeValues': values
+        }
+
+
+class StateMachine(object):
+    """
+    The precomputed transition lookup and updates.
+
+    :param transitions: current state -> {transition: new state}
+    :param state_times: state -> time attributes set on entering it.
+    :param item_format: format of the items updated.
+    """
+    def __init__(self, transitions, state_times=None, item_format=FULL_FORMAT):
+        object.__init__(self)
+        state_times = state_times or {}
+        self.__next = {}
+        # (current state, transition) -> CompiledTransition for just that state
+        self.__exact = {}
+        # transition -> CompiledTransition for the most current states
+        self.__blind = {}
+        by_target = {}
+        for from_state, moves in transitions.items():
+            for transition, to_state in moves.items():
+                self.__next[(from_state, transition)] = to_state
+                self.__exact[(from_state, transition)] = CompiledTransition(
+                    transition, [from_state], to_state, state_times.get(to_state, []), item_format)
+                by_target.setdefault((transition, to_state), []).append(from_state)
+        for (transition, to_state), from_states in by_target.items():
+            if transition not in self.__blind or len(from_states) > len(self.__blind[transition].from_states):
+                self.__blind[transition] = CompiledTransition(
+                    transition, sorted(from_states), to_state, state_times.get(to_state, []), item_format)
+        self.states = frozenset(transitions.keys())
+
+    def next_state(self, current_state, transition):
+        """
+        :return: the new state, or None if the transition isn't allowed.
+        """
+        return self.__next.get((current_state, transition))
+
+    def exact(self, current_state, transition):
+        return self.__exact.get((current_state, transition))
+
+    def blind(self, transition):
+        """
+        The update to try before knowing the current state; None if no
+        state has the transition.
+        """
+        return self.__blind.get(transition)
+
+
+ACTIVITY_STATES = StateMachine(ACTIVITY_TRANSITIONS, ACTIVITY_STATE_TIMES)
+WORKFLOW_STATES = StateMachine(WORKFLOW_TRANSITIONS)
+
+# item format -> StateMachine
+ACTIVITY_STATES_BY_FORMAT = {
+    FULL_FORMAT: ACTIVITY_STATES,
+    COMPACT_FORMAT: StateMachine(ACTIVITY_TRANSITIONS, ACTIVITY_STATE_TIMES, COMPACT_FORMAT)
+}
+
+# item format -> StateMachine, for the activities with heartbeats enabled
+ACTIVITY_HEARTBEAT_STATES_BY_FORMAT = {
+    FULL_FORMAT: StateMachine(ACTIVITY_TRANSITIONS, ACTIVITY_HEARTBEAT_STATE_TIMES),
+    COMPACT_FORMAT: StateMachine(ACTIVITY_TRANSITIONS, ACTIVITY_HEARTBEAT_STATE_TIMES, COMPACT_FORMAT)
+}
+
+
+class TransitionStats(object):
+    def __init__(self):
+        object.__init__(self)
+        self.transitions = 0
+        self.blind_hits = 0
+        self.reads = 0
+        self.conflicts = 0
+
+
+class TransitionEngine(object):
+    """
+    Runs transitions on one table's items.
+
+    :param db: DynamoDB low-level client.
+    :param table_name: full table name.
+    :param machine: StateMachine
+    :param max_attempts: number of conditional updates to try before
+        giving up when the state keeps changing underneath.
+    """
+    def __init__(self, db, table_name, machine, max_attempts=4, clock=time.time):
+        object.__init__(self)
+        self.__db = db
+        self.__table_name = table_name
+        self.__machine = machine
+        self.__max_attempts = max_attempts
+        self.__clock = clock
+        self.stats = TransitionStats()
+
+    def transition(self, key, transition, expected_state=None, machine=None):
+        """
+        Move the item to the state the transition leads to from its current
+        state.
+
+        :param key: the item's DynamoDB key.
+        :param expected_state: the state the caller believes the item is
+            in, if it knows; the first update assumes it.
+        :param machine: StateMachine to use for this item, in place of the
+            engine's.
+        :return: (the old state, the new state)
+        :raise TransitionNotAllowed: the current state has no such
+            transition.
+        :raise TransitionConflict: the state kept changing.
+        """
+        machine = machine or self.__machine
+        compiled = None
+        if expected_state is not None:
+            compiled = machine.exact(expected_state, transition)
+        if compiled is None:
+            compiled = machine.blind(transition)
+        if compiled is None:
+            raise TransitionNotAllowed(transition, expected_state)
+        self.stats.transitions += 1
+        attempt = 0
+        while True:
+            attempt += 1
+            request = compiled.request(self.__table_name, key, int(self.__clock()))
+            request['ReturnValues'] = 'UPDATED_OLD'
+            try:
+                response = self.__db.update_item(**request)
+            except Exception as e:
+                if not is_conditional_check_failure(e):
+                    raise
+                response = None
+            if response is not None:
+                if attempt == 1:
+                    self.stats.blind_hits += 1
+                old_state = response.get('Attributes', {}).get(STATE_ATTRIBUTE, {}).get('S')
+                return old_state or compiled.from_states[0], compiled.to_state
+            if attempt >= self.__max_attempts:
+                raise TransitionConflict(transition, attempt)
+            if attempt > 1:
+                self.stats.conflicts += 1
+            current_state = self.current_state(key)
+            compiled = machine.exact(current_state, transition)
+            if compiled is None:
+                raise TransitionNotAllowed(transition, current_state)
+
+    def current_state(self, key):
+        self.stats.reads += 1
+        response = self.__db.get_item(
+            TableName=self.__table_name, Key=key, ConsistentRead=True,
+            ProjectionExpression='#state', ExpressionAttributeNames={'#state': STATE_ATTRIBUTE})
+        item = response.get('Item')
+        if item is None:
+            raise ItemNotFound(self.__table_name, key)
+        return item.get(STATE_ATTRIBUTE, {}).get('S')
+
+
+class ActivityTransitionEngine(TransitionEngine):
+    """
+    Transitions for the activity_exec table.
+
+    :param client: WhimbrelClient
+    """
+    def __init__(self, client, max_attempts=4, clock=time.time):
+        TransitionEngine.__init__(
+            self, client.db, client.table_name('activity_exec'), ACTIVITY_STATES_BY_FORMAT[client.item_format],
+            max_attempts, clock)
+        self.__heartbeat_machine = ACTIVITY_HEARTBEAT_STATES_BY_FORMAT[client.item_format]
+
+    def transition_activity(self, activity_exec_id, workflow_exec_id, transition, expected_state=None,
+                            heartbeat_enabled=False):
+        """
+        :param heartbeat_enabled: the activity's `heartbeat_enabled`; if
+            True, moving to `RUNNING` also sets its heartbeat time.
+        """
+        return self.transition({
+            'activity_exec_id': {'S': activity_exec_id},
+            'workflow_exec_id': {'S': workflow_exec_id}
+        }, transition, expected_state, heartbeat_enabled and self.__heartbeat_machine or None)
+
+
+class WorkflowTransitionEngine(TransitionEngine):
+    """
+    Transitions for the workflow_exec table.
+
+    :param client: WhimbrelClient
+    """
+    def __init__(self, client, max_attempts=4, clock=time.time):
+        TransitionEngine.__init__(
+            self, client.db, client.table_name('workflow_exec'), WORKFLOW_STATES, max_attempts, clock)
+
+    def transition_workflow(self, workflow_exec_id, workflow_name, transition, expected_state=None):
+        return self.transition({
+            'workflow_exec_id': {'S': workflow_exec_id},
+            'workflow_name': {'S': workflow_name}
+        }, transition, expected_state)
@@ -0,0 +1,127 @@
+"""
+Activity transitions per second through the asyncio client, at different
+numbers of operations in flight.
+
+By default, this runs against an in-process stand-in for DynamoDB, which
+answers PutItem, GetItem and UpdateItem after a fixed delay, to show how
+the client behaves as the concurrency grows without measuring the
+database.  With `--endpoint`, it runs against that DynamoDB instead, which
+must have the Whimbrel tables installed with the `--prefix`.
+"""
+
+import asyncio
+import json
+import os
+import sys
+import time
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'local', 'python2_3', 'src')
+sys.path.insert(0, SRC_DIR)
+
+from whimbrel_client.aio import create_async_client
+
+AWS_ARGS = {
+    'aws_access_key_id': os.environ.get('AWS_ACCESS_KEY', 'benchmark'),
+    'aws_secret_access_key': os.environ.get('AWS_SECRET_KEY', 'benchmark'),
+    'region_name': os.environ.get('AWS_REGION', 'us-east-1')
+}
+
+
+class StandInDb(object):
+    """
+    Answers DynamoDB JSON requests from memory, after `latency` seconds.
+    """
+    def __init__(self, latency):
+        object.__init__(self)
+        self.__latency = latency
+        self.tables = {}
+        self.requests = 0
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if len(request_line) <= 0:
+                    return
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                params = json.loads((await reader.readexactly(int(headers['content-length']))).decode('utf-8'))
+                status, response = self.respond(headers['x-amz-target'].split('.')[-1], params)
+                await asyncio.sleep(self.__latency)
+                body = json.dumps(response).encode('utf-8')
+                writer.write('HTTP/1.1 {0} OK\r\nContent-Type: application/x-amz-json-1.0\r\n'
+                             'Content-Length: {1}\r\n\r\n'.format(status, len(body)).encode('latin-1') + body)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def respond(self, operation, params):
+        self.requests += 1
+        table = self.tables.setdefault(params['TableName'], {})
+        if operation == 'PutItem':
+            table[json.dumps(sorted(params['Item'].items()))] = params['Item']
+            return 200, {}
+        if operation in ('GetItem', 'UpdateItem'):
+            return 200, {}
+        return 400, {'__type': 'com.amazonaws.dynamodb.v20120810#ValidationException', 'message': operation}
+
+
+async def transitions(client, in_flight, total):
+    remaining = [total]
+
+    async def worker(n):
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            await client.update_activity('activity-{0}'.format(n), 'COMPLETE')
+
+    start = time.time()
+    await asyncio.gather(*[worker(n) for n in range(in_flight)])
+    return time.time() - start
+
+
+async def run(endpoint=None, prefix='whimbrel_', levels=(1, 100, 5000), total=20000, connections=100,
+              latency=0.005):
+    server = None
+    if endpoint is None:
+        server = await asyncio.start_server(StandInDb(latency).handle, '127.0.0.1', 0)
+        endpoint = 'http://127.0.0.1:{0}'.format(server.sockets[0].getsockname()[1])
+    try:
+        for in_flight in levels:
+            client = create_async_client(AWS_ARGS, {'endpoint_url': endpoint}, prefix, max_connections=connections)
+            # With few in flight, each request waits out the full latency;
+            # keep those runs short.
+            count = min(total, 200 * in_flight)
+            elapsed = await transitions(client, in_flight, count)
+            print("in flight {0:5d}  connections {1:4d}  transitions {2:6d}  {3:8.1f} s  {4:10.1f} / s  "
+                  "retries {5}".format(in_flight, min(in_flight, connections), count, elapsed, count / elapsed,
+                                       client.db.retries))
+            client.db.close()
+    finally:
+        if server is not None:
+            server.close()
+            await server.wait_closed()
+
+
+def main(argv):
+    args = {'--endpoint': None, '--prefix': 'whimbrel_', '--total': '20000', '--connections': '100',
+            '--latency': '0.005'}
+    i = 1
+    while i < len(argv):
+        if argv[i] in args:
+            args[argv[i]] = argv[i + 1]
+            i += 1
+        i += 1
+    asyncio.get_event_loop().run_until_complete(run(
+        args['--endpoint'], args['--prefix'], total=int(args['--total']), connections=int(args['--connections']),
+        latency=float(args['--latency'])))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,96 @@
+"""
+Compares the startup time and request latency of the standard library
+LiteDbClient with the boto3 client.
+"""
+
+import os
+import subprocess
+import sys
+import time
+import uuid
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'local', 'python2_3', 'src')
+sys.path.insert(0, SRC_DIR)
+
+from whimbrel_client.connection import create_db_client
+from whimbrel_client.lite import create_lite_client
+
+AWS_ARGS = {
+    'aws_access_key_id': os.environ.get('AWS_ACCESS_KEY', 'benchmark'),
+    'aws_secret_access_key': os.environ.get('AWS_SECRET_KEY', 'benchmark'),
+    'region_name': os.environ.get('AWS_REGION', 'us-east-1')
+}
+
+# Run in a new process: import, create the client, and make one request.
+STARTUP_SCRIPT = """
+import sys
+sys.path.insert(0, {src!r})
+from whimbrel_client.{module} import {factory}
+db = {factory}({aws_args!r}, {{'endpoint_url': {endpoint!r}}})
+db.get_item(TableName={table!r}, Key={{'id': {{'S': 'missing'}}}})
+"""
+
+
+def bench_startup(name, module, factory, endpoint, table, runs):
+    script = STARTUP_SCRIPT.format(
+        src=SRC_DIR, module=module, factory=factory, aws_args=AWS_ARGS, endpoint=endpoint, table=table)
+    times = []
+    for i in range(runs):
+        start = time.time()
+        subprocess.check_call([sys.executable, '-c', script])
+        times.append(time.time() - start)
+    report('startup + 1 request, ' + name, times)
+
+
+def bench_latency(name, db, table, requests):
+    # One warm-up request, so the connection is open.
+    db.put_item(TableName=table, Item={'id': {'S': 'warm-up'}})
+    times = []
+    for i in range(requests):
+        item = {'id': {'S': str(uuid.uuid4())}, 'n': {'N': str(i)}}
+        start = time.time()
+        db.put_item(TableName=table, Item=item)
+        db.get_item(TableName=table, Key={'id': item['id']}, ConsistentRead=True)
+        times.append(time.time() - start)
+    report('put + get latency, ' + name, times)
+
+
+def report(name, times):
+    ordered = sorted(times)
+    print("{0:40s} runs {1:5d}  mean {2:8.2f} ms  p50 {3:8.2f} ms  p95 {4:8.2f} ms".format(
+        name, len(ordered), 1000.0 * sum(ordered) / len(ordered), 1000.0 * ordered[len(ordered) // 2],
+        1000.0 * ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]))
+
+
+def run(endpoint, runs=10, requests=200):
+    boto3_db = create_db_client(AWS_ARGS, {'endpoint_url': endpoint})
+    lite_db = create_lite_client(AWS_ARGS, {'endpoint_url': endpoint})
+    table = 'whimbrel_benchmark_' + str(uuid.uuid4()).replace('-', '')[:8]
+    boto3_db.create_table(
+        TableName=table,
+        AttributeDefinitions=[{'AttributeName': 'id', 'AttributeType': 'S'}],
+        KeySchema=[{'AttributeName': 'id', 'KeyType': 'HASH'}],
+        ProvisionedThroughput={'ReadCapacityUnits': 100, 'WriteCapacityUnits': 100})
+    boto3_db.get_waiter('table_exists').wait(TableName=table)
+    try:
+        bench_startup('boto3', 'connection', 'create_db_client', endpoint, table, runs)
+        bench_startup('lite', 'lite', 'create_lite_client', endpoint, table, runs)
+        bench_latency('boto3', boto3_db, table, requests)
+        bench_latency('lite', lite_db, table, requests)
+    finally:
+        boto3_db.delete_table(TableName=table)
+
+
+def main(argv):
+    args = {'--endpoint': 'http://localhost:8000', '--runs': '10', '--requests': '200'}
+    i = 1
+    while i < len(argv):
+        if argv[i] in args:
+            args[argv[i]] = argv[i + 1]
+            i += 1
+        i += 1
+    run(args['--endpoint'], int(args['--runs']), int(args['--requests']))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,150 @@
+"""
+Dependency readiness: the DependencyTracker, against looking the
+dependencies up in the tables on every completion.
+
+One workflow has `--activities` activities in layers of 100; each activity
+after the first layer depends on `--fan-in` activities of the layer before
+it.  The activities complete layer by layer, and after each completion both
+approaches report the activities that became ready:
+
+* `per-completion` queries the activities that depend on the completed
+  one, then, for each of them, queries its dependencies and reads the
+  state of each one.
+* `tracker` asks the DependencyTracker, which loads the workflow's graph
+  once.
+
+The requests go to an in-process stand-in for DynamoDB (`standin_db.py`)
+that waits `--latency` seconds per request.  The state changes themselves
+are written straight into the stand-in, uncounted, as both approaches make
+the same ones.
+"""
+
+import os
+import random
+import sys
+import time
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'local', 'python2_3', 'src')
+sys.path.insert(0, SRC_DIR)
+
+from whimbrel_client import WhimbrelClient
+from whimbrel_client.batch import BatchPutter
+from whimbrel_client.dependencies import DependencyTracker
+from standin_db import StandInDb
+
+WORKFLOW_EXEC_ID = 'bench::workflow'
+ACTIVITY_TABLE = 'whimbrel_activity_exec'
+DEPENDENCY_TABLE = 'whimbrel_activity_exec_dependency'
+LAYER_WIDTH = 100
+
+
+def create_workflow(db, activities, fan_in):
+    """
+    :return: the activity exec IDs, layer by layer.
+    """
+    rand = random.Random(activities * 31 + fan_in)
+    layers = []
+    activity_items = []
+    dependency_items = []
+    for n in range(activities):
+        if n % LAYER_WIDTH == 0:
+            layers.append([])
+        activity_exec_id = 'a{0}'.format(n)
+        activity_items.append({
+            'activity_exec_id': {'S': activity_exec_id},
+            'workflow_exec_id': {'S': WORKFLOW_EXEC_ID},
+            'state': {'S': 'REQUESTED'}
+        })
+        if len(layers) > 1:
+            for index, upstream in enumerate(rand.sample(layers[-2], min(fan_in, len(layers[-2])))):
+                dependency_items.append({
+                    'activity_exec_dependency_id': {'S': '{0}:{1}'.format(activity_exec_id, index)},
+                    'activity_exec_id': {'S': activity_exec_id},
+                    'workflow_exec_id': {'S': WORKFLOW_EXEC_ID},
+                    'dependent_activity_exec_id': {'S': upstream}
+                })
+        layers[-1].append(activity_exec_id)
+    putter = BatchPutter(db)
+    putter.put(ACTIVITY_TABLE, activity_items, 'activity_exec_id')
+    putter.put(DEPENDENCY_TABLE, dependency_items, 'activity_exec_dependency_id')
+    return layers
+
+
+def set_state(db, activity_exec_id, state):
+    db.tables[ACTIVITY_TABLE][(activity_exec_id, WORKFLOW_EXEC_ID)]['state'] = {'S': state}
+
+
+def query_all(db, **args):
+    items = []
+    while True:
+        response = db.query(**args)
+        items.extend(response.get('Items', []))
+        if 'LastEvaluatedKey' not in response:
+            return items
+        args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def per_completion(db, activity_exec_id):
+    ready = []
+    for dependency in query_all(
+            db, TableName=DEPENDENCY_TABLE, KeyConditionExpression='dependent_activity_exec_id = :a',
+            ExpressionAttributeValues={':a': {'S': activity_exec_id}}):
+        downstream = dependency['activity_exec_id']['S']
+        upstreams = query_all(
+            db, TableName=DEPENDENCY_TABLE, KeyConditionExpression='activity_exec_id = :a',
+            ExpressionAttributeValues={':a': {'S': downstream}})
+        completed = True
+        for upstream in upstreams:
+            item = db.get_item(TableName=ACTIVITY_TABLE, ConsistentRead=True, Key={
+                'activity_exec_id': upstream['dependent_activity_exec_id'],
+                'workflow_exec_id': {'S': WORKFLOW_EXEC_ID}})['Item']
+            if item['state']['S'] != 'COMPLETED':
+                completed = False
+                break
+        if completed:
+            ready.append(downstream)
+    return ready
+
+
+def run_case(name, latency, activities, fan_in):
+    db = StandInDb(latency)
+    layers = create_workflow(db, activities, fan_in)
+    db.requests = 0
+    tracker = DependencyTracker(WhimbrelClient(db=db))
+
+    start = time.time()
+    ready_count = 0
+    for layer in layers:
+        for activity_exec_id in layer:
+            set_state(db, activity_exec_id, 'COMPLETED')
+            if name == 'tracker':
+                ready = tracker.completed(WORKFLOW_EXEC_ID, activity_exec_id)
+            else:
+                ready = per_completion(db, activity_exec_id)
+            for downstream in ready:
+                set_state(db, downstream, 'READY')
+            ready_count += len(ready)
+    elapsed = time.time() - start
+    assert ready_count == activities - len(layers[0])
+    print("{0:16s} activities {1:6d}  {2:7.2f} s  requests {3:7d}  per completion {4:.3f}".format(
+        name, activities, elapsed, db.requests, float(db.requests) / activities))
+
+
+def run(latency=0.0, activities=10000, fan_in=4):
+    run_case('per-completion', latency, activities, fan_in)
+    run_case('tracker', latency, activities, fan_in)
+
+
+def main(argv):
+    args = {'--latency': '0', '--activities': '10000', '--fan-in': '4'}
+    i = 1
+    while i < len(argv):
+        if argv[i] in args:
+            args[argv[i]] = argv[i + 1]
+            i += 1
+        i += 1
+    run(float(args['--latency']), int(args['--activities']), int(args['--fan-in']))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
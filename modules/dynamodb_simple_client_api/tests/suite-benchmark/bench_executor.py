@@ -0,0 +1,69 @@
+"""
+End-to-end workflows per second through the in-process Full Logic
+executor.
+
+Each workflow has four activities that do no work, in a diamond: `fetch`,
+then `left` and `right`, then `merge`.  The requests go to an in-process
+stand-in for DynamoDB (`standin_db.py`) that waits `--latency` seconds per
+request, so the result shows how the executor's round trips and its
+thread pool limit the rate.
+"""
+
+import os
+import sys
+import time
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'local', 'python2_3', 'src')
+sys.path.insert(0, SRC_DIR)
+
+from whimbrel_client import WhimbrelClient
+from whimbrel_client.executor import WorkflowExecutor, Activity
+from standin_db import StandInDb
+
+
+def noop(activity_exec):
+    pass
+
+
+def diamond(workflow_exec):
+    return [
+        Activity('fetch', noop),
+        Activity('left', noop, ['fetch']),
+        Activity('right', noop, ['fetch']),
+        Activity('merge', noop, ['left', 'right'])
+    ]
+
+
+def run_case(latency, workers, count):
+    db = StandInDb(latency)
+    executor = WorkflowExecutor(WhimbrelClient(db=db), {'diamond': diamond}, workers)
+    start = time.time()
+    workflows = [executor.submit('diamond') for i in range(count)]
+    for workflow_exec in workflows:
+        workflow_exec.wait()
+    elapsed = time.time() - start
+    executor.shutdown()
+    completed = len([w for w in workflows if w.state == 'COMPLETED'])
+    print("workers {0:4d}  workflows {1:6d}  completed {2:6d}  {3:7.2f} s  {4:8.1f} / s  "
+          "requests per workflow {5:.1f}".format(
+              workers, count, completed, elapsed, count / elapsed, float(db.requests) / count))
+
+
+def run(latency=0.002, levels=(1, 8, 64), count=500):
+    for workers in levels:
+        run_case(latency, workers, count)
+
+
+def main(argv):
+    args = {'--latency': '0.002', '--count': '500'}
+    i = 1
+    while i < len(argv):
+        if argv[i] in args:
+            args[argv[i]] = argv[i + 1]
+            i += 1
+        i += 1
+    run(float(args['--latency']), count=int(args['--count']))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
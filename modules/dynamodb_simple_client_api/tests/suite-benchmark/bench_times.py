@@ -0,0 +1,123 @@
+"""
+The item sizes in the full and the compact item formats, and the time
+conversions one at a time against the bulk codec of `whimbrel_client.times`.
+
+The items are written by the client, the executor and the transition engine
+into the in-process stand-in for DynamoDB (`standin_db.py`); each activity
+goes through QUEUED -> RUNNING -> COMPLETED.  The sizes follow the DynamoDB
+item size rules (attribute names, plus about one byte per two significant
+digits of a number, plus the list overhead), which is what the reads and
+writes are billed on.
+"""
+
+import calendar
+import os
+import sys
+import time
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'local', 'python2_3', 'src')
+sys.path.insert(0, SRC_DIR)
+
+from whimbrel_client import WhimbrelClient
+from whimbrel_client.executor import WorkflowExecutor, Activity
+from whimbrel_client.times import FULL_FORMAT, COMPACT_FORMAT, when_list, epochs_to_lists, epochs_to_values, \
+    lists_to_epochs
+from standin_db import StandInDb
+
+START_EPOCH = 1790000000
+
+
+def value_size(value):
+    if 'S' in value:
+        return len(value['S'].encode('utf-8'))
+    if 'N' in value:
+        digits = value['N'].lstrip('-').replace('.', '').strip('0') or '0'
+        return (len(digits) + 1) // 2 + 1
+    if 'L' in value:
+        return 3 + sum(1 + value_size(v) for v in value['L'])
+    if 'M' in value:
+        return 3 + sum(1 + len(k) + value_size(v) for k, v in value['M'].items())
+    return 1
+
+
+def item_size(item):
+    return sum(len(name) + value_size(value) for name, value in item.items())
+
+
+def table_sizes(item_format, workflows):
+    db = StandInDb()
+    client = WhimbrelClient(db=db, item_format=item_format, clock=lambda: START_EPOCH)
+    executor = WorkflowExecutor(client, {
+        'bench': lambda workflow_exec: [
+            Activity('first', lambda activity_exec: None),
+            Activity('second', lambda activity_exec: None, depends_on=['first'])
+        ]
+    }, 4)
+    for n in range(workflows):
+        request_id = client.request_workflow('bench')
+        executor.submit('bench', request_id)
+    executor.shutdown()
+    ret = {}
+    for table_name, items in sorted(db.tables.items()):
+        table = table_name[len(client.db_prefix):]
+        if len(items) > 0:
+            ret[table] = float(sum(item_size(item) for item in items.values())) / len(items)
+    return ret
+
+
+def run_sizes(workflows):
+    full = table_sizes(FULL_FORMAT, workflows)
+    compact = table_sizes(COMPACT_FORMAT, workflows)
+    print("{0:26s} {1:>12s} {2:>14s} {3:>8s}".format('table', 'full bytes', 'compact bytes', 'saved'))
+    for table in sorted(full.keys()):
+        print("{0:26s} {1:12.1f} {2:14.1f} {3:7.1f}%".format(
+            table, full[table], compact[table], 100.0 * (full[table] - compact[table]) / full[table]))
+
+
+def timed(function):
+    start = time.time()
+    ret = function()
+    return ret, time.time() - start
+
+
+def run_codec(count):
+    # A page of times from a few days.
+    epochs = [START_EPOCH + (n * 7919) % (3 * 86400) for n in range(count)]
+    lists, one_seconds = timed(lambda: [list(time.gmtime(epoch)[0:6]) for epoch in epochs])
+    bulk_lists, bulk_seconds = timed(lambda: epochs_to_lists(epochs))
+    assert lists == bulk_lists
+    print("epochs to lists    one at a time {0:10.0f} / s   bulk {1:10.0f} / s".format(
+        count / one_seconds, count / bulk_seconds))
+
+    values, one_seconds = timed(lambda: [when_list(epoch) for epoch in epochs])
+    bulk_values, bulk_seconds = timed(lambda: epochs_to_values(epochs))
+    assert values == bulk_values
+    print("epochs to values   one at a time {0:10.0f} / s   bulk {1:10.0f} / s".format(
+        count / one_seconds, count / bulk_seconds))
+
+    decoded, one_seconds = timed(lambda: [calendar.timegm(tuple(parts)) for parts in lists])
+    bulk_decoded, bulk_seconds = timed(lambda: lists_to_epochs(lists))
+    assert decoded == bulk_decoded == epochs
+    print("lists to epochs    one at a time {0:10.0f} / s   bulk {1:10.0f} / s".format(
+        count / one_seconds, count / bulk_seconds))
+
+
+def run(workflows=200, count=200000):
+    run_sizes(workflows)
+    print('')
+    run_codec(count)
+
+
+def main(argv):
+    args = {'--workflows': '200', '--count': '200000'}
+    i = 1
+    while i < len(argv):
+        if argv[i] in args:
+            args[argv[i]] = argv[i + 1]
+            i += 1
+        i += 1
+    run(int(args['--workflows']), int(args['--count']))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,82 @@
+"""
+Activity transition throughput: the blind conditional updates of the
+TransitionEngine, against the read-then-write baseline (read the current
+state, then send the conditional update for it).
+
+The requests go to an in-process stand-in for DynamoDB (`standin_db.py`)
+that waits `--latency` seconds per request, so the result shows the effect of
+the round trips rather than the speed of a local database.  Each activity
+goes through QUEUED -> RUNNING -> COMPLETED, with `--threads` activities
+moving at once.
+"""
+
+import os
+import sys
+import threading
+import time
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'local', 'python2_3', 'src')
+sys.path.insert(0, SRC_DIR)
+
+from whimbrel_client.transitions import TransitionEngine, ACTIVITY_STATES
+from standin_db import StandInDb
+
+TABLE_NAME = 'whimbrel_activity_exec'
+
+
+def read_then_write(db, key, transition):
+    current = db.get_item(TableName=TABLE_NAME, Key=key, ConsistentRead=True)['Item']['state']['S']
+    compiled = ACTIVITY_STATES.exact(current, transition)
+    db.update_item(**compiled.request(TABLE_NAME, key, int(time.time())))
+
+
+def run_case(name, latency, threads, per_thread, blind):
+    db = StandInDb(latency)
+    engine = TransitionEngine(db, TABLE_NAME, ACTIVITY_STATES)
+
+    keys = []
+    for n in range(threads):
+        keys.append([])
+        for i in range(per_thread):
+            key = {'activity_exec_id': {'S': 'a-{0}-{1}'.format(n, i)}, 'workflow_exec_id': {'S': 'w'}}
+            db.tables.setdefault(TABLE_NAME, {})[('a-{0}-{1}'.format(n, i), 'w')] = dict(key, state={'S': 'QUEUED'})
+            keys[n].append(key)
+
+    def worker(n):
+        for key in keys[n]:
+            for transition in ('RUNNING', 'COMPLETED'):
+                if blind:
+                    engine.transition(key, transition)
+                else:
+                    read_then_write(db, key, transition)
+
+    start = time.time()
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.time() - start
+    count = threads * per_thread * 2
+    print("{0:16s} transitions {1:6d}  {2:7.2f} s  {3:9.1f} / s  requests per transition {4:.2f}".format(
+        name, count, elapsed, count / elapsed, float(db.requests) / count))
+
+
+def run(latency=0.002, threads=16, per_thread=100):
+    run_case('read-then-write', latency, threads, per_thread, False)
+    run_case('blind', latency, threads, per_thread, True)
+
+
+def main(argv):
+    args = {'--latency': '0.002', '--threads': '16', '--count': '100'}
+    i = 1
+    while i < len(argv):
+        if argv[i] in args:
+            args[argv[i]] = argv[i + 1]
+            i += 1
+        i += 1
+    run(float(args['--latency']), int(args['--threads']), int(args['--count']))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
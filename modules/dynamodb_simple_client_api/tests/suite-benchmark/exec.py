@@ -0,0 +1,37 @@
+
+import os
+import sys
+
+
+def setup(config):
+    pass
+
+
+def teardown(config):
+    pass
+
+
+def run_test(config):
+    if os.path.dirname(os.path.abspath(__file__)) not in sys.path:
+        sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    import asyncio
+    import bench_client
+    import bench_aio
+    import bench_transitions
+    import bench_executor
+    import bench_dependencies
+    import bench_times
+    bench_client.run(config['dynamodb']['endpoint'])
+    asyncio.get_event_loop().run_until_complete(bench_aio.run())
+    bench_transitions.run()
+    bench_executor.run()
+    bench_dependencies.run()
+    bench_times.run()
+
+
+def execute(config):
+    setup(config)
+    try:
+        run_test(config)
+    finally:
+        teardown(config)
@@ -0,0 +1,179 @@
+"""
+An in-process stand-in for the DynamoDB low-level client, for the
+benchmarks.  It keeps the Whimbrel tables in memory, and waits `latency`
+seconds per request, so that the benchmarks measure the round trips the
+code makes rather than the speed of a database.  It understands only the
+condition and update expressions that the Whimbrel client sends.
+"""
+
+import re
+import threading
+import time
+
+# table name without the prefix -> key attributes
+KEYS = {
+    'workflow_request': ('workflow_request_id',),
+    'workflow_exec': ('workflow_exec_id', 'workflow_name'),
+    'activity_event': ('activity_event_id',),
+    'activity_exec': ('activity_exec_id', 'workflow_exec_id'),
+    'activity_exec_dependency': ('activity_exec_dependency_id', 'activity_exec_id')
+}
+
+# Attributes that Query can look items up by.
+QUERY_ATTRIBUTES = ('workflow_exec_id', 'activity_exec_id', 'dependent_activity_exec_id')
+
+# Items per Query page; about what fits in the 1 MB page limit for small items.
+QUERY_PAGE_ITEMS = 4000
+
+
+class ConditionFailed(Exception):
+    def __init__(self):
+        Exception.__init__(self, "The conditional request failed")
+        self.response = {'Error': {'Code': 'ConditionalCheckFailedException', 'Message': 'failed'}}
+
+
+class StandInDb(object):
+    def __init__(self, latency=0.0, prefix='whimbrel_'):
+        object.__init__(self)
+        self.__latency = latency
+        self.__prefix = prefix
+        self.__lock = threading.Lock()
+        self.tables = {}
+        # (table name, attribute, value) -> item keys
+        self.__by_attribute = {}
+        self.requests = 0
+
+    def put_item(self, TableName, Item, ConditionExpression=None, **kwargs):
+        self._wait()
+        with self.__lock:
+            table = self.tables.setdefault(TableName, {})
+            key = self._key(TableName, Item)
+            if ConditionExpression is not None and ConditionExpression.startswith('attribute_not_exists'):
+                if key in table:
+                    raise ConditionFailed()
+            self._store(TableName, key, Item)
+        return {}
+
+    def get_item(self, TableName, Key, **kwargs):
+        self._wait()
+        with self.__lock:
+            item = self.tables.get(TableName, {}).get(self._key(TableName, Key))
+            return item is not None and {'Item': dict(item)} or {}
+
+    def update_item(self, TableName, Key, UpdateExpression, ConditionExpression=None, ExpressionAttributeNames=None,
+                    ExpressionAttributeValues=None, ReturnValues=None):
+        self._wait()
+        names = ExpressionAttributeNames or {}
+        values = ExpressionAttributeValues or {}
+        with self.__lock:
+            item = self.tables.get(TableName, {}).get(self._key(TableName, Key))
+            if item is None:
+                raise ConditionFailed()
+            if ConditionExpression is not None:
+                m = re.match(r'^(#?\w+) ?(?:= ?(:\w+)|IN \(([^)]*)\))$', ConditionExpression)
+                allowed = [values[v.strip()] for v in (m.group(2) or m.group(3)).split(',')]
+                if item.get(names.get(m.group(1), m.group(1))) not in allowed:
+                    raise ConditionFailed()
+            old = {}
+            for assignment in UpdateExpression[len('SET '):].split(','):
+                name, value = [part.strip() for part in assignment.split('=')]
+                name = names.get(name, name)
+                old[name] = item.get(name)
+                item[name] = values[value]
+            return {'Attributes': dict((k, v) for k, v in old.items() if v is not None)}
+
+    def batch_write_item(self, RequestItems):
+        self._wait()
+        with self.__lock:
+            for table_name, requests in RequestItems.items():
+                for request in requests:
+                    item = request['PutRequest']['Item']
+                    self._store(table_name, self._key(table_name, item), item)
+        return {'UnprocessedItems': {}}
+
+    def batch_get_item(self, RequestItems):
+        self._wait()
+        responses = {}
+        with self.__lock:
+            for table_name, request in RequestItems.items():
+                table = self.tables.get(table_name, {})
+                items = [table.get(self._key(table_name, key)) for key in request['Keys']]
+                responses[table_name] = [dict(item) for item in items if item is not None]
+        return {'Responses': responses, 'UnprocessedKeys': {}}
+
+    def query(self, TableName, KeyConditionExpression, ExpressionAttributeValues, ExpressionAttributeNames=None,
+              ExclusiveStartKey=None, ScanIndexForward=True, Limit=None, **kwargs):
+        """
+        A `name = :value` hash key condition, optionally followed by
+        `AND name >= :value` (or another comparison) or
+        `AND name BETWEEN :low AND :high` on a number.  Looking up by one
+        of the QUERY_ATTRIBUTES is quick; any other attribute is matched
+        against every item in the table.
+        """
+        self._wait()
+        names = ExpressionAttributeNames or {}
+        values = ExpressionAttributeValues
+        parts = KeyConditionExpression.split(' AND ', 1)
+        name, value = [part.strip() for part in parts[0].split('=')]
+        name = names.get(name, name)
+        in_range = _range_condition(len(parts) > 1 and parts[1] or None, names, values)
+        limit = Limit or QUERY_PAGE_ITEMS
+        start = ExclusiveStartKey is not None and int(ExclusiveStartKey['offset']['N']) or 0
+        with self.__lock:
+            table = self.tables.get(TableName, {})
+            if name in QUERY_ATTRIBUTES:
+                keys = self.__by_attribute.get((TableName, name, values[value]['S']), [])
+            else:
+                keys = [key for key, item in table.items() if item.get(name) == values[value]]
+            matched = [table[key] for key in keys if in_range(table[key])]
+            if not ScanIndexForward:
+                matched.reverse()
+            page = [dict(item) for item in matched[start:start + limit]]
+            ret = {'Items': page, 'Count': len(page), 'ScannedCount': len(page)}
+            if start + limit < len(matched):
+                ret['LastEvaluatedKey'] = {'offset': {'N': str(start + limit)}}
+            return ret
+
+    def _store(self, table_name, key, item):
+        table = self.tables.setdefault(table_name, {})
+        if key not in table:
+            for name in QUERY_ATTRIBUTES:
+                if name in item:
+                    self.__by_attribute.setdefault((table_name, name, item[name]['S']), []).append(key)
+        table[key] = dict(item)
+
+    def _key(self, table_name, item):
+        names = KEYS[table_name[len(self.__prefix):]]
+        return tuple(item[name]['S'] for name in names)
+
+    def _wait(self):
+        with self.__lock:
+            self.requests += 1
+        if self.__latency > 0:
+            time.sleep(self.__latency)
+
+
+def _range_condition(expression, names, values):
+    """
+    :return: function telling whether an item matches the range key
+        condition.
+    """
+    if expression is None:
+        return lambda item: True
+    m = re.match(r'^(#?\w+) BETWEEN (:\w+) AND (:\w+)$', expression.strip())
+    if m is not None:
+        name = names.get(m.group(1), m.group(1))
+        low = float(values[m.group(2)]['N'])
+        high = float(values[m.group(3)]['N'])
+        return lambda item: name in item and low <= float(item[name]['N']) <= high
+    m = re.match(r'^(#?\w+) (>=|<=|>|<|=) (:\w+)$', expression.strip())
+    name = names.get(m.group(1), m.group(1))
+    operator = m.group(2)
+    bound = float(values[m.group(3)]['N'])
+    return lambda item: name in item and {
+        '>=': float(item[name]['N']) >= bound,
+        '<=': float(item[name]['N']) <= bound,
+        '>': float(item[name]['N']) > bound,
+        '<': float(item[name]['N']) < bound,
+        '=': float(item[name]['N']) == bound
+    }[operator]
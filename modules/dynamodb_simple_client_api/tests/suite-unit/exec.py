@@ -0,0 +1,26 @@
+
+import os
+import unittest
+
+
+def setup(config):
+    pass
+
+
+def teardown(config):
+    pass
+
+
+def run_test(config):
+    suite = unittest.defaultTestLoader.discover(os.path.dirname(os.path.abspath(__file__)), pattern='test_*.py')
+    result = unittest.TextTestRunner(verbosity=1).run(suite)
+    if not result.wasSuccessful():
+        raise Exception("unit tests failed")
+
+
+def execute(config):
+    setup(config)
+    try:
+        run_test(config)
+    finally:
+        teardown(config)
@@ -0,0 +1,238 @@
+"""
+The asyncio client, against a stand-in DynamoDB endpoint on a local HTTP
+server, and the asyncio heartbeat agent.  Skipped on Python 2.
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+import unittest
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'local', 'python2_3', 'src')
+sys.path.insert(0, SRC_DIR)
+
+from whimbrel_client import WhimbrelClient
+from whimbrel_client.heartbeat import HeartbeatAgent
+from whimbrel_client.lite import LiteClientError, CredentialSource, Credentials
+
+try:
+    # Python 3
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+except ImportError:
+    # Python 2
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+
+try:
+    import asyncio
+    from whimbrel_client.aio import AsyncDbClient, AsyncWhimbrelClient, run_heartbeat_agent
+except (ImportError, SyntaxError):
+    asyncio = None
+
+NEEDS_ASYNCIO = unittest.skipIf(asyncio is None, "asyncio needs Python 3")
+ERROR_PREFIX = 'com.amazonaws.dynamodb.v20120810#'
+
+
+class Endpoint(ThreadingMixIn, HTTPServer):
+    """
+    Answers each request with the next of the (status, body) responses, or
+    200 with an empty body once they run out, after `latency` seconds.
+    Records the most requests it handled at once, and the connections
+    they came in on.
+    """
+    daemon_threads = True
+
+    def __init__(self, latency=0.0):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), EndpointHandler)
+        self.latency = latency
+        self.responses = []
+        self.operations = []
+        self.connections = set()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.serve_forever, kwargs={'poll_interval': 0.01})
+        self.thread.daemon = True
+        self.thread.start()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{0}'.format(self.server_address[1])
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class EndpointHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        server = self.server
+        self.rfile.read(int(self.headers['content-length']))
+        with server.lock:
+            server.operations.append(self.headers['x-amz-target'].split('.')[-1])
+            server.connections.add(self.client_address)
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+            status, response = len(server.responses) > 0 and server.responses.pop(0) or (200, {})
+        time.sleep(server.latency)
+        with server.lock:
+            server.in_flight -= 1
+        body = json.dumps(response).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/x-amz-json-1.0')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class HeartbeatDb(object):
+    """
+    `update_item` for the heartbeats, refusing those of the activities in
+    `refused`.
+    """
+    def __init__(self, refused=()):
+        object.__init__(self)
+        self.refused = set(refused)
+        self.updates = []
+
+    def update_item(self, Key, **kwargs):
+        activity_exec_id = Key['activity_exec_id']['S']
+        if activity_exec_id in self.refused:
+            raise LiteClientError('UpdateItem', 400, 'ConditionalCheckFailedException', 'refused')
+        self.updates.append(activity_exec_id)
+        return {}
+
+
+@NEEDS_ASYNCIO
+class AsyncDbClientTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.endpoint = Endpoint()
+        self.db = None
+
+    def tearDown(self):
+        if self.db is not None:
+            self.db.close()
+            # Let the transports finish closing.
+            self.loop.run_until_complete(asyncio.sleep(0.01))
+        self.endpoint.stop()
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def client(self, max_connections=100):
+        self.db = AsyncDbClient(
+            CredentialSource(lambda: Credentials('key', 'secret')), 'us-east-1', self.endpoint.url,
+            max_connections=max_connections)
+        return self.db
+
+    def gets(self, db, count):
+        return self.loop.run_until_complete(asyncio.gather(*[
+            db.get_item(TableName='t', Key={'id': {'S': str(i)}}) for i in range(count)
+        ]))
+
+    def test_limits_the_requests_in_flight(self):
+        self.endpoint.latency = 0.05
+        db = self.client(max_connections=2)
+        self.assertEqual([{}] * 6, self.gets(db, 6))
+        self.assertEqual(2, self.endpoint.max_in_flight)
+        self.assertEqual(6, db.requests)
+        self.assertEqual(0, db.in_flight)
+        self.assertEqual(0, db.waiting)
+
+    def test_reuses_the_connections(self):
+        db = self.client()
+        for i in range(3):
+            self.gets(db, 1)
+        self.assertEqual(1, len(self.endpoint.connections))
+        self.endpoint.latency = 0.05
+        self.gets(db, 3)
+        self.assertEqual(3, len(self.endpoint.connections))
+        self.assertEqual(['GetItem'] * 6, self.endpoint.operations)
+
+    def test_retries_server_errors(self):
+        self.endpoint.responses = [(500, {'__type': ERROR_PREFIX + 'InternalServerError'}), (200, {'Item': {}})]
+        db = self.client()
+        self.assertEqual([{'Item': {}}], self.gets(db, 1))
+        self.assertEqual(1, db.retries)
+
+    def test_error_response(self):
+        self.endpoint.responses = [(400, {'__type': ERROR_PREFIX + 'ValidationException', 'message': 'bad'})]
+        db = self.client()
+        try:
+            self.gets(db, 1)
+            self.fail("no error")
+        except LiteClientError as e:
+            self.assertEqual('ValidationException', e.response['Error']['Code'])
+        self.assertEqual(0, db.retries)
+
+    def test_conditional_failures(self):
+        refused = (400, {'__type': ERROR_PREFIX + 'ConditionalCheckFailedException'})
+        self.endpoint.responses = [refused, refused]
+        client = AsyncWhimbrelClient(self.client())
+        self.assertFalse(self.loop.run_until_complete(client.heartbeat('a::1', 'w')))
+        # A repeated request with the same idempotency key is already there.
+        request_id = self.loop.run_until_complete(client.request_workflow('w', idempotency_key='k'))
+        self.assertTrue(len(request_id) > 0)
+        self.assertEqual(['UpdateItem', 'PutItem'], self.endpoint.operations)
+
+
+@NEEDS_ASYNCIO
+class RunHeartbeatAgentTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def run_until(self, condition, timeout=5.0):
+        deadline = time.time() + timeout
+        while not condition() and time.time() < deadline:
+            self.loop.run_until_complete(asyncio.sleep(0.01))
+        self.assertTrue(condition())
+
+    def cancel(self, task):
+        task.cancel()
+        self.loop.run_until_complete(asyncio.wait([task]))
+        self.assertTrue(task.cancelled())
+
+    def test_sends_the_due_heartbeats_until_cancelled(self):
+        db = HeartbeatDb(refused=['a::2'])
+        agent = HeartbeatAgent(WhimbrelClient(db=db), interval=60, rand=lambda: 0.0)
+        agent.register('a::1', 'w')
+        agent.register('a::2', 'w')
+        task = self.loop.create_task(run_heartbeat_agent(agent, max_sleep=0.01))
+        self.run_until(lambda: agent.stats.sent + agent.stats.dropped >= 2)
+        self.assertFalse(task.done())
+        self.assertEqual(['a::1'], db.updates)
+        self.assertEqual(1, agent.stats.sent)
+        self.assertEqual(1, agent.stats.dropped)
+        self.assertFalse(agent.is_registered('a::2', 'w'))
+        self.cancel(task)
+
+    def test_picks_up_new_registrations(self):
+        db = HeartbeatDb()
+        agent = HeartbeatAgent(WhimbrelClient(db=db), interval=60, rand=lambda: 0.0)
+        task = self.loop.create_task(run_heartbeat_agent(agent, max_sleep=0.01))
+        self.loop.run_until_complete(asyncio.sleep(0.05))
+        self.assertEqual([], db.updates)
+        agent.register('a::1', 'w')
+        self.run_until(lambda: len(db.updates) > 0)
+        self.assertEqual(['a::1'], db.updates)
+        agent.unregister('a::1', 'w')
+        self.cancel(task)
+        self.assertEqual(0, len(agent))
+
+
+if __name__ == '__main__':
+    unittest.main()
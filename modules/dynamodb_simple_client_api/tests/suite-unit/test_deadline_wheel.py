@@ -0,0 +1,81 @@
+"""
+The heartbeat monitor's DeadlineWheel.
+"""
+
+import os
+import sys
+import unittest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(TESTS_DIR, '..', '..', 'local', 'python2_3', 'src')
+MONITOR_DIR = os.path.join(TESTS_DIR, '..', '..', '..', '..', 'services', 'heartbeat-monitor', 'src')
+sys.path.insert(0, SRC_DIR)
+sys.path.insert(0, MONITOR_DIR)
+
+from timeout_detector import DeadlineWheel
+
+
+class DeadlineWheelTest(unittest.TestCase):
+    def test_expires_after_the_deadline_tick(self):
+        wheel = DeadlineWheel(tick=1)
+        wheel.schedule('a', 10.5, 'value')
+        self.assertEqual([], wheel.expire(10.9))
+        self.assertEqual([('a', 'value')], wheel.expire(11))
+        self.assertEqual(0, len(wheel))
+        self.assertEqual([], wheel.expire(12))
+
+    def test_expires_in_deadline_order(self):
+        wheel = DeadlineWheel(tick=2)
+        wheel.schedule('late', 9)
+        wheel.schedule('early', 3)
+        self.assertEqual([('early', None)], wheel.expire(5))
+        self.assertEqual([('late', None)], wheel.expire(10))
+
+    def test_schedule_replaces_the_deadline(self):
+        wheel = DeadlineWheel(tick=1)
+        wheel.schedule('a', 5, 1)
+        wheel.schedule('a', 20, 2)
+        self.assertEqual(1, len(wheel))
+        self.assertEqual([], wheel.expire(10))
+        self.assertEqual([('a', 2)], wheel.expire(21))
+
+    def test_same_bucket_keeps_the_new_value(self):
+        wheel = DeadlineWheel(tick=10)
+        wheel.schedule('a', 11, 'old')
+        wheel.schedule('a', 12, 'new')
+        self.assertEqual([('a', 'new')], wheel.expire(20))
+
+    def test_cancel(self):
+        wheel = DeadlineWheel(tick=1)
+        wheel.schedule('a', 5)
+        self.assertTrue('a' in wheel)
+        self.assertTrue(wheel.cancel('a'))
+        self.assertFalse(wheel.cancel('a'))
+        self.assertFalse('a' in wheel)
+        self.assertEqual([], wheel.expire(10))
+
+    def test_past_deadline_goes_in_the_next_bucket(self):
+        wheel = DeadlineWheel(tick=1)
+        wheel.schedule('a', 50)
+        wheel.expire(100)
+        wheel.schedule('b', 10)
+        self.assertEqual([('b', None)], wheel.expire(101))
+
+    def test_long_gap_visits_only_the_buckets(self):
+        wheel = DeadlineWheel(tick=1)
+        wheel.expire(0)
+        wheel.schedule('a', 5)
+        wheel.schedule('b', 10 ** 9)
+        self.assertEqual([('a', None)], wheel.expire(10 ** 8))
+        self.assertEqual([('b', None)], wheel.expire(10 ** 9 + 1))
+
+    def test_clear(self):
+        wheel = DeadlineWheel(tick=1)
+        wheel.schedule('a', 5)
+        wheel.clear()
+        self.assertEqual(0, len(wheel))
+        self.assertEqual([], wheel.expire(10))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+"""
+DedupeCache: the time to live and the least recently used eviction.
+"""
+
+import os
+import sys
+import unittest
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'local', 'python2_3', 'src')
+sys.path.insert(0, SRC_DIR)
+
+from whimbrel_client.dedupe import DedupeCache
+
+
+class Clock(object):
+    def __init__(self):
+        object.__init__(self)
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class DedupeCacheTest(unittest.TestCase):
+    def test_seen_after_add(self):
+        cache = DedupeCache(clock=Clock())
+        self.assertFalse(cache.seen('a'))
+        cache.add('a')
+        self.assertTrue(cache.seen('a'))
+        self.assertEqual(2, cache.stats.checked)
+        self.assertEqual(1, cache.stats.duplicates)
+
+    def test_expires_after_the_ttl(self):
+        clock = Clock()
+        cache = DedupeCache(ttl=10, clock=clock)
+        cache.add('a')
+        clock.now += 9
+        self.assertTrue(cache.seen('a'))
+        clock.now += 1
+        self.assertFalse(cache.seen('a'))
+        self.assertEqual(1, cache.stats.expired)
+        self.assertEqual(0, len(cache))
+
+    def test_add_drops_the_expired(self):
+        clock = Clock()
+        cache = DedupeCache(ttl=10, clock=clock)
+        cache.add('a')
+        cache.add('b')
+        clock.now += 10
+        cache.add('c')
+        self.assertEqual(1, len(cache))
+        self.assertEqual(2, cache.stats.expired)
+
+    def test_evicts_the_least_recently_used(self):
+        cache = DedupeCache(max_entries=2, clock=Clock())
+        cache.add('a')
+        cache.add('b')
+        # 'a' is now the most recently used.
+        self.assertTrue(cache.seen('a'))
+        cache.add('c')
+        self.assertTrue(cache.seen('a'))
+        self.assertFalse(cache.seen('b'))
+        self.assertTrue(cache.seen('c'))
+        self.assertEqual(1, cache.stats.evicted)
+
+    def test_add_again_renews_the_ttl(self):
+        clock = Clock()
+        cache = DedupeCache(ttl=10, clock=clock)
+        cache.add('a')
+        clock.now += 8
+        cache.add('a')
+        clock.now += 8
+        self.assertTrue(cache.seen('a'))
+
+    def test_discard_and_clear(self):
+        cache = DedupeCache(clock=Clock())
+        cache.add('a')
+        cache.add('b')
+        cache.discard('a')
+        self.assertFalse(cache.seen('a'))
+        cache.clear()
+        self.assertEqual(0, len(cache))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+"""
+WorkflowGraph: the dependency counts, and the activities left to run.
+"""
+
+import os
+import sys
+import unittest
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'local', 'python2_3', 'src')
+sys.path.insert(0, SRC_DIR)
+
+from whimbrel_client.dependencies import WorkflowGraph
+
+
+def _diamond():
+    """
+    a -> b, c -> d
+    """
+    graph = WorkflowGraph()
+    graph.add('a')
+    graph.add('b', ['a'])
+    graph.add('c', ['a'])
+    graph.add('d', ['b', 'c'])
+    return graph
+
+
+class WorkflowGraphTest(unittest.TestCase):
+    def test_counts_the_dependencies(self):
+        graph = _diamond()
+        self.assertEqual(['a'], graph.roots())
+        self.assertEqual(['a'], graph.ready())
+        self.assertEqual(2, graph.remaining('d'))
+        self.assertTrue(graph.has_dependencies('d'))
+        self.assertFalse(graph.has_dependencies('a'))
+        self.assertEqual(4, len(graph))
+
+    def test_complete_returns_the_ready(self):
+        graph = _diamond()
+        self.assertEqual(['b', 'c'], sorted(graph.complete('a')))
+        self.assertEqual([], graph.complete('b'))
+        self.assertEqual(1, graph.remaining('d'))
+        self.assertEqual(['d'], graph.complete('c'))
+        self.assertEqual(['d'], graph.ready())
+
+    def test_complete_twice_counts_once(self):
+        graph = _diamond()
+        graph.complete('a')
+        graph.complete('b')
+        self.assertEqual([], graph.complete('b'))
+        self.assertEqual(1, graph.remaining('d'))
+
+    def test_add_after_complete(self):
+        graph = WorkflowGraph()
+        graph.complete('a')
+        graph.add('b', ['a'])
+        self.assertEqual(0, graph.remaining('b'))
+        self.assertEqual(['b'], graph.ready())
+
+    def test_waiting_on_and_dependents(self):
+        graph = _diamond()
+        graph.complete('a')
+        graph.complete('b')
+        self.assertEqual(['c'], graph.waiting_on('d'))
+        self.assertEqual(['b', 'c'], sorted(graph.dependents('a')))
+        self.assertEqual([], graph.dependents('d'))
+
+    def test_downstream_skips_the_completed(self):
+        graph = _diamond()
+        self.assertEqual(['b', 'c', 'd'], sorted(graph.downstream('a')))
+        graph.complete('a')
+        graph.complete('b')
+        self.assertEqual(['d'], graph.downstream('b'))
+        self.assertEqual(['c', 'd'], sorted(graph.downstream('a')))
+
+
+if __name__ == '__main__':
+    unittest.main()
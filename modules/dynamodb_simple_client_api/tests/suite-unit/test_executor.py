@@ -0,0 +1,109 @@
+"""
+The in-process executor's failure paths, against the benchmark stand-in
+for DynamoDB.
+"""
+
+import logging
+import os
+import sys
+import unittest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(TESTS_DIR, '..', '..', 'local', 'python2_3', 'src')
+sys.path.insert(0, SRC_DIR)
+sys.path.insert(0, os.path.join(TESTS_DIR, '..', 'suite-benchmark'))
+
+from whimbrel_client import WhimbrelClient
+from whimbrel_client.executor import WorkflowExecutor, Activity
+from standin_db import StandInDb
+
+
+class FailingDb(StandInDb):
+    """
+    Fails the update moving the activity `fail_activity` to `fail_state`.
+    """
+    def __init__(self, fail_activity, fail_state):
+        StandInDb.__init__(self)
+        self.fail_activity = fail_activity
+        self.fail_state = fail_state
+
+    def update_item(self, TableName, Key, UpdateExpression, ConditionExpression=None, ExpressionAttributeNames=None,
+                    ExpressionAttributeValues=None, **kwargs):
+        activity_exec_id = Key.get('activity_exec_id', {}).get('S', '')
+        if (activity_exec_id.startswith(self.fail_activity + '::') and
+                (ExpressionAttributeValues or {}).get(':to') == {'S': self.fail_state}):
+            raise RuntimeError("connection reset")
+        return StandInDb.update_item(
+            self, TableName, Key, UpdateExpression, ConditionExpression, ExpressionAttributeNames,
+            ExpressionAttributeValues, **kwargs)
+
+
+def noop(activity_exec):
+    pass
+
+
+def broken(activity_exec):
+    raise ValueError("broken")
+
+
+def chain(*runs):
+    def decide(workflow_exec):
+        activities = []
+        for i in range(len(runs)):
+            activities.append(Activity('a{0}'.format(i), runs[i], i > 0 and ['a{0}'.format(i - 1)] or []))
+        return activities
+    return decide
+
+
+class ExecutorFailureTest(unittest.TestCase):
+    def setUp(self):
+        # The executor logs the errors raised on its threads.
+        self.logger = logging.getLogger('whimbrel_client.executor')
+        self.level = self.logger.level
+        self.logger.setLevel(logging.CRITICAL)
+
+    def tearDown(self):
+        self.logger.setLevel(self.level)
+
+    def run_workflow(self, db, decide):
+        executor = WorkflowExecutor(WhimbrelClient(db=db), {'w': decide}, workers=1)
+        try:
+            return executor.run('w')
+        finally:
+            executor.shutdown()
+
+    def states(self, db, workflow_exec):
+        workflow = db.tables['whimbrel_workflow_exec'][(workflow_exec.workflow_exec_id, 'w')]
+        activities = dict(
+            (item['activity_name']['S'], item['state']['S'])
+            for item in db.tables['whimbrel_activity_exec'].values())
+        return workflow['state']['S'], activities
+
+    def test_completes(self):
+        db = StandInDb()
+        workflow_exec = self.run_workflow(db, chain(noop, noop))
+        self.assertEqual(('COMPLETED', {'a0': 'COMPLETED', 'a1': 'COMPLETED'}), self.states(db, workflow_exec))
+
+    def test_activity_failure_cancels_the_rest(self):
+        db = StandInDb()
+        workflow_exec = self.run_workflow(db, chain(noop, broken, noop))
+        self.assertEqual(('FAILED', {'a0': 'COMPLETED', 'a1': 'FAILED', 'a2': 'CANCELLED'}),
+                         self.states(db, workflow_exec))
+        self.assertEqual(None, workflow_exec.error)
+
+    def test_executor_error_fails_the_workflow(self):
+        db = FailingDb('a1', 'RUNNING')
+        workflow_exec = self.run_workflow(db, chain(noop, noop, noop))
+        self.assertEqual(('FAILED', {'a0': 'COMPLETED', 'a1': 'CANCELLED', 'a2': 'CANCELLED'}),
+                         self.states(db, workflow_exec))
+        self.assertTrue(isinstance(workflow_exec.error, RuntimeError))
+
+    def test_executor_error_after_running(self):
+        db = FailingDb('a0', 'COMPLETED')
+        workflow_exec = self.run_workflow(db, chain(noop, noop))
+        self.assertEqual(('FAILED', {'a0': 'CANCELLED_RUNNING', 'a1': 'CANCELLED'}), self.states(db, workflow_exec))
+        self.assertTrue(isinstance(workflow_exec.error, RuntimeError))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+"""
+The standard library DynamoDB client's request and response bodies, with
+a stand-in for the HTTP exchange.
+"""
+
+import json
+import os
+import sys
+import unittest
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'local', 'python2_3', 'src')
+sys.path.insert(0, SRC_DIR)
+
+from whimbrel_client.lite import LiteDbClient, LiteClientError, CredentialSource, Credentials
+
+DATA = b'\x00\x01\x02\xff'
+ENCODED = 'AAEC/w=='
+
+
+class StubClient(LiteDbClient):
+    """
+    Answers each request with the next of the (status, body) responses,
+    and keeps the request bodies.
+    """
+    def __init__(self, responses):
+        LiteDbClient.__init__(
+            self, CredentialSource(lambda: Credentials('key', 'secret')), 'us-east-1', sleep=lambda seconds: None)
+        self.responses = list(responses)
+        self.bodies = []
+
+    def _post(self, operation, body):
+        self.bodies.append(json.loads(body.decode('utf-8')))
+        status, response = self.responses.pop(0)
+        return status, json.dumps(response).encode('utf-8')
+
+
+class LiteDbClientTest(unittest.TestCase):
+    def test_binary_values_are_base64_encoded(self):
+        client = StubClient([(200, {})])
+        client.put_item(TableName='t', Item={
+            'id': {'S': 'a'},
+            'data': {'B': DATA},
+            'set': {'BS': [DATA, bytearray(b'x')]},
+            'nested': {'L': [{'M': {'B': {'B': DATA}}}]}
+        })
+        item = client.bodies[0]['Item']
+        self.assertEqual({'S': 'a'}, item['id'])
+        self.assertEqual({'B': ENCODED}, item['data'])
+        self.assertEqual({'BS': [ENCODED, 'eA==']}, item['set'])
+        self.assertEqual({'L': [{'M': {'B': {'B': ENCODED}}}]}, item['nested'])
+
+    def test_binary_values_are_decoded(self):
+        client = StubClient([(200, {'Items': [{
+            'id': {'S': 'a'},
+            'data': {'B': ENCODED},
+            'set': {'BS': [ENCODED]},
+            'nested': {'M': {'B': {'L': [{'B': ENCODED}]}}}
+        }], 'Count': 1})])
+        response = client.query(TableName='t')
+        item = response['Items'][0]
+        self.assertEqual({'S': 'a'}, item['id'])
+        self.assertEqual({'B': DATA}, item['data'])
+        self.assertEqual({'BS': [DATA]}, item['set'])
+        self.assertEqual({'M': {'B': {'L': [{'B': DATA}]}}}, item['nested'])
+        self.assertEqual(1, response['Count'])
+
+    def test_retries_throttled_requests(self):
+        throttled = {'__type': 'com.amazonaws.dynamodb.v20120810#ProvisionedThroughputExceededException'}
+        client = StubClient([(400, throttled), (200, {'Item': {'data': {'B': ENCODED}}})])
+        self.assertEqual({'Item': {'data': {'B': DATA}}}, client.get_item(TableName='t', Key={'id': {'S': 'a'}}))
+        self.assertEqual(2, len(client.bodies))
+
+    def test_error_response(self):
+        failed = {'__type': 'com.amazonaws.dynamodb.v20120810#ConditionalCheckFailedException', 'message': 'no'}
+        client = StubClient([(400, failed)])
+        try:
+            client.delete_item(TableName='t', Key={'id': {'B': DATA}})
+            self.fail("no error")
+        except LiteClientError as e:
+            self.assertEqual('ConditionalCheckFailedException', e.response['Error']['Code'])
+        self.assertEqual({'id': {'B': ENCODED}}, client.bodies[0]['Key'])
+
+
+if __name__ == '__main__':
+    unittest.main()
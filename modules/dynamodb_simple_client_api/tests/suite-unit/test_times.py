@@ -0,0 +1,79 @@
+"""
+The time attributes: the epoch and list forms, one at a time and in bulk,
+and the conversions between the item formats.
+"""
+
+import os
+import sys
+import unittest
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'local', 'python2_3', 'src')
+sys.path.insert(0, SRC_DIR)
+
+from whimbrel_client.times import (
+    FULL_FORMAT, COMPACT_FORMAT, ITEM_FORMAT_ATTRIBUTE, when_list, time_attributes, format_attributes,
+    item_format, item_epoch, item_time_list, epochs_to_lists, epochs_to_values, lists_to_epochs,
+    expand_items, compact_items
+)
+
+# 2000-02-29 23:59:59, the turn of a leap year's year, and the epoch.
+EPOCHS = [951868799, 951868800, 978307199, 978307200, 0, 1700000000]
+
+
+class TimesTest(unittest.TestCase):
+    def test_when_list(self):
+        self.assertEqual(
+            [{'N': '2000'}, {'N': '2'}, {'N': '29'}, {'N': '23'}, {'N': '59'}, {'N': '59'}], when_list(951868799))
+
+    def test_bulk_matches_one_at_a_time(self):
+        self.assertEqual([when_list(epoch) for epoch in EPOCHS], epochs_to_values(EPOCHS))
+        self.assertEqual(
+            [[int(part['N']) for part in when_list(epoch)] for epoch in EPOCHS], epochs_to_lists(EPOCHS))
+
+    def test_round_trip(self):
+        self.assertEqual(EPOCHS, lists_to_epochs(epochs_to_lists(EPOCHS)))
+        self.assertEqual(EPOCHS, lists_to_epochs(epochs_to_values(EPOCHS)))
+
+    def test_time_attributes(self):
+        full = time_attributes('start_time', 978307200)
+        self.assertEqual({'start_time_epoch', 'start_time'}, set(full.keys()))
+        compact = time_attributes('start_time', 978307200, COMPACT_FORMAT)
+        self.assertEqual({'start_time_epoch': {'N': '978307200'}}, compact)
+        self.assertEqual({}, format_attributes(FULL_FORMAT))
+        self.assertEqual(COMPACT_FORMAT, item_format(format_attributes(COMPACT_FORMAT)))
+
+    def test_item_readers_accept_both_formats(self):
+        full = {'when': {'L': when_list(978307200)}}
+        compact = {'when_epoch': {'N': '978307200'}}
+        self.assertEqual(978307200, item_epoch(full, 'when'))
+        self.assertEqual(978307200, item_epoch(compact, 'when'))
+        self.assertEqual([2001, 1, 1, 0, 0, 0], item_time_list(full, 'when'))
+        self.assertEqual([2001, 1, 1, 0, 0, 0], item_time_list(compact, 'when'))
+        self.assertEqual(None, item_epoch({}, 'when'))
+
+    def test_unset_times_stay_negative(self):
+        item = {'start_time_epoch': {'N': '-1'}}
+        self.assertEqual(-1, item_epoch(item, 'start_time'))
+        self.assertEqual(None, item_time_list(item, 'start_time'))
+        self.assertEqual([item], expand_items([item], ['start_time']))
+        self.assertFalse('start_time' in item)
+
+    def test_compact_then_expand(self):
+        items = [
+            dict(time_attributes('start_time', epoch)) for epoch in EPOCHS
+        ]
+        # An old item with only the list.
+        del items[0]['start_time_epoch']
+        original = [dict(item) for item in items]
+        original[0]['start_time_epoch'] = {'N': str(EPOCHS[0])}
+        compact_items(items, ['start_time'])
+        for item, epoch in zip(items, EPOCHS):
+            self.assertEqual({'start_time_epoch': {'N': str(epoch)}, ITEM_FORMAT_ATTRIBUTE: {'N': '2'}}, item)
+        expand_items(items, ['start_time'])
+        for item, expected in zip(items, original):
+            del item[ITEM_FORMAT_ATTRIBUTE]
+            self.assertEqual(expected, item)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+"""
+The installer's table waiter: its backoff, deadline and batch waiting,
+against a stand-in `describe_table` and a fake clock.
+"""
+
+import os
+import sys
+import types
+import unittest
+
+INSTALLER_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', '..', 'installer')
+
+
+def _import_waiter():
+    """
+    Import `whimbrel.install.db.waiter` without running the package
+    `__init__` modules, which import the whole installer and boto3.
+    """
+    for name, path in (('whimbrel', ['whimbrel']),
+                       ('whimbrel.install', ['whimbrel', 'install']),
+                       ('whimbrel.install.db', ['whimbrel', 'install', 'db'])):
+        if name not in sys.modules:
+            package = types.ModuleType(name)
+            package.__path__ = [os.path.join(INSTALLER_DIR, *path)]
+            sys.modules[name] = package
+    from whimbrel.install.db import waiter
+    return waiter
+
+
+waiter = _import_waiter()
+
+
+class FakeClock(object):
+    def __init__(self):
+        object.__init__(self)
+        self.now = 1000.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class Tables(object):
+    """
+    `describe_table` for tables that become active after a number of
+    polls; None never does.
+    """
+    def __init__(self, polls):
+        object.__init__(self)
+        self.polls = dict(polls)
+        self.calls = []
+
+    def describe_table(self, TableName):
+        self.calls.append(TableName)
+        left = self.polls[TableName]
+        if left is not None:
+            left -= 1
+            self.polls[TableName] = left
+        status = left is not None and left <= 0 and 'ACTIVE' or 'CREATING'
+        return {'Table': {'TableName': TableName, 'TableStatus': status}}
+
+
+def _waiter(tables, clock, **kwargs):
+    return waiter.TableWaiter(tables, progress=False, sleep=clock.sleep, clock=clock, **kwargs)
+
+
+class TableWaiterTest(unittest.TestCase):
+    def test_backoff_doubles_up_to_the_cap(self):
+        w = _waiter(Tables({}), FakeClock(), initial_delay=1, max_delay=5, jitter=0)
+        self.assertEqual([1, 2, 4, 5, 5], [w.next_delay(attempt) for attempt in range(5)])
+
+    def test_jitter_stays_within_the_fraction(self):
+        low = _waiter(Tables({}), FakeClock(), initial_delay=4, max_delay=4, jitter=0.5, rand=lambda: 0.0)
+        high = _waiter(Tables({}), FakeClock(), initial_delay=4, max_delay=4, jitter=0.5, rand=lambda: 1.0)
+        self.assertEqual(2.0, low.next_delay(0))
+        self.assertEqual(4.0, high.next_delay(0))
+
+    def test_wait_polls_until_active(self):
+        clock = FakeClock()
+        tables = Tables({'t': 3})
+        w = _waiter(tables, clock, initial_delay=1, max_delay=20, jitter=0)
+        response = w.wait('t')
+        self.assertEqual('ACTIVE', response['Table']['TableStatus'])
+        self.assertEqual([1, 2], clock.sleeps)
+        self.assertEqual(3, w.stats.describe_calls)
+        self.assertEqual(3.0, w.stats.table_seconds['t'])
+
+    def test_wait_skips_an_active_description(self):
+        tables = Tables({'t': 1})
+        w = _waiter(tables, FakeClock())
+        w.wait('t', {'Table': {'TableName': 't', 'TableStatus': 'ACTIVE'}})
+        self.assertEqual([], tables.calls)
+
+    def test_deadline_raises(self):
+        clock = FakeClock()
+        w = _waiter(Tables({'t': None}), clock, initial_delay=1, max_delay=4, deadline=10, jitter=0)
+        try:
+            w.wait('t')
+            self.fail("no timeout")
+        except waiter.TableWaitTimeout as e:
+            self.assertEqual(['t'], e.pending)
+            self.assertEqual(10.0, e.waited)
+        # The last sleep is cut short to end at the deadline.
+        self.assertEqual([1, 2, 4, 3], clock.sleeps)
+
+    def test_wait_all_polls_only_the_pending_tables(self):
+        tables = Tables({'a': 1, 'b': 3})
+        w = _waiter(tables, FakeClock(), initial_delay=1, jitter=0)
+        self.assertEqual(['a', 'b'], sorted(w.wait_all(['a', 'b', 'a']).keys()))
+        self.assertEqual(['a', 'b', 'b', 'b'], tables.calls)
+        self.assertEqual({'a': 1, 'b': 3}, w.stats.table_describe_calls)
+
+    def test_wait_all_any_active(self):
+        tables = Tables({'a': 2, 'b': None})
+        w = _waiter(tables, FakeClock(), initial_delay=1, jitter=0)
+        self.assertEqual(['a'], list(w.wait_all(['a', 'b'], waiter.ANY_ACTIVE).keys()))
+
+    def test_mark_started_measures_from_the_request(self):
+        clock = FakeClock()
+        w = _waiter(Tables({'t': 2}), clock, initial_delay=1, jitter=0)
+        w.mark_started('t')
+        clock.now += 5
+        w.wait('t')
+        self.assertEqual(6.0, w.stats.table_seconds['t'])
+
+    def test_is_active_checks_the_indexes(self):
+        table = {'TableName': 't', 'TableStatus': 'ACTIVE',
+                 'GlobalSecondaryIndexes': [{'IndexName': 'i', 'IndexStatus': 'CREATING'}]}
+        self.assertFalse(waiter.is_active({'Table': table}))
+        table['GlobalSecondaryIndexes'][0]['IndexStatus'] = 'ACTIVE'
+        self.assertTrue(waiter.is_active({'TableDescription': table}))
+
+
+if __name__ == '__main__':
+    unittest.main()
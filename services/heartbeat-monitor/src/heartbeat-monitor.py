@@ -0,0 +1,54 @@
+#!/usr/bin/python
+
+import logging
+import os
+import signal
+import sys
+
+# The Python client, from this checkout, unless it is already installed.
+sys.path.append(os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', '..', '..',
+    'modules', 'dynamodb_simple_client_api', 'local', 'python2_3', 'src'))
+
+from whimbrel_client.cli import CommandLine
+from heartbeat_monitor import HeartbeatMonitor, MetricsServer
+
+args = CommandLine(sys.argv, {
+    '--timeout': 'timeout',
+    '--interval': 'interval',
+    '--segments': 'segments',
+    '--workers': 'workers',
+    '--metrics-port': 'metrics_port'
+}, {
+    '--scan': 'scan',
+    '--once': 'once'
+}, defaults={'timeout': '300', 'interval': '60', 'segments': '4', 'workers': '8', 'source': 'Heartbeat Monitor'})
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+client = args.client(max_pool_connections=int(args.get('workers')) + int(args.get('segments')), lite=True)
+monitor = HeartbeatMonitor(
+    client, timeout=int(args.get('timeout')), segments=int(args.get('segments')),
+    workers=int(args.get('workers')), use_index=not args.get('scan', False))
+
+if args.get('once', False):
+    monitor.run_once()
+    sys.stdout.write(monitor.metrics.text())
+    sys.exit(0)
+
+metrics_server = None
+if args.get('metrics_port') is not None:
+    metrics_server = MetricsServer(monitor.metrics, int(args.get('metrics_port')))
+    metrics_server.start()
+
+
+def stop(signum, frame):
+    monitor.stop()
+
+
+signal.signal(signal.SIGTERM, stop)
+signal.signal(signal.SIGINT, stop)
+try:
+    monitor.run_forever(float(args.get('interval')))
+finally:
+    if metrics_server is not None:
+        metrics_server.close()
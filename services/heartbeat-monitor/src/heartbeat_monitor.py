@@ -0,0 +1,425 @@
+"""
+The heartbeat monitor.
+
+Each pass finds the `RUNNING` activities with heartbeats enabled whose
+`heartbeat_time_epoch` is older than the timeout, moves each to
+`TIMED_OUT`, and fails its workflow execution.
+
+The stale activities are found with a Query of the `state_heartbeat` index
+on `activity_exec` (hash `state`, range `heartbeat_time_epoch`), which
+only reads the stale items.  If the table has no such index, the monitor
+falls back to a parallel segmented Scan, with a filter and a projection so
+that only the few attributes it needs come back.
+
+Each timeout is a conditional update that still requires the activity to
+be `RUNNING` with the stale heartbeat, so an activity that sent a
+heartbeat, or finished, since the index was read is left alone.
+Conditional updates can't be sent in a BatchWriteItem, and a transaction
+fails as a whole when any one condition fails, so the updates for a pass
+are sent in parallel from a pool of threads instead.
+
+The owning workflow moves from `RUNNING` to `FAILED_WAITING`: it failed,
+but its other activities may still be running.  Whoever runs the workflow
+finishes it as `FAILED` once they stop.
+
+An update that raises an error is logged and counted, and the other updates
+of the pass go ahead.  The activity is still `RUNNING`, so the next pass
+finds it again.  A workflow that couldn't be failed is tried again on the
+next pass.
+"""
+
+import logging
+import threading
+import time
+
+try:
+    # Python 3
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+from whimbrel_client import error_code, is_conditional_check_failure
+from whimbrel_client.threads import in_threads, split
+from whimbrel_client.transitions import (
+    ACTIVITY_STATES_BY_FORMAT, WorkflowTransitionEngine, TransitionNotAllowed, ItemNotFound
+)
+
+_LOG = logging.getLogger(__name__)
+
+HEARTBEAT_INDEX = 'state_heartbeat'
+
+# The attributes each stale activity needs; the index projects them all.
+PROJECTION = 'activity_exec_id, workflow_exec_id, workflow_name, heartbeat_time_epoch'
+
+# Errors meaning the index does not exist on the table.
+MISSING_INDEX_ERRORS = ('ValidationException', 'ResourceNotFoundException')
+
+
+class MonitorMetrics(object):
+    """
+    Counters for the monitor passes.  `last_*` describe the most recent
+    pass; the others are totals since the monitor started.
+    """
+    def __init__(self):
+        object.__init__(self)
+        self.__lock = threading.Lock()
+        self.passes = 0
+        self.failed_passes = 0
+        self.scan_seconds = 0.0
+        self.last_scan_seconds = 0.0
+        self.last_pass_time = 0
+        self.items_examined = 0
+        self.last_items_examined = 0
+        self.timeouts = 0
+        self.last_timeouts = 0
+        self.conflicts = 0
+        self.workflows_failed = 0
+        self.errors = 0
+
+    def add_pass(self, scan_seconds, items_examined, timeouts, conflicts, workflows_failed, when, errors=0):
+        with self.__lock:
+            self.passes += 1
+            self.scan_seconds += scan_seconds
+            self.last_scan_seconds = scan_seconds
+            self.last_pass_time = when
+            self.items_examined += items_examined
+            self.last_items_examined = items_examined
+            self.timeouts += timeouts
+            self.last_timeouts = timeouts
+            self.conflicts += conflicts
+            self.workflows_failed += workflows_failed
+            self.errors += errors
+
+    def add_failed_pass(self):
+        with self.__lock:
+            self.failed_passes += 1
+
+    def text(self):
+        """
+        The metrics in the Prometheus text format.
+        """
+        with self.__lock:
+            values = [
+                ('passes_total', 'counter', 'Monitor passes run.', self.passes),
+                ('failed_passes_total', 'counter', 'Monitor passes that raised an error.', self.failed_passes),
+                ('scan_seconds_total', 'counter', 'Time spent finding the stale activities.', self.scan_seconds),
+                ('last_scan_seconds', 'gauge', 'Time the last pass spent finding the stale activities.',
+                    self.last_scan_seconds),
+                ('last_pass_time_seconds', 'gauge', 'Epoch time the last pass finished.', self.last_pass_time),
+                ('items_examined_total', 'counter', 'Activity items read from the index or scan.',
+                    self.items_examined),
+                ('last_items_examined', 'gauge', 'Activity items read by the last pass.',
+                    self.last_items_examined),
+                ('timeouts_total', 'counter', 'Activities moved to TIMED_OUT.', self.timeouts),
+                ('last_timeouts', 'gauge', 'Activities moved to TIMED_OUT by the last pass.', self.last_timeouts),
+                ('conflicts_total', 'counter', 'Stale activities that changed before the update.', self.conflicts),
+                ('workflows_failed_total', 'counter', 'Workflow executions moved to FAILED_WAITING.',
+                    self.workflows_failed),
+                ('errors_total', 'counter', 'Activity and workflow updates that raised an error.', self.errors)
+            ]
+        lines = []
+        for name, kind, description, value in values:
+            lines.append('# HELP whimbrel_heartbeat_monitor_{0} {1}'.format(name, description))
+            lines.append('# TYPE whimbrel_heartbeat_monitor_{0} {1}'.format(name, kind))
+            lines.append('whimbrel_heartbeat_monitor_{0} {1}'.format(name, value))
+        return '\n'.join(lines) + '\n'
+
+
+class HeartbeatMonitor(object):
+    """
+    Times out the activities whose heartbeats stopped.
+
+    :param client: WhimbrelClient
+    :param timeout: seconds without a heartbeat before an activity times
+        out.
+    :param segments: number of parallel scan segments, when there is no
+        index to query.
+    :param workers: number of updates sent at once.
+    :param use_index: False to always scan, rather than query the
+        `state_heartbeat` index.
+    """
+    def __init__(self, client, timeout=300, segments=4, workers=8, use_index=True, clock=time.time):
+        object.__init__(self)
+        assert segments > 0
+        assert workers > 0
+        self.__client = client
+        self.__timeout = timeout
+        self.__segments = segments
+        self.__use_index = use_index
+        self.__clock = clock
+        self.__writer = TimeoutWriter(client, workers, clock)
+        self.__stop = threading.Event()
+        self.metrics = MonitorMetrics()
+
+    def run_forever(self, interval=60):
+        """
+        Run a pass every `interval` seconds, until `stop` is called.  A
+        failed pass is logged, and the next one runs as usual.
+        """
+        self.__stop.clear()
+        while not self.__stop.is_set():
+            start = self.__clock()
+            try:
+                self.run_once()
+            except Exception:
+                _LOG.exception("heartbeat monitor pass failed")
+                self.metrics.add_failed_pass()
+            self.__stop.wait(max(0.0, interval - (self.__clock() - start)))
+
+    def stop(self):
+        self.__stop.set()
+
+    def run_once(self):
+        """
+        Run one pass.
+
+        :return: the number of activities timed out.
+        """
+        now = int(self.__clock())
+        cutoff = now - self.__timeout
+        scan_start = self.__clock()
+        stale, examined = self.find_stale(cutoff)
+        scan_seconds = self.__clock() - scan_start
+
+        timed_out, conflicts, failed, errors = self.__writer.time_out(stale, cutoff, now)
+
+        self.metrics.add_pass(scan_seconds, examined, len(timed_out), len(conflicts), len(failed), self.__clock(),
+                              errors)
+        if len(timed_out) > 0:
+            _LOG.info("timed out %d activities in %d workflows (%d examined, %.2fs scan)",
+                      len(timed_out), len(failed), examined, scan_seconds)
+        return len(timed_out)
+
+    def find_stale(self, cutoff):
+        """
+        :return: (the stale activity items, the number of items examined)
+        """
+        if self.__use_index:
+            try:
+                return self._query(cutoff)
+            except Exception as e:
+                if error_code(e) not in MISSING_INDEX_ERRORS:
+                    raise
+                _LOG.warning("cannot query the %s index (%s); scanning instead", HEARTBEAT_INDEX, e)
+                self.__use_index = False
+        return self._scan(cutoff)
+
+    def _query(self, cutoff):
+        return query_heartbeats(self.__client, cutoff)
+
+    def _scan(self, cutoff):
+        stale = []
+        examined = [0] * self.__segments
+        lock = threading.Lock()
+
+        def segment_scan(segments):
+            segment = segments[0]
+            args = {
+                'TableName': self.__client.table_name('activity_exec'),
+                'FilterExpression':
+                    '#state = :running AND heartbeat_enabled = :true AND '
+                    'heartbeat_time_epoch BETWEEN :zero AND :cutoff',
+                'ProjectionExpression': PROJECTION,
+                'ExpressionAttributeNames': {'#state': 'state'},
+                'ExpressionAttributeValues': {
+                    ':running': {'S': 'RUNNING'},
+                    ':zero': {'N': '0'},
+                    ':cutoff': {'N': str(cutoff - 1)},
+                    ':true': {'BOOL': True}
+                }
+            }
+            if self.__segments > 1:
+                args['Segment'] = segment
+                args['TotalSegments'] = self.__segments
+            while True:
+                response = self.__client.db.scan(**args)
+                examined[segment] += response.get('ScannedCount', 0)
+                with lock:
+                    stale.extend(response.get('Items', []))
+                if 'LastEvaluatedKey' not in response:
+                    return
+                args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+        in_threads(segment_scan, [[segment] for segment in range(self.__segments)])
+        return stale, sum(examined)
+
+
+class TimeoutWriter(object):
+    """
+    Moves stale activities to `TIMED_OUT`, and their workflows to
+    `FAILED_WAITING`, sending the updates from a pool of threads.  A
+    workflow whose update raised an error is tried again on the next call.
+
+    :param client: WhimbrelClient
+    :param workers: number of updates sent at once.
+    """
+    def __init__(self, client, workers=8, clock=time.time):
+        object.__init__(self)
+        assert workers > 0
+        self.__client = client
+        self.__workers = workers
+        # workflow exec ID -> workflow name, for the workflows still to fail.
+        self.__unfailed = {}
+        self.__unfailed_lock = threading.Lock()
+        self.__workflow_states = WorkflowTransitionEngine(client, clock=clock)
+        self.__timeout_transition = ACTIVITY_STATES_BY_FORMAT[client.item_format].exact('RUNNING', 'TIMEOUT')
+
+    def time_out(self, items, cutoff, now):
+        """
+        :param items: the stale activities, each with the
+            `activity_exec_id`, `workflow_exec_id` and `workflow_name`
+            attributes.
+        :param cutoff: only activities whose heartbeat is older than this
+            epoch time are timed out.
+        :return: (the items timed out, the items that changed since they
+            were read, the workflow exec IDs moved to FAILED_WAITING, the
+            items whose update raised an error)
+        """
+        timed_out = []
+        conflicts = []
+        failed = []
+        errors = []
+        lock = threading.Lock()
+
+        def time_out_activities(chunk):
+            for item in chunk:
+                try:
+                    done = self._time_out(item, cutoff, now)
+                except Exception:
+                    _LOG.exception("activity %s not timed out", item['activity_exec_id']['S'])
+                    with lock:
+                        errors.append(item)
+                    continue
+                with lock:
+                    if done:
+                        timed_out.append(item)
+                    else:
+                        conflicts.append(item)
+
+        in_threads(time_out_activities, split(items, self.__workers))
+
+        with self.__unfailed_lock:
+            workflows = self.__unfailed
+            self.__unfailed = {}
+        for item in timed_out:
+            workflows[item['workflow_exec_id']['S']] = item['workflow_name']['S']
+
+        def fail_workflows(chunk):
+            for workflow_exec_id, workflow_name in chunk:
+                try:
+                    done = self._fail_workflow(workflow_exec_id, workflow_name)
+                except Exception:
+                    _LOG.exception("workflow %s not failed; trying again next time", workflow_exec_id)
+                    with self.__unfailed_lock:
+                        self.__unfailed[workflow_exec_id] = workflow_name
+                    continue
+                if done:
+                    with lock:
+                        failed.append(workflow_exec_id)
+
+        in_threads(fail_workflows, split(sorted(workflows.items()), self.__workers))
+        return timed_out, conflicts, failed, errors
+
+    def _time_out(self, item, cutoff, now):
+        """
+        :return: True if the activity moved to TIMED_OUT, False if it
+            changed since it was read.
+        """
+        request = self.__timeout_transition.request(self.__client.table_name('activity_exec'), {
+            'activity_exec_id': item['activity_exec_id'],
+            'workflow_exec_id': item['workflow_exec_id']
+        }, now)
+        request['ConditionExpression'] += ' AND heartbeat_enabled = :true AND heartbeat_time_epoch < :cutoff'
+        values = dict(request['ExpressionAttributeValues'])
+        values[':true'] = {'BOOL': True}
+        values[':cutoff'] = {'N': str(cutoff)}
+        request['ExpressionAttributeValues'] = values
+        try:
+            self.__client.db.update_item(**request)
+        except Exception as e:
+            if is_conditional_check_failure(e):
+                return False
+            raise
+        return True
+
+    def _fail_workflow(self, workflow_exec_id, workflow_name):
+        """
+        :return: True if the workflow moved to FAILED_WAITING, False if it
+            had already failed or finished.
+        """
+        try:
+            self.__workflow_states.transition_workflow(workflow_exec_id, workflow_name, 'FAILED_WAITING', 'RUNNING')
+        except (TransitionNotAllowed, ItemNotFound) as e:
+            _LOG.info("workflow %s not failed: %s", workflow_exec_id, e)
+            return False
+        return True
+
+
+class MetricsServer(object):
+    """
+    Serves the monitor metrics, in the Prometheus text format, over HTTP
+    from a background thread.
+    """
+    def __init__(self, metrics, port, host=''):
+        object.__init__(self)
+        self.__server = HTTPServer((host, port), _MetricsHandler)
+        self.__server.metrics = metrics
+        self.__thread = threading.Thread(target=self.__server.serve_forever, name="heartbeat-monitor-metrics")
+        self.__thread.daemon = True
+
+    @property
+    def port(self):
+        return self.__server.server_address[1]
+
+    def start(self):
+        self.__thread.start()
+
+    def close(self):
+        self.__server.shutdown()
+        self.__server.server_close()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = self.server.metrics.text().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def query_heartbeats(client, before):
+    """
+    Query the `state_heartbeat` index for the `RUNNING` activities with
+    heartbeats enabled, whose last heartbeat is older than `before`.
+
+    :return: (the activity items, the number of items examined)
+    """
+    args = {
+        'TableName': client.table_name('activity_exec'),
+        'IndexName': HEARTBEAT_INDEX,
+        'KeyConditionExpression': '#state = :running AND heartbeat_time_epoch BETWEEN :zero AND :before',
+        'FilterExpression': 'heartbeat_enabled = :true',
+        'ProjectionExpression': PROJECTION,
+        'ExpressionAttributeNames': {'#state': 'state'},
+        'ExpressionAttributeValues': {
+            ':running': {'S': 'RUNNING'},
+            ':zero': {'N': '0'},
+            ':before': {'N': str(before - 1)},
+            ':true': {'BOOL': True}
+        }
+    }
+    items = []
+    examined = 0
+    while True:
+        response = client.db.query(**args)
+        items.extend(response.get('Items', []))
+        examined += response.get('ScannedCount', len(response.get('Items', [])))
+        if 'LastEvaluatedKey' not in response:
+            return items, examined
+        args['ExclusiveStartKey'] = response['LastEvaluatedKey']
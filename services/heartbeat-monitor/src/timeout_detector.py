@@ -0,0 +1,316 @@
+"""
+Event driven heartbeat timeouts.
+
+The polling `HeartbeatMonitor` reads the index on every pass, whether or
+not anything timed out.  `TimeoutDetector` instead keeps the heartbeat
+deadline of every running activity in memory, updates it as the heartbeats
+arrive, and only writes when a deadline passes.  It is fed with the
+`activity_exec` stream records (`apply_record`), or directly by a process
+that sends the heartbeats (`heartbeat` and `finished`).  When it starts, it
+loads the running activities with one Query of the `state_heartbeat` index
+(`rebuild`).
+
+The deadlines are kept in a `DeadlineWheel`: a timing wheel with one
+bucket per tick, so a new heartbeat moves the activity between two
+buckets, and finding the expired activities only looks at the buckets
+that have passed.  Unlike a heap, a heartbeat leaves no stale entry
+behind, so the memory stays proportional to the number of activities.
+
+An expired activity is timed out with the same conditional update as the
+polling monitor.  If the update finds a newer heartbeat, one the detector
+never saw, the activity is read again and its deadline moved.  If the
+update (or the read) raises an error, the activity is given a deadline one
+tick away, to try again.
+"""
+
+import logging
+import threading
+import time
+
+from heartbeat_monitor import TimeoutWriter, query_heartbeats
+
+_LOG = logging.getLogger(__name__)
+
+# Later than any heartbeat; for loading all the running activities.
+MAX_EPOCH = 2 ** 53
+
+
+class DeadlineWheel(object):
+    """
+    Deadlines for a set of keys, bucketed by tick.  The buckets are kept in
+    a dictionary by their tick number, so the wheel has no fixed span, and
+    a deadline can be any time.  Not thread safe.
+
+    :param tick: seconds per bucket; an expired key is returned up to one
+        tick after its deadline.
+    """
+    def __init__(self, tick=1):
+        object.__init__(self)
+        assert tick > 0
+        self.__tick = tick
+        # bucket number -> set of keys
+        self.__buckets = {}
+        # key -> (bucket number, value)
+        self.__entries = {}
+        # the first bucket not yet expired; None until the first expire.
+        self.__next = None
+
+    def schedule(self, key, deadline, value=None):
+        """
+        Set the key's deadline, replacing any earlier one.
+
+        :param value: kept with the key, and returned when it expires.
+        """
+        bucket = int(deadline // self.__tick)
+        if self.__next is not None and bucket < self.__next:
+            bucket = self.__next
+        entry = self.__entries.get(key)
+        if entry is not None:
+            if entry[0] == bucket:
+                if entry[1] is not value:
+                    self.__entries[key] = (bucket, value)
+                return
+            self._discard(key, entry[0])
+        self.__entries[key] = (bucket, value)
+        keys = self.__buckets.get(bucket)
+        if keys is None:
+            keys = set()
+            self.__buckets[bucket] = keys
+        keys.add(key)
+
+    def cancel(self, key):
+        """
+        :return: True if the key had a deadline.
+        """
+        entry = self.__entries.pop(key, None)
+        if entry is None:
+            return False
+        self._discard(key, entry[0])
+        return True
+
+    def expire(self, now):
+        """
+        Remove the keys whose bucket ended by `now`.
+
+        :return: list of (key, value)
+        """
+        end = int(now // self.__tick)
+        if self.__next is None:
+            if len(self.__buckets) <= 0:
+                self.__next = end
+                return []
+            self.__next = min(self.__buckets.keys())
+        ret = []
+        if end - self.__next > len(self.__buckets):
+            # A long gap since the last call; only visit the buckets that exist.
+            passed = sorted(b for b in self.__buckets.keys() if b < end)
+        else:
+            passed = range(self.__next, end)
+        for bucket in passed:
+            keys = self.__buckets.pop(bucket, None)
+            if keys is not None:
+                for key in keys:
+                    ret.append((key, self.__entries.pop(key)[1]))
+        self.__next = max(self.__next, end)
+        return ret
+
+    def clear(self):
+        self.__buckets = {}
+        self.__entries = {}
+        self.__next = None
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def __contains__(self, key):
+        return key in self.__entries
+
+    def _discard(self, key, bucket):
+        keys = self.__buckets.get(bucket)
+        if keys is not None:
+            keys.discard(key)
+            if len(keys) <= 0:
+                del self.__buckets[bucket]
+
+
+class DetectorStats(object):
+    def __init__(self):
+        object.__init__(self)
+        self.records = 0
+        self.expired = 0
+        self.timeouts = 0
+        self.conflicts = 0
+        self.rescheduled = 0
+        self.workflows_failed = 0
+        self.errors = 0
+        self.last_expire_seconds = 0.0
+
+
+class TimeoutDetector(object):
+    """
+    Times out the activities whose heartbeat deadline passes.  Safe to feed
+    from several threads while another runs `expire`.
+
+    :param client: WhimbrelClient
+    :param timeout: seconds without a heartbeat before an activity times
+        out.
+    :param tick: resolution of the deadlines, in seconds.
+    :param workers: number of updates sent at once.
+    """
+    def __init__(self, client, timeout=300, tick=1, workers=8, clock=time.time):
+        object.__init__(self)
+        self.__client = client
+        self.__timeout = timeout
+        self.__tick = tick
+        self.__clock = clock
+        self.__writer = TimeoutWriter(client, workers, clock)
+        self.__wheel = DeadlineWheel(tick)
+        self.__lock = threading.Lock()
+        # The workflow names, shared by all the activities of the workflow.
+        self.__names = {}
+        self.__stop = threading.Event()
+        self.stats = DetectorStats()
+
+    def __len__(self):
+        return len(self.__wheel)
+
+    def heartbeat(self, activity_exec_id, workflow_exec_id, workflow_name, heartbeat_epoch):
+        """
+        Record a heartbeat of a running activity.
+        """
+        with self.__lock:
+            name = self.__names.setdefault(workflow_name, workflow_name)
+            self.__wheel.schedule(
+                (activity_exec_id, workflow_exec_id), heartbeat_epoch + self.__timeout, name)
+
+    def finished(self, activity_exec_id, workflow_exec_id):
+        """
+        Stop tracking an activity that is no longer running.
+        """
+        with self.__lock:
+            self.__wheel.cancel((activity_exec_id, workflow_exec_id))
+
+    def apply_record(self, record):
+        """
+        Apply an `activity_exec` stream record (NEW_IMAGE or
+        NEW_AND_OLD_IMAGES).
+        """
+        with self.__lock:
+            self.stats.records += 1
+        data = record['dynamodb']
+        keys = data.get('NewImage') or data['Keys']
+        activity_exec_id = keys['activity_exec_id']['S']
+        workflow_exec_id = keys['workflow_exec_id']['S']
+        if record['eventName'] == 'REMOVE' or not self.apply_item(data.get('NewImage', {})):
+            self.finished(activity_exec_id, workflow_exec_id)
+
+    def apply_item(self, item):
+        """
+        Track the `activity_exec` item, if it is running with heartbeats.
+
+        :return: True if it is tracked.
+        """
+        if item.get('state', {}).get('S') != 'RUNNING' or not item.get('heartbeat_enabled', {}).get('BOOL'):
+            return False
+        heartbeat_epoch = int(item.get('heartbeat_time_epoch', {}).get('N', '-1'))
+        if heartbeat_epoch < 0:
+            return False
+        self.heartbeat(item['activity_exec_id']['S'], item['workflow_exec_id']['S'], item['workflow_name']['S'],
+                       heartbeat_epoch)
+        return True
+
+    def rebuild(self):
+        """
+        Replace the deadlines with those of the running activities in the
+        table; call when the detector starts.
+
+        :return: the number of activities tracked.
+        """
+        items, examined = query_heartbeats(self.__client, MAX_EPOCH)
+        with self.__lock:
+            self.__wheel.clear()
+            self.__names = {}
+        for item in items:
+            item['state'] = {'S': 'RUNNING'}
+            item['heartbeat_enabled'] = {'BOOL': True}
+            self.apply_item(item)
+        _LOG.info("tracking %d running activities", len(self.__wheel))
+        return len(self.__wheel)
+
+    def expire(self, now=None):
+        """
+        Time out the activities whose deadline passed.
+
+        :return: the number of activities timed out.
+        """
+        start = self.__clock()
+        now = int(now is None and start or now)
+        with self.__lock:
+            expired = self.__wheel.expire(now)
+        if len(expired) <= 0:
+            return 0
+        items = [{
+            'activity_exec_id': {'S': activity_exec_id},
+            'workflow_exec_id': {'S': workflow_exec_id},
+            'workflow_name': {'S': workflow_name}
+        } for (activity_exec_id, workflow_exec_id), workflow_name in expired]
+        timed_out, conflicts, failed, errors = self.__writer.time_out(items, now - self.__timeout, now)
+        rescheduled = 0
+        for item in conflicts:
+            try:
+                if self._reload(item):
+                    rescheduled += 1
+            except Exception:
+                _LOG.exception("activity %s not read again", item['activity_exec_id']['S'])
+                errors.append(item)
+        for item in errors:
+            self._retry(item, now + self.__tick)
+        self.stats.expired += len(expired)
+        self.stats.timeouts += len(timed_out)
+        self.stats.conflicts += len(conflicts)
+        self.stats.rescheduled += rescheduled
+        self.stats.workflows_failed += len(failed)
+        self.stats.errors += len(errors)
+        self.stats.last_expire_seconds = self.__clock() - start
+        if len(timed_out) > 0:
+            _LOG.info("timed out %d activities in %d workflows", len(timed_out), len(failed))
+        return len(timed_out)
+
+    def run_forever(self):
+        """
+        Expire the deadlines every tick, until `stop` is called.
+        """
+        self.__stop.clear()
+        while not self.__stop.is_set():
+            try:
+                self.expire()
+            except Exception:
+                _LOG.exception("timeout detector expiry failed")
+            self.__stop.wait(self.__tick)
+
+    def stop(self):
+        self.__stop.set()
+
+    def _retry(self, item, deadline):
+        """
+        Give an activity whose timeout failed a new deadline, unless a
+        heartbeat already gave it one.
+        """
+        key = (item['activity_exec_id']['S'], item['workflow_exec_id']['S'])
+        with self.__lock:
+            if key not in self.__wheel:
+                name = self.__names.setdefault(item['workflow_name']['S'], item['workflow_name']['S'])
+                self.__wheel.schedule(key, deadline, name)
+
+    def _reload(self, item):
+        """
+        Read an activity whose timeout found a newer state, and track it
+        again if it is still running.
+        """
+        response = self.__client.db.get_item(
+            TableName=self.__client.table_name('activity_exec'), ConsistentRead=True,
+            Key={'activity_exec_id': item['activity_exec_id'], 'workflow_exec_id': item['workflow_exec_id']},
+            ProjectionExpression='activity_exec_id, workflow_exec_id, workflow_name, #state, '
+                                 'heartbeat_enabled, heartbeat_time_epoch',
+            ExpressionAttributeNames={'#state': 'state'})
+        return 'Item' in response and self.apply_item(response['Item'])
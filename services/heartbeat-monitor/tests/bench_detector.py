@@ -0,0 +1,141 @@
+"""
+Timeout detector scale: memory use, heartbeat rate and expiry latency with
+`--activities` tracked activities (a million by default).
+
+* Memory is the size the deadlines take, measured with tracemalloc, for
+  the `DeadlineWheel` and for a heap with lazy deletion (each heartbeat
+  pushes a new entry, and the old ones are skipped when popped), after each
+  activity sent `--heartbeats` heartbeats.
+* The heartbeat rate is the number of `TimeoutDetector.heartbeat` calls per
+  second, each moving an activity's deadline.
+* The deadlines are spread over `--spread` seconds; the expiry runs once
+  per simulated tick, and the time each call takes, including the
+  conditional updates sent to a stand-in table that accepts them at once,
+  is the delay between the end of the tick and the timeouts being written.
+
+Python 3 only (tracemalloc).
+"""
+
+import gc
+import heapq
+import os
+import sys
+import time
+import tracemalloc
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+CLIENT_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', '..', '..',
+    'modules', 'dynamodb_simple_client_api', 'local', 'python2_3', 'src')
+sys.path.insert(0, SRC_DIR)
+sys.path.insert(0, CLIENT_DIR)
+
+from whimbrel_client import WhimbrelClient
+from timeout_detector import DeadlineWheel, TimeoutDetector
+
+TIMEOUT = 300
+START = 1500000000
+ACTIVITIES_PER_WORKFLOW = 20
+
+
+class AcceptingDb(object):
+    """
+    Accepts every update, as though each condition held.
+    """
+    def __init__(self):
+        object.__init__(self)
+        self.updates = 0
+
+    def update_item(self, **kwargs):
+        self.updates += 1
+        return {'Attributes': {'state': {'S': 'RUNNING'}}}
+
+
+def keys(count):
+    return [('a{0}'.format(n), 'w{0}'.format(n // ACTIVITIES_PER_WORKFLOW)) for n in range(count)]
+
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return kept, after - before
+
+
+def memory(activities, heartbeats, spread):
+    ids = keys(activities)
+
+    def wheel():
+        w = DeadlineWheel()
+        for beat in range(heartbeats):
+            for n, key in enumerate(ids):
+                w.schedule(key, START + (n % spread) + beat * 30 + TIMEOUT, 'workflow')
+        return w
+
+    def heap():
+        deadlines = {}
+        h = []
+        for beat in range(heartbeats):
+            for n, key in enumerate(ids):
+                deadline = START + (n % spread) + beat * 30 + TIMEOUT
+                deadlines[key] = deadline
+                heapq.heappush(h, (deadline, key))
+        return deadlines, h
+
+    for name, build in (('wheel', wheel), ('heap', heap)):
+        kept, used = measure(build)
+        print("{0:6s} activities {1:8d}  heartbeats each {2:2d}  memory {3:7.1f} MB  {4:6.1f} bytes per activity".format(
+            name, activities, heartbeats, used / 1048576.0, float(used) / activities))
+        del kept
+
+
+def detector_run(activities, spread, tick):
+    db = AcceptingDb()
+    now = [START]
+    detector = TimeoutDetector(WhimbrelClient(db=db), timeout=TIMEOUT, tick=tick, clock=lambda: now[0])
+    ids = keys(activities)
+
+    start = time.time()
+    for n, (activity_exec_id, workflow_exec_id) in enumerate(ids):
+        detector.heartbeat(activity_exec_id, workflow_exec_id, 'workflow', START + (n % spread))
+    elapsed = time.time() - start
+    print("heartbeat  {0:8d} calls  {1:6.2f} s  {2:10.1f} / s".format(activities, elapsed, activities / elapsed))
+
+    durations = []
+    timed_out = 0
+    start = time.time()
+    now[0] = START + TIMEOUT
+    while timed_out < activities:
+        now[0] += tick
+        t = time.time()
+        timed_out += detector.expire(now[0])
+        durations.append(time.time() - t)
+    elapsed = time.time() - start
+    durations.sort()
+    print("expire     {0:8d} timeouts  {1:6.2f} s  {2:10.1f} / s  per tick p50 {3:.1f} ms  p99 {4:.1f} ms  "
+          "max {5:.1f} ms, plus up to {6} s tick".format(
+              timed_out, elapsed, timed_out / elapsed, durations[len(durations) // 2] * 1000,
+              durations[int(len(durations) * 0.99)] * 1000, durations[-1] * 1000, tick))
+
+
+def run(activities=1000000, heartbeats=4, spread=600, tick=1):
+    memory(activities, heartbeats, spread)
+    detector_run(activities, spread, tick)
+
+
+def main(argv):
+    args = {'--activities': '1000000', '--heartbeats': '4', '--spread': '600', '--tick': '1'}
+    i = 1
+    while i < len(argv):
+        if argv[i] in args:
+            args[argv[i]] = argv[i + 1]
+            i += 1
+        i += 1
+    run(int(args['--activities']), int(args['--heartbeats']), int(args['--spread']), int(args['--tick']))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,283 @@
+"""
+The record handlers, which take the place of the
+`whimbrel-dynamodb-onWorkflowRequest` and
+`whimbrel-dynamodb-onActivityEvent` Lambda functions.  Rather than one
+invocation per record, each is called with a batch of stream records, and
+applies them with the Full Logic client.
+
+* `WorkflowRequestHandler` starts a workflow execution, with a
+  `WorkflowExecutor`, for each new `workflow_request` item that isn't
+  `manual`.
+* `ActivityEventHandler` applies the transition of each new
+  `activity_event` item to its `activity_exec` item.  The events of one
+  activity are applied in order; different activities are applied in
+  parallel.  When an activity completes, the activities that depend on it
+  and now have all their dependencies are moved to `READY`.  When it fails
+  or times out, its workflow moves to `FAILED_WAITING` and the activities
+  that can no longer run are cancelled.
+* `ActivityExecHandler` feeds the `activity_exec` records to a
+  `TimeoutDetector` (from the heartbeat monitor service).
+
+An item missing an attribute the handler needs is logged, counted in
+`malformed` and skipped, rather than failing its whole batch.
+
+The request and event handlers can share a `DedupeCache`: an event whose ID
+was processed recently (a batch retried, or read again after a restart) is
+counted in `duplicates` and dropped, rather than sent as an update that
+would fail its condition.
+"""
+
+import logging
+import threading
+
+from whimbrel_client.threads import in_threads, split
+from whimbrel_client.transitions import (
+    ActivityTransitionEngine, WorkflowTransitionEngine, TransitionNotAllowed, ItemNotFound
+)
+
+_LOG = logging.getLogger(__name__)
+
+# Activity states that fail the workflow.
+FAILED_ACTIVITY_STATES = ('FAILED', 'TIMED_OUT')
+
+
+class HandlerStats(object):
+    def __init__(self):
+        object.__init__(self)
+        self.__lock = threading.Lock()
+        self.records = 0
+        self.ignored = 0
+        self.malformed = 0
+        self.duplicates = 0
+        self.workflows_started = 0
+        self.transitions = 0
+        self.rejected = 0
+        self.missing = 0
+        self.readied = 0
+        self.cancelled = 0
+        self.workflows_failed = 0
+
+    def add(self, **counts):
+        with self.__lock:
+            for name, count in counts.items():
+                setattr(self, name, getattr(self, name) + count)
+
+    def counts(self):
+        """
+        :return: counter name -> value
+        """
+        with self.__lock:
+            return dict((k, v) for k, v in self.__dict__.items() if not k.startswith('_'))
+
+
+def new_images(records):
+    """
+    The new item of each INSERT record, in order; the Whimbrel request and
+    event tables are only ever inserted into.
+    """
+    return [
+        record['dynamodb']['NewImage'] for record in records
+        if record.get('eventName') == 'INSERT' and 'NewImage' in record.get('dynamodb', {})
+    ]
+
+
+def is_manual(item):
+    """
+    True if the item's client runs the logic itself, so the handlers must
+    leave it alone.
+    """
+    value = item.get('manual')
+    if value is None:
+        return False
+    if 'BOOL' in value:
+        return value['BOOL']
+    return len(value.get('B') or '') > 0
+
+
+class WorkflowRequestHandler(object):
+    """
+    :param executor: WorkflowExecutor with the decision functions of the
+        workflows to start.
+    :param dedupe: DedupeCache of the requests already started, or None.
+    """
+    def __init__(self, executor, dedupe=None):
+        object.__init__(self)
+        self.__executor = executor
+        self.__dedupe = dedupe
+        self.stats = HandlerStats()
+
+    def __call__(self, records):
+        started = 0
+        ignored = 0
+        duplicates = 0
+        malformed = 0
+        for item in new_images(records):
+            if is_manual(item):
+                ignored += 1
+                continue
+            try:
+                workflow_request_id = item['workflow_request_id']['S']
+                workflow_name = item['workflow_name']['S']
+            except KeyError as e:
+                _LOG.warning("skipping workflow request without %s: %s", e, item)
+                malformed += 1
+                continue
+            if self.__dedupe is not None and self.__dedupe.seen(workflow_request_id):
+                duplicates += 1
+                continue
+            workflow_version = item.get('workflow_version', {}).get('N')
+            try:
+                self.__executor.submit(
+                    workflow_name, workflow_request_id,
+                    workflow_version is not None and int(workflow_version) or None)
+                started += 1
+            except ValueError as e:
+                _LOG.warning("not starting workflow request %s: %s", workflow_request_id, e)
+                ignored += 1
+            if self.__dedupe is not None:
+                self.__dedupe.add(workflow_request_id)
+        self.stats.add(records=len(records), workflows_started=started, ignored=ignored, duplicates=duplicates,
+                       malformed=malformed)
+
+
+class ActivityEventHandler(object):
+    """
+    :param client: WhimbrelClient
+    :param tracker: DependencyTracker, to move the dependent activities to
+        `READY` and cancel them on failure; None to leave that to another
+        process.
+    :param workers: number of activities updated at once.
+    :param dedupe: DedupeCache of the events already applied, or None.
+    """
+    def __init__(self, client, tracker=None, workers=8, dedupe=None):
+        object.__init__(self)
+        self.__client = client
+        self.__tracker = tracker
+        self.__workers = workers
+        self.__dedupe = dedupe
+        self.__activities = ActivityTransitionEngine(client)
+        self.__workflows = WorkflowTransitionEngine(client)
+        self.stats = HandlerStats()
+
+    def __call__(self, records):
+        # activity exec ID -> its (event ID, transition), in order
+        events = {}
+        order = []
+        for item in new_images(records):
+            if is_manual(item):
+                self.stats.add(ignored=1)
+                continue
+            try:
+                activity_event_id = item['activity_event_id']['S']
+                activity_exec_id = item['activity_exec_id']['S']
+                transition = item['transition']['S']
+            except KeyError as e:
+                _LOG.warning("skipping activity event without %s: %s", e, item)
+                self.stats.add(malformed=1)
+                continue
+            if self.__dedupe is not None and self.__dedupe.seen(activity_event_id):
+                self.stats.add(duplicates=1)
+                continue
+            if activity_exec_id not in events:
+                events[activity_exec_id] = []
+                order.append(activity_exec_id)
+            events[activity_exec_id].append((activity_event_id, transition))
+        self.stats.add(records=len(records))
+
+        def apply_all(activity_exec_ids):
+            for activity_exec_id in activity_exec_ids:
+                self.apply(activity_exec_id, events[activity_exec_id])
+
+        in_threads(apply_all, split(order, self.__workers))
+
+    def apply(self, activity_exec_id, events):
+        """
+        Apply the events, in order, to the activity.
+
+        :param events: list of (activity event ID, transition)
+        """
+        item = self._find(activity_exec_id)
+        if item is None:
+            _LOG.warning("no activity exec %s for %d events", activity_exec_id, len(events))
+            self.stats.add(missing=len(events))
+            return
+        workflow_exec_id = item['workflow_exec_id']['S']
+        state = item.get('state', {}).get('S')
+        heartbeat_enabled = item.get('heartbeat_enabled', {}).get('BOOL', False)
+        for activity_event_id, transition in events:
+            try:
+                old_state, state = self.__activities.transition_activity(
+                    activity_exec_id, workflow_exec_id, transition, state, heartbeat_enabled)
+            except (TransitionNotAllowed, ItemNotFound) as e:
+                _LOG.info("activity exec %s: %s", activity_exec_id, e)
+                self.stats.add(rejected=1)
+                self._done(activity_event_id)
+                continue
+            self.stats.add(transitions=1)
+            if state == 'COMPLETED':
+                self._completed(activity_exec_id, workflow_exec_id)
+            elif state in FAILED_ACTIVITY_STATES:
+                self._failed(activity_exec_id, workflow_exec_id, item.get('workflow_name', {}).get('S'))
+            self._done(activity_event_id)
+
+    def _done(self, activity_event_id):
+        if self.__dedupe is not None:
+            self.__dedupe.add(activity_event_id)
+
+    def _completed(self, activity_exec_id, workflow_exec_id):
+        if self.__tracker is None:
+            return
+        for ready in self.__tracker.completed(workflow_exec_id, activity_exec_id):
+            if self._try(ready, workflow_exec_id, 'READY'):
+                self.stats.add(readied=1)
+
+    def _failed(self, activity_exec_id, workflow_exec_id, workflow_name):
+        if workflow_name is not None:
+            try:
+                self.__workflows.transition_workflow(workflow_exec_id, workflow_name, 'FAILED_WAITING', 'RUNNING')
+                self.stats.add(workflows_failed=1)
+            except (TransitionNotAllowed, ItemNotFound) as e:
+                _LOG.info("workflow exec %s: %s", workflow_exec_id, e)
+        if self.__tracker is None:
+            return
+        for downstream in self.__tracker.failed(workflow_exec_id, activity_exec_id):
+            if self._try(downstream, workflow_exec_id, 'CANCEL'):
+                self.stats.add(cancelled=1)
+        self.__tracker.forget(workflow_exec_id)
+
+    def _try(self, activity_exec_id, workflow_exec_id, transition):
+        try:
+            self.__activities.transition_activity(activity_exec_id, workflow_exec_id, transition, 'REQUESTED')
+            return True
+        except (TransitionNotAllowed, ItemNotFound) as e:
+            _LOG.info("activity exec %s: %s", activity_exec_id, e)
+            return False
+
+    def _find(self, activity_exec_id):
+        """
+        The activity exec item; the events only have its hash key, so it is
+        queried for.
+        """
+        response = self.__client.db.query(
+            TableName=self.__client.table_name('activity_exec'), ConsistentRead=True,
+            KeyConditionExpression='activity_exec_id = :a',
+            ProjectionExpression='activity_exec_id, workflow_exec_id, workflow_name, #state, heartbeat_enabled',
+            ExpressionAttributeNames={'#state': 'state'},
+            ExpressionAttributeValues={':a': {'S': activity_exec_id}})
+        items = response.get('Items', [])
+        return len(items) > 0 and items[0] or None
+
+
+class ActivityExecHandler(object):
+    """
+    :param detector: TimeoutDetector
+    """
+    def __init__(self, detector):
+        object.__init__(self)
+        self.__detector = detector
+        self.stats = HandlerStats()
+
+    def __call__(self, records):
+        for record in records:
+            self.__detector.apply_record(record)
+        self.stats.add(records=len(records))
@@ -0,0 +1,137 @@
+#!/usr/bin/python
+
+import importlib
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# The Python client, from this checkout, unless it is already installed.
+sys.path.append(os.path.join(
+    SRC_DIR, '..', '..', '..', 'modules', 'dynamodb_simple_client_api', 'local', 'python2_3', 'src'))
+
+from whimbrel_client import create_streams_client
+from whimbrel_client.cli import CommandLine
+from whimbrel_client.dedupe import DedupeCache
+from whimbrel_client.dependencies import DependencyTracker
+from whimbrel_client.executor import WorkflowExecutor
+from stream_processor import (
+    StreamProcessor, Checkpoints, DeadLetters, ProcessorMetrics, MetricsServer, stream_arn, checkpoint_directory
+)
+from handlers import WorkflowRequestHandler, ActivityEventHandler, ActivityExecHandler
+
+args = CommandLine(sys.argv, {
+    '--checkpoints': 'checkpoints',
+    '--dead-letters': 'dead_letters',
+    '--max-attempts': 'max_attempts',
+    '--processes': 'processes',
+    '--workers': 'workers',
+    '--batch': 'batch',
+    '--decisions': 'decisions',
+    '--heartbeat-timeout': 'heartbeat_timeout',
+    '--metrics-port': 'metrics_port',
+    '--lag-interval': 'lag_interval',
+    '--dedupe-entries': 'dedupe_entries',
+    '--dedupe-ttl': 'dedupe_ttl'
+}, {}, defaults={'checkpoints': 'checkpoints', 'dead_letters': 'dead-letters', 'max_attempts': '10',
+                 'processes': '1', 'workers': '8', 'batch': '1000',
+                 'lag_interval': '60', 'dedupe_entries': '100000', 'dedupe_ttl': '3600',
+                 'source': 'Stream Processor'})
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(process)d %(levelname)s %(message)s')
+
+
+def load_decisions(name):
+    """
+    The decision functions dictionary named by `module:attribute`.
+    """
+    module_name, attribute = name.split(':', 1)
+    return getattr(importlib.import_module(module_name), attribute)
+
+
+def run(index, count):
+    workers = int(args.get('workers'))
+    client = args.client(max_pool_connections=workers * 2, lite=True)
+    streams = create_streams_client(args.aws_args, args.dynamodb_args)
+    metrics = ProcessorMetrics()
+    dedupe = DedupeCache(int(args.get('dedupe_entries')), int(args.get('dedupe_ttl')))
+    metrics.register('dedupe', lambda: dict(vars(dedupe.stats)))
+    processors = []
+    background = []
+
+    # 0 retries a failed batch until it is accepted.
+    max_attempts = int(args.get('max_attempts')) or None
+
+    def add(table, handler, partition):
+        arn = stream_arn(client, table)
+        checkpoints = Checkpoints(checkpoint_directory(args.get('checkpoints'), arn))
+        dead_letters = DeadLetters(checkpoint_directory(args.get('dead_letters'), arn))
+        processors.append(StreamProcessor(
+            streams, arn, handler, checkpoints, metrics, table, partition, batch_size=int(args.get('batch')),
+            max_attempts=max_attempts, dead_letters=dead_letters))
+        metrics.register(table + '_handler', handler.stats.counts)
+
+    if args.get('decisions') is not None:
+        executor = WorkflowExecutor(client, load_decisions(args.get('decisions')), workers)
+        add('workflow_request', WorkflowRequestHandler(executor, dedupe), (index, count))
+    # With several processes, the activities of a workflow complete in
+    # different processes, so each tracker checks the table as well.
+    tracker = DependencyTracker(client, shared=count > 1)
+    add('activity_event', ActivityEventHandler(client, tracker, workers, dedupe), (index, count))
+    if args.get('heartbeat_timeout') is not None and index == 0:
+        # One detector follows all the heartbeats, in the first process.
+        sys.path.append(os.path.join(SRC_DIR, '..', '..', 'heartbeat-monitor', 'src'))
+        from timeout_detector import TimeoutDetector
+        detector = TimeoutDetector(client, timeout=int(args.get('heartbeat_timeout')), workers=workers)
+        detector.rebuild()
+        add('activity_exec', ActivityExecHandler(detector), (0, 1))
+        background.append(detector)
+
+    metrics_server = None
+    if args.get('metrics_port') is not None:
+        metrics_server = MetricsServer(metrics, int(args.get('metrics_port')) + index)
+        metrics_server.start()
+
+    stopping = threading.Event()
+
+    def stop(signum, frame):
+        stopping.set()
+        for processor in processors + background:
+            processor.stop()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    threads = [threading.Thread(target=p.run_forever) for p in processors + background]
+    for t in threads:
+        t.daemon = True
+        t.start()
+    while not stopping.is_set():
+        stopping.wait(float(args.get('lag_interval')))
+        logging.info("records %s, lag seconds %s, duplicates dropped %d",
+                     metrics.records(), metrics.lag(), dedupe.stats.duplicates)
+    for t in threads:
+        t.join()
+    if metrics_server is not None:
+        metrics_server.close()
+
+
+processes = int(args.get('processes'))
+if processes <= 1:
+    run(0, 1)
+else:
+    children = [multiprocessing.Process(target=run, args=(i, processes)) for i in range(processes)]
+    for child in children:
+        child.start()
+
+    def forward(signum, frame):
+        for c in children:
+            if c.is_alive():
+                os.kill(c.pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, forward)
+    for child in children:
+        child.join()
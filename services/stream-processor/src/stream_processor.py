@@ -0,0 +1,674 @@
+"""
+The DynamoDB Streams processor.
+
+`StreamProcessor` reads every shard of one table's stream, each shard on
+its own thread, and calls a handler with each batch of records that
+`GetRecords` returns, in the order they were written.  After a batch is
+handled, the shard's last sequence number is written to its checkpoint, so
+a restarted processor continues after the last batch it finished.  A
+batch is retried, with backoff, until the handler accepts it, so every
+record is handled at least once.  After `max_attempts` failures, the
+records of the batch are handed over one at a time instead; a record the
+handler still can't accept is logged, written to the `DeadLetters`, and
+skipped, so one bad record doesn't stop its shard for good.
+
+The shards are discovered with `DescribeStream` every `discover_interval`
+seconds.  A shard that was split starts only once its parent was read to
+its end (or was trimmed from the stream), which keeps the records for one
+key in order.
+
+One process can only use one core for the handlers.  To use more, run
+several processes with the same checkpoint directory, each with its own
+`partition` (index, count); a process reads the shards whose ID hashes to
+its index.  The checkpoints are one file per shard, and each shard has a
+single reader, so the processes never write the same file.
+
+`ProcessorMetrics` has, for each shard, the records handled and the lag:
+the age of the last record handled when the batch finished, or zero once a
+read finds no new records.
+"""
+
+import base64
+import calendar
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+
+try:
+    # Python 3
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+from whimbrel_client import error_code
+
+_LOG = logging.getLogger(__name__)
+
+# The checkpoint of a shard that was read to its end.
+SHARD_END = 'SHARD_END'
+
+# Most records GetRecords returns at once.
+MAX_RECORDS = 1000
+
+EXPIRED_ITERATOR_ERRORS = ('ExpiredIteratorException',)
+TRIMMED_ERRORS = ('TrimmedDataAccessException',)
+MISSING_SHARD_ERRORS = ('ResourceNotFoundException',)
+
+# Longest wait between the attempts at a batch the handler rejected.
+MAX_RETRY_WAIT = 30.0
+
+# Attempts at a batch before its records are handled one at a time, and
+# then at each of its records before it is skipped.
+MAX_ATTEMPTS = 10
+RECORD_ATTEMPTS = 3
+
+
+def stream_arn(client, table):
+    """
+    The ARN of the table's current stream.
+
+    :param table: table name, without the prefix.
+    """
+    response = client.db.describe_table(TableName=client.table_name(table))
+    arn = response['Table'].get('LatestStreamArn')
+    if arn is None:
+        raise ValueError("table {0} has no stream".format(client.table_name(table)))
+    return arn
+
+
+def checkpoint_directory(base, arn):
+    """
+    The checkpoint directory for the stream, under `base`; each stream
+    (including a new stream for the same table) gets its own.
+    """
+    # arn:aws:dynamodb:(region):(account):table/(table name)/stream/(label)
+    parts = arn.split('/')
+    name = len(parts) >= 4 and '{0}_{1}'.format(parts[1], parts[3]) or arn
+    return os.path.join(base, name.replace(':', '-'))
+
+
+def partition_of(shard_id, count):
+    """
+    The partition (process index) that reads the shard.
+    """
+    return (zlib.crc32(shard_id.encode('utf-8')) & 0xffffffff) % count
+
+
+def record_epoch(record):
+    """
+    The approximate time the record was written, as epoch seconds, or None.
+    boto3 returns a datetime, the JSON protocol a number.
+    """
+    value = record.get('dynamodb', {}).get('ApproximateCreationDateTime')
+    if value is None:
+        return None
+    if hasattr(value, 'utctimetuple'):
+        return calendar.timegm(value.utctimetuple())
+    return float(value)
+
+
+class Checkpoints(object):
+    """
+    The last handled sequence number of each shard of a stream, as one file
+    per shard in `directory`.
+
+    :param directory: the stream's checkpoint directory; created if needed.
+    """
+    def __init__(self, directory):
+        object.__init__(self)
+        self.__directory = directory
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # Another process made it first.
+                if not os.path.isdir(directory):
+                    raise
+
+    @property
+    def directory(self):
+        return self.__directory
+
+    def get(self, shard_id):
+        """
+        :return: the shard's checkpoint, or None if it has none.
+        """
+        try:
+            with open(self._path(shard_id), 'r') as f:
+                return f.read().strip() or None
+        except IOError:
+            return None
+
+    def set(self, shard_id, sequence_number):
+        path = self._path(shard_id)
+        temp = path + '.tmp'
+        with open(temp, 'w') as f:
+            f.write(sequence_number)
+        try:
+            os.rename(temp, path)
+        except OSError:
+            # Windows will not rename over an existing file.
+            os.remove(path)
+            os.rename(temp, path)
+
+    def finish(self, shard_id):
+        self.set(shard_id, SHARD_END)
+
+    def is_finished(self, shard_id):
+        return self.get(shard_id) == SHARD_END
+
+    def remove(self, shard_id):
+        try:
+            os.remove(self._path(shard_id))
+        except OSError:
+            pass
+
+    def shards(self):
+        """
+        :return: the IDs of the shards with a checkpoint.
+        """
+        return [name for name in os.listdir(self.__directory) if not name.endswith('.tmp')]
+
+    def _path(self, shard_id):
+        return os.path.join(self.__directory, shard_id)
+
+
+class DeadLetters(object):
+    """
+    The records the handler could not accept, as JSON lines, one file per
+    shard in `directory`, to look at and replay by hand.
+
+    :param directory: the stream's dead letter directory; created with the
+        first record.
+    """
+    def __init__(self, directory):
+        object.__init__(self)
+        self.__directory = directory
+        self.__lock = threading.Lock()
+
+    @property
+    def directory(self):
+        return self.__directory
+
+    def add(self, shard_id, record):
+        line = json.dumps(record, sort_keys=True, default=_json_default)
+        with self.__lock:
+            if not os.path.isdir(self.__directory):
+                try:
+                    os.makedirs(self.__directory)
+                except OSError:
+                    # Another process made it first.
+                    if not os.path.isdir(self.__directory):
+                        raise
+            with open(os.path.join(self.__directory, shard_id + '.jsonl'), 'a') as f:
+                f.write(line + '\n')
+
+
+class ShardStatus(object):
+    def __init__(self):
+        object.__init__(self)
+        self.records = 0
+        self.batches = 0
+        self.empty_reads = 0
+        self.handler_errors = 0
+        self.skipped = 0
+        self.read_errors = 0
+        self.lag_seconds = 0.0
+        self.finished = False
+
+
+class ProcessorMetrics(object):
+    """
+    Counters for each shard read, by table.  Shared by the processors of a
+    process.
+    """
+    def __init__(self):
+        object.__init__(self)
+        self.__lock = threading.Lock()
+        # (table, shard ID) -> ShardStatus
+        self.__shards = {}
+        # list of (name, function returning counter name -> value)
+        self.__counters = []
+
+    def register(self, name, counts):
+        """
+        Add other counters, such as a handler's, to the metrics text.
+
+        :param counts: function returning a dictionary of counter name ->
+            value; each is shown as `(name)_(counter name)_total`.
+        """
+        with self.__lock:
+            self.__counters.append((name, counts))
+
+    def batch(self, table, shard_id, records, lag_seconds):
+        with self.__lock:
+            status = self._status(table, shard_id)
+            status.records += records
+            status.batches += 1
+            status.lag_seconds = lag_seconds
+
+    def empty_read(self, table, shard_id):
+        with self.__lock:
+            status = self._status(table, shard_id)
+            status.empty_reads += 1
+            status.lag_seconds = 0.0
+
+    def handler_error(self, table, shard_id):
+        with self.__lock:
+            self._status(table, shard_id).handler_errors += 1
+
+    def skipped(self, table, shard_id):
+        with self.__lock:
+            self._status(table, shard_id).skipped += 1
+
+    def read_error(self, table, shard_id):
+        with self.__lock:
+            self._status(table, shard_id).read_errors += 1
+
+    def finished(self, table, shard_id):
+        with self.__lock:
+            status = self._status(table, shard_id)
+            status.finished = True
+            status.lag_seconds = 0.0
+
+    def forget(self, table, shard_id):
+        with self.__lock:
+            self.__shards.pop((table, shard_id), None)
+
+    def lag(self):
+        """
+        :return: table -> the largest lag of its unfinished shards, in
+            seconds.
+        """
+        ret = {}
+        with self.__lock:
+            for (table, shard_id), status in self.__shards.items():
+                if not status.finished:
+                    ret[table] = max(ret.get(table, 0.0), status.lag_seconds)
+        return ret
+
+    def records(self):
+        """
+        :return: table -> records handled.
+        """
+        ret = {}
+        with self.__lock:
+            for (table, shard_id), status in self.__shards.items():
+                ret[table] = ret.get(table, 0) + status.records
+        return ret
+
+    def text(self):
+        """
+        The metrics in the Prometheus text format.
+        """
+        with self.__lock:
+            shards = sorted((key, _copy(status)) for key, status in self.__shards.items())
+            counters = list(self.__counters)
+        values = [
+            ('records_total', 'counter', 'Stream records handled.', lambda s: s.records),
+            ('batches_total', 'counter', 'Record batches handled.', lambda s: s.batches),
+            ('empty_reads_total', 'counter', 'Reads that found no new records.', lambda s: s.empty_reads),
+            ('handler_errors_total', 'counter', 'Batches the handler raised an error for; each is retried.',
+                lambda s: s.handler_errors),
+            ('skipped_records_total', 'counter', 'Records skipped after the handler kept failing on them.',
+                lambda s: s.skipped),
+            ('read_errors_total', 'counter', 'GetRecords calls that failed.', lambda s: s.read_errors),
+            ('lag_seconds', 'gauge', 'Age of the last record handled, or 0 once the shard is caught up.',
+                lambda s: s.lag_seconds),
+            ('finished', 'gauge', '1 once the shard was read to its end.', lambda s: s.finished and 1 or 0)
+        ]
+        lines = []
+        for name, kind, description, value in values:
+            lines.append('# HELP whimbrel_stream_processor_{0} {1}'.format(name, description))
+            lines.append('# TYPE whimbrel_stream_processor_{0} {1}'.format(name, kind))
+            for (table, shard_id), status in shards:
+                lines.append('whimbrel_stream_processor_{0}{{table="{1}",shard="{2}"}} {3}'.format(
+                    name, table, shard_id, value(status)))
+        for group, counts in counters:
+            for name, value in sorted(counts().items()):
+                lines.append('# TYPE whimbrel_stream_processor_{0}_{1}_total counter'.format(group, name))
+                lines.append('whimbrel_stream_processor_{0}_{1}_total {2}'.format(group, name, value))
+        return '\n'.join(lines) + '\n'
+
+    def _status(self, table, shard_id):
+        status = self.__shards.get((table, shard_id))
+        if status is None:
+            status = ShardStatus()
+            self.__shards[(table, shard_id)] = status
+        return status
+
+
+class ShardReader(object):
+    """
+    Reads one shard from its checkpoint, until the shard ends or the
+    processor stops.
+
+    :param max_attempts: attempts at a batch before its records are handled
+        one at a time, and the ones that still fail skipped; None to retry
+        a batch until it is accepted.
+    :param dead_letters: DeadLetters for the skipped records, or None.
+    """
+    def __init__(self, streams, arn, shard_id, handler, checkpoints, metrics, table, stopping,
+                 batch_size=MAX_RECORDS, idle_wait=1.0, retry_wait=1.0, clock=time.time,
+                 max_attempts=MAX_ATTEMPTS, dead_letters=None):
+        object.__init__(self)
+        self.__streams = streams
+        self.__arn = arn
+        self.__shard_id = shard_id
+        self.__handler = handler
+        self.__checkpoints = checkpoints
+        self.__metrics = metrics
+        self.__table = table
+        self.__stopping = stopping
+        self.__batch_size = batch_size
+        self.__idle_wait = idle_wait
+        self.__retry_wait = retry_wait
+        self.__clock = clock
+        self.__max_attempts = max_attempts
+        self.__dead_letters = dead_letters
+
+    def run(self):
+        """
+        :return: True if the shard was read to its end.
+        """
+        iterator = self._iterator()
+        while iterator is not None and not self.__stopping.is_set():
+            try:
+                response = self.__streams.get_records(ShardIterator=iterator, Limit=self.__batch_size)
+            except Exception as e:
+                code = error_code(e)
+                if code in EXPIRED_ITERATOR_ERRORS:
+                    iterator = self._iterator()
+                    continue
+                if code in TRIMMED_ERRORS:
+                    # The records after the checkpoint are gone; go on from the oldest that remain.
+                    _LOG.warning("shard %s was trimmed past its checkpoint; records were lost", self.__shard_id)
+                    self.__checkpoints.remove(self.__shard_id)
+                    iterator = self._iterator()
+                    continue
+                if code in MISSING_SHARD_ERRORS:
+                    _LOG.warning("shard %s no longer exists", self.__shard_id)
+                    break
+                _LOG.warning("reading shard %s failed: %s", self.__shard_id, e)
+                self.__metrics.read_error(self.__table, self.__shard_id)
+                self.__stopping.wait(self.__retry_wait)
+                continue
+
+            records = response.get('Records', [])
+            if len(records) > 0:
+                if not self._handle(records):
+                    return False
+                self.__checkpoints.set(self.__shard_id, records[-1]['dynamodb']['SequenceNumber'])
+                created = record_epoch(records[-1])
+                self.__metrics.batch(
+                    self.__table, self.__shard_id, len(records),
+                    created is not None and max(0.0, self.__clock() - created) or 0.0)
+            iterator = response.get('NextShardIterator')
+            if iterator is not None and len(records) <= 0:
+                self.__metrics.empty_read(self.__table, self.__shard_id)
+                self.__stopping.wait(self.__idle_wait)
+        if iterator is None or not self.__stopping.is_set():
+            self.__checkpoints.finish(self.__shard_id)
+            self.__metrics.finished(self.__table, self.__shard_id)
+            return True
+        return False
+
+    def _handle(self, records):
+        """
+        Hand the batch to the handler, until it accepts it.  If it keeps
+        failing, hand over the records one at a time, and skip those that
+        still fail.
+
+        :return: False if the processor stopped first.
+        """
+        accepted = self._attempt(records, self.__max_attempts)
+        if accepted is not None:
+            return accepted
+        _LOG.error("%d records from shard %s failed %d times; handling them one at a time",
+                   len(records), self.__shard_id, self.__max_attempts)
+        for record in records:
+            accepted = self._attempt([record], RECORD_ATTEMPTS)
+            if accepted is None:
+                self._skip(record)
+            elif not accepted:
+                return False
+        return True
+
+    def _attempt(self, records, max_attempts):
+        """
+        :return: True once the handler accepts the records, False if the
+            processor stopped first, or None after `max_attempts` failures.
+        """
+        attempt = 0
+        while not self.__stopping.is_set():
+            try:
+                self.__handler(records)
+                return True
+            except Exception:
+                _LOG.exception("handling %d records from shard %s failed", len(records), self.__shard_id)
+                self.__metrics.handler_error(self.__table, self.__shard_id)
+            attempt += 1
+            if max_attempts is not None and attempt >= max_attempts:
+                return None
+            self.__stopping.wait(min(MAX_RETRY_WAIT, self.__retry_wait * (2 ** (attempt - 1))))
+        return False
+
+    def _skip(self, record):
+        _LOG.error("skipping record %s of shard %s", record.get('dynamodb', {}).get('SequenceNumber'),
+                   self.__shard_id)
+        self.__metrics.skipped(self.__table, self.__shard_id)
+        if self.__dead_letters is not None:
+            self.__dead_letters.add(self.__shard_id, record)
+
+    def _iterator(self):
+        checkpoint = self.__checkpoints.get(self.__shard_id)
+        if checkpoint == SHARD_END:
+            return None
+        args = {'StreamArn': self.__arn, 'ShardId': self.__shard_id}
+        if checkpoint is None:
+            args['ShardIteratorType'] = 'TRIM_HORIZON'
+        else:
+            args['ShardIteratorType'] = 'AFTER_SEQUENCE_NUMBER'
+            args['SequenceNumber'] = checkpoint
+        return self.__streams.get_shard_iterator(**args)['ShardIterator']
+
+
+class StreamProcessor(object):
+    """
+    Reads the shards of one stream.
+
+    :param streams: DynamoDB Streams low-level client.
+    :param arn: the stream ARN; see `stream_arn`.
+    :param handler: function called with each batch of records.  The
+        batches of one shard come one at a time, in order, but the shards
+        are read at once, so it must be safe to call from several threads.
+        If it raises an error, the same batch is handed to it again (see
+        `ShardReader` for when it gives up).
+    :param checkpoints: Checkpoints for this stream.
+    :param metrics: ProcessorMetrics; shared by the processors of a process.
+    :param table: the table name in the metrics and logs.
+    :param partition: (index, count); read only the shards in partition
+        `index` of `count`.
+    :param batch_size: most records read at once.
+    :param discover_interval: seconds between looking for new shards.
+    :param idle_wait: seconds to wait after a read found no new records.
+    :param max_attempts: see `ShardReader`.
+    :param dead_letters: DeadLetters for the skipped records, or None.
+    """
+    def __init__(self, streams, arn, handler, checkpoints, metrics=None, table=None, partition=(0, 1),
+                 batch_size=MAX_RECORDS, discover_interval=10, idle_wait=1.0, clock=time.time,
+                 max_attempts=MAX_ATTEMPTS, dead_letters=None):
+        object.__init__(self)
+        assert 0 <= partition[0] < partition[1]
+        self.__streams = streams
+        self.__arn = arn
+        self.__handler = handler
+        self.__checkpoints = checkpoints
+        self.metrics = metrics or ProcessorMetrics()
+        self.__table = table or arn
+        self.__partition = partition
+        self.__batch_size = batch_size
+        self.__discover_interval = discover_interval
+        self.__idle_wait = idle_wait
+        self.__clock = clock
+        self.__max_attempts = max_attempts
+        self.__dead_letters = dead_letters
+        self.__stopping = threading.Event()
+        self.__wake = threading.Event()
+        self.__lock = threading.Lock()
+        # shard ID -> Thread
+        self.__readers = {}
+
+    def shards(self):
+        """
+        :return: all the shards of the stream, as DescribeStream returns
+            them.
+        """
+        shards = []
+        args = {'StreamArn': self.__arn}
+        while True:
+            description = self.__streams.describe_stream(**args)['StreamDescription']
+            shards.extend(description.get('Shards', []))
+            if description.get('LastEvaluatedShardId') is None:
+                return shards
+            args['ExclusiveStartShardId'] = description['LastEvaluatedShardId']
+
+    def start_shards(self):
+        """
+        Start a reader for each shard of this partition that is ready and
+        not already being read.
+
+        :return: the number of readers started.
+        """
+        shards = self.shards()
+        listed = set(shard['ShardId'] for shard in shards)
+        started = 0
+        for shard in shards:
+            shard_id = shard['ShardId']
+            if partition_of(shard_id, self.__partition[1]) != self.__partition[0]:
+                continue
+            with self.__lock:
+                if shard_id in self.__readers:
+                    continue
+            if self.__checkpoints.is_finished(shard_id):
+                continue
+            parent = shard.get('ParentShardId')
+            if parent is not None and parent in listed and not self.__checkpoints.is_finished(parent):
+                # The parent's records come first.
+                continue
+            self._start(shard_id)
+            started += 1
+        # Shards that aged out of the stream will never be read again.
+        for shard_id in self.__checkpoints.shards():
+            if shard_id not in listed and partition_of(shard_id, self.__partition[1]) == self.__partition[0]:
+                self.__checkpoints.remove(shard_id)
+                self.metrics.forget(self.__table, shard_id)
+        return started
+
+    def run_forever(self):
+        """
+        Read the shards until `stop` is called, then wait for the readers
+        to finish their current batch.
+        """
+        self.__stopping.clear()
+        while not self.__stopping.is_set():
+            try:
+                self.start_shards()
+            except Exception:
+                _LOG.exception("discovering the shards of %s failed", self.__table)
+            self.__wake.wait(self.__discover_interval)
+            self.__wake.clear()
+        with self.__lock:
+            readers = list(self.__readers.values())
+        for t in readers:
+            t.join()
+
+    def stop(self):
+        self.__stopping.set()
+        self.__wake.set()
+
+    def readers(self):
+        """
+        :return: the IDs of the shards being read.
+        """
+        with self.__lock:
+            return sorted(self.__readers.keys())
+
+    def _start(self, shard_id):
+        reader = ShardReader(
+            self.__streams, self.__arn, shard_id, self.__handler, self.__checkpoints, self.metrics, self.__table,
+            self.__stopping, self.__batch_size, self.__idle_wait, clock=self.__clock,
+            max_attempts=self.__max_attempts, dead_letters=self.__dead_letters)
+
+        def run():
+            try:
+                if reader.run():
+                    _LOG.info("finished shard %s of %s", shard_id, self.__table)
+            except Exception:
+                _LOG.exception("reading shard %s of %s failed", shard_id, self.__table)
+            finally:
+                with self.__lock:
+                    self.__readers.pop(shard_id, None)
+                # Its children may be ready; or it failed, and needs a new reader.
+                self.__wake.set()
+
+        t = threading.Thread(target=run, name="stream-{0}-{1}".format(self.__table, shard_id))
+        t.daemon = True
+        with self.__lock:
+            self.__readers[shard_id] = t
+        t.start()
+
+
+class MetricsServer(object):
+    """
+    Serves the processor metrics, in the Prometheus text format, over HTTP
+    from a background thread.
+    """
+    def __init__(self, metrics, port, host=''):
+        object.__init__(self)
+        self.__server = HTTPServer((host, port), _MetricsHandler)
+        self.__server.metrics = metrics
+        self.__thread = threading.Thread(target=self.__server.serve_forever, name="stream-processor-metrics")
+        self.__thread.daemon = True
+
+    @property
+    def port(self):
+        return self.__server.server_address[1]
+
+    def start(self):
+        self.__thread.start()
+
+    def close(self):
+        self.__server.shutdown()
+        self.__server.server_close()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = self.server.metrics.text().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _json_default(value):
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    if isinstance(value, (bytes, bytearray)):
+        return base64.b64encode(bytes(value)).decode('ascii')
+    return str(value)
+
+
+def _copy(status):
+    ret = ShardStatus()
+    ret.__dict__.update(status.__dict__)
+    return ret
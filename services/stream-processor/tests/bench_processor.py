@@ -0,0 +1,155 @@
+"""
+Activity events per second through the stream processor, reading one
+record at a time (as a Lambda function invoked per record would) against
+reading micro-batches.
+
+`--activities` activities each get three events (`QUEUED`, `RUNNING`,
+`COMPLETED`), spread over `--shards` shards of an in-process stand-in for
+DynamoDB Streams.  The transitions go to the in-process DynamoDB stand-in
+from the client benchmarks; both wait `--latency` seconds per request, so
+the result shows the effect of the round trips and of applying a batch's
+activities in parallel.
+
+The `redelivered` cases then read the whole stream a second time, as after
+a lost checkpoint, with and without a `DedupeCache`: the requests per
+record show what the repeats cost.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+CLIENT_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', '..', '..',
+    'modules', 'dynamodb_simple_client_api', 'local', 'python2_3', 'src')
+STANDIN_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', '..', '..',
+    'modules', 'dynamodb_simple_client_api', 'tests', 'suite-benchmark')
+sys.path.insert(0, SRC_DIR)
+sys.path.insert(0, CLIENT_DIR)
+sys.path.insert(0, STANDIN_DIR)
+
+from whimbrel_client import WhimbrelClient
+from whimbrel_client.dedupe import DedupeCache
+from standin_db import StandInDb
+from stream_processor import StreamProcessor, Checkpoints
+from handlers import ActivityEventHandler
+
+ARN = 'arn:aws:dynamodb:local:000000000000:table/whimbrel_activity_event/stream/bench'
+
+
+class StandInStreams(object):
+    """
+    Closed shards holding fixed records.
+    """
+    def __init__(self, shards, latency=0.0):
+        object.__init__(self)
+        self.__shards = shards
+        self.__latency = latency
+        self.__lock = threading.Lock()
+        self.requests = 0
+
+    def describe_stream(self, StreamArn, ExclusiveStartShardId=None):
+        return {'StreamDescription': {'Shards': [
+            {'ShardId': shard_id} for shard_id in sorted(self.__shards.keys())]}}
+
+    def get_shard_iterator(self, StreamArn, ShardId, ShardIteratorType, SequenceNumber=None):
+        position = ShardIteratorType == 'AFTER_SEQUENCE_NUMBER' and int(SequenceNumber) + 1 or 0
+        return {'ShardIterator': '{0}:{1}'.format(ShardId, position)}
+
+    def get_records(self, ShardIterator, Limit=1000):
+        with self.__lock:
+            self.requests += 1
+        if self.__latency > 0:
+            time.sleep(self.__latency)
+        shard_id, position = ShardIterator.rsplit(':', 1)
+        position = int(position)
+        records = self.__shards[shard_id][position:position + Limit]
+        ret = {'Records': records}
+        if position + Limit < len(self.__shards[shard_id]):
+            ret['NextShardIterator'] = '{0}:{1}'.format(shard_id, position + Limit)
+        return ret
+
+
+def populate(activities, shards):
+    db_items = []
+    streams = dict(('shard-{0:03d}'.format(s), []) for s in range(shards))
+    for n in range(activities):
+        activity_exec_id = 'a{0}'.format(n)
+        db_items.append({
+            'activity_exec_id': {'S': activity_exec_id},
+            'workflow_exec_id': {'S': 'w{0}'.format(n // 10)},
+            'workflow_name': {'S': 'bench'},
+            'state': {'S': 'REQUESTED'}
+        })
+        records = streams['shard-{0:03d}'.format(n % shards)]
+        for transition in ('QUEUED', 'RUNNING', 'COMPLETED'):
+            records.append({'eventName': 'INSERT', 'dynamodb': {
+                'SequenceNumber': str(len(records)),
+                'NewImage': {
+                    'activity_event_id': {'S': '{0}::{1}'.format(activity_exec_id, transition)},
+                    'activity_exec_id': {'S': activity_exec_id},
+                    'transition': {'S': transition}
+                }
+            }})
+    return db_items, streams
+
+
+def read_all(streams, handler, batch_size):
+    directory = tempfile.mkdtemp()
+    try:
+        processor = StreamProcessor(
+            streams, ARN, handler, Checkpoints(directory), table='activity_event', batch_size=batch_size)
+        start = time.time()
+        processor.start_shards()
+        while len(processor.readers()) > 0:
+            time.sleep(0.01)
+        return time.time() - start
+    finally:
+        shutil.rmtree(directory)
+
+
+def run_case(name, activities, shards, latency, batch_size, workers, redeliver=False, dedupe=None):
+    db_items, shard_records = populate(activities, shards)
+    db = StandInDb(latency)
+    for item in db_items:
+        db.put_item(TableName='whimbrel_activity_exec', Item=item)
+    streams = StandInStreams(shard_records, latency)
+    handler = ActivityEventHandler(WhimbrelClient(db=db), workers=workers, dedupe=dedupe)
+    if redeliver:
+        read_all(streams, handler, batch_size)
+    requests = db.requests + streams.requests
+    applied = handler.stats.transitions
+    elapsed = read_all(streams, handler, batch_size)
+    records = activities * 3
+    print("{0:12s} batch {1:5d}  workers {2:3d}  records {3:7d}  applied {4:7d}  {5:7.2f} s  {6:9.1f} / s  "
+          "requests per record {7:.2f}".format(
+              name, batch_size, workers, records, handler.stats.transitions - applied, elapsed, records / elapsed,
+              float(db.requests + streams.requests - requests) / records))
+
+
+def run(activities=2000, shards=4, latency=0.002):
+    run_case('per record', activities, shards, latency, 1, 1)
+    run_case('micro-batch', activities, shards, latency, 1000, 8)
+    run_case('micro-batch', activities, shards, latency, 1000, 32)
+    run_case('redelivered', activities, shards, latency, 1000, 32, redeliver=True)
+    run_case('+ dedupe', activities, shards, latency, 1000, 32, redeliver=True, dedupe=DedupeCache())
+
+
+def main(argv):
+    args = {'--activities': '2000', '--shards': '4', '--latency': '0.002'}
+    i = 1
+    while i < len(argv):
+        if argv[i] in args:
+            args[argv[i]] = argv[i + 1]
+            i += 1
+        i += 1
+    run(int(args['--activities']), int(args['--shards']), float(args['--latency']))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
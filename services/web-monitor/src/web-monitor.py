@@ -0,0 +1,51 @@
+#!/usr/bin/python
+
+import logging
+import os
+import signal
+import sys
+import threading
+
+# The Python client, from this checkout, unless it is already installed.
+sys.path.append(os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', '..', '..',
+    'modules', 'dynamodb_simple_client_api', 'local', 'python2_3', 'src'))
+
+from whimbrel_client.cli import CommandLine
+from web_monitor import StateView, Broadcaster, MonitorServer
+
+args = CommandLine(sys.argv, {
+    '--port': 'port',
+    '--bind': 'bind',
+    '--refresh': 'refresh',
+    '--history': 'history',
+    '--history-limit': 'history_limit'
+}, {}, defaults={'port': '8080', 'bind': '127.0.0.1', 'refresh': '5', 'history': '86400',
+                 'history_limit': '1000', 'source': 'Web Monitor'})
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+client = args.client(max_pool_connections=2, lite=True)
+broadcaster = Broadcaster()
+view = StateView(
+    client, history_seconds=int(args.get('history')), history_limit=int(args.get('history_limit')),
+    on_change=broadcaster.publish)
+view.refresh()
+
+server = MonitorServer((args.get('bind'), int(args.get('port'))), view, broadcaster)
+server_thread = threading.Thread(target=server.serve_forever, name='web-monitor-http')
+server_thread.daemon = True
+server_thread.start()
+logging.info("serving http://%s:%s/", args.get('bind'), args.get('port'))
+
+
+def stop(signum, frame):
+    view.stop()
+
+
+signal.signal(signal.SIGTERM, stop)
+signal.signal(signal.SIGINT, stop)
+try:
+    view.run_forever(float(args.get('refresh')))
+finally:
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,513 @@
+"""
+The web monitor backend.
+
+One `StateView` holds the state of the workflow and activity executions in
+memory, and refreshes it from DynamoDB on an interval, from a single
+thread.  The browsers only ever read the view, so the read cost depends on
+the refresh interval and the number of executions, not on the number of
+open dashboards.
+
+Each refresh:
+
+1. Queries the `state_start_time` index of `workflow_exec`, and the
+   `state_heartbeat` index of `activity_exec`, for each of the states an
+   execution can still leave.  These return only the index's projected
+   attributes.  An activity is in the `state_heartbeat` index once it has a
+   `heartbeat_time_epoch`, which the clients write (as -1) when they add it.
+2. Reads, with batched gets, only the executions that were in one of those
+   states on the last refresh and no longer are, to learn the state they
+   finished in.
+3. Compares the result with the view, and publishes the executions that
+   changed to the server-sent event stream.
+
+The finished executions are kept in the view up to `history_limit` of
+each; on start, the view loads the workflows that finished within
+`history_seconds`.
+
+The HTTP server serves `index.html`, the JSON API, and the event stream:
+
+* `GET /api/summary` - the counts by state, and the refresh statistics.
+* `GET /api/workflows?state=&name=&offset=&limit=` - a page of the
+  workflow executions, newest first.
+* `GET /api/activities?state=&name=&workflow_exec_id=&offset=&limit=` - a
+  page of the activity executions, newest first.
+* `GET /api/events` - server-sent events: an `update` event for each
+  refresh that changed anything, with the changed executions and the
+  removed IDs.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+try:
+    # Python 3
+    import queue
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+except ImportError:
+    # Python 2
+    import Queue as queue
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+
+from whimbrel_client.batch import BatchGetter
+
+_LOG = logging.getLogger(__name__)
+
+WORKFLOW_INDEX = 'state_start_time'
+ACTIVITY_INDEX = 'state_heartbeat'
+
+# The states an execution can still leave, which each refresh queries.
+ACTIVE_WORKFLOW_STATES = ('REQUESTED', 'RUNNING', 'FAILED_WAITING', 'CANCEL_REQUESTED')
+FINISHED_WORKFLOW_STATES = ('FAILED', 'CANCELLED', 'COMPLETED')
+ACTIVE_ACTIVITY_STATES = ('REQUESTED', 'READY', 'QUEUED', 'PREPARING', 'RUNNING')
+
+ACTIVITY_PROJECTION = (
+    'activity_exec_id, workflow_exec_id, activity_name, workflow_name, #state, heartbeat_enabled, '
+    'start_time_epoch, heartbeat_time_epoch, end_time_epoch')
+WORKFLOW_PROJECTION = (
+    'workflow_exec_id, workflow_name, #state, start_time_epoch, workflow_request_id, workflow_version')
+
+MAX_PAGE_ITEMS = 500
+DEFAULT_PAGE_ITEMS = 50
+
+# Seconds between the keep-alive comments on an idle event stream.
+KEEP_ALIVE_SECONDS = 15
+
+INDEX_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'index.html')
+
+
+def plain(item):
+    """
+    The DynamoDB item as plain JSON values.
+    """
+    ret = {}
+    for name, value in item.items():
+        ret[name] = _plain_value(value)
+    return ret
+
+
+def _plain_value(value):
+    if 'S' in value:
+        return value['S']
+    if 'N' in value:
+        number = value['N']
+        if '.' in number or 'e' in number or 'E' in number:
+            return float(number)
+        return int(number)
+    if 'BOOL' in value:
+        return value['BOOL']
+    if 'L' in value:
+        return [_plain_value(v) for v in value['L']]
+    if 'NULL' in value:
+        return None
+    return None
+
+
+class RefreshStats(object):
+    def __init__(self):
+        object.__init__(self)
+        self.refreshes = 0
+        self.failed_refreshes = 0
+        self.queries = 0
+        self.batch_gets = 0
+        self.last_refresh_time = 0
+        self.last_refresh_seconds = 0.0
+        self.last_requests = 0
+        self.last_changes = 0
+
+    def as_dict(self):
+        return {
+            'refreshes': self.refreshes,
+            'failed_refreshes': self.failed_refreshes,
+            'queries': self.queries,
+            'batch_gets': self.batch_gets,
+            'last_refresh_time': self.last_refresh_time,
+            'last_refresh_seconds': self.last_refresh_seconds,
+            'last_requests': self.last_requests,
+            'last_changes': self.last_changes
+        }
+
+
+class StateView(object):
+    """
+    The cached workflow and activity executions.
+
+    :param client: WhimbrelClient
+    :param history_seconds: on start, load the workflows that finished
+        (that started) within this many seconds.
+    :param history_limit: number of finished workflows, and of finished
+        activities, kept in the view.
+    :param on_change: function called with (version, change) after each
+        refresh that changed anything.
+    """
+    def __init__(self, client, history_seconds=86400, history_limit=1000, on_change=None, clock=time.time):
+        object.__init__(self)
+        self.__client = client
+        self.__history_seconds = history_seconds
+        self.__history_limit = history_limit
+        self.__on_change = on_change
+        self.__clock = clock
+        self.__getter = BatchGetter(client.db)
+        self.__lock = threading.Lock()
+        self.__stop = threading.Event()
+        # ID -> plain item
+        self.__workflows = {}
+        self.__activities = {}
+        # The same items, newest first, for the pages.
+        self.__workflow_list = []
+        self.__activity_list = []
+        # The IDs of the finished items, in the order they were seen.
+        self.__finished_workflows = []
+        self.__finished_activities = []
+        self.__loaded = False
+        self.version = 0
+        self.stats = RefreshStats()
+
+    def run_forever(self, interval=5):
+        """
+        Refresh every `interval` seconds, until `stop` is called.
+        """
+        self.__stop.clear()
+        while not self.__stop.is_set():
+            start = self.__clock()
+            try:
+                self.refresh()
+            except Exception:
+                _LOG.exception("web monitor refresh failed")
+                self.stats.failed_refreshes += 1
+            self.__stop.wait(max(0.0, interval - (self.__clock() - start)))
+
+    def stop(self):
+        self.__stop.set()
+
+    def refresh(self):
+        """
+        Bring the view up to date.
+
+        :return: the change published, or None if nothing changed.
+        """
+        start = self.__clock()
+        requests = self.stats.queries + self.stats.batch_gets
+
+        workflows = {}
+        for state in ACTIVE_WORKFLOW_STATES:
+            for item in self._query('workflow_exec', WORKFLOW_INDEX, state):
+                workflows[item['workflow_exec_id']] = item
+        if not self.__loaded:
+            since = int(self.__clock()) - self.__history_seconds
+            for state in FINISHED_WORKFLOW_STATES:
+                for item in self._query('workflow_exec', WORKFLOW_INDEX, state, ('start_time_epoch', since)):
+                    workflows[item['workflow_exec_id']] = item
+        activities = {}
+        for state in ACTIVE_ACTIVITY_STATES:
+            for item in self._query('activity_exec', ACTIVITY_INDEX, state):
+                activities[item['activity_exec_id']] = item
+
+        # The executions that left the active states since the last refresh.
+        with self.__lock:
+            left_workflows = [
+                item for key, item in self.__workflows.items()
+                if key not in workflows and item.get('state') in ACTIVE_WORKFLOW_STATES
+            ]
+            left_activities = [
+                item for key, item in self.__activities.items()
+                if key not in activities and item.get('state') in ACTIVE_ACTIVITY_STATES
+            ]
+        for item in self._get('workflow_exec', WORKFLOW_PROJECTION, [
+                {'workflow_exec_id': {'S': w['workflow_exec_id']}, 'workflow_name': {'S': w['workflow_name']}}
+                for w in left_workflows]):
+            workflows[item['workflow_exec_id']] = item
+        for item in self._get('activity_exec', ACTIVITY_PROJECTION, [
+                {'activity_exec_id': {'S': a['activity_exec_id']}, 'workflow_exec_id': {'S': a['workflow_exec_id']}}
+                for a in left_activities]):
+            activities[item['activity_exec_id']] = item
+
+        with self.__lock:
+            changed_workflows, removed_workflows = self._merge(
+                self.__workflows, workflows, self.__finished_workflows, ACTIVE_WORKFLOW_STATES)
+            changed_activities, removed_activities = self._merge(
+                self.__activities, activities, self.__finished_activities, ACTIVE_ACTIVITY_STATES)
+            self.__workflow_list = _newest_first(self.__workflows.values())
+            self.__activity_list = _newest_first(self.__activities.values())
+            self.__loaded = True
+            changes = len(changed_workflows) + len(removed_workflows) + len(changed_activities) + \
+                len(removed_activities)
+            change = None
+            if changes > 0:
+                self.version += 1
+                change = {
+                    'version': self.version,
+                    'workflows': changed_workflows,
+                    'removed_workflows': removed_workflows,
+                    'activities': changed_activities,
+                    'removed_activities': removed_activities,
+                    'summary': self._counts()
+                }
+            version = self.version
+
+        self.stats.refreshes += 1
+        self.stats.last_refresh_time = int(self.__clock())
+        self.stats.last_refresh_seconds = self.__clock() - start
+        self.stats.last_requests = self.stats.queries + self.stats.batch_gets - requests
+        self.stats.last_changes = changes
+        if change is not None and self.__on_change is not None:
+            self.__on_change(version, change)
+        return change
+
+    def summary(self):
+        with self.__lock:
+            ret = self._counts()
+            ret['version'] = self.version
+        ret['refresh'] = self.stats.as_dict()
+        return ret
+
+    def workflows(self, state=None, name=None, offset=0, limit=DEFAULT_PAGE_ITEMS):
+        """
+        :return: a page of the workflow executions, newest first.
+        """
+        with self.__lock:
+            items = self.__workflow_list
+        return _page([
+            item for item in items
+            if (state is None or item.get('state') == state) and (name is None or item.get('workflow_name') == name)
+        ], offset, limit)
+
+    def activities(self, state=None, name=None, workflow_exec_id=None, offset=0, limit=DEFAULT_PAGE_ITEMS):
+        """
+        :return: a page of the activity executions, newest first.
+        """
+        with self.__lock:
+            items = self.__activity_list
+        return _page([
+            item for item in items
+            if (state is None or item.get('state') == state) and
+            (name is None or item.get('activity_name') == name) and
+            (workflow_exec_id is None or item.get('workflow_exec_id') == workflow_exec_id)
+        ], offset, limit)
+
+    def _merge(self, current, fresh, finished, active_states):
+        """
+        Merge the fresh items into the current ones.
+
+        :param finished: the IDs of the finished items, oldest first.
+        :param active_states: the states an item can still leave.
+        :return: (the changed items, the removed IDs)
+        """
+        changed = []
+        for key, item in fresh.items():
+            old = current.get(key)
+            if old is not None:
+                # The index items lack the attributes it does not project.
+                merged = dict(old)
+                merged.update(item)
+                item = merged
+            if item != old:
+                current[key] = item
+                changed.append(item)
+                if item.get('state') not in active_states and (
+                        old is None or old.get('state') in active_states):
+                    finished.append(key)
+        removed = []
+        for key, item in list(current.items()):
+            if key not in fresh and item.get('state') in active_states:
+                # An active item that could not be read any more.
+                del current[key]
+                removed.append(key)
+        while len(finished) > self.__history_limit:
+            key = finished.pop(0)
+            if current.pop(key, None) is not None:
+                removed.append(key)
+        return changed, removed
+
+    def _counts(self):
+        workflow_counts = {}
+        for item in self.__workflows.values():
+            workflow_counts[item.get('state')] = workflow_counts.get(item.get('state'), 0) + 1
+        activity_counts = {}
+        for item in self.__activities.values():
+            activity_counts[item.get('state')] = activity_counts.get(item.get('state'), 0) + 1
+        return {'workflows': workflow_counts, 'activities': activity_counts}
+
+    def _query(self, table, index, state, since=None):
+        args = {
+            'TableName': self.__client.table_name(table),
+            'IndexName': index,
+            'KeyConditionExpression': '#state = :state',
+            'ExpressionAttributeNames': {'#state': 'state'},
+            'ExpressionAttributeValues': {':state': {'S': state}}
+        }
+        if since is not None:
+            args['KeyConditionExpression'] += ' AND {0} >= :since'.format(since[0])
+            args['ExpressionAttributeValues'][':since'] = {'N': str(since[1])}
+            args['ScanIndexForward'] = False
+            args['Limit'] = self.__history_limit
+        items = []
+        while True:
+            self.stats.queries += 1
+            response = self.__client.db.query(**args)
+            items.extend(plain(item) for item in response.get('Items', []))
+            if since is not None or 'LastEvaluatedKey' not in response:
+                return items
+            args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    def _get(self, table, projection, keys):
+        if len(keys) <= 0:
+            return []
+        requests = self.__getter.requests
+        items = self.__getter.get(
+            self.__client.table_name(table), keys, ProjectionExpression=projection,
+            ExpressionAttributeNames={'#state': 'state'})
+        self.stats.batch_gets += self.__getter.requests - requests
+        return [plain(item) for item in items]
+
+
+class Broadcaster(object):
+    """
+    Hands each published event to every connected event stream.  A client
+    that falls `max_queued` events behind is dropped.
+    """
+    def __init__(self, max_queued=100):
+        object.__init__(self)
+        self.__max_queued = max_queued
+        self.__lock = threading.Lock()
+        self.__clients = []
+
+    def publish(self, version, change):
+        data = json.dumps(change, sort_keys=True)
+        with self.__lock:
+            clients = list(self.__clients)
+        for client in clients:
+            try:
+                client.put_nowait((version, data))
+            except queue.Full:
+                _LOG.info("dropping an event stream %d events behind", self.__max_queued)
+                self.unsubscribe(client)
+                # Make room for the None, which closes the stream.
+                try:
+                    while True:
+                        client.get_nowait()
+                except queue.Empty:
+                    pass
+                client.put_nowait(None)
+
+    def subscribe(self):
+        client = queue.Queue(self.__max_queued)
+        with self.__lock:
+            self.__clients.append(client)
+        return client
+
+    def unsubscribe(self, client):
+        with self.__lock:
+            if client in self.__clients:
+                self.__clients.remove(client)
+
+    def __len__(self):
+        with self.__lock:
+            return len(self.__clients)
+
+
+class MonitorServer(ThreadingMixIn, HTTPServer):
+    """
+    The web monitor HTTP server.
+
+    :param view: StateView
+    :param broadcaster: Broadcaster the view's changes are published to.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, view, broadcaster):
+        HTTPServer.__init__(self, address, _MonitorHandler)
+        self.view = view
+        self.broadcaster = broadcaster
+
+
+class _MonitorHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        args = dict((k, v[0]) for k, v in parse_qs(url.query).items())
+        try:
+            if url.path in ('/', '/index.html'):
+                with open(INDEX_FILE, 'rb') as f:
+                    self._send(200, 'text/html; charset=utf-8', f.read())
+            elif url.path == '/api/summary':
+                self._json(self.server.view.summary())
+            elif url.path == '/api/workflows':
+                offset, limit = _paging(args)
+                self._json(self.server.view.workflows(args.get('state'), args.get('name'), offset, limit))
+            elif url.path == '/api/activities':
+                offset, limit = _paging(args)
+                self._json(self.server.view.activities(
+                    args.get('state'), args.get('name'), args.get('workflow_exec_id'), offset, limit))
+            elif url.path == '/api/events':
+                self._events()
+            else:
+                self._json({'error': 'not found'}, 404)
+        except ValueError as e:
+            self._json({'error': str(e)}, 400)
+
+    def _events(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        client = self.server.broadcaster.subscribe()
+        try:
+            self.wfile.write('retry: 5000\n\n'.encode('utf-8'))
+            self.wfile.flush()
+            while True:
+                try:
+                    event = client.get(timeout=KEEP_ALIVE_SECONDS)
+                except queue.Empty:
+                    self.wfile.write(': keep-alive\n\n'.encode('utf-8'))
+                    self.wfile.flush()
+                    continue
+                if event is None:
+                    return
+                version, data = event
+                self.wfile.write('id: {0}\nevent: update\ndata: {1}\n\n'.format(version, data).encode('utf-8'))
+                self.wfile.flush()
+        except (IOError, OSError):
+            # The browser went away.
+            pass
+        finally:
+            self.server.broadcaster.unsubscribe(client)
+
+    def _json(self, value, status=200):
+        self._send(status, 'application/json', json.dumps(value, sort_keys=True).encode('utf-8'))
+
+    def _send(self, status, content_type, body):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        _LOG.debug(format, *args)
+
+
+def _paging(args):
+    offset = int(args.get('offset', '0'))
+    limit = int(args.get('limit', str(DEFAULT_PAGE_ITEMS)))
+    if offset < 0 or limit <= 0:
+        raise ValueError("offset must not be negative, and limit must be positive")
+    return offset, min(limit, MAX_PAGE_ITEMS)
+
+
+def _page(items, offset, limit):
+    return {'items': items[offset:offset + limit], 'total': len(items), 'offset': offset, 'limit': limit}
+
+
+def _newest_first(items):
+    return sorted(items, key=lambda item: item.get('start_time_epoch') or 0, reverse=True)
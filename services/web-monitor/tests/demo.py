@@ -0,0 +1,94 @@
+"""
+Runs the web monitor locally, against the in-process DynamoDB stand-in
+from the client benchmarks, with an executor that keeps starting
+workflows, so the dashboard has something to show.  Open
+http://127.0.0.1:8080/ (or the `--port`).
+
+Each workflow has four activities, in a diamond; some of them sleep, and
+one in `--fail-every` workflows fails.
+"""
+
+import logging
+import os
+import random
+import sys
+import threading
+import time
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+CLIENT_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', '..', '..',
+    'modules', 'dynamodb_simple_client_api', 'local', 'python2_3', 'src')
+STANDIN_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', '..', '..',
+    'modules', 'dynamodb_simple_client_api', 'tests', 'suite-benchmark')
+sys.path.insert(0, SRC_DIR)
+sys.path.insert(0, CLIENT_DIR)
+sys.path.insert(0, STANDIN_DIR)
+
+from whimbrel_client import WhimbrelClient
+from whimbrel_client.executor import WorkflowExecutor, Activity
+from standin_db import StandInDb
+from web_monitor import StateView, Broadcaster, MonitorServer
+
+
+def work(activity_exec):
+    time.sleep(random.random() * 2)
+
+
+def fail(activity_exec):
+    raise ValueError("failed on purpose")
+
+
+def decisions(fail_every):
+    count = [0]
+
+    def diamond(workflow_exec):
+        count[0] += 1
+        last = fail_every > 0 and count[0] % fail_every == 0 and fail or work
+        return [
+            Activity('fetch', work),
+            Activity('left', work, ['fetch']),
+            Activity('right', last, ['fetch']),
+            Activity('merge', work, ['left', 'right'])
+        ]
+    return {'diamond': diamond}
+
+
+def main(argv):
+    args = {'--port': '8080', '--refresh': '2', '--rate': '1', '--fail-every': '5'}
+    i = 1
+    while i < len(argv):
+        if argv[i] in args:
+            args[argv[i]] = argv[i + 1]
+            i += 1
+        i += 1
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    client = WhimbrelClient(db=StandInDb())
+    executor = WorkflowExecutor(client, decisions(int(args['--fail-every'])), workers=8)
+    broadcaster = Broadcaster()
+    view = StateView(client, on_change=broadcaster.publish)
+    server = MonitorServer(('127.0.0.1', int(args['--port'])), view, broadcaster)
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.daemon = True
+    server_thread.start()
+    refresh_thread = threading.Thread(target=view.run_forever, args=(float(args['--refresh']),))
+    refresh_thread.daemon = True
+    refresh_thread.start()
+    logging.info("serving http://127.0.0.1:%s/", args['--port'])
+
+    try:
+        while True:
+            executor.submit('diamond')
+            time.sleep(1.0 / float(args['--rate']))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        view.stop()
+        server.shutdown()
+        executor.shutdown()
+
+
+if __name__ == '__main__':
+    main(sys.argv)